@@ -0,0 +1,119 @@
+"""
+Compares the codecs of compressed fields on typical large values: stored size,
+compression and decompression throughput, per payload kind and size.
+
+    python -m benchmarks.bench_compression --sizes 1000 10000 100000
+
+zstd is only measured when the zstandard package is installed. Values below
+the compress_min_bytes of a field are stored as they are, the smallest size
+shows why a threshold pays off.
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from pymongex.models.compression import (
+    available_codecs,
+    compress_value,
+    decompress_value,
+)
+
+
+def make_html(size: int, rng: random.Random) -> str:
+    words = ["order", "customer", "shipped", "total", "status", "item", "price"]
+    parts = []
+    length = 0
+    while length < size:
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+        part = f'<div class="row-{rng.randint(0, 9)}"><span>{text}</span></div>\n'
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)[:size]
+
+
+def make_payload(size: int, rng: random.Random) -> Dict[str, Any]:
+    # raw API payloads: repeated keys, varied values
+    items = []
+    while len(json.dumps(items)) < size:
+        items.append(
+            {
+                "sku": f"SKU-{rng.randint(0, 99999):05d}",
+                "quantity": rng.randint(1, 20),
+                "price": round(rng.uniform(1, 500), 2),
+                "note": rng.choice(["", "gift", "express", "fragile"]),
+            }
+        )
+    return {"items": items}
+
+
+def make_random(size: int, rng: random.Random) -> str:
+    # tokens and hashes barely compress, the size check keeps them plain
+    return "".join(rng.choice("0123456789abcdef") for _ in range(size))
+
+
+KINDS: Dict[str, Callable[[int, random.Random], Any]] = {
+    "html": make_html,
+    "payload": make_payload,
+    "random": make_random,
+}
+
+
+def serialized_size(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value))
+
+
+def measure(values: List[Any], codec: str, repeat: int) -> Dict[str, float]:
+    original = sum(serialized_size(value) for value in values)
+    compress_best = decompress_best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compressed = [compress_value(value, codec, min_bytes=0) for value in values]
+        compress_best = min(compress_best, time.perf_counter() - start)
+        start = time.perf_counter()
+        for value in compressed:
+            decompress_value(value)
+        decompress_best = min(decompress_best, time.perf_counter() - start)
+    stored = sum(
+        len(value) if isinstance(value, bytes) else serialized_size(value)
+        for value in compressed
+    )
+    megabytes = original / 1e6
+    return {
+        "ratio": stored / original,
+        "compress_mb_s": megabytes / compress_best,
+        "decompress_mb_s": megabytes / decompress_best,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--count", type=int, default=200, help="values per size")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    codecs = available_codecs()
+    print(f"codecs: {', '.join(codecs)}")
+    header = f"{'kind':<8} {'size':>8} {'codec':<6} {'stored':>7} "
+    print(header + f"{'compress MB/s':>14} {'decompress MB/s':>16}")
+    for kind, make in KINDS.items():
+        for size in args.sizes:
+            rng = random.Random(args.seed)
+            values = [make(size, rng) for _ in range(args.count)]
+            for codec in codecs:
+                result = measure(values, codec, args.repeat)
+                print(
+                    f"{kind:<8} {size:>8} {codec:<6} {result['ratio']:>6.0%} "
+                    f"{result['compress_mb_s']:>14.1f} "
+                    f"{result['decompress_mb_s']:>16.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
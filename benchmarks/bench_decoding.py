@@ -0,0 +1,140 @@
+"""
+Compares decoding + validation of large result sets inline on the event loop,
+on a worker thread and in a process pool, and reports where each mode pays off.
+
+    python -m benchmarks.bench_decoding --sizes 1000 10000 100000 --output records
+
+The lag columns are the longest stall of the event loop during the call. Models
+are expensive to pickle back from pool processes; records are much cheaper.
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import bson
+
+from pymongex.clients.decoding import decode_raw_batch
+
+from .models import BenchOrder, make_order_documents
+
+MODES = ("inline", "thread", "process")
+
+
+def encode_batches(documents: List[dict], batch_size: int) -> List[bytes]:
+    return [
+        b"".join(bson.encode(doc) for doc in documents[i : i + batch_size])
+        for i in range(0, len(documents), batch_size)
+    ]
+
+
+def decode_all_batches(raw_batches: List[bytes], output: str) -> List:
+    return [
+        item
+        for raw in raw_batches
+        for item in decode_raw_batch(BenchOrder, raw, output)
+    ]
+
+
+async def _monitor_loop(stop: asyncio.Event, interval: float = 0.001) -> float:
+    """Largest delay the event loop added to a 1 ms sleep."""
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - start - interval)
+    return max_lag
+
+
+async def run_mode(
+    mode: str, raw_batches: List[bytes], pool: ProcessPoolExecutor, output: str
+):
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_loop(stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    if mode == "inline":
+        models = decode_all_batches(raw_batches, output)
+    elif mode == "thread":
+        models = await asyncio.to_thread(decode_all_batches, raw_batches, output)
+    else:
+        loop = asyncio.get_running_loop()
+        batches = await asyncio.gather(
+            *[
+                loop.run_in_executor(pool, decode_raw_batch, BenchOrder, raw, output)
+                for raw in raw_batches
+            ]
+        )
+        models = [model for batch in batches for model in batch]
+    elapsed = time.perf_counter() - start
+    stop.set()
+    max_lag = await monitor
+    return elapsed, max_lag
+
+
+async def bench(
+    sizes: List[int], batch_size: int, processes: int, repeat: int, output: str
+):
+    results: Dict[int, Dict[str, Dict[str, float]]] = {}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        # start the workers so pool start-up is not attributed to the first size
+        await asyncio.gather(
+            *[
+                asyncio.get_running_loop().run_in_executor(pool, abs, 0)
+                for _ in range(processes)
+            ]
+        )
+        for size in sizes:
+            raw_batches = encode_batches(make_order_documents(size), batch_size)
+            results[size] = {}
+            for mode in MODES:
+                runs = [
+                    await run_mode(mode, raw_batches, pool, output)
+                    for _ in range(repeat)
+                ]
+                results[size][mode] = {
+                    "seconds": min(run[0] for run in runs),
+                    "max_loop_lag": min(run[1] for run in runs),
+                }
+    return results
+
+
+def report(results: Dict[int, Dict[str, Dict[str, float]]]) -> None:
+    print(f"{'docs':>9} " + " ".join(f"{m + ' s':>10} {m + ' lag':>12}" for m in MODES))
+    for size, modes in results.items():
+        row = " ".join(
+            f"{modes[m]['seconds']:>10.4f} {modes[m]['max_loop_lag']:>12.4f}"
+            for m in MODES
+        )
+        print(f"{size:>9} {row}")
+
+    for mode in ("thread", "process"):
+        crossover = next(
+            (
+                size
+                for size, modes in results.items()
+                if modes[mode]["seconds"] < modes["inline"]["seconds"]
+            ),
+            None,
+        )
+        print(f"{mode} faster than inline from: {crossover or 'not reached'} docs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", choices=["models", "records"], default="models")
+    args = parser.parse_args()
+    results = asyncio.run(
+        bench(args.sizes, args.batch_size, args.processes, args.repeat, args.output)
+    )
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Measures the cold import cost of pymongex with `python -X importtime` and checks
+it against the budgets in import_budget.json. Exits with status 1 when a budget
+is exceeded or a forbidden module (e.g. motor for sync-only use) is imported.
+
+    python -m benchmarks.bench_import_time --repeat 5 --top 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BUDGET_FP = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "import_budget.json"
+)
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Return (module, self_us, cumulative_us) for every imported module."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure(statement: str) -> List[Tuple[str, int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def run_scenario(name: str, scenario: Dict, repeat: int, top: int) -> bool:
+    # the fastest run is the least disturbed by other processes
+    runs = [measure(scenario["statement"]) for _ in range(repeat)]
+    modules = min(runs, key=lambda run: sum(m[1] for m in run))
+    total_ms = sum(m[1] for m in modules) / 1000
+    imported = {m[0] for m in modules}
+    forbidden = sorted(
+        f
+        for f in scenario.get("forbidden", [])
+        if any(m == f or m.startswith(f + ".") for m in imported)
+    )
+
+    ok = total_ms <= scenario["budget_ms"] and not forbidden
+    print(
+        f"[{'ok' if ok else 'FAIL'}] {name}: {total_ms:.1f} ms "
+        f"(budget {scenario['budget_ms']} ms, {len(modules)} modules)"
+    )
+    if forbidden:
+        print(f"    forbidden modules imported: {', '.join(forbidden)}")
+    for module, self_us, _ in sorted(modules, key=lambda m: -m[1])[:top]:
+        print(f"    {self_us / 1000:8.2f} ms  {module}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget", default=BUDGET_FP)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("scenarios", nargs="*")
+    args = parser.parse_args()
+
+    with open(args.budget, "r") as f:
+        budgets = json.load(f)
+    names = args.scenarios or list(budgets)
+    results = [run_scenario(n, budgets[n], args.repeat, args.top) for n in names]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
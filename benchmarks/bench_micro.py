@@ -0,0 +1,232 @@
+"""
+CPU and allocation micro-benchmarks of the database independent hot paths:
+pipeline building, validation, timezone normalisation, serialization,
+insert preprocessing and id conversion.
+
+    python -m benchmarks.bench_micro --output results.json
+    python -m benchmarks.bench_micro --save-baseline baseline.json
+    python -m benchmarks.bench_micro --compare baseline.json --threshold 0.15
+
+With --compare the exit status is 1 when a case got slower (ops/sec) or
+allocates more (peak bytes per op) than the threshold allows.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import ObjectId
+
+from pymongex import PipelineBuilder
+from pymongex.clients.sync_client import SyncMongoClient
+from pymongex.models.collection import ensure_utc_timezone
+from pymongex.service.ids import to_object_ids
+
+from .models import (
+    BenchExpandedOrder,
+    BenchOrder,
+    BenchWideIn,
+    BenchWideOut,
+    make_order_documents,
+    make_wide_documents,
+)
+
+BATCH = 100
+
+
+class Case:
+    def __init__(self, name: str, fn: Callable[[], Any], docs_per_op: int = 1):
+        self.name = name
+        self.fn = fn
+        self.docs_per_op = docs_per_op
+
+
+def build_cases() -> List[Case]:
+    # the client is only used for its pure helpers, it never connects
+    client = SyncMongoClient()
+    orders = make_order_documents(BATCH)
+    wide = make_wide_documents(BATCH)
+    wide_in = make_wide_documents(BATCH, with_id=False)
+    wide_in_models = [BenchWideIn(**doc) for doc in wide_in]
+    wide_model = BenchWideOut(**wide[0])
+    hex_ids = [str(ObjectId()) for _ in range(BATCH)]
+
+    return [
+        Case(
+            "pipeline.build_simple",
+            lambda: PipelineBuilder(
+                BenchOrder,
+                {"status": "open"},
+                sort={"created_at": -1},
+                skip=10,
+                limit=50,
+            ).build_pipeline(),
+        ),
+        Case(
+            "pipeline.build_expand",
+            lambda: PipelineBuilder(
+                BenchExpandedOrder,
+                {"status": "open"},
+                limit=50,
+                expand=["customer", "account"],
+            ).build_pipeline(),
+        ),
+        Case(
+            "pipeline.build_simple_static",
+            lambda: PipelineBuilder.build_simple_pipeline(
+                {"status": "open"}, sort={"_id": 1}, limit=10, project={"_id": 1}
+            ),
+        ),
+        Case(
+            "validate.docs_to_models.orders",
+            lambda: client._docs_to_models(BenchOrder, orders),
+            docs_per_op=BATCH,
+        ),
+        Case(
+            "validate.docs_to_models.wide",
+            lambda: client._docs_to_models(BenchWideOut, wide),
+            docs_per_op=BATCH,
+        ),
+        Case(
+            "models.ensure_utc_timezone.wide",
+            lambda: [ensure_utc_timezone(doc) for doc in wide],
+            docs_per_op=BATCH,
+        ),
+        Case("serialize.json_dict.wide", lambda: wide_model.json_dict()),
+        Case(
+            "insert.prepare_documents.dicts",
+            lambda: client._prepare_insert_documents(BenchWideIn, wide_in),
+            docs_per_op=BATCH,
+        ),
+        Case(
+            "insert.prepare_documents.models",
+            lambda: client._prepare_insert_documents(BenchWideIn, wide_in_models),
+            docs_per_op=BATCH,
+        ),
+        Case("ids.to_object_ids.hex", lambda: to_object_ids(hex_ids), BATCH),
+    ]
+
+
+def time_case(case: Case, min_time: float, repeat: int) -> float:
+    """Best ops/sec over `repeat` runs of at least `min_time` seconds each."""
+    case.fn()
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            case.fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        iterations *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            case.fn()
+        best = min(best, time.perf_counter() - start)
+    return iterations / best
+
+
+def measure_allocations(case: Case, iterations: int = 10) -> Dict[str, float]:
+    tracemalloc.start()
+    try:
+        peaks = []
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            result = case.fn()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - base)
+            del result
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_bytes_per_op": min(peaks),
+        "retained_bytes_per_op": max(0, after - before) / iterations,
+    }
+
+
+def run(cases: List[Case], min_time: float, repeat: int) -> Dict[str, Any]:
+    results = {}
+    for case in cases:
+        ops_per_sec = time_case(case, min_time, repeat)
+        results[case.name] = {
+            "ops_per_sec": ops_per_sec,
+            "us_per_op": 1e6 / ops_per_sec,
+            "us_per_doc": 1e6 / ops_per_sec / case.docs_per_op,
+            "docs_per_op": case.docs_per_op,
+            **measure_allocations(case),
+        }
+        print(
+            f"{case.name:<36} {ops_per_sec:>12.1f} ops/s "
+            f"{results[case.name]['us_per_doc']:>10.2f} us/doc "
+            f"{results[case.name]['peak_bytes_per_op'] / 1024:>10.1f} KiB peak"
+        )
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "created": time.time(),
+        },
+        "results": results,
+    }
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], threshold: float
+) -> List[str]:
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        speed = result["ops_per_sec"] / base["ops_per_sec"]
+        memory = (result["peak_bytes_per_op"] + 1) / (base["peak_bytes_per_op"] + 1)
+        marker = ""
+        if speed < 1 - threshold:
+            marker = "  <-- slower"
+            regressions.append(f"{name}: {speed:.2f}x ops/sec of baseline")
+        if memory > 1 + threshold:
+            marker += "  <-- allocates more"
+            regressions.append(f"{name}: {memory:.2f}x peak bytes of baseline")
+        print(f"{name:<36} speed {speed:>6.2f}x  memory {memory:>6.2f}x{marker}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-k", "--filter", default=None, help="substring of case names")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--save-baseline", default=None)
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    cases = [c for c in build_cases() if not args.filter or args.filter in c.name]
+    results = run(cases, args.min_time, args.repeat)
+
+    for fp in (args.output, args.save_baseline):
+        if fp:
+            with open(fp, "w") as f:
+                json.dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from datetime import datetime as dt
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pydantic import Field, create_model
+
+from pymongex import BaseDatabase, InCollectionModel, OutCollectionModel
+from pymongex.utils import utc_now
+
+bench_db = BaseDatabase("benchDB")
+
+WIDE_FIELDS = 60
+
+
+class BenchOrder(OutCollectionModel):
+    class Collection:
+        collection = bench_db.add_collection("orders")
+
+    customer_id: ObjectId
+    status: str
+    total: float
+    quantity: int
+    tags: List[str] = []
+    note: Optional[str] = None
+    shipped_at: Optional[dt] = None
+
+
+# expanded models need the projection of InCollectionModel and the custom
+# pipeline lookup of OutCollectionModel
+class BenchCustomer(OutCollectionModel, InCollectionModel):
+    class Collection:
+        collection = bench_db.add_collection("customers")
+
+    name: str
+    tier: str
+    order_count: Optional[int] = Field(
+        default=None,
+        json_schema_extra={
+            "pipeline": [{"$count": "order_count"}],
+        },
+    )
+
+
+class BenchAccount(OutCollectionModel, InCollectionModel):
+    class Collection:
+        collection = bench_db.add_collection("accounts")
+
+    plan: str
+    seats: int
+
+
+class BenchExpandedOrder(OutCollectionModel):
+    class Collection:
+        collection = bench_db.add_collection("orders")
+
+    customer_id: ObjectId
+    account_id: ObjectId
+    status: str
+    total: float
+    customer: Optional[BenchCustomer] = Field(
+        default=None,
+        json_schema_extra={"local_field": "customer_id", "foreign_field": "_id"},
+    )
+    account: Optional[BenchAccount] = Field(
+        default=None,
+        json_schema_extra={"local_field": "account_id", "foreign_field": "_id"},
+    )
+    line_count: Optional[int] = Field(
+        default=None,
+        json_schema_extra={
+            "pipeline": [{"$addFields": {"line_count": {"$size": "$lines"}}}],
+        },
+    )
+
+
+def _wide_fields() -> Dict[str, Any]:
+    fields = {}
+    for i in range(WIDE_FIELDS):
+        kind = i % 4
+        if kind == 0:
+            fields[f"text_{i}"] = (str, ...)
+        elif kind == 1:
+            fields[f"number_{i}"] = (int, ...)
+        elif kind == 2:
+            fields[f"when_{i}"] = (Optional[dt], None)
+        else:
+            fields[f"nested_{i}"] = (Dict[str, Any], {})
+    return fields
+
+
+class _WideCollection:
+    collection = bench_db.add_collection("wide")
+
+
+BenchWideIn = create_model(
+    "BenchWideIn",
+    __base__=InCollectionModel,
+    __module__=__name__,
+    **_wide_fields(),
+)
+BenchWideIn.Collection = _WideCollection
+
+BenchWideOut = create_model(
+    "BenchWideOut",
+    __base__=OutCollectionModel,
+    __module__=__name__,
+    **_wide_fields(),
+)
+BenchWideOut.Collection = _WideCollection
+
+
+def make_order_documents(count: int) -> List[dict]:
+    now = utc_now()
+    return [
+        {
+            "_id": ObjectId(),
+            "id": ObjectId(),
+            "created_at": now,
+            "updated_at": now,
+            "customer_id": ObjectId(),
+            "status": "shipped" if i % 3 else "open",
+            "total": i * 1.5,
+            "quantity": i % 17,
+            "tags": ["priority", f"region-{i % 5}"],
+            "note": "leave at the door" if i % 4 else None,
+            "shipped_at": now if i % 3 else None,
+        }
+        for i in range(count)
+    ]
+
+
+def make_wide_documents(count: int, with_id: bool = True) -> List[dict]:
+    # naive datetimes so ensure_utc_timezone has work to do, like BSON reads
+    now = dt.now()
+    documents = []
+    for n in range(count):
+        document = {"id": ObjectId()} if with_id else {}
+        for i in range(WIDE_FIELDS):
+            kind = i % 4
+            if kind == 0:
+                document[f"text_{i}"] = f"value {n} {i}"
+            elif kind == 1:
+                document[f"number_{i}"] = n * i
+            elif kind == 2:
+                document[f"when_{i}"] = now
+            else:
+                document[f"nested_{i}"] = {
+                    "at": now,
+                    "items": [{"at": now, "n": k} for k in range(3)],
+                }
+        documents.append(document)
+    return documents
@@ -1,33 +1,126 @@
+from importlib import import_module
 from typing import Optional
 
 from .config import set_connection_string
 
 __all__ = ["set_connection_string"]
 
+# Public names are loaded on first access (PEP 562) so that a sync-only process
+# never imports motor and a plain `import pymongex` stays cheap. The names the
+# star imports used to re-export are kept.
+_LAZY_ATTRIBUTES = {
+    "ObjectId": "bson",
+    "Enum": "enum",
+    "EnumMeta": "enum",
+    "ChangePage": ".clients.changes",
+    "ChangeWatermark": ".clients.changes",
+    "HedgePolicy": ".clients.read_policy",
+    "RetryPolicy": ".clients.read_policy",
+    "ResultCache": ".clients.result_cache",
+    "LimitAction": ".clients.result_limits",
+    "ResultLimits": ".clients.result_limits",
+    "set_result_limits": ".clients.result_limits",
+    "SlowQueryPolicy": ".clients.slow_query",
+    "BaseEnum": ".constants",
+    "MetaEnum": ".constants",
+    "PyObjectId": ".constants",
+    "AdmissionRejected": ".exceptions",
+    "DeadlineExceeded": ".exceptions",
+    "ResultTooLarge": ".exceptions",
+    "VersionConflict": ".exceptions",
+    "AsyncDumpClient": ".dump",
+    "DumpClient": ".dump",
+    "CollectionModel": ".models",
+    "DataModel": ".models",
+    "InCollectionModel": ".models",
+    "OutCollectionModel": ".models",
+    "QueryOptions": ".options",
+    "deadline": ".options",
+    "InMemorySink": ".metrics",
+    "MetricsSink": ".metrics",
+    "render_prometheus": ".metrics",
+    "set_metrics_sink": ".metrics",
+    "AsyncMemoryClient": ".memory",
+    "MemoryClient": ".memory",
+    "BasePipelineParser": ".pipelines",
+    "PipelineBuilder": ".pipelines",
+    "AdmissionController": ".service.admission",
+    "Priority": ".service.admission",
+    "priority": ".service.admission",
+    "AsyncBaseService": ".service.async_service",
+    "AsyncPartitionedService": ".service.async_service",
+    "AsyncViewService": ".service.async_service",
+    "CounterBuffer": ".service.counters",
+    "PartitionPeriod": ".service.partitions",
+    "Partitioning": ".service.partitions",
+    "Snapshot": ".service.snapshots",
+    "SnapshotDrift": ".service.snapshots",
+    "SyncBaseService": ".service.sync_service",
+    "SyncPartitionedService": ".service.sync_service",
+    "SyncViewService": ".service.sync_service",
+    "AsyncUnitOfWork": ".service.unit_of_work",
+    "UnitOfWork": ".service.unit_of_work",
+    "MongoAsyncClientSingleton": ".singleton.async_mongo_singleton",
+    "MongoSyncClientSingleton": ".singleton.sync_mongo_singleton",
+    "WarmupReport": ".startup",
+    "async_warmup": ".startup",
+    "warmup": ".startup",
+    "BaseDatabase": ".storage",
+    "Collection": ".storage",
+}
 
-from .constants import *
-from .models import *
-from .pipelines import BasePipelineParser, PipelineBuilder
-from .service import AsyncBaseService, SyncBaseService
-from .singleton import MongoAsyncClientSingleton, MongoSyncClientSingleton
-from .storage import BaseDatabase, Collection
+_LAZY_MODULES = {
+    "clients": ".clients",
+    "collection": ".models.collection",
+    "constants": ".constants",
+    "datamodel": ".models.datamodel",
+    "models": ".models",
+    "pipelines": ".pipelines",
+    "service": ".service",
+    "singleton": ".singleton",
+    "storage": ".storage",
+    "utils": ".utils",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_MODULES:
+        value = import_module(_LAZY_MODULES[name], __name__)
+    elif name in _LAZY_ATTRIBUTES:
+        value = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | set(_LAZY_MODULES))
 
 
 async def async_connect(connection_string: Optional[str] = None):
+    from .singleton.async_mongo_singleton import MongoAsyncClientSingleton
+
     if connection_string is not None and isinstance(connection_string, str):
         set_connection_string(connection_string)
     await MongoAsyncClientSingleton.initialize()
 
 
 def connect(connection_string: Optional[str] = None):
+    from .singleton.sync_mongo_singleton import MongoSyncClientSingleton
+
     if connection_string is not None and isinstance(connection_string, str):
         set_connection_string(connection_string)
     MongoSyncClientSingleton.initialize()
 
 
 async def async_disconnect():
+    from .singleton.async_mongo_singleton import MongoAsyncClientSingleton
+
     await MongoAsyncClientSingleton.close_client()
 
 
 def disconnect():
+    from .singleton.sync_mongo_singleton import MongoSyncClientSingleton
+
     MongoSyncClientSingleton.close_client()
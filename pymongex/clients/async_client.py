@@ -1,6 +1,24 @@
-from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Any, Dict, List, Optional, Union, Type
+import asyncio
+import time
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    Type,
+)
+import bson
 from bson import ObjectId
+from pymongo import DeleteMany
+from pymongo.errors import BulkWriteError
+from pymongo.results import BulkWriteResult
 
 from pydantic import BaseModel
 
@@ -9,18 +27,36 @@ from ..models.collection import (
     OutCollectionModel,
     CollectionModel,
 )
+from ..options import QueryOptions
+from ..utils import utc_now
 from ..singleton.async_mongo_singleton import (
     MongoAsyncClientSingleton,
 )
 from .base_client import BaseMongoClient
+from .changes import (
+    delete_arguments,
+    empty_bulk_result,
+    is_delete,
+    is_incremental,
+    merge_bulk_result,
+    split_at_deletes,
+    tombstone_location,
+    tombstone_requests,
+)
+from .decoding import DecodeMode, decode_raw_batch
+from .read_policy import is_read_only_pipeline
+from .result_limits import (
+    LimitAction,
+    ResultGuard,
+    ResultLimits,
+    resolve_result_limits,
+)
+from .slow_query import explain_command
 
 
 class AsyncMongoClient(BaseMongoClient):
     _client: AsyncIOMotorClient
 
-    def __init__(self):
-        self._client = None
-
     def _initialize_client(self):
         if self._client is None:
             self._client = MongoAsyncClientSingleton.get_client()
@@ -38,55 +74,175 @@ class AsyncMongoClient(BaseMongoClient):
         collection_name = model.get_collection()
         return self._client[db_name][collection_name]
 
+    def _get_database_client(self, database: str) -> Any:
+        self._initialize_client()
+        return self._client[database]
+
     async def _aggregate(
         self,
         model: Type[OutCollectionModel],
         pipeline: List[Dict[str, Any]],
+        options: Optional[QueryOptions] = None,
     ) -> List[Dict[str, Any]]:
         self._initialize_client()
-        client = self._get_collection_client(model)
-        documents = await client.aggregate(pipeline).to_list(length=None)
+
+        async def read(collection: AsyncIOMotorCollection) -> List[Dict[str, Any]]:
+            # resolved per attempt so retries see the remaining deadline
+            resolved = self._resolve_options(model, options)
+            cursor = collection.aggregate(pipeline, **resolved.aggregate_kwargs())
+            return await cursor.to_list(length=None)
+
+        started = time.perf_counter()
+        documents = await self._read(
+            model, read, idempotent=is_read_only_pipeline(pipeline)
+        )
+        self._after_read(model, "aggregate", pipeline, started, len(documents))
         return documents
 
+    def _after_read(
+        self,
+        model: Type[CollectionModel],
+        operation: str,
+        pipeline: List[Dict[str, Any]],
+        started: float,
+        documents: int,
+    ) -> None:
+        key = self._record_read(model, operation, pipeline, started, documents)
+        if key is not None:
+            task = asyncio.get_running_loop().create_task(
+                self._explain(model, pipeline, key)
+            )
+            # the loop only keeps weak references to its tasks
+            self.slow_queries.tasks.add(task)
+            task.add_done_callback(self.slow_queries.tasks.discard)
+
+    async def _explain(
+        self, model: Type[CollectionModel], pipeline: List[Dict[str, Any]], key: str
+    ) -> None:
+        log = self.slow_queries
+        try:
+            self._initialize_client()
+            database = self._client[model.get_database()]
+            explain = await database.command(
+                "explain",
+                explain_command(model.get_collection(), pipeline),
+                verbosity="executionStats",
+            )
+        except Exception as error:
+            log.explain_failed(key, error)
+            return
+        log.attach_explain(key, explain)
+
+    async def _read(
+        self,
+        model: Type[CollectionModel],
+        read: Callable[[AsyncIOMotorCollection], Awaitable[Any]],
+        idempotent: bool = True,
+    ) -> Any:
+        collection = self._get_collection_client(model)
+        if not idempotent:
+            return await read(collection)
+        self.read_stats.incr("reads")
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_read(model, collection, read)
+            except Exception as e:
+                policy = self.retry_policy
+                if policy is None or not policy.is_retryable(e):
+                    raise
+                if attempt + 1 >= policy.max_attempts:
+                    self.read_stats.incr("retries_exhausted")
+                    raise
+                self.read_stats.incr("retries")
+                await asyncio.sleep(policy.backoff(attempt))
+                attempt += 1
+
+    async def _hedged_read(
+        self,
+        model: Type[CollectionModel],
+        collection: AsyncIOMotorCollection,
+        read: Callable[[AsyncIOMotorCollection], Awaitable[Any]],
+    ) -> Any:
+        policy = self.hedge_policy
+        if policy is None:
+            return await read(collection)
+
+        key = model.get_collection()
+        delay = self._latencies.hedge_delay_ms(key, policy) / 1000
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(read(collection))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                self._latencies.record(key, (time.perf_counter() - start) * 1000)
+                return primary.result()
+
+            hedge_collection = collection
+            if policy.read_preference is not None:
+                hedge_collection = collection.with_options(
+                    read_preference=policy.read_preference
+                )
+            self.read_stats.incr("hedges_issued")
+            hedge = asyncio.ensure_future(read(hedge_collection))
+            tasks.add(hedge)
+            winner = await self._first_success(tasks)
+            self._latencies.record(key, (time.perf_counter() - start) * 1000)
+            if winner is hedge:
+                self.read_stats.incr("hedges_won")
+            return winner.result()
+        finally:
+            # cancels the loser and both reads if the caller itself is cancelled
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    async def _first_success(tasks: Set[asyncio.Future]) -> asyncio.Future:
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task
+                error = task.exception()
+        raise error
+
     async def insert_one(
         self,
         model: Type[InCollectionModel],
         document: Union[Dict, InCollectionModel, BaseModel],
+        options: Optional[QueryOptions] = None,
     ) -> ObjectId:
         self._initialize_client()
-        if not isinstance(document, InCollectionModel):
-            if isinstance(document, BaseModel):
-                document = model(**document.dict())
-            elif isinstance(document, dict):
-                document = model(**document)
-            else:
-                raise ValueError(
-                    "Document must be of the same type as the model or a dict"
-                )
+        # the same preparation as insert_many, compressed values included
+        db_dict = self._prepare_insert_documents(model, [document])[0]
         client = self._get_collection_client(model)
-        db_dict = document.db_dict()
-        result = await client.insert_one(db_dict)
+        options = self._resolve_options(model, options)
+        with self._writing(model), options.timeout():
+            result = await client.insert_one(
+                db_dict, **options.write_kwargs(hint=False, collation=False)
+            )
         return result.inserted_id
 
     async def insert_many(
         self,
         model: Type[InCollectionModel],
         documents: List[Union[Dict, InCollectionModel, BaseModel]],
+        options: Optional[QueryOptions] = None,
     ) -> List[ObjectId]:
         self._initialize_client()
-        if all(isinstance(doc, InCollectionModel) for doc in documents):
-            documents = [doc.db_dict() for doc in documents]
-        elif all(isinstance(doc, BaseModel) for doc in documents):
-            documents = [model(**doc.dict()).db_dict() for doc in documents]
-        elif all(isinstance(doc, dict) for doc in documents):
-            documents = [model(**doc).db_dict() for doc in documents]
-        else:
-            raise ValueError(
-                "All documents must be of the same type as the model or a dict"
-            )
-
+        documents = self._prepare_insert_documents(model, documents)
         client = self._get_collection_client(model)
-        result = await client.insert_many(documents)
+        options = self._resolve_options(model, options)
+        with self._writing(model), options.timeout():
+            result = await client.insert_many(
+                documents, **options.write_kwargs(hint=False, collation=False)
+            )
         return result.inserted_ids
 
     async def find_one(
@@ -96,6 +252,7 @@ class AsyncMongoClient(BaseMongoClient):
         sort: dict = None,
         expand: Optional[List[str]] = None,
         skip: int = 0,
+        options: Optional[QueryOptions] = None,
     ) -> Optional[OutCollectionModel]:
         pipeline = self._prepare_find_pipeline(
             model,
@@ -105,7 +262,7 @@ class AsyncMongoClient(BaseMongoClient):
             limit=1,
             expand=expand,
         )
-        documents = await self._aggregate(model, pipeline)
+        documents = await self._aggregate(model, pipeline, options=options)
         document = documents[0] if documents else None
         if document:
             return self._to_model(model=model, document=document)
@@ -118,23 +275,220 @@ class AsyncMongoClient(BaseMongoClient):
         skip: int = 0,
         limit: int = None,
         expand: Optional[List[str]] = None,
+        options: Optional[QueryOptions] = None,
     ) -> List[OutCollectionModel]:
         pipeline = self._prepare_find_pipeline(
             model, query, sort, skip, limit, expand=expand
         )
-        documents = await self._aggregate(model, pipeline)
-        return self._docs_to_models(model, documents)
+        limits = resolve_result_limits(model)
+        if limits is not None:
+            return await self._find_limited(model, pipeline, limits, options=options)
+        mode = self.decode_policy.mode
+        if mode == DecodeMode.PROCESS:
+            return await self._aggregate_decoded(model, pipeline, options=options)
+        documents = await self._aggregate(model, pipeline, options=options)
+        if mode == DecodeMode.THREAD:
+            return await asyncio.to_thread(self._decode_documents, model, documents)
+        return self._decode_documents(model, documents)
+
+    async def iter_many(
+        self,
+        model: Type[OutCollectionModel],
+        query: dict = {},
+        sort: dict = None,
+        skip: int = 0,
+        limit: int = None,
+        expand: Optional[List[str]] = None,
+        options: Optional[QueryOptions] = None,
+    ) -> AsyncIterator[OutCollectionModel]:
+        """
+        find_many as an async iterator. When the result limits of `model` have
+        the STREAM action, the documents beyond the limits are read from the
+        open cursor while iterating instead of raising.
+        """
+        limits = resolve_result_limits(model)
+        if limits is None or limits.action != LimitAction.STREAM:
+            for item in await self.find_many(
+                model, query, sort, skip, limit, expand=expand, options=options
+            ):
+                yield item
+            return
+        pipeline = self._prepare_find_pipeline(
+            model, query, sort, skip, limit, expand=expand
+        )
+        guard, cursor, batches = await self._read_limited(
+            model, pipeline, limits, options
+        )
+        async for item in self._stream_limited(model, guard, cursor, batches):
+            yield item
+
+    async def _find_limited(
+        self,
+        model: Type[OutCollectionModel],
+        pipeline: List[Dict[str, Any]],
+        limits: ResultLimits,
+        options: Optional[QueryOptions] = None,
+    ) -> List[Any]:
+        if limits.action == LimitAction.STREAM:
+            # a list cannot stream, iter_many does
+            limits = limits.model_copy(update={"action": LimitAction.RAISE})
+        guard, cursor, batches = await self._read_limited(
+            model, pipeline, limits, options
+        )
+        await cursor.close()
+        guard.finish()
+        return await self._decode_raw_batches(model, batches)
+
+    async def _read_limited(
+        self,
+        model: Type[OutCollectionModel],
+        pipeline: List[Dict[str, Any]],
+        limits: ResultLimits,
+        options: Optional[QueryOptions] = None,
+    ) -> Tuple[ResultGuard, Any, List[bytes]]:
+        """
+        Reads raw batches, so the result is measured from their BSON lengths,
+        and stops reading once it exceeds `limits`. The cursor is left open.
+        """
+
+        async def read(collection: AsyncIOMotorCollection):
+            resolved = self._resolve_options(model, options)
+            guard = ResultGuard(model, limits)
+            cursor = collection.aggregate_raw_batches(
+                pipeline, **resolved.aggregate_kwargs()
+            )
+            batches = []
+            try:
+                async for raw_batch in cursor:
+                    kept = guard.admit(raw_batch)
+                    if kept:
+                        batches.append(kept)
+                    if guard.exceeded:
+                        break
+            except BaseException:
+                await cursor.close()
+                raise
+            return guard, cursor, batches
+
+        started = time.perf_counter()
+        guard, cursor, batches = await self._read(
+            model, read, idempotent=is_read_only_pipeline(pipeline)
+        )
+        self._after_read(model, "aggregate", pipeline, started, guard.documents)
+        return guard, cursor, batches
+
+    async def _stream_limited(
+        self,
+        model: Type[OutCollectionModel],
+        guard: ResultGuard,
+        cursor: Any,
+        batches: List[bytes],
+    ) -> AsyncIterator[Any]:
+        try:
+            for raw_batch in batches:
+                for item in await self._decode_raw_batches(model, [raw_batch]):
+                    yield item
+            async for raw_batch in cursor:
+                guard.add(raw_batch)
+                for item in await self._decode_raw_batches(model, [raw_batch]):
+                    yield item
+        finally:
+            await cursor.close()
+            guard.finish()
+
+    async def _decode_raw_batches(
+        self, model: Type[OutCollectionModel], batches: List[bytes]
+    ) -> List[Any]:
+        mode = self.decode_policy.mode
+        if mode == DecodeMode.PROCESS:
+            loop = asyncio.get_running_loop()
+            pool = self._get_decode_pool()
+            output = self.decode_policy.output
+            futures = [
+                loop.run_in_executor(pool, decode_raw_batch, model, raw_batch, output)
+                for raw_batch in batches
+            ]
+            decoded = await asyncio.gather(*futures)
+            return [item for batch in decoded for item in batch]
+        documents = [
+            document for raw_batch in batches for document in bson.decode_all(raw_batch)
+        ]
+        if mode == DecodeMode.THREAD:
+            return await asyncio.to_thread(self._decode_documents, model, documents)
+        return self._decode_documents(model, documents)
+
+    async def _aggregate_decoded(
+        self,
+        model: Type[OutCollectionModel],
+        pipeline: List[Dict[str, Any]],
+        options: Optional[QueryOptions] = None,
+    ) -> List[Any]:
+        # raw batches are handed to the pool while the next one is fetched
+        output = self.decode_policy.output
+
+        async def read(collection: AsyncIOMotorCollection) -> List[Any]:
+            resolved = self._resolve_options(model, options)
+            loop = asyncio.get_running_loop()
+            pool = self._get_decode_pool()
+            cursor = collection.aggregate_raw_batches(
+                pipeline, **resolved.aggregate_kwargs()
+            )
+            futures = []
+            async for raw_batch in cursor:
+                futures.append(
+                    loop.run_in_executor(
+                        pool, decode_raw_batch, model, raw_batch, output
+                    )
+                )
+            batches = await asyncio.gather(*futures)
+            return [item for batch in batches for item in batch]
+
+        started = time.perf_counter()
+        items = await self._read(
+            model, read, idempotent=is_read_only_pipeline(pipeline)
+        )
+        self._after_read(model, "aggregate", pipeline, started, len(items))
+        return items
+
+    async def find_batches(
+        self,
+        model: Type[OutCollectionModel],
+        query: dict = {},
+        sort: dict = None,
+        batch_size: int = 1000,
+        expand: Optional[List[str]] = None,
+        options: Optional[QueryOptions] = None,
+    ) -> AsyncIterator[List[OutCollectionModel]]:
+        if batch_size <= 0:
+            raise ValueError("batch_size has to be a strict positive integer")
+        pipeline = self._prepare_find_pipeline(model, query, sort, expand=expand)
+        options = self._resolve_options(model, options)
+        if options.batch_size is None:
+            options = options.model_copy(update={"batch_size": batch_size})
+        client = self._get_collection_client(model)
+        cursor = client.aggregate(pipeline, **options.aggregate_kwargs())
+        try:
+            while True:
+                documents = await cursor.to_list(length=batch_size)
+                if not documents:
+                    break
+                yield self._docs_to_models(model, documents)
+        finally:
+            await cursor.close()
 
     async def update_one(
         self,
         model: Type[InCollectionModel],
         query: Dict,
         update: Dict,
+        options: Optional[QueryOptions] = None,
     ) -> int:
         self._initialize_client()
         client = self._get_collection_client(model)
         self._add_updated_at(update=update)
-        result = await client.update_one(query, update)
+        options = self._resolve_options(model, options)
+        with self._writing(model), options.timeout():
+            result = await client.update_one(query, update, **options.write_kwargs())
         return result.modified_count
 
     async def update_many(
@@ -142,31 +496,155 @@ class AsyncMongoClient(BaseMongoClient):
         model: Type[InCollectionModel],
         query: Dict,
         update: Dict,
+        options: Optional[QueryOptions] = None,
     ) -> int:
         self._initialize_client()
         client = self._get_collection_client(model)
         self._add_updated_at(update=update)
-        result = await client.update_many(query, [update])
+        options = self._resolve_options(model, options)
+        with self._writing(model), options.timeout():
+            result = await client.update_many(query, update, **options.write_kwargs())
         return result.modified_count
 
-    async def delete_one(self, model: Type[InCollectionModel], query: Dict) -> int:
+    async def delete_one(
+        self,
+        model: Type[InCollectionModel],
+        query: Dict,
+        options: Optional[QueryOptions] = None,
+    ) -> int:
         self._initialize_client()
         client = self._get_collection_client(model)
-        result = await client.delete_one(query)
+        options = self._resolve_options(model, options)
+        with self._writing(model), options.timeout():
+            if is_incremental(model):
+                ids = await self._tombstone(
+                    model, query, many=False, **options.write_kwargs()
+                )
+                query = {"_id": {"$in": ids}}
+            result = await client.delete_one(query, **options.write_kwargs())
         return result.deleted_count
 
-    async def delete_many(self, model: Type[InCollectionModel], query: Dict) -> int:
+    async def delete_many(
+        self,
+        model: Type[InCollectionModel],
+        query: Dict,
+        options: Optional[QueryOptions] = None,
+    ) -> int:
         self._initialize_client()
         client = self._get_collection_client(model)
-        result = await client.delete_many(query)
+        options = self._resolve_options(model, options)
+        with self._writing(model), options.timeout():
+            if is_incremental(model):
+                ids = await self._tombstone(
+                    model, query, many=True, **options.write_kwargs()
+                )
+                query = {"_id": {"$in": ids}}
+            result = await client.delete_many(query, **options.write_kwargs())
         return result.deleted_count
 
+    async def _tombstone(
+        self,
+        model: Type[InCollectionModel],
+        query: Dict,
+        many: bool,
+        session: Any = None,
+        **kwargs,
+    ) -> List[Any]:
+        """
+        Writes the tombstones of the documents `query` deletes and returns
+        their ids, the caller deletes them by id. `kwargs` are the find
+        options of the delete, its collation and hint. Tombstones go first: a
+        failure in between leaves the tombstone of a live document, which its
+        next update supersedes.
+        """
+        client = self._get_collection_client(model)
+        cursor = client.find(query, {"_id": 1}, session=session, **kwargs)
+        if not many:
+            cursor = cursor.limit(1)
+        ids = [document["_id"] for document in await cursor.to_list(None)]
+        if ids:
+            tombstones = self._get_collection_client(tombstone_location(model))
+            await tombstones.bulk_write(
+                tombstone_requests(ids, utc_now()), ordered=False, session=session
+            )
+        return ids
+
+    async def _tombstoned_bulk_write(
+        self,
+        model: Type[InCollectionModel],
+        requests: List[Any],
+        ordered: bool,
+        session: Any,
+        options: QueryOptions,
+    ) -> BulkWriteResult:
+        """
+        The bulk_write of an incremental model with deletes, flushed before
+        each delete so it matches the documents the earlier requests left, as
+        within one bulk_write. A delete writes its tombstones, then deletes
+        the ids read with its collation and hint.
+        """
+        client = self._get_collection_client(model)
+        total = empty_bulk_result()
+        acknowledged = True
+        for offset, segment in split_at_deletes(requests):
+            if is_delete(segment[0]):
+                query, many, kwargs = delete_arguments(segment[0])
+                ids = await self._tombstone(model, query, many, session, **kwargs)
+                segment = [DeleteMany({"_id": {"$in": ids}}, **kwargs)]
+            try:
+                result = await client.bulk_write(
+                    segment,
+                    ordered=ordered,
+                    session=session,
+                    **options.write_kwargs(hint=False, collation=False),
+                )
+            except BulkWriteError as error:
+                merge_bulk_result(total, error.details, offset)
+                if ordered:
+                    raise BulkWriteError(total) from error
+                continue
+            if result.acknowledged:
+                merge_bulk_result(total, result.bulk_api_result, offset)
+            else:
+                acknowledged = False
+        if total["writeErrors"] or total["writeConcernErrors"]:
+            raise BulkWriteError(total)
+        return BulkWriteResult(total, acknowledged)
+
+    async def bulk_write(
+        self,
+        model: Type[InCollectionModel],
+        requests: List[Any],
+        ordered: bool = True,
+        options: Optional[QueryOptions] = None,
+        session: Any = None,
+    ) -> BulkWriteResult:
+        self._initialize_client()
+        client = self._get_collection_client(model)
+        options = self._resolve_options(model, options)
+        with self._writing(model), options.timeout():
+            if self._tombstones_needed(model, requests):
+                return await self._tombstoned_bulk_write(
+                    model, requests, ordered, session, options
+                )
+            return await client.bulk_write(
+                requests,
+                ordered=ordered,
+                session=session,
+                **options.write_kwargs(hint=False, collation=False),
+            )
+
+    async def start_session(self, **kwargs) -> Any:
+        self._initialize_client()
+        return await self._client.start_session(**kwargs)
+
     async def aggregate(
         self,
         model: Type[OutCollectionModel],
         pipeline: List[Dict[str, Any]],
         parse: bool = False,
         map_id: bool = False,
+        options: Optional[QueryOptions] = None,
     ) -> Union[List[OutCollectionModel], List[Union[Dict[str, Any], Any]]]:
         if map_id:
             map_id_stage = {"$addFields": {"id": "$_id"}}
@@ -174,7 +652,8 @@ class AsyncMongoClient(BaseMongoClient):
             pipeline.append(map_id_stage)
             pipeline.append(project_id_stage)
 
-        documents = await self._aggregate(model, pipeline)
+        documents = await self._aggregate(model, pipeline, options=options)
+        self._invalidate_pipeline_target(model, pipeline)
         if not parse:
             return documents
         return self._docs_to_models(model, documents)
@@ -183,7 +662,16 @@ class AsyncMongoClient(BaseMongoClient):
         self,
         model: Type[InCollectionModel],
         query: Dict,
+        options: Optional[QueryOptions] = None,
     ) -> int:
         self._initialize_client()
-        client = self._get_collection_client(model)
-        return await client.count_documents(query)
+
+        async def read(collection: AsyncIOMotorCollection) -> int:
+            resolved = self._resolve_options(model, options)
+            return await collection.count_documents(query, **resolved.count_kwargs())
+
+        started = time.perf_counter()
+        count = await self._read(model, read)
+        pipeline = [{"$match": query}, {"$count": "count"}]
+        self._after_read(model, "count", pipeline, started, 1)
+        return count
@@ -1,19 +1,108 @@
+import time
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Type, Union
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Type, Union
 
 from bson import ObjectId
-from pydantic import BaseModel, TypeAdapter
+from pydantic import BaseModel
 
+from ..metrics.recording import record_validation
 from ..models.collection import (
+    CollectionModel,
     InCollectionModel,
     OutCollectionModel,
 )
+from ..models.compression import decompress_document
+from ..options import QueryOptions, resolve_options
 from ..pipelines.pipeline_builder import PipelineBuilder
 from ..utils import utc_now
+from .changes import is_delete, is_incremental, stamp_insert
+from .decoding import (
+    DecodeOutput,
+    DecodePolicy,
+    list_adapter,
+    model_adapter,
+    to_records,
+)
+from .read_policy import HedgePolicy, LatencyTracker, ReadStats, RetryPolicy
+from .result_cache import invalidate_collection, pipeline_target
+from .slow_query import SlowQueryLog, SlowQueryPolicy
 
 
 class BaseMongoClient(ABC):
 
+    def __init__(
+        self,
+        client: Any = None,
+        hedge_policy: Optional[HedgePolicy] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        decode_policy: Optional[DecodePolicy] = None,
+        slow_query_policy: Optional[SlowQueryPolicy] = None,
+    ):
+        # client can be injected (e.g. a fake) instead of using the singleton
+        self._client = client
+        self.read_stats = ReadStats()
+        self.set_read_policies(hedge_policy=hedge_policy, retry_policy=retry_policy)
+        self.decode_policy = decode_policy or DecodePolicy()
+        self._decode_pool = None
+        self.set_slow_query_policy(slow_query_policy)
+
+    def set_read_policies(
+        self,
+        hedge_policy: Optional[HedgePolicy] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        self.hedge_policy = hedge_policy
+        self.retry_policy = retry_policy
+        window = hedge_policy.window if hedge_policy else 1000
+        self._latencies = LatencyTracker(window=window)
+
+    def set_slow_query_policy(self, policy: Optional[SlowQueryPolicy]) -> None:
+        # None turns the slow query log off
+        self.slow_queries = SlowQueryLog(policy) if policy is not None else None
+
+    def _record_read(
+        self,
+        model: Type[CollectionModel],
+        operation: str,
+        pipeline: List[Dict[str, Any]],
+        started: float,
+        documents: int,
+    ) -> Optional[str]:
+        """
+        Records a read that started at the perf_counter `started` if it was
+        slow, returns the shape key when it has to be explained.
+        """
+        log = self.slow_queries
+        if log is None:
+            return None
+        duration_ms = (time.perf_counter() - started) * 1000
+        if not log.is_slow(duration_ms):
+            return None
+        return log.record(model, operation, pipeline, duration_ms, documents)
+
+    @contextmanager
+    def _writing(self, model: Type[CollectionModel]) -> Iterator[None]:
+        # drops the cached results reading the collection, also when the write
+        # fails since part of it may have been applied
+        try:
+            yield
+        finally:
+            invalidate_collection(model.get_database(), model.get_collection())
+
+    def _tombstones_needed(
+        self, model: Type[CollectionModel], requests: List[Any]
+    ) -> bool:
+        return is_incremental(model) and any(map(is_delete, requests))
+
+    def _invalidate_pipeline_target(
+        self, model: Type[CollectionModel], pipeline: List[Dict[str, Any]]
+    ) -> None:
+        target = pipeline_target(model.get_database(), pipeline)
+        if target is not None:
+            invalidate_collection(*target)
+
     def _prepare_find_pipeline(
         self,
         model: Type[InCollectionModel],
@@ -36,21 +125,80 @@ class BaseMongoClient(ABC):
         )
         return builder.build_pipeline()
 
+    def _prepare_insert_documents(
+        self,
+        model: Type[InCollectionModel],
+        documents: List[Union[Dict, InCollectionModel, BaseModel]],
+    ) -> List[Dict[str, Any]]:
+        if all(isinstance(doc, InCollectionModel) for doc in documents):
+            documents = [doc.db_dict() for doc in documents]
+        elif all(isinstance(doc, BaseModel) for doc in documents):
+            documents = [model(**doc.dict()).db_dict() for doc in documents]
+        elif all(isinstance(doc, dict) for doc in documents):
+            documents = [
+                model(**decompress_document(model, doc)).db_dict() for doc in documents
+            ]
+        else:
+            raise ValueError(
+                "All documents must be of the same type as the model or a dict"
+            )
+        if is_incremental(model):
+            documents = [stamp_insert(document) for document in documents]
+        return documents
+
+    def _resolve_options(
+        self,
+        model: Type[InCollectionModel],
+        options: Optional[QueryOptions] = None,
+    ) -> QueryOptions:
+        return resolve_options(model.get_query_options(), options)
+
     def _to_model(
         self,
         model: Type[OutCollectionModel],
         document: Dict[str, Any],
     ) -> OutCollectionModel:
-        ta = TypeAdapter(model)
-        return ta.validate_python(document, from_attributes=True)
+        started = time.perf_counter()
+        instance = model_adapter(model).validate_python(document, from_attributes=True)
+        model.mark_loaded([instance])
+        record_validation(started)
+        return instance
 
     def _docs_to_models(
         self,
         model: Type[OutCollectionModel],
         mongodb_cursors: List[Dict[str, Any]],
     ):
-        ta = TypeAdapter(list[model])
-        return ta.validate_python(mongodb_cursors, from_attributes=True)
+        started = time.perf_counter()
+        models = list_adapter(model).validate_python(
+            mongodb_cursors, from_attributes=True
+        )
+        models = model.mark_loaded(models)
+        record_validation(started)
+        return models
+
+    def _decode_documents(
+        self,
+        model: Type[OutCollectionModel],
+        documents: List[Dict[str, Any]],
+    ) -> List[Any]:
+        if self.decode_policy.output == DecodeOutput.RECORDS:
+            # records are not written back, no need to track changes
+            started = time.perf_counter()
+            models = list_adapter(model).validate_python(
+                documents, from_attributes=True
+            )
+            records = to_records(model, models)
+            record_validation(started)
+            return records
+        return self._docs_to_models(model, documents)
+
+    def _get_decode_pool(self) -> ProcessPoolExecutor:
+        if self._decode_pool is None:
+            self._decode_pool = ProcessPoolExecutor(
+                max_workers=self.decode_policy.processes
+            )
+        return self._decode_pool
 
     def _add_updated_at(self, update: dict) -> None:
         update["$set"] = update.get("$set", {})
@@ -61,6 +209,7 @@ class BaseMongoClient(ABC):
         self,
         model: InCollectionModel,
         document: Union[Dict, InCollectionModel, BaseModel],
+        options: Optional[QueryOptions] = None,
     ) -> ObjectId:
         pass
 
@@ -69,12 +218,16 @@ class BaseMongoClient(ABC):
         self,
         model: InCollectionModel,
         documents: List[Union[Dict, InCollectionModel, BaseModel]],
+        options: Optional[QueryOptions] = None,
     ) -> List[ObjectId]:
         pass
 
     @abstractmethod
     def find_one(
-        self, model: OutCollectionModel, query: dict
+        self,
+        model: OutCollectionModel,
+        query: dict,
+        options: Optional[QueryOptions] = None,
     ) -> Optional[InCollectionModel]:
         pass
 
@@ -86,23 +239,46 @@ class BaseMongoClient(ABC):
         sort: dict = None,
         skip: int = 0,
         limit: int = None,
+        options: Optional[QueryOptions] = None,
     ) -> List[InCollectionModel]:
         pass
 
     @abstractmethod
-    def update_one(self, model: InCollectionModel, query: Dict, update: Dict) -> int:
+    def update_one(
+        self,
+        model: InCollectionModel,
+        query: Dict,
+        update: Dict,
+        options: Optional[QueryOptions] = None,
+    ) -> int:
         pass
 
     @abstractmethod
-    def update_many(self, model: InCollectionModel, query: Dict, update: Dict) -> int:
+    def update_many(
+        self,
+        model: InCollectionModel,
+        query: Dict,
+        update: Dict,
+        options: Optional[QueryOptions] = None,
+    ) -> int:
         pass
 
     @abstractmethod
-    def delete_one(self, model: InCollectionModel, query: Dict) -> int:
+    def delete_one(
+        self,
+        model: InCollectionModel,
+        query: Dict,
+        options: Optional[QueryOptions] = None,
+    ) -> int:
         pass
 
     @abstractmethod
-    def delete_many(self, model: InCollectionModel, query: Dict) -> int:
+    def delete_many(
+        self,
+        model: InCollectionModel,
+        query: Dict,
+        options: Optional[QueryOptions] = None,
+    ) -> int:
         pass
 
     @abstractmethod
@@ -112,9 +288,15 @@ class BaseMongoClient(ABC):
         pipeline: List[Dict[str, Any]],
         parse: bool = False,
         map_id: bool = False,
+        options: Optional[QueryOptions] = None,
     ) -> Union[List[OutCollectionModel], List[Union[Dict[str, Any], Any]]]:
         pass
 
     @abstractmethod
-    def count(self, model: InCollectionModel, query: Dict) -> int:
+    def count(
+        self,
+        model: InCollectionModel,
+        query: Dict,
+        options: Optional[QueryOptions] = None,
+    ) -> int:
         pass
@@ -0,0 +1,206 @@
+from datetime import datetime as dt
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from bson import ObjectId
+from pydantic import BaseModel, Field
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+
+from ..constants import PyObjectId
+from ..models.collection import CollectionModel, ensure_utc_timezone
+
+TOMBSTONE_SUFFIX = "_tombstones"
+
+# the order changes are paged in, backed by the index of ensure_change_indexes
+CHANGE_SORT = {"updated_at": 1, "_id": 1}
+
+
+class CollectionLocation:
+    """A collection passed to the clients in place of a model."""
+
+    def __init__(self, database: str, collection: str):
+        self.database = database
+        self.collection = collection
+
+    def get_database(self) -> str:
+        return self.database
+
+    def get_collection(self) -> str:
+        return self.collection
+
+
+def is_incremental(model: Type[CollectionModel]) -> bool:
+    """
+    Models with Collection.incremental_sync stamp updated_at on insert and
+    leave a tombstone for every deleted document, see changes_since.
+    """
+    return getattr(model.Collection, "incremental_sync", False)
+
+
+def check_incremental(model: Type[CollectionModel]) -> None:
+    if not is_incremental(model):
+        raise ValueError(
+            f"{model.__name__} does not set Collection.incremental_sync, its "
+            "inserts are not stamped with updated_at and its deletes leave no "
+            "tombstones"
+        )
+
+
+def tombstone_location(model: Type[CollectionModel]) -> CollectionLocation:
+    return CollectionLocation(
+        model.get_database(), f"{model.get_collection()}{TOMBSTONE_SUFFIX}"
+    )
+
+
+def stamp_insert(document: Dict[str, Any]) -> Dict[str, Any]:
+    # inserts are changes too, they are paged by updated_at like updates
+    if document.get("updated_at") is None:
+        document["updated_at"] = document.get("created_at")
+    return document
+
+
+def tombstone_requests(ids: List[Any], deleted_at: dt) -> List[UpdateOne]:
+    return [
+        UpdateOne(
+            {"_id": id},
+            {"$set": {"updated_at": deleted_at, "deleted_at": deleted_at}},
+            upsert=True,
+        )
+        for id in ids
+    ]
+
+
+def is_delete(request: Any) -> bool:
+    return isinstance(request, (DeleteOne, DeleteMany))
+
+
+def delete_arguments(request: Any) -> Tuple[Dict[str, Any], bool, Dict[str, Any]]:
+    """
+    The filter of a DeleteOne or DeleteMany, whether it deletes many and its
+    collation and hint, which pymongo only keeps in private attributes.
+    """
+    kwargs = {"collation": request._collation, "hint": request._hint}
+    kwargs = {name: value for name, value in kwargs.items() if value is not None}
+    return request._filter, isinstance(request, DeleteMany), kwargs
+
+
+def split_at_deletes(requests: List[Any]) -> List[Tuple[int, List[Any]]]:
+    """
+    The runs of requests between deletes and each delete alone, with the
+    index of their first request.
+    """
+    segments: List[Tuple[int, List[Any]]] = []
+    for index, request in enumerate(requests):
+        if is_delete(request) or not segments or is_delete(segments[-1][1][0]):
+            segments.append((index, [request]))
+        else:
+            segments[-1][1].append(request)
+    return segments
+
+
+def empty_bulk_result() -> Dict[str, Any]:
+    return {
+        "writeErrors": [],
+        "writeConcernErrors": [],
+        "nInserted": 0,
+        "nUpserted": 0,
+        "nMatched": 0,
+        "nModified": 0,
+        "nRemoved": 0,
+        "upserted": [],
+    }
+
+
+def merge_bulk_result(
+    total: Dict[str, Any], result: Dict[str, Any], offset: int
+) -> None:
+    # indexes of the segment's result are shifted to the whole request list
+    for key in ("nInserted", "nUpserted", "nMatched", "nModified", "nRemoved"):
+        total[key] += result.get(key, 0)
+    for key in ("upserted", "writeErrors"):
+        total[key] += [
+            {**item, "index": item["index"] + offset} for item in result.get(key, [])
+        ]
+    total["writeConcernErrors"] += result.get("writeConcernErrors", [])
+
+
+class ChangeWatermark(BaseModel):
+    """
+    Position in the changes of a collection: the (updated_at, _id) of the last
+    change read. Persist it and pass it back to changes_since to resume.
+    """
+
+    updated_at: Optional[dt] = None
+    id: Optional[PyObjectId] = None
+
+
+class ChangePage(BaseModel):
+    # inserted or updated documents, in change order
+    documents: List[Any] = Field(default_factory=list)
+    deleted_ids: List[PyObjectId] = Field(default_factory=list)
+    # to persist once the page is processed
+    watermark: ChangeWatermark
+
+    def __len__(self) -> int:
+        return len(self.documents) + len(self.deleted_ids)
+
+
+def change_query(
+    watermark: Optional[ChangeWatermark], settle_seconds: float, now: dt
+) -> Dict[str, Any]:
+    """
+    The changes after `watermark`. Changes stamped in the last
+    `settle_seconds` are left for the next call, so a write stamped before
+    but committed after a page was read is not skipped by the watermark.
+    Documents without updated_at, written before incremental_sync was set,
+    sort first and are returned by the first pages.
+    """
+    settled = now - timedelta(seconds=settle_seconds)
+    conditions = [{"$or": [{"updated_at": None}, {"updated_at": {"$lte": settled}}]}]
+    if watermark is not None and watermark.id is not None:
+        if watermark.updated_at is None:
+            after = [
+                {"updated_at": None, "_id": {"$gt": watermark.id}},
+                {"updated_at": {"$ne": None}},
+            ]
+        else:
+            after = [
+                {"updated_at": {"$gt": watermark.updated_at}},
+                {"updated_at": watermark.updated_at, "_id": {"$gt": watermark.id}},
+            ]
+        conditions.append({"$or": after})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _change_key(updated_at: Optional[dt], id: ObjectId) -> Tuple:
+    updated_at = ensure_utc_timezone(updated_at)
+    return (updated_at is not None, updated_at or dt.min, id)
+
+
+def merge_changes(
+    documents: List[Any],
+    tombstones: List[Dict[str, Any]],
+    batch_size: int,
+    watermark: Optional[ChangeWatermark],
+) -> ChangePage:
+    """
+    One page out of the first `batch_size` documents and tombstones after the
+    watermark, each sorted by (updated_at, _id).
+    """
+    changes = [(_change_key(doc.updated_at, doc.id), doc, False) for doc in documents]
+    changes += [
+        (_change_key(tombstone.get("updated_at"), tombstone["_id"]), tombstone, True)
+        for tombstone in tombstones
+    ]
+    changes.sort(key=lambda change: change[0])
+    changes = changes[:batch_size]
+    if not changes:
+        return ChangePage(watermark=watermark or ChangeWatermark())
+    has_updated_at, updated_at, id = changes[-1][0]
+    return ChangePage(
+        documents=[change for _, change, deleted in changes if not deleted],
+        deleted_ids=[change["_id"] for _, change, deleted in changes if deleted],
+        watermark=ChangeWatermark(
+            updated_at=updated_at if has_updated_at else None, id=id
+        ),
+    )
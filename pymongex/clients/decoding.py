@@ -0,0 +1,59 @@
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple, Type
+
+import bson
+from pydantic import BaseModel, Field, TypeAdapter
+
+from ..constants import BaseEnum
+
+
+class DecodeMode(BaseEnum):
+    # decode and validate on the calling thread (the event loop for async)
+    INLINE = "inline"
+    # async only: validate on a worker thread so the event loop never blocks
+    THREAD = "thread"
+    # fetch raw BSON batches and decode + validate them in a process pool
+    PROCESS = "process"
+
+
+class DecodeOutput(BaseEnum):
+    MODELS = "models"
+    # tuples of field values in model field order, cheaper to pickle back
+    RECORDS = "records"
+
+
+class DecodePolicy(BaseModel):
+    mode: DecodeMode = DecodeMode.INLINE
+    output: DecodeOutput = DecodeOutput.MODELS
+    processes: Optional[int] = Field(default=None, ge=1)
+
+
+@lru_cache(maxsize=None)
+def model_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def to_records(model: Type[BaseModel], models: List[BaseModel]) -> List[Tuple]:
+    keys = model.get_keys()
+    return [tuple(getattr(instance, key) for key in keys) for instance in models]
+
+
+def decode_raw_batch(
+    model: Type[BaseModel],
+    raw_batch: bytes,
+    output: DecodeOutput = DecodeOutput.MODELS,
+) -> List[Any]:
+    """
+    Decodes a raw BSON batch and validates it into `model` instances. Runs in
+    pool processes, so `model` has to be importable from a module.
+    """
+    documents = bson.decode_all(raw_batch)
+    models = list_adapter(model).validate_python(documents, from_attributes=True)
+    if DecodeOutput(output) == DecodeOutput.RECORDS:
+        return to_records(model, models)
+    return model.mark_loaded(models)
@@ -0,0 +1,364 @@
+import asyncio
+import copy
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+
+import bson
+from bson import ObjectId
+from pymongo.results import (
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+Documents = Union[List[Dict[str, Any]], Callable[[List[Dict[str, Any]]], List[Dict]]]
+
+
+class Fault:
+    """A single scripted fault: an added latency, an error or both."""
+
+    def __init__(self, latency_ms: float = 0, error: Optional[Exception] = None):
+        self.latency_ms = latency_ms
+        self.error = error
+
+
+class _FaultState:
+    def __init__(
+        self,
+        faults: Optional[List[Fault]],
+        latency_ms: float,
+        slow_rate: float,
+        slow_latency_ms: float,
+        error_rate: float,
+        error_factory: Callable[[], Exception],
+        seed: Optional[int],
+    ):
+        self.faults: Deque[Fault] = deque(faults or [])
+        self.latency_ms = latency_ms
+        self.slow_rate = slow_rate
+        self.slow_latency_ms = slow_latency_ms
+        self.error_rate = error_rate
+        self.error_factory = error_factory
+        self.random = random.Random(seed)
+        self.calls: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def next_fault(self, method: str, read_preference: Any) -> Fault:
+        with self.lock:
+            self.calls.append({"method": method, "read_preference": read_preference})
+            if self.faults:
+                return self.faults.popleft()
+            latency = self.latency_ms
+            if self.slow_rate and self.random.random() < self.slow_rate:
+                latency = self.slow_latency_ms
+            error = None
+            if self.error_rate and self.random.random() < self.error_rate:
+                error = self.error_factory()
+            return Fault(latency_ms=latency, error=error)
+
+
+def _encode_batch(documents: List[Dict[str, Any]]) -> bytes:
+    return b"".join(bson.encode(document) for document in documents)
+
+
+class _Cursor:
+    def __init__(self, documents: List[Dict[str, Any]]):
+        self._documents = iter(documents)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        return next(self._documents)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._documents = iter(())
+
+
+class FaultInjectingCollection:
+    """
+    Pymongo-like collection that injects latency and errors, for exercising
+    hedged and retried reads without a server. Calls are delegated to `inner`
+    when given, otherwise reads return `documents` and writes return synthetic
+    results. Scripted `faults` are consumed in order before the random ones.
+    """
+
+    def __init__(
+        self,
+        inner: Any = None,
+        documents: Optional[Documents] = None,
+        faults: Optional[List[Fault]] = None,
+        latency_ms: float = 0,
+        slow_rate: float = 0.0,
+        slow_latency_ms: float = 0,
+        error_rate: float = 0.0,
+        error_factory: Optional[Callable[[], Exception]] = None,
+        seed: Optional[int] = None,
+        read_preference: Any = None,
+        _state: Optional[_FaultState] = None,
+    ):
+        if error_factory is None:
+            from pymongo.errors import AutoReconnect
+
+            error_factory = lambda: AutoReconnect("injected fault")  # noqa: E731
+        self._inner = inner
+        self._documents = documents if documents is not None else []
+        self._read_preference = read_preference
+        self._state = _state or _FaultState(
+            faults,
+            latency_ms,
+            slow_rate,
+            slow_latency_ms,
+            error_rate,
+            error_factory,
+            seed,
+        )
+
+    @property
+    def calls(self) -> List[Dict[str, Any]]:
+        return self._state.calls
+
+    def add_faults(self, *faults: Fault) -> None:
+        with self._state.lock:
+            self._state.faults.extend(faults)
+
+    def with_options(self, read_preference: Any = None, **kwargs):
+        inner = self._inner
+        if inner is not None:
+            inner = inner.with_options(read_preference=read_preference, **kwargs)
+        return self.__class__(
+            inner=inner,
+            documents=self._documents,
+            read_preference=read_preference,
+            _state=self._state,
+        )
+
+    def _fault(self, method: str) -> Fault:
+        return self._state.next_fault(method, self._read_preference)
+
+    def _inject(self, method: str) -> None:
+        fault = self._fault(method)
+        if fault.latency_ms:
+            time.sleep(fault.latency_ms / 1000)
+        if fault.error is not None:
+            raise fault.error
+
+    def _read_documents(self, pipeline: List[Dict[str, Any]]) -> List[Dict]:
+        if callable(self._documents):
+            return self._documents(pipeline)
+        return copy.deepcopy(self._documents)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs):
+        self._inject("aggregate")
+        if self._inner is not None:
+            return self._inner.aggregate(pipeline, **kwargs)
+        return _Cursor(self._read_documents(pipeline))
+
+    def aggregate_raw_batches(self, pipeline: List[Dict[str, Any]], **kwargs):
+        self._inject("aggregate")
+        if self._inner is not None:
+            return self._inner.aggregate_raw_batches(pipeline, **kwargs)
+        return _Cursor([_encode_batch(self._read_documents(pipeline))])
+
+    def count_documents(self, query: Dict, **kwargs) -> int:
+        self._inject("count_documents")
+        if self._inner is not None:
+            return self._inner.count_documents(query, **kwargs)
+        return len(self._read_documents([{"$match": query}]))
+
+    def insert_one(self, document: Dict, **kwargs) -> InsertOneResult:
+        self._inject("insert_one")
+        if self._inner is not None:
+            return self._inner.insert_one(document, **kwargs)
+        return InsertOneResult(document.setdefault("_id", ObjectId()), True)
+
+    def insert_many(self, documents: List[Dict], **kwargs) -> InsertManyResult:
+        self._inject("insert_many")
+        if self._inner is not None:
+            return self._inner.insert_many(documents, **kwargs)
+        return InsertManyResult(
+            [doc.setdefault("_id", ObjectId()) for doc in documents], True
+        )
+
+    def _update(self, method: str, query: Dict, update: Any, **kwargs):
+        self._inject(method)
+        if self._inner is not None:
+            return getattr(self._inner, method)(query, update, **kwargs)
+        return UpdateResult({"n": 1, "nModified": 1}, True)
+
+    def update_one(self, query: Dict, update: Any, **kwargs) -> UpdateResult:
+        return self._update("update_one", query, update, **kwargs)
+
+    def update_many(self, query: Dict, update: Any, **kwargs) -> UpdateResult:
+        return self._update("update_many", query, update, **kwargs)
+
+    def _delete(self, method: str, query: Dict, **kwargs) -> DeleteResult:
+        self._inject(method)
+        if self._inner is not None:
+            return getattr(self._inner, method)(query, **kwargs)
+        return DeleteResult({"n": 1}, True)
+
+    def delete_one(self, query: Dict, **kwargs) -> DeleteResult:
+        return self._delete("delete_one", query, **kwargs)
+
+    def delete_many(self, query: Dict, **kwargs) -> DeleteResult:
+        return self._delete("delete_many", query, **kwargs)
+
+
+class _AsyncCursor:
+    def __init__(self, collection: "AsyncFaultInjectingCollection", pipeline, kwargs):
+        self._collection = collection
+        self._pipeline = pipeline
+        self._kwargs = kwargs
+        self._inner_cursor = None
+        self._documents: Optional[List[Dict[str, Any]]] = None
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        collection = self._collection
+        if collection._inner is not None:
+            if self._inner_cursor is None:
+                await collection._inject("aggregate")
+                self._inner_cursor = collection._inner.aggregate(
+                    self._pipeline, **self._kwargs
+                )
+            return await self._inner_cursor.to_list(length=length)
+        if self._documents is None:
+            await collection._inject("aggregate")
+            self._documents = collection._read_documents(self._pipeline)
+        if length is None:
+            length = len(self._documents)
+        documents = self._documents[:length]
+        self._documents = self._documents[length:]
+        return documents
+
+    async def close(self) -> None:
+        if self._inner_cursor is not None:
+            await self._inner_cursor.close()
+        self._documents = []
+
+
+class _AsyncRawBatchCursor(_AsyncCursor):
+    def __aiter__(self):
+        return self._batches()
+
+    async def _batches(self):
+        collection = self._collection
+        await collection._inject("aggregate")
+        if collection._inner is not None:
+            cursor = collection._inner.aggregate_raw_batches(
+                self._pipeline, **self._kwargs
+            )
+            async for raw_batch in cursor:
+                yield raw_batch
+            return
+        yield _encode_batch(collection._read_documents(self._pipeline))
+
+
+class AsyncFaultInjectingCollection(FaultInjectingCollection):
+    """Motor-like counterpart of FaultInjectingCollection, latency is awaited."""
+
+    async def _inject(self, method: str) -> None:
+        fault = self._fault(method)
+        if fault.latency_ms:
+            await asyncio.sleep(fault.latency_ms / 1000)
+        if fault.error is not None:
+            raise fault.error
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> _AsyncCursor:
+        # like motor, the command is only sent once the cursor is consumed
+        return _AsyncCursor(self, pipeline, kwargs)
+
+    def aggregate_raw_batches(self, pipeline: List[Dict[str, Any]], **kwargs):
+        return _AsyncRawBatchCursor(self, pipeline, kwargs)
+
+    async def count_documents(self, query: Dict, **kwargs) -> int:
+        await self._inject("count_documents")
+        if self._inner is not None:
+            return await self._inner.count_documents(query, **kwargs)
+        return len(self._read_documents([{"$match": query}]))
+
+    async def insert_one(self, document: Dict, **kwargs) -> InsertOneResult:
+        await self._inject("insert_one")
+        if self._inner is not None:
+            return await self._inner.insert_one(document, **kwargs)
+        return InsertOneResult(document.setdefault("_id", ObjectId()), True)
+
+    async def insert_many(self, documents: List[Dict], **kwargs) -> InsertManyResult:
+        await self._inject("insert_many")
+        if self._inner is not None:
+            return await self._inner.insert_many(documents, **kwargs)
+        return InsertManyResult(
+            [doc.setdefault("_id", ObjectId()) for doc in documents], True
+        )
+
+    async def _update(self, method: str, query: Dict, update: Any, **kwargs):
+        await self._inject(method)
+        if self._inner is not None:
+            return await getattr(self._inner, method)(query, update, **kwargs)
+        return UpdateResult({"n": 1, "nModified": 1}, True)
+
+    async def _delete(self, method: str, query: Dict, **kwargs) -> DeleteResult:
+        await self._inject(method)
+        if self._inner is not None:
+            return await getattr(self._inner, method)(query, **kwargs)
+        return DeleteResult({"n": 1}, True)
+
+
+class FaultInjectingClient:
+    """
+    Stands in for MongoClient/AsyncIOMotorClient so `client[db][name]` resolves
+    to fault injecting collections, e.g. `SyncMongoClient(FaultInjectingClient(...))`.
+    With `inner`, collections not given explicitly wrap `inner[db][name]` in
+    `collection_class(**fault_options)`, e.g. to add latency to a MemoryClient.
+    """
+
+    def __init__(
+        self,
+        collection: Optional[FaultInjectingCollection] = None,
+        collections: Optional[Dict[str, FaultInjectingCollection]] = None,
+        inner: Any = None,
+        collection_class: type = FaultInjectingCollection,
+        **fault_options,
+    ):
+        self._default = collection
+        self._collections = collections or {}
+        self._inner = inner
+        self._collection_class = collection_class
+        self._fault_options = fault_options
+        self._lock = threading.Lock()
+
+    def __getitem__(self, db_name: str) -> "_FaultInjectingDatabase":
+        return _FaultInjectingDatabase(self, db_name)
+
+    def _get_collection(self, db_name: str, name: str) -> FaultInjectingCollection:
+        key = f"{db_name}.{name}"
+        collection = self._collections.get(key, self._default)
+        if collection is None and self._inner is not None:
+            with self._lock:
+                collection = self._collections.get(key)
+                if collection is None:
+                    collection = self._collections[key] = self._collection_class(
+                        inner=self._inner[db_name][name], **self._fault_options
+                    )
+        if collection is None:
+            raise KeyError(f"No fault injecting collection for {db_name}.{name}")
+        return collection
+
+
+class _FaultInjectingDatabase:
+    def __init__(self, client: FaultInjectingClient, name: str):
+        self._client = client
+        self.name = name
+
+    def __getitem__(self, name: str) -> FaultInjectingCollection:
+        return self._client._get_collection(self.name, name)
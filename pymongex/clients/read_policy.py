@@ -0,0 +1,113 @@
+import random
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo.errors import AutoReconnect, ConnectionFailure, PyMongoError
+
+WRITE_STAGES = ("$out", "$merge")
+
+
+class RetryPolicy(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    max_attempts: int = Field(default=3, ge=1)
+    base_delay_ms: float = Field(default=20, ge=0)
+    max_delay_ms: float = Field(default=500, ge=0)
+    retryable_errors: Tuple[Type[Exception], ...] = (AutoReconnect, ConnectionFailure)
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, self.retryable_errors):
+            return True
+        return isinstance(error, PyMongoError) and error.has_error_label(
+            "RetryableReadError"
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Seconds to sleep before the given retry attempt (full jitter)."""
+        ceiling = min(self.max_delay_ms, self.base_delay_ms * 2**attempt)
+        return random.uniform(0, ceiling) / 1000
+
+
+class HedgePolicy(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    percentile: float = Field(default=95, gt=0, lt=100)
+    # used until min_samples latencies have been observed for a collection
+    initial_delay_ms: float = Field(default=50, ge=0)
+    min_delay_ms: float = Field(default=2, ge=0)
+    max_delay_ms: float = Field(default=1000, ge=0)
+    min_samples: int = Field(default=20, ge=1)
+    window: int = Field(default=1000, ge=1)
+    # sync clients run hedged reads on a thread pool of this size
+    max_workers: int = Field(default=32, ge=2)
+    # e.g. ReadPreference.SECONDARY_PREFERRED to send the hedge to another member
+    read_preference: Optional[Any] = None
+
+
+class LatencyTracker:
+    """Sliding window of read latencies per collection used to derive the hedge delay."""
+
+    def __init__(self, window: int = 1000):
+        self._window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, latency_ms: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self._window)
+            samples.append(latency_ms)
+
+    def percentile(self, key: str, percentile: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(key, ()))
+        if not samples:
+            return None
+        samples.sort()
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def hedge_delay_ms(self, key: str, policy: HedgePolicy) -> float:
+        if self.count(key) < policy.min_samples:
+            return policy.initial_delay_ms
+        delay = self.percentile(key, policy.percentile)
+        return min(policy.max_delay_ms, max(policy.min_delay_ms, delay))
+
+
+class ReadStats:
+    """Thread-safe counters for hedged and retried reads."""
+
+    FIELDS = (
+        "reads",
+        "hedges_issued",
+        "hedges_won",
+        "retries",
+        "retries_exhausted",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {field: 0 for field in self.FIELDS}
+
+    def incr(self, field: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[field] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = {field: 0 for field in self.FIELDS}
+
+
+def is_read_only_pipeline(pipeline: List[Dict[str, Any]]) -> bool:
+    return not any(stage in WRITE_STAGES for step in pipeline for stage in step)
@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import bson
+from pydantic import BaseModel
+
+CollectionKey = Tuple[str, str]
+
+# per collection counters bumped by every write, a load only stores its
+# result if none of its collections was written to while it ran
+_versions: Dict[CollectionKey, int] = {}
+_versions_lock = threading.Lock()
+_caches: "weakref.WeakSet[ResultCache]" = weakref.WeakSet()
+
+_UNCACHEABLE = object()
+
+
+def cache_key(*parts: Any) -> str:
+    """Hash of the BSON encoding of `parts`, type and key order sensitive."""
+    return hashlib.sha1(bson.encode({"k": list(parts)})).hexdigest()
+
+
+def pipeline_collections(
+    database: str, collection: str, pipeline: List[Dict[str, Any]]
+) -> Set[CollectionKey]:
+    """The collection of a pipeline and every collection it reads from."""
+    collections = {(database, collection)}
+
+    def add(source: Any) -> None:
+        if isinstance(source, dict):
+            collections.add((source.get("db", database), source["coll"]))
+        elif source is not None:
+            collections.add((database, source))
+
+    def visit(stages: List[Dict[str, Any]]) -> None:
+        for stage in stages:
+            for name, spec in stage.items():
+                if name in ("$lookup", "$graphLookup"):
+                    add(spec.get("from"))
+                    visit(spec.get("pipeline", []))
+                elif name == "$unionWith":
+                    if isinstance(spec, dict):
+                        add(spec.get("coll"))
+                        visit(spec.get("pipeline", []))
+                    else:
+                        add(spec)
+                elif name == "$facet":
+                    for facet in spec.values():
+                        visit(facet)
+
+    visit(pipeline)
+    return collections
+
+
+def pipeline_target(
+    database: str, pipeline: List[Dict[str, Any]]
+) -> Optional[CollectionKey]:
+    """The collection written by a trailing $out or $merge stage, if any."""
+    if not pipeline:
+        return None
+    stage = pipeline[-1]
+    if "$out" in stage:
+        target = stage["$out"]
+    elif "$merge" in stage:
+        target = stage["$merge"]
+        if isinstance(target, dict) and "into" in target:
+            target = target["into"]
+    else:
+        return None
+    if isinstance(target, dict):
+        return target.get("db", database), target["coll"]
+    return database, target
+
+
+def invalidate_collection(database: str, collection: str) -> None:
+    """Drops the cached results reading from a collection, called on writes."""
+    key = (database, collection)
+    with _versions_lock:
+        _versions[key] = _versions.get(key, 0) + 1
+    for cache in list(_caches):
+        cache.invalidate(key)
+
+
+def _current_versions(collections: Set[CollectionKey]) -> Dict[CollectionKey, int]:
+    with _versions_lock:
+        return {key: _versions.get(key, 0) for key in collections}
+
+
+def _is_cacheable(value: Any) -> bool:
+    # streamed results are iterators, they can only be consumed once
+    return value is None or isinstance(value, (list, dict, BaseModel))
+
+
+def _copy_item(item: Any) -> Any:
+    if isinstance(item, BaseModel):
+        return item.model_copy()
+    if isinstance(item, dict):
+        return dict(item)
+    return item
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_copy_item(item) for item in value]
+    return _copy_item(value)
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "collections")
+
+    def __init__(self, value: Any, expires_at: float, collections: Set):
+        self.value = value
+        self.expires_at = expires_at
+        self.collections = collections
+
+
+class ResultCache:
+    """
+    TTL and LRU bounded cache of read results, set as the `_cache` of a
+    service. Entries are dropped when any client writes to a collection
+    they read from, $lookup sources included. Concurrent misses of one key
+    run a single query, the other callers wait for its result.
+
+    Hits return shallow copies: the models are new instances but nested
+    values are shared with the cache, treat them as read-only.
+    """
+
+    FIELDS = ("hits", "misses", "collapsed", "evictions", "invalidations")
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 1024):
+        if ttl_seconds <= 0:
+            raise ValueError("ttl_seconds has to be a strict positive number")
+        if max_entries <= 0:
+            raise ValueError("max_entries has to be a strict positive integer")
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_collection: Dict[CollectionKey, Set[str]] = {}
+        self._flights: Dict[str, Future] = {}
+        self._async_flights: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._counters = {field: 0 for field in self.FIELDS}
+        _caches.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries)}
+
+    def _lookup(self, key: str) -> Any:
+        # with the lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return _UNCACHEABLE
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return _UNCACHEABLE
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return entry.value
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for collection in entry.collections:
+            keys = self._by_collection.get(collection)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_collection[collection]
+
+    def _store(
+        self,
+        key: str,
+        value: Any,
+        collections: Set[CollectionKey],
+        versions: Dict[CollectionKey, int],
+    ) -> None:
+        # with the lock held, skipped if a collection was written meanwhile
+        if _current_versions(collections) != versions:
+            return
+        self._remove(key)
+        expires_at = time.monotonic() + self.ttl_seconds
+        self._entries[key] = _Entry(value, expires_at, collections)
+        for collection in collections:
+            self._by_collection.setdefault(collection, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def invalidate(self, collection: CollectionKey) -> None:
+        with self._lock:
+            keys = self._by_collection.pop(collection, ())
+            for key in list(keys):
+                self._remove(key)
+            self._counters["invalidations"] += len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_collection.clear()
+
+    def get_or_load(
+        self, key: str, collections: Set[CollectionKey], load: Callable[[], Any]
+    ) -> Any:
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _UNCACHEABLE:
+                return _copy(value)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self._counters["misses"] += 1
+            else:
+                self._counters["collapsed"] += 1
+        if not leader:
+            value = flight.result()
+            return load() if value is _UNCACHEABLE else _copy(value)
+
+        versions = _current_versions(collections)
+        try:
+            value = load()
+        except BaseException as error:
+            with self._lock:
+                del self._flights[key]
+            flight.set_exception(error)
+            raise
+        cacheable = _is_cacheable(value)
+        with self._lock:
+            del self._flights[key]
+            if cacheable:
+                self._store(key, value, collections, versions)
+        flight.set_result(value if cacheable else _UNCACHEABLE)
+        return _copy(value) if cacheable else value
+
+    async def get_or_load_async(
+        self,
+        key: str,
+        collections: Set[CollectionKey],
+        load: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        flight_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _UNCACHEABLE:
+                return _copy(value)
+            flight = self._async_flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = asyncio.get_running_loop().create_future()
+                self._async_flights[flight_key] = flight
+                self._counters["misses"] += 1
+            else:
+                self._counters["collapsed"] += 1
+        if not leader:
+            # shielded so a cancelled waiter does not cancel the leader's result
+            value = await asyncio.shield(flight)
+            return await load() if value is _UNCACHEABLE else _copy(value)
+
+        versions = _current_versions(collections)
+        try:
+            value = await load()
+        except BaseException as error:
+            with self._lock:
+                del self._async_flights[flight_key]
+            flight.set_exception(error)
+            # retrieved here so an error without waiters is not reported
+            flight.exception()
+            raise
+        cacheable = _is_cacheable(value)
+        with self._lock:
+            del self._async_flights[flight_key]
+            if cacheable:
+                self._store(key, value, collections, versions)
+        flight.set_result(value if cacheable else _UNCACHEABLE)
+        return _copy(value) if cacheable else value
@@ -0,0 +1,203 @@
+import logging
+import struct
+import threading
+from typing import Dict, List, Optional, Type
+
+from pydantic import BaseModel, Field
+
+from ..constants import BaseEnum
+from ..exceptions import ResultTooLarge
+from ..models.collection import CollectionModel
+
+logger = logging.getLogger("pymongex.result_limits")
+
+_INT32 = struct.Struct("<i")
+
+
+class LimitAction(BaseEnum):
+    RAISE = "raise"
+    # keep the documents within the limits and log a warning
+    TRUNCATE = "truncate"
+    # iter_many reads the rest of the result from the cursor while iterating,
+    # find_many raises as a list cannot stream
+    STREAM = "stream"
+
+
+class ResultLimits(BaseModel):
+    """
+    Limits of a find_many result, None means unlimited. A ResultLimits without
+    limits still measures the results into the memory stats.
+    """
+
+    max_documents: Optional[int] = Field(default=None, gt=0)
+    # decoded size, measured as the BSON length of the documents
+    max_bytes: Optional[int] = Field(default=None, gt=0)
+    action: Optional[LimitAction] = None
+
+    def merge(self, other: Optional["ResultLimits"]) -> "ResultLimits":
+        """Return a copy where every field set on `other` overrides this one."""
+        if other is None:
+            return self
+        return self.model_copy(update=other.model_dump(exclude_none=True))
+
+
+_default_limits: Optional[ResultLimits] = None
+
+
+def set_result_limits(limits: Optional[ResultLimits]) -> None:
+    """Limits of every model, a model's Collection.result_limits overrides them."""
+    global _default_limits
+    _default_limits = limits
+
+
+def resolve_result_limits(model: Type[CollectionModel]) -> Optional[ResultLimits]:
+    model_limits = getattr(model.Collection, "result_limits", None)
+    if _default_limits is None:
+        return model_limits
+    return _default_limits.merge(model_limits)
+
+
+class ResultSizeStats:
+    FIELDS = (
+        "calls",
+        "documents",
+        "bytes",
+        "peak_documents",
+        "peak_bytes",
+        "raised",
+        "truncated",
+        "streamed",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {field: 0 for field in self.FIELDS}
+
+    def record(self, documents: int, size: int, action: Optional[str]) -> None:
+        with self._lock:
+            counters = self._counters
+            counters["calls"] += 1
+            counters["documents"] += documents
+            counters["bytes"] += size
+            counters["peak_documents"] = max(counters["peak_documents"], documents)
+            counters["peak_bytes"] = max(counters["peak_bytes"], size)
+            if action is not None:
+                counters[action] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = {field: 0 for field in self.FIELDS}
+
+
+_stats: Dict[str, ResultSizeStats] = {}
+_stats_lock = threading.Lock()
+
+
+def result_size_stats(model: Type[CollectionModel]) -> ResultSizeStats:
+    key = f"{model.get_database()}.{model.get_collection()}.{model.__name__}"
+    stats = _stats.get(key)
+    if stats is None:
+        with _stats_lock:
+            stats = _stats.setdefault(key, ResultSizeStats())
+    return stats
+
+
+def document_sizes(raw_batch: bytes) -> List[int]:
+    # BSON length of every document of a raw batch, read from their prefixes
+    sizes = []
+    offset = 0
+    end = len(raw_batch)
+    while offset < end:
+        size = _INT32.unpack_from(raw_batch, offset)[0]
+        sizes.append(size)
+        offset += size
+    return sizes
+
+
+class ResultGuard:
+    """
+    Counts the documents and bytes of the raw batches of one result against
+    its limits. `admit` returns the part of a batch to keep and sets
+    `exceeded` once a limit is reached, the caller stops reading then unless
+    the result is streamed.
+    """
+
+    def __init__(self, model: Type[CollectionModel], limits: ResultLimits):
+        self.model = model
+        self.limits = limits
+        self.action = limits.action or LimitAction.RAISE
+        self.documents = 0
+        self.bytes = 0
+        self.exceeded = False
+
+    def _fits(self, documents: int, size: int) -> bool:
+        limits = self.limits
+        if limits.max_documents is not None and documents > limits.max_documents:
+            return False
+        return limits.max_bytes is None or size <= limits.max_bytes
+
+    def admit(self, raw_batch: bytes) -> bytes:
+        sizes = document_sizes(raw_batch)
+        if self.exceeded or self._fits(
+            self.documents + len(sizes), self.bytes + len(raw_batch)
+        ):
+            self.documents += len(sizes)
+            self.bytes += len(raw_batch)
+            return raw_batch
+        self.exceeded = True
+        if self.action == LimitAction.STREAM:
+            self.documents += len(sizes)
+            self.bytes += len(raw_batch)
+            return raw_batch
+        # the documents of the batch that still fit
+        kept = 0
+        for size in sizes:
+            if not self._fits(self.documents + 1, self.bytes + size):
+                break
+            self.documents += 1
+            self.bytes += size
+            kept += size
+        if self.action == LimitAction.RAISE:
+            self.finish()
+            raise ResultTooLarge(
+                f"{self.model.__name__} result exceeds {self.describe_limits()}, "
+                f"stopped after {self.documents} documents ({self.bytes} bytes)",
+                documents=self.documents,
+                size=self.bytes,
+            )
+        return raw_batch[:kept]
+
+    def add(self, raw_batch: bytes) -> None:
+        # batches read after switching to streaming, only counted
+        self.documents += len(document_sizes(raw_batch))
+        self.bytes += len(raw_batch)
+
+    def describe_limits(self) -> str:
+        limits = []
+        if self.limits.max_documents is not None:
+            limits.append(f"{self.limits.max_documents} documents")
+        if self.limits.max_bytes is not None:
+            limits.append(f"{self.limits.max_bytes} bytes")
+        return " or ".join(limits)
+
+    def finish(self) -> None:
+        action = None
+        if self.exceeded:
+            action = {
+                LimitAction.RAISE: "raised",
+                LimitAction.TRUNCATE: "truncated",
+                LimitAction.STREAM: "streamed",
+            }[self.action]
+            if self.action == LimitAction.TRUNCATE:
+                logger.warning(
+                    "%s result truncated to %d documents (%d bytes), it exceeds %s",
+                    self.model.__name__,
+                    self.documents,
+                    self.bytes,
+                    self.describe_limits(),
+                )
+        result_size_stats(self.model).record(self.documents, self.bytes, action)
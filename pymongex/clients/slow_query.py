@@ -0,0 +1,215 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+
+from bson import json_util
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger("pymongex.slow_query")
+
+# stages whose values come from the caller, they are redacted from shapes
+REDACTED_STAGES = ("$match", "$limit", "$skip", "$sample")
+
+
+class SlowQueryPolicy(BaseModel):
+    threshold_ms: float = Field(default=200, ge=0)
+    # share of the slow calls explained in the background, between 0 and 1
+    explain_sample_rate: float = Field(default=0.0, ge=0, le=1)
+    # sync clients run the explains on a thread pool of this size
+    explain_workers: int = Field(default=1, ge=1)
+    # shapes tracked at most, slow calls of further shapes are only logged
+    max_shapes: int = Field(default=1000, ge=1)
+    log_level: int = logging.WARNING
+    # the logged pipeline holds the query values, False logs the shape only
+    log_pipeline: bool = True
+
+
+class ShapeStats(BaseModel):
+    model: str
+    operation: str
+    shape: Any
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    documents: int = 0
+    last_pipeline: Optional[List[Dict[str, Any]]] = None
+    # summary of the last explain("executionStats") of the shape
+    explain: Optional[Dict[str, Any]] = None
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+def redact(value: Any) -> Any:
+    """Keeps the keys and operators of a query, replaces the values by "?"."""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # lists of any length, like $in values, share a shape
+        shapes = []
+        for item in value:
+            shape = redact(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+def pipeline_shape(pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    shape = []
+    for stage in pipeline:
+        name, spec = next(iter(stage.items()))
+        if name in REDACTED_STAGES:
+            spec = redact(spec)
+        elif name == "$lookup" and "pipeline" in spec:
+            spec = {**spec, "pipeline": pipeline_shape(spec["pipeline"])}
+        shape.append({name: spec})
+    return shape
+
+
+def _find_key(value: Any, key: str) -> Any:
+    # depth first search, explain output nests differently per server version
+    if isinstance(value, dict):
+        if key in value:
+            return value[key]
+        values = value.values()
+    elif isinstance(value, list):
+        values = value
+    else:
+        return None
+    for item in values:
+        found = _find_key(item, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _plan_summary(plan: Optional[Dict[str, Any]]) -> str:
+    # "FETCH <- IXSCAN {'status': 1}", single input stages only
+    stages = []
+    while isinstance(plan, dict):
+        stage = plan.get("stage", "?")
+        if "keyPattern" in plan:
+            stage = f"{stage} {plan['keyPattern']}"
+        stages.append(stage)
+        plan = plan.get("inputStage") or plan.get("queryPlan")
+    return " <- ".join(stages)
+
+
+def summarize_explain(explain: Dict[str, Any]) -> Dict[str, Any]:
+    winning_plan = _find_key(explain, "winningPlan")
+    stats = _find_key(explain, "executionStats") or {}
+    return {
+        "winning_plan": winning_plan,
+        "plan_summary": _plan_summary(winning_plan),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    }
+
+
+def explain_command(collection_name: str, pipeline: List[Dict[str, Any]]) -> dict:
+    return {"aggregate": collection_name, "pipeline": pipeline, "cursor": {}}
+
+
+class SlowQueryLog:
+    """
+    Logs the client reads slower than the policy threshold and aggregates them
+    per model, operation and pipeline shape. A sample of them is explained
+    in the background, the summary is attached to the shape.
+    """
+
+    def __init__(self, policy: SlowQueryPolicy):
+        self.policy = policy
+        self.dropped = 0
+        self._stats: Dict[str, ShapeStats] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # explains running on the event loop of async clients
+        self.tasks: Set[Any] = set()
+
+    def is_slow(self, duration_ms: float) -> bool:
+        return duration_ms >= self.policy.threshold_ms
+
+    def record(
+        self,
+        model: type,
+        operation: str,
+        pipeline: List[Dict[str, Any]],
+        duration_ms: float,
+        documents: int,
+    ) -> Optional[str]:
+        """
+        Logs a slow call and adds it to its shape, returns the shape key when
+        the call was sampled to be explained.
+        """
+        shape = pipeline_shape(pipeline)
+        key = f"{model.__name__}.{operation}:{json_util.dumps(shape)}"
+        message = "Slow %s of %s: %.1f ms, %d documents, shape %s"
+        args = [operation, model.__name__, duration_ms, documents, key]
+        if self.policy.log_pipeline:
+            message += ", pipeline %s"
+            args.append(json_util.dumps(pipeline))
+        logger.log(self.policy.log_level, message, *args)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.policy.max_shapes:
+                    self.dropped += 1
+                    return None
+                stats = self._stats[key] = ShapeStats(
+                    model=model.__name__, operation=operation, shape=shape
+                )
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.documents += documents
+            stats.last_pipeline = pipeline
+        sample_rate = self.policy.explain_sample_rate
+        if sample_rate and random.random() < sample_rate:
+            return key
+        return None
+
+    def attach_explain(self, key: str, explain: Dict[str, Any]) -> None:
+        summary = summarize_explain(explain)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is not None:
+                stats.explain = summary
+        logger.log(
+            self.policy.log_level,
+            "Explained %s: %s, %s keys and %s documents examined",
+            key,
+            summary["plan_summary"],
+            summary["keys_examined"],
+            summary["docs_examined"],
+        )
+
+    def explain_failed(self, key: str, error: Exception) -> None:
+        logger.debug("Explain of %s failed: %r", key, error)
+
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.policy.explain_workers,
+                    thread_name_prefix="pymongex-explain",
+                )
+            return self._executor
+
+    def shapes(self) -> List[ShapeStats]:
+        with self._lock:
+            return [stats.model_copy() for stats in self._stats.values()]
+
+    def top(self, n: int = 10, by: str = "total_ms") -> List[ShapeStats]:
+        """The `n` shapes with the highest total_ms, max_ms, mean_ms or count."""
+        return sorted(self.shapes(), key=lambda s: getattr(s, by), reverse=True)[:n]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+            self.dropped = 0
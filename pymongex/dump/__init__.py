@@ -0,0 +1,2 @@
+from .client import AsyncDumpClient, DumpClient, DumpCollection, DumpDatabase
+from .reader import BsonDumpFile
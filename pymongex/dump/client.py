@@ -0,0 +1,325 @@
+import os
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+import bson
+from pymongo.errors import InvalidOperation, OperationFailure
+
+from ..memory.aggregation import first_match_filter, run_pipeline
+from ..memory.collection import (
+    RAW_BATCH_SIZE,
+    AsyncMemoryCollection,
+    IndexKeys,
+    MemoryCursor,
+    MemoryFindCursor,
+    _index_name,
+    _normalize_keys,
+    distinct_values,
+)
+from ..memory.query import compile_query, equality_values
+from .reader import BsonDumpFile
+
+
+class DumpCollection:
+    """
+    Read-only pymongo-like collection over a BsonDumpFile. Filters pinning an
+    indexed field with a value, $eq or $in only decode the matching documents,
+    other filters decode the file once in order. The _id index is built by
+    the first lookup on _id. Results are streamed, writes raise
+    InvalidOperation.
+    """
+
+    def __init__(
+        self, database: "DumpDatabase", name: str, dump: Optional[BsonDumpFile]
+    ):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        # a missing file reads as an empty collection, like on a server
+        self.dump = dump
+
+    def with_options(self, **kwargs) -> "DumpCollection":
+        return self
+
+    def _read_only(self, *args, **kwargs):
+        raise InvalidOperation(f"{self.full_name} is a read-only BSON dump")
+
+    insert_one = insert_many = _read_only
+    update_one = update_many = replace_one = _read_only
+    delete_one = delete_many = bulk_write = drop = _read_only
+
+    # reads
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return list(self._documents())
+
+    def _documents(self, positions: Optional[Iterable[int]] = None) -> Iterator:
+        if self.dump is None:
+            return iter(())
+        return self.dump.documents(positions)
+
+    def has_index(self, field: str) -> bool:
+        return self.dump is not None and field in self.dump.indexed_fields
+
+    def find_equal(self, field: str, values: List[Any]) -> List[Dict[str, Any]]:
+        return list(self._documents(self.dump.positions(field, values)))
+
+    def _candidates(self, filter: Optional[Dict[str, Any]]) -> Iterator:
+        if filter and self.dump is not None:
+            # lookups by _id would scan anyway, the scan builds the _id index
+            if equality_values(filter, "_id") is not None:
+                self.dump.create_index("_id")
+            for field in self.dump.indexed_fields:
+                values = equality_values(filter, field)
+                if values is not None:
+                    return self._documents(self.dump.positions(field, values))
+        return self._documents()
+
+    def _match(self, filter: Optional[Dict[str, Any]]) -> Iterator:
+        predicate = compile_query(filter)
+        return (doc for doc in self._candidates(filter) if predicate(doc))
+
+    def _aggregate(self, pipeline: List[Dict[str, Any]]) -> Iterator:
+        for stage in pipeline:
+            if "$out" in stage or "$merge" in stage:
+                raise OperationFailure(
+                    f"{next(iter(stage))} is not supported on a BSON dump",
+                    code=40324,
+                )
+        documents = self._candidates(first_match_filter(pipeline))
+        return run_pipeline(documents, pipeline, self.database)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> MemoryCursor:
+        return MemoryCursor(lambda: self._aggregate(pipeline))
+
+    def aggregate_raw_batches(
+        self, pipeline: List[Dict[str, Any]], **kwargs
+    ) -> MemoryCursor:
+        batch_size = kwargs.get("batchSize") or kwargs.get("batch_size")
+        batch_size = batch_size or RAW_BATCH_SIZE
+
+        def fetch() -> Iterator[bytes]:
+            batch = []
+            for document in self._aggregate(pipeline):
+                batch.append(bson.encode(document))
+                if len(batch) >= batch_size:
+                    yield b"".join(batch)
+                    batch = []
+            if batch:
+                yield b"".join(batch)
+
+        return MemoryCursor(fetch)
+
+    def find(self, filter: Any = None, projection: Any = None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return MemoryFindCursor(self, filter, projection, kwargs)
+
+    def find_one(self, filter: Any = None, *args, **kwargs) -> Optional[Dict]:
+        kwargs["limit"] = 1
+        for document in self.find(filter, *args, **kwargs):
+            return document
+        return None
+
+    def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        if filter:
+            count = sum(1 for _ in self._match(filter))
+        else:
+            count = self.estimated_document_count()
+        count -= kwargs.get("skip", 0)
+        if kwargs.get("limit"):
+            count = min(count, kwargs["limit"])
+        return max(0, count)
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return len(self.dump) if self.dump is not None else 0
+
+    def distinct(self, key: str, filter: Optional[Dict] = None, **kwargs) -> List:
+        return distinct_values(self._match(filter), key)
+
+    # indexes are kept next to the file, not in it
+
+    def create_index(self, keys: IndexKeys, **kwargs) -> str:
+        """Indexes the first key of `keys`, reusing a persisted index if any."""
+        keys = _normalize_keys(keys)
+        if self.dump is not None:
+            self.dump.create_index(keys[0][0])
+        return kwargs.get("name") or _index_name(keys)
+
+    def drop_index(self, index_or_name: Union[str, IndexKeys]) -> None:
+        if self.dump is None:
+            return
+        if isinstance(index_or_name, str):
+            field = index_or_name.rsplit("_", 1)[0]
+        else:
+            field = _normalize_keys(index_or_name)[0][0]
+        self.dump.drop_index(field)
+
+    def index_information(self) -> Dict[str, Dict[str, Any]]:
+        fields = self.dump.indexed_fields if self.dump is not None else []
+        return {
+            _index_name([(field, 1)]): {"key": [(field, 1)], "v": 2} for field in fields
+        }
+
+
+class DumpDatabase:
+    def __init__(self, client: "DumpClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, DumpCollection] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> DumpCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str, **kwargs) -> DumpCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = self._collections[name] = self._open(name)
+        return collection
+
+    def _open(self, name: str) -> DumpCollection:
+        client = self.client
+        path = client.path_for(self.name, name)
+        dump = None
+        if path is not None and os.path.exists(path):
+            dump = BsonDumpFile(path, persist=client.persist_indexes)
+            for field in client.indexes.get(f"{self.name}.{name}", []):
+                dump.create_index(field)
+        return DumpCollection(self, name, dump)
+
+    def lookup_source(self, name: str) -> DumpCollection:
+        return self.get_collection(name)
+
+    def list_collection_names(self, **kwargs) -> List[str]:
+        names = set()
+        directory = self.client.directory
+        if directory is not None and os.path.isdir(os.path.join(directory, self.name)):
+            for filename in os.listdir(os.path.join(directory, self.name)):
+                if filename.endswith(".bson"):
+                    names.add(filename[: -len(".bson")])
+        for full_name in self.client.files:
+            db_name, _, name = full_name.partition(".")
+            if db_name == self.name:
+                names.add(name)
+        return sorted(names)
+
+    def command(
+        self, command: Union[str, Dict[str, Any]], value: Any = 1, **kwargs
+    ) -> Dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}'", code=59)
+
+    def _close(self) -> None:
+        with self._lock:
+            for collection in self._collections.values():
+                if collection.dump is not None:
+                    collection.dump.close()
+            self._collections.clear()
+
+
+class DumpClient:
+    """
+    Read-only stand-in for MongoClient over `mongodump` output, e.g.
+    `SyncMongoClient(client=DumpClient("dump"))`. `client[db][name]` reads
+    `<directory>/<db>/<name>.bson`, `files` maps "db.collection" to other
+    paths. `indexes` lists the fields to index per "db.collection" when the
+    file is opened; indexes are persisted next to the file unless
+    `persist_indexes` is off.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        files: Optional[Dict[str, str]] = None,
+        indexes: Optional[Dict[str, List[str]]] = None,
+        persist_indexes: bool = True,
+    ):
+        self.directory = os.fspath(directory) if directory is not None else None
+        self.files = {name: os.fspath(path) for name, path in (files or {}).items()}
+        self.indexes = indexes or {}
+        self.persist_indexes = persist_indexes
+        self._databases: Dict[str, DumpDatabase] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> DumpDatabase:
+        return self.get_database(name)
+
+    def get_database(self, name: str, **kwargs) -> DumpDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            with self._lock:
+                database = self._databases.get(name)
+                if database is None:
+                    database = self._databases[name] = DumpDatabase(self, name)
+        return database
+
+    def path_for(self, db_name: str, name: str) -> Optional[str]:
+        path = self.files.get(f"{db_name}.{name}")
+        if path is None and self.directory is not None:
+            path = os.path.join(self.directory, db_name, f"{name}.bson")
+        return path
+
+    def list_database_names(self, **kwargs) -> List[str]:
+        names = {full_name.partition(".")[0] for full_name in self.files}
+        if self.directory is not None and os.path.isdir(self.directory):
+            names.update(
+                name
+                for name in os.listdir(self.directory)
+                if os.path.isdir(os.path.join(self.directory, name))
+            )
+        return sorted(names)
+
+    def close(self) -> None:
+        """Unmaps every opened file."""
+        with self._lock:
+            for database in self._databases.values():
+                database._close()
+            self._databases.clear()
+
+
+class AsyncDumpDatabase:
+    def __init__(self, database: DumpDatabase):
+        self.delegate = database
+        self.name = database.name
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str, **kwargs) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self.delegate.get_collection(name))
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return self.delegate.list_collection_names()
+
+    async def command(
+        self, command: Union[str, Dict[str, Any]], value: Any = 1, **kwargs
+    ) -> Dict:
+        return self.delegate.command(command, value, **kwargs)
+
+
+class AsyncDumpClient:
+    """
+    Motor-like counterpart of DumpClient, takes the same arguments or an
+    existing `client`. Documents are decoded inline on the event loop.
+    """
+
+    def __init__(self, *args, client: Optional[DumpClient] = None, **kwargs):
+        self.delegate = client or DumpClient(*args, **kwargs)
+
+    def __getitem__(self, name: str) -> AsyncDumpDatabase:
+        return self.get_database(name)
+
+    def get_database(self, name: str, **kwargs) -> AsyncDumpDatabase:
+        return AsyncDumpDatabase(self.delegate.get_database(name))
+
+    async def list_database_names(self, **kwargs) -> List[str]:
+        return self.delegate.list_database_names()
+
+    def close(self) -> None:
+        self.delegate.close()
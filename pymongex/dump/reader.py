@@ -0,0 +1,220 @@
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import bson
+from bson.errors import InvalidBSON
+
+from ..memory.values import resolve_query_path, split_path
+from ..utils import MISSING, sort_key
+
+_INT32 = struct.Struct("<i")
+# magic, source size, source mtime, number of offsets
+_OFFSETS_HEADER = struct.Struct("<8sqqq")
+_OFFSETS_MAGIC = b"PMXOFF01"
+
+
+def _index_values(document: Dict[str, Any], field: str) -> List[Any]:
+    # multikey, like a server index: an array is indexed as a whole and by
+    # each of its elements, a missing field as null
+    values = []
+    for value in resolve_query_path(document, split_path(field)):
+        values.append(None if value is MISSING else value)
+        if isinstance(value, list):
+            values.extend(value)
+    return values
+
+
+class FieldIndex:
+    """Positions of the documents of a dump by value of one field."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.values: Dict[Tuple, Any] = {}
+        self.positions: Dict[Tuple, array] = {}
+
+    def add(self, value: Any, position: int) -> None:
+        key = sort_key(value)
+        positions = self.positions.get(key)
+        if positions is None:
+            self.values[key] = value
+            positions = self.positions[key] = array("q")
+        # a document repeating a value in an array is indexed once
+        if not positions or positions[-1] != position:
+            positions.append(position)
+
+    def lookup(self, values: Iterable[Any]) -> List[int]:
+        found = set()
+        for value in values:
+            found.update(self.positions.get(sort_key(value), ()))
+        return sorted(found)
+
+
+class BsonDumpFile:
+    """
+    Read-only view of a `mongodump` .bson file. The file is memory-mapped and
+    documents are decoded straight from the mapping when they are read. The
+    document boundaries and any field indexes are persisted next to the file
+    and reused for as long as the file is unchanged.
+    """
+
+    def __init__(self, path: str, persist: bool = True):
+        self.path = os.fspath(path)
+        self.persist = persist
+        stat = os.stat(self.path)
+        self._signature = (stat.st_size, stat.st_mtime_ns)
+        self._file = open(self.path, "rb")
+        self._mmap: Optional[mmap.mmap] = None
+        if stat.st_size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+        else:
+            self._view = memoryview(b"")
+        self._offsets = self._load_offsets()
+        self._indexes: Dict[str, FieldIndex] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    # offsets
+
+    def _offsets_path(self) -> str:
+        return f"{self.path}.pymongex-offsets"
+
+    def _scan_offsets(self) -> array:
+        view, size = self._view, len(self._view)
+        offsets = array("q", [0])
+        position = 0
+        while position < size:
+            if size - position < 5:
+                raise InvalidBSON(f"{self.path}: truncated document at {position}")
+            (length,) = _INT32.unpack_from(view, position)
+            if length < 5 or position + length > size:
+                raise InvalidBSON(
+                    f"{self.path}: invalid document length {length} at {position}"
+                )
+            position += length
+            offsets.append(position)
+        return offsets
+
+    def _load_offsets(self) -> array:
+        path = self._offsets_path()
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_OFFSETS_HEADER.size)
+                magic, size, mtime_ns, count = _OFFSETS_HEADER.unpack(header)
+                if magic == _OFFSETS_MAGIC and (size, mtime_ns) == self._signature:
+                    offsets = array("q")
+                    offsets.fromfile(f, count)
+                    return offsets
+        except (OSError, struct.error, EOFError):
+            pass
+        offsets = self._scan_offsets()
+        if self.persist:
+            header = _OFFSETS_HEADER.pack(
+                _OFFSETS_MAGIC, *self._signature, len(offsets)
+            )
+            self._write_sidecar(path, header + offsets.tobytes())
+        return offsets
+
+    def _write_sidecar(self, path: str, data: bytes) -> None:
+        # the dump may live on a read-only volume, the index is then kept in
+        # memory only
+        try:
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            pass
+
+    # documents
+
+    def raw(self, position: int) -> memoryview:
+        """The encoded document at `position`, a view on the mapped file."""
+        return self._view[self._offsets[position] : self._offsets[position + 1]]
+
+    def document(self, position: int) -> Dict[str, Any]:
+        return bson.decode(self.raw(position))
+
+    def documents(
+        self, positions: Optional[Iterable[int]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Decodes the documents at `positions`, by default all in file order."""
+        if positions is None:
+            positions = range(len(self))
+        for position in positions:
+            yield self.document(position)
+
+    # field indexes
+
+    def _index_path(self, field: str) -> str:
+        return f"{self.path}.pymongex-{field}.index"
+
+    def _load_index(self, field: str) -> Optional[FieldIndex]:
+        try:
+            with open(self._index_path(field), "rb") as f:
+                entries = bson.decode_file_iter(f)
+                header = next(entries, None)
+                if header is None or header.get("field") != field:
+                    return None
+                if (header.get("size"), header.get("mtime_ns")) != self._signature:
+                    return None
+                index = FieldIndex(field)
+                for entry in entries:
+                    key = sort_key(entry["v"])
+                    index.values[key] = entry["v"]
+                    index.positions[key] = array("q", entry["p"])
+                return index
+        except (OSError, InvalidBSON):
+            return None
+
+    def _build_index(self, field: str) -> FieldIndex:
+        index = FieldIndex(field)
+        for position, document in enumerate(self.documents()):
+            for value in _index_values(document, field):
+                index.add(value, position)
+        if self.persist:
+            size, mtime_ns = self._signature
+            header = {"field": field, "size": size, "mtime_ns": mtime_ns}
+            data = [bson.encode(header)]
+            for key, positions in index.positions.items():
+                data.append(bson.encode({"v": index.values[key], "p": list(positions)}))
+            self._write_sidecar(self._index_path(field), b"".join(data))
+        return index
+
+    def create_index(self, field: str) -> FieldIndex:
+        """Loads the persisted index on `field`, building it with one scan if needed."""
+        with self._lock:
+            index = self._indexes.get(field)
+            if index is None:
+                index = self._load_index(field) or self._build_index(field)
+                self._indexes[field] = index
+            return index
+
+    def drop_index(self, field: str) -> None:
+        with self._lock:
+            self._indexes.pop(field, None)
+
+    @property
+    def indexed_fields(self) -> List[str]:
+        return list(self._indexes)
+
+    def positions(self, field: str, values: Iterable[Any]) -> List[int]:
+        """Positions of the documents whose indexed `field` equals one of `values`."""
+        return self._indexes[field].lookup(values)
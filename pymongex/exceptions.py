@@ -0,0 +1,33 @@
+from typing import Any
+
+from pymongo.errors import ExecutionTimeout
+
+
+class DeadlineExceeded(ExecutionTimeout):
+    """Raised when the ambient deadline has already passed before a call is sent."""
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call is not admitted because the wait queue is full or timed out."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class VersionConflict(Exception):
+    """Raised by update() when the stored version is not the loaded one."""
+
+    def __init__(self, message: str, id: Any, version: Any):
+        super().__init__(message)
+        self.id = id
+        self.version = version
+
+
+class ResultTooLarge(Exception):
+    """Raised when a result exceeds its ResultLimits and the action is "raise"."""
+
+    def __init__(self, message: str, documents: int, size: int):
+        super().__init__(message)
+        self.documents = documents
+        self.size = size
@@ -0,0 +1,3 @@
+from .report import LoadTestReport, OperationStats
+from .runner import run_workload, run_workload_async
+from .spec import OperationSpec, OperationType, WorkloadMode, WorkloadSpec
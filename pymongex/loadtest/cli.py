@@ -0,0 +1,48 @@
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from .runner import run_workload
+from .spec import WorkloadSpec
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="pymongex-loadtest",
+        description="Runs a workload spec against MongoDB or an in-process stand-in",
+    )
+    parser.add_argument("spec", help="workload spec JSON file")
+    parser.add_argument("--mode", choices=["sync", "async"], default=None)
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=None, help="operations/s")
+    parser.add_argument("--duration", type=float, default=None, help="seconds")
+    parser.add_argument(
+        "--connection-string", default=None, help="run against this MongoDB"
+    )
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    spec = WorkloadSpec.from_file(args.spec)
+    overrides = {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "duration_s": args.duration,
+        "connection_string": args.connection_string,
+    }
+    overrides = {key: value for key, value in overrides.items() if value is not None}
+    if overrides:
+        spec = WorkloadSpec(**{**spec.model_dump(), **overrides})
+
+    report = run_workload(spec)
+    print(report.format_table())
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report.model_dump(), f, indent=4)
+    if report.count == 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
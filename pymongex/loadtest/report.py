@@ -0,0 +1,125 @@
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class OperationStats(BaseModel):
+    count: int
+    errors: int
+    error_rate: float
+    throughput: float
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    # mean client CPU time per call and the rest of the latency, sync mode only
+    cpu_ms: Optional[float] = None
+    wait_ms: Optional[float] = None
+    error_types: Dict[str, int] = {}
+
+
+class LoadTestReport(BaseModel):
+    mode: str
+    target: str
+    concurrency: int
+    rate: Optional[float]
+    duration_s: float
+    count: int
+    errors: int
+    throughput: float
+    error_rate: float
+    # CPU time of the whole process (all threads) during the measured window
+    process_cpu_s: float
+    cpu_utilization: float
+    operations: Dict[str, OperationStats]
+
+    def format_table(self) -> str:
+        lines = [
+            f"{self.mode} against {self.target}: {self.count} ops in "
+            f"{self.duration_s:.1f}s, {self.throughput:.1f} ops/s, "
+            f"{self.error_rate:.2%} errors, "
+            f"client cpu {self.process_cpu_s:.2f}s ({self.cpu_utilization:.0%})",
+            f"{'operation':<20} {'count':>8} {'ops/s':>9} {'err%':>7} "
+            f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'cpu':>8} {'wait':>8}",
+        ]
+        for name, stats in self.operations.items():
+            cpu = "-" if stats.cpu_ms is None else f"{stats.cpu_ms:.2f}"
+            wait = "-" if stats.wait_ms is None else f"{stats.wait_ms:.2f}"
+            lines.append(
+                f"{name:<20} {stats.count:>8} {stats.throughput:>9.1f} "
+                f"{stats.error_rate:>7.2%} {stats.p50_ms:>8.2f} {stats.p95_ms:>8.2f} "
+                f"{stats.p99_ms:>8.2f} {stats.max_ms:>8.2f} {cpu:>8} {wait:>8}"
+            )
+        lines.append("latencies and cpu/wait in ms")
+        return "\n".join(lines)
+
+
+def percentile(samples: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    if not samples:
+        return 0.0
+    index = min(
+        len(samples) - 1, max(0, int(len(samples) * percentile / 100 + 0.5) - 1)
+    )
+    return samples[index]
+
+
+class Recorder:
+    """Thread-safe collection of per-operation latency samples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, List[float]] = {}
+        self._cpu: Dict[str, List[float]] = {}
+        self._errors: Dict[str, Counter] = {}
+
+    def record(
+        self,
+        name: str,
+        latency: float,
+        cpu: Optional[float] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        with self._lock:
+            self._latencies.setdefault(name, []).append(latency)
+            if cpu is not None:
+                self._cpu.setdefault(name, []).append(cpu)
+            errors = self._errors.setdefault(name, Counter())
+            if error is not None:
+                errors[type(error).__name__] += 1
+
+    def operation_stats(self, duration_s: float) -> Dict[str, OperationStats]:
+        with self._lock:
+            names = list(self._latencies)
+            latencies = {name: sorted(self._latencies[name]) for name in names}
+            cpu = {name: list(self._cpu.get(name, ())) for name in names}
+            errors = {name: Counter(self._errors[name]) for name in names}
+
+        stats = {}
+        for name in names:
+            samples = latencies[name]
+            count = len(samples)
+            error_count = sum(errors[name].values())
+            mean = sum(samples) / count
+            cpu_ms = wait_ms = None
+            if cpu[name]:
+                cpu_ms = sum(cpu[name]) / len(cpu[name]) * 1000
+                wait_ms = max(0.0, mean * 1000 - cpu_ms)
+            stats[name] = OperationStats(
+                count=count,
+                errors=error_count,
+                error_rate=error_count / count,
+                throughput=count / duration_s,
+                mean_ms=mean * 1000,
+                p50_ms=percentile(samples, 50) * 1000,
+                p95_ms=percentile(samples, 95) * 1000,
+                p99_ms=percentile(samples, 99) * 1000,
+                max_ms=samples[-1] * 1000,
+                cpu_ms=cpu_ms,
+                wait_ms=wait_ms,
+                error_types=dict(errors[name]),
+            )
+        return stats
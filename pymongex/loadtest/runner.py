@@ -0,0 +1,358 @@
+import asyncio
+import copy
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from importlib import import_module
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+
+from ..clients.fault_injection import (
+    AsyncFaultInjectingCollection,
+    FaultInjectingClient,
+    FaultInjectingCollection,
+)
+from ..config import set_connection_string
+from .report import LoadTestReport, Recorder
+from .spec import OperationSpec, OperationType, WorkloadMode, WorkloadSpec
+
+SEED_CHUNK = 500
+
+DocumentFactory = Callable[[random.Random], dict]
+
+
+def load_object(path: str) -> Any:
+    """Imports `package.module:attribute`."""
+    module_name, _, attribute = path.partition(":")
+    if not attribute:
+        raise ValueError(f"Expected 'package.module:attribute', got '{path}'")
+    return getattr(import_module(module_name), attribute)
+
+
+class Workload:
+    """The resolved operation mix of a spec bound to a service."""
+
+    def __init__(
+        self,
+        spec: WorkloadSpec,
+        service: type,
+        factory: Optional[DocumentFactory],
+        ids: List[ObjectId],
+    ):
+        self.spec = spec
+        self.service = service
+        self.factory = factory
+        self.ids = ids
+        self._operations = spec.operations
+        self._weights = [operation.weight for operation in spec.operations]
+        needs_ids = {OperationType.GET_BY_ID, OperationType.UPDATE_BY_ID}
+        if not ids and any(op.op in needs_ids for op in spec.operations):
+            raise ValueError("get_by_id and update_by_id need seeded documents")
+        if factory is None and any(
+            op.op == OperationType.CREATE_MANY for op in spec.operations
+        ):
+            raise ValueError("create_many needs a document_factory")
+
+    def choose(self, rng: random.Random) -> OperationSpec:
+        return rng.choices(self._operations, weights=self._weights)[0]
+
+    def build_call(self, operation: OperationSpec, rng: random.Random) -> Callable:
+        """
+        Prepares the arguments outside of the measured call. The returned
+        callable gives a coroutine on async services.
+        """
+        service = self.service
+        if operation.op == OperationType.GET_BY_ID:
+            id = rng.choice(self.ids)
+            return lambda: service.get_by_id(id, expand=operation.expand)
+        if operation.op == OperationType.GET_MANY:
+            return lambda: service.get_many(
+                copy.deepcopy(operation.query),
+                sort=operation.sort,
+                limit=operation.limit,
+                expand=operation.expand,
+            )
+        if operation.op == OperationType.CREATE_MANY:
+            documents = [self.factory(rng) for _ in range(operation.count)]
+            return lambda: service.create_many(documents)
+        id = rng.choice(self.ids)
+        # the client adds updated_at to the update document in place
+        update = copy.deepcopy(operation.update)
+        return lambda: service.update_by_id(id, update)
+
+
+class _Schedule:
+    """Hands out operation start times, shared by all workers."""
+
+    def __init__(self, spec: WorkloadSpec, start: float, end: float):
+        self._rate = spec.rate
+        self._max_operations = spec.max_operations
+        self._start = start
+        self._end = end
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def next_slot(self) -> Optional[float]:
+        with self._lock:
+            if self._max_operations and self._issued >= self._max_operations:
+                return None
+            slot = None
+            if self._rate:
+                slot = self._start + self._issued / self._rate
+            self._issued += 1
+        if slot is None:
+            slot = time.perf_counter()
+        if slot >= self._end:
+            return None
+        return slot
+
+
+def _stand_in_client(spec: WorkloadSpec) -> FaultInjectingClient:
+    # an in-memory engine behind the usual client, with per call latency added
+    from ..memory import AsyncMemoryClient, MemoryClient
+
+    if spec.mode == WorkloadMode.ASYNC:
+        inner, collection_class = AsyncMemoryClient(), AsyncFaultInjectingCollection
+    else:
+        inner, collection_class = MemoryClient(), FaultInjectingCollection
+    return FaultInjectingClient(
+        inner=inner,
+        collection_class=collection_class,
+        latency_ms=spec.stand_in_latency_ms,
+    )
+
+
+def _resolve_services(spec: WorkloadSpec) -> Tuple[type, Optional[type]]:
+    if spec.service is not None:
+        return load_object(spec.service), None
+    from . import workload
+
+    if spec.mode == WorkloadMode.ASYNC:
+        return workload.AsyncLoadOrderService, workload.AsyncLoadCustomerService
+    return workload.LoadOrderService, workload.LoadCustomerService
+
+
+def _customer_count(spec: WorkloadSpec) -> int:
+    return max(1, spec.seed_documents // 10)
+
+
+def _custom_factory(spec: WorkloadSpec) -> Optional[DocumentFactory]:
+    if spec.document_factory is None:
+        return None
+    return load_object(spec.document_factory)
+
+
+def _chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+@contextmanager
+def _client_override(services: List[type], client: Any) -> Iterator[None]:
+    # the stand-in replaces the services' clients for the duration of the run
+    previous = [service.__dict__.get("_mongo_client") for service in services]
+    for service in services:
+        service._mongo_client = client
+    try:
+        yield
+    finally:
+        for service, value in zip(services, previous):
+            if value is None:
+                del service._mongo_client
+            else:
+                service._mongo_client = value
+
+
+def _seed_sync(
+    spec: WorkloadSpec, service: type, customer_service: Optional[type]
+) -> Tuple[Optional[DocumentFactory], List[ObjectId]]:
+    from .workload import OrderFactory, make_customer
+
+    rng = random.Random(spec.random_seed)
+    factory = _custom_factory(spec)
+    if customer_service is not None:
+        customers = [make_customer(rng) for _ in range(_customer_count(spec))]
+        customer_ids = []
+        for chunk in _chunks(customers, SEED_CHUNK):
+            customer_ids += [c.id for c in customer_service.create_many(chunk)]
+        factory = OrderFactory(customer_ids)
+    if factory is None:
+        return None, service.get_only_ids(limit=spec.seed_documents or 1000)
+    documents = [factory(rng) for _ in range(spec.seed_documents)]
+    ids = []
+    for chunk in _chunks(documents, SEED_CHUNK):
+        ids += [model.id for model in service.create_many(chunk)]
+    return factory, ids
+
+
+async def _seed_async(
+    spec: WorkloadSpec, service: type, customer_service: Optional[type]
+) -> Tuple[Optional[DocumentFactory], List[ObjectId]]:
+    from .workload import OrderFactory, make_customer
+
+    rng = random.Random(spec.random_seed)
+    factory = _custom_factory(spec)
+    if customer_service is not None:
+        customers = [make_customer(rng) for _ in range(_customer_count(spec))]
+        customer_ids = []
+        for chunk in _chunks(customers, SEED_CHUNK):
+            customer_ids += [c.id for c in await customer_service.create_many(chunk)]
+        factory = OrderFactory(customer_ids)
+    if factory is None:
+        return None, await service.get_only_ids(limit=spec.seed_documents or 1000)
+    documents = [factory(rng) for _ in range(spec.seed_documents)]
+    ids = []
+    for chunk in _chunks(documents, SEED_CHUNK):
+        ids += [model.id for model in await service.create_many(chunk)]
+    return factory, ids
+
+
+def _worker_random(spec: WorkloadSpec, index: int) -> random.Random:
+    if spec.random_seed is None:
+        return random.Random()
+    return random.Random(spec.random_seed + index + 1)
+
+
+def _build_report(
+    spec: WorkloadSpec,
+    recorder: Recorder,
+    duration_s: float,
+    process_cpu_s: float,
+) -> LoadTestReport:
+    operations = recorder.operation_stats(duration_s)
+    count = sum(stats.count for stats in operations.values())
+    errors = sum(stats.errors for stats in operations.values())
+    return LoadTestReport(
+        mode=spec.mode.value,
+        target="mongodb" if spec.connection_string else "stand-in",
+        concurrency=spec.concurrency,
+        rate=spec.rate,
+        duration_s=duration_s,
+        count=count,
+        errors=errors,
+        throughput=count / duration_s,
+        error_rate=errors / count if count else 0.0,
+        process_cpu_s=process_cpu_s,
+        cpu_utilization=process_cpu_s / duration_s,
+        operations=operations,
+    )
+
+
+def _execute_sync(spec: WorkloadSpec, workload: Workload) -> LoadTestReport:
+    recorder = Recorder()
+    start = time.perf_counter()
+    measure_start = start + spec.warmup_s
+    schedule = _Schedule(spec, start, measure_start + spec.duration_s)
+
+    def worker(index: int) -> None:
+        rng = _worker_random(spec, index)
+        while True:
+            slot = schedule.next_slot()
+            if slot is None:
+                return
+            delay = slot - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            operation = workload.choose(rng)
+            call = workload.build_call(operation, rng)
+            cpu_start = time.thread_time()
+            error = None
+            try:
+                call()
+            except Exception as e:
+                error = e
+            finished = time.perf_counter()
+            if slot >= measure_start:
+                cpu = time.thread_time() - cpu_start
+                recorder.record(operation.label, finished - slot, cpu, error)
+
+    with ThreadPoolExecutor(
+        max_workers=spec.concurrency, thread_name_prefix="pymongex-loadtest"
+    ) as executor:
+        futures = [executor.submit(worker, i) for i in range(spec.concurrency)]
+        wait(futures, timeout=max(0.0, measure_start - time.perf_counter()))
+        cpu_start = time.process_time()
+        for future in futures:
+            future.result()
+    duration = time.perf_counter() - measure_start
+    return _build_report(spec, recorder, duration, time.process_time() - cpu_start)
+
+
+async def _execute_async(spec: WorkloadSpec, workload: Workload) -> LoadTestReport:
+    recorder = Recorder()
+    start = time.perf_counter()
+    measure_start = start + spec.warmup_s
+    schedule = _Schedule(spec, start, measure_start + spec.duration_s)
+
+    async def worker(index: int) -> None:
+        rng = _worker_random(spec, index)
+        while True:
+            slot = schedule.next_slot()
+            if slot is None:
+                return
+            delay = slot - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            operation = workload.choose(rng)
+            call = workload.build_call(operation, rng)
+            error = None
+            try:
+                await call()
+            except Exception as e:
+                error = e
+            finished = time.perf_counter()
+            # other tasks run on the same thread, so cpu time is only per process
+            if slot >= measure_start:
+                recorder.record(operation.label, finished - slot, None, error)
+
+    tasks = [asyncio.create_task(worker(i)) for i in range(spec.concurrency)]
+    await asyncio.wait(tasks, timeout=max(0.0, measure_start - time.perf_counter()))
+    cpu_start = time.process_time()
+    await asyncio.gather(*tasks)
+    duration = time.perf_counter() - measure_start
+    return _build_report(spec, recorder, duration, time.process_time() - cpu_start)
+
+
+def run_workload(spec: WorkloadSpec) -> LoadTestReport:
+    """Seeds and runs a sync workload, see `run_workload_async` for async specs."""
+    if spec.mode == WorkloadMode.ASYNC:
+        return asyncio.run(run_workload_async(spec))
+
+    service, customer_service = _resolve_services(spec)
+    services = [s for s in (service, customer_service) if s is not None]
+    if spec.connection_string is not None:
+        from ..singleton.sync_mongo_singleton import MongoSyncClientSingleton
+
+        set_connection_string(spec.connection_string)
+        MongoSyncClientSingleton.initialize()
+        factory, ids = _seed_sync(spec, service, customer_service)
+        return _execute_sync(spec, Workload(spec, service, factory, ids))
+
+    from ..clients.sync_client import SyncMongoClient
+
+    client = SyncMongoClient(client=_stand_in_client(spec))
+    with _client_override(services, client):
+        factory, ids = _seed_sync(spec, service, customer_service)
+        return _execute_sync(spec, Workload(spec, service, factory, ids))
+
+
+async def run_workload_async(spec: WorkloadSpec) -> LoadTestReport:
+    service, customer_service = _resolve_services(spec)
+    services = [s for s in (service, customer_service) if s is not None]
+    if spec.connection_string is not None:
+        from ..singleton.async_mongo_singleton import MongoAsyncClientSingleton
+
+        set_connection_string(spec.connection_string)
+        await MongoAsyncClientSingleton.initialize()
+        factory, ids = await _seed_async(spec, service, customer_service)
+        return await _execute_async(spec, Workload(spec, service, factory, ids))
+
+    from ..clients.async_client import AsyncMongoClient
+
+    client = AsyncMongoClient(client=_stand_in_client(spec))
+    with _client_override(services, client):
+        factory, ids = await _seed_async(spec, service, customer_service)
+        return await _execute_async(spec, Workload(spec, service, factory, ids))
@@ -0,0 +1,75 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from ..constants import BaseEnum
+
+
+class OperationType(BaseEnum):
+    GET_BY_ID = "get_by_id"
+    GET_MANY = "get_many"
+    CREATE_MANY = "create_many"
+    UPDATE_BY_ID = "update_by_id"
+
+
+class WorkloadMode(BaseEnum):
+    SYNC = "sync"
+    ASYNC = "async"
+
+
+class OperationSpec(BaseModel):
+    op: OperationType
+    # relative share of this operation in the mix
+    weight: float = Field(default=1, gt=0)
+    # reported name, defaults to the operation type
+    name: Optional[str] = None
+    # get_many
+    query: Dict[str, Any] = {}
+    sort: Optional[Dict[str, int]] = None
+    limit: Optional[int] = Field(default=20, ge=1)
+    # get_by_id and get_many
+    expand: Optional[List[str]] = None
+    # create_many: documents per call
+    count: int = Field(default=10, ge=1)
+    # update_by_id
+    update: Dict[str, Any] = {"$inc": {"quantity": 1}}
+
+    @property
+    def label(self) -> str:
+        return self.name or self.op.value
+
+
+class WorkloadSpec(BaseModel):
+    """
+    A load test run. Without `rate` every worker issues its next operation as
+    soon as the previous one returned (closed loop). With `rate` operations are
+    scheduled at fixed intervals and latency is measured from the scheduled
+    start, so a stalled server is not hidden by workers that stop sending.
+    """
+
+    operations: List[OperationSpec] = Field(min_length=1)
+    mode: WorkloadMode = WorkloadMode.SYNC
+    concurrency: int = Field(default=8, ge=1)
+    # operations per second over all workers
+    rate: Optional[float] = Field(default=None, gt=0)
+    duration_s: float = Field(default=10, gt=0)
+    # stop after this many operations even if duration_s is not reached
+    max_operations: Optional[int] = Field(default=None, ge=1)
+    # operations started before this are run but not recorded
+    warmup_s: float = Field(default=0, ge=0)
+    # documents created before the run, get_by_id and update_by_id pick from them
+    seed_documents: int = Field(default=1000, ge=0)
+    # mongodb to run against, None uses an in-process stand-in
+    connection_string: Optional[str] = None
+    stand_in_latency_ms: float = Field(default=1, ge=0)
+    # "package.module:ServiceClass", defaults to the built-in order workload
+    service: Optional[str] = None
+    # "package.module:function" called with a random.Random, returns a document
+    document_factory: Optional[str] = None
+    random_seed: Optional[int] = None
+
+    @classmethod
+    def from_file(cls, path: str) -> "WorkloadSpec":
+        with open(path, "r") as f:
+            return cls(**json.load(f))
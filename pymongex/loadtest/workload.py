@@ -0,0 +1,98 @@
+import random
+from typing import List, Optional
+
+from bson import ObjectId
+from pydantic import Field
+
+from ..models import InCollectionModel, OutCollectionModel
+from ..service.async_service import AsyncBaseService
+from ..service.sync_service import SyncBaseService
+from ..storage import BaseDatabase
+
+loadtest_db = BaseDatabase("pymongexLoadTest")
+
+STATUSES = ["open", "paid", "shipped", "returned"]
+TIERS = ["free", "team", "enterprise"]
+
+
+class LoadCustomerIn(InCollectionModel):
+    class Collection:
+        collection = loadtest_db.add_collection("customers")
+
+    name: str
+    tier: str
+
+
+# expanded into LoadOrder, which needs the projection of InCollectionModel
+class LoadCustomer(OutCollectionModel, InCollectionModel):
+    class Collection:
+        collection = loadtest_db.add_collection("customers")
+
+    name: str
+    tier: str
+
+
+class LoadOrderIn(InCollectionModel):
+    class Collection:
+        collection = loadtest_db.add_collection("orders")
+
+    customer_id: ObjectId
+    status: str
+    total: float
+    quantity: int
+    tags: List[str] = []
+
+
+class LoadOrder(OutCollectionModel):
+    class Collection:
+        collection = loadtest_db.add_collection("orders")
+
+    customer_id: ObjectId
+    status: str
+    total: float
+    quantity: int
+    tags: List[str] = []
+    customer: Optional[LoadCustomer] = Field(
+        default=None,
+        json_schema_extra={"local_field": "customer_id", "foreign_field": "_id"},
+    )
+
+
+class LoadCustomerService(SyncBaseService):
+    _in_model = LoadCustomerIn
+    _out_model = LoadCustomer
+
+
+class LoadOrderService(SyncBaseService):
+    _in_model = LoadOrderIn
+    _out_model = LoadOrder
+
+
+class AsyncLoadCustomerService(AsyncBaseService):
+    _in_model = LoadCustomerIn
+    _out_model = LoadCustomer
+
+
+class AsyncLoadOrderService(AsyncBaseService):
+    _in_model = LoadOrderIn
+    _out_model = LoadOrder
+
+
+def make_customer(rng: random.Random) -> dict:
+    return {"name": f"customer-{rng.randrange(10**6)}", "tier": rng.choice(TIERS)}
+
+
+class OrderFactory:
+    """Random orders referencing the seeded customers."""
+
+    def __init__(self, customer_ids: List[ObjectId]):
+        self.customer_ids = customer_ids
+
+    def __call__(self, rng: random.Random) -> dict:
+        return {
+            "customer_id": rng.choice(self.customer_ids),
+            "status": rng.choice(STATUSES),
+            "total": round(rng.uniform(1, 500), 2),
+            "quantity": rng.randint(1, 20),
+            "tags": rng.sample(["gift", "priority", "bulk", "return"], k=2),
+        }
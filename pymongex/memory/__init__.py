@@ -0,0 +1,3 @@
+from .client import AsyncMemoryClient, AsyncMemoryDatabase, MemoryClient, MemoryDatabase
+from .collection import AsyncMemoryCollection, MemoryCollection
+from .session import AsyncMemorySession, MemorySession
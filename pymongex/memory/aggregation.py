@@ -0,0 +1,506 @@
+import heapq
+import random
+from functools import cmp_to_key
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Protocol
+
+from pymongo.errors import OperationFailure
+
+from ..utils import MISSING, sort_key
+from .expressions import evaluate
+from .query import compile_query
+from .values import (
+    copy_value,
+    get_field,
+    resolve_query_path,
+    set_field,
+    split_path,
+    unset_field,
+)
+
+Documents = Iterable[Dict[str, Any]]
+Variables = Optional[Dict[str, Any]]
+
+# stages that pass stored documents through unchanged, everything else works
+# on copies
+_FILTER_STAGES = {"$match", "$sort", "$skip", "$limit", "$sample"}
+
+
+class CollectionResolver(Protocol):
+    """Gives $lookup access to the other collections of the database."""
+
+    def lookup_source(self, name: str) -> "LookupSource": ...
+
+
+class LookupSource(Protocol):
+    def snapshot(self) -> List[Dict[str, Any]]: ...
+
+    def has_index(self, field: str) -> bool: ...
+
+    def find_equal(self, field: str, values: List[Any]) -> List[Dict[str, Any]]: ...
+
+
+def run_pipeline(
+    documents: Documents,
+    pipeline: List[Dict[str, Any]],
+    resolver: Optional[CollectionResolver] = None,
+    variables: Variables = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streams `documents` through `pipeline`. Input documents are never
+    modified, stages that change documents see copies.
+    """
+    stream: Iterator[Dict[str, Any]] = iter(documents)
+    copied = False
+    stages = list(pipeline)
+    index = 0
+    while index < len(stages):
+        stage = stages[index]
+        if len(stage) != 1:
+            raise OperationFailure(
+                "A pipeline stage specification object must contain exactly one field.",
+                code=40323,
+            )
+        name, argument = next(iter(stage.items()))
+        if name not in _FILTER_STAGES and not copied:
+            stream = (copy_value(document) for document in stream)
+            copied = True
+        if name == "$sort":
+            # a following $limit turns the sort into a top-k selection
+            limit = None
+            if index + 1 < len(stages) and "$limit" in stages[index + 1]:
+                limit = stages[index + 1]["$limit"]
+                index += 1
+            stream = iter(sort_documents(stream, argument, limit))
+        else:
+            function = _STAGES.get(name)
+            if function is None:
+                raise OperationFailure(
+                    f"Unrecognized pipeline stage name: '{name}'", code=40324
+                )
+            stream = function(stream, argument, resolver, variables)
+        index += 1
+    if not copied:
+        stream = (copy_value(document) for document in stream)
+    return stream
+
+
+def _match(stream: Iterator, argument, resolver, variables) -> Iterator:
+    predicate = compile_query(argument)
+    return (document for document in stream if predicate(document, variables))
+
+
+def _sort_value(document: Dict[str, Any], parts: List[str], direction: int):
+    values = resolve_query_path(document, parts)
+    candidates = []
+    for value in values:
+        if isinstance(value, list) and value:
+            candidates.extend(value)
+        else:
+            candidates.append(value)
+    keys = [sort_key(value) for value in candidates]
+    # arrays sort by their smallest element ascending, largest descending
+    return min(keys) if direction > 0 else max(keys)
+
+
+def sort_documents(
+    documents: Iterable[Dict[str, Any]],
+    sort: Dict[str, int],
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    fields = []
+    for field, direction in sort.items():
+        if direction not in (1, -1):
+            raise OperationFailure("$sort key ordering must be 1 or -1", code=15975)
+        fields.append((split_path(field), direction))
+
+    def cmp(a, b) -> int:
+        for key_a, key_b, (_, direction) in zip(a[0], b[0], fields):
+            if key_a != key_b:
+                return direction if key_a > key_b else -direction
+        return 0
+
+    decorated = (
+        (tuple(_sort_value(doc, parts, direction) for parts, direction in fields), doc)
+        for doc in documents
+    )
+    key = cmp_to_key(cmp)
+    if limit is not None:
+        chosen = heapq.nsmallest(limit, decorated, key=key)
+    else:
+        chosen = sorted(decorated, key=key)
+    return [document for _, document in chosen]
+
+
+def _skip(stream: Iterator, argument, resolver, variables) -> Iterator:
+    for index, document in enumerate(stream):
+        if index >= argument:
+            yield document
+
+
+def _limit(stream: Iterator, argument, resolver, variables) -> Iterator:
+    if argument <= 0:
+        raise OperationFailure("the limit must be positive", code=15958)
+    for index, document in enumerate(stream):
+        yield document
+        if index + 1 >= argument:
+            return
+
+
+def _sample(stream: Iterator, argument, resolver, variables) -> Iterator:
+    documents = list(stream)
+    size = min(argument["size"], len(documents))
+    return iter(random.sample(documents, size))
+
+
+def _is_operator(value: Any) -> bool:
+    return len(value) == 1 and next(iter(value)).startswith("$")
+
+
+def _is_flag(value: Any) -> bool:
+    return isinstance(value, (bool, int, float)) and not isinstance(value, str)
+
+
+def _project_included(value: Any, spec: Dict[str, Any], root, variables) -> Any:
+    # applies a nested inclusion spec to an embedded document or array of them
+    if isinstance(value, list):
+        return [
+            _project_included(item, spec, root, variables)
+            for item in value
+            if isinstance(item, dict)
+        ]
+    if not isinstance(value, dict):
+        return MISSING
+    return _include(value, spec, root, variables)
+
+
+def _include(
+    document: Dict[str, Any], spec: Dict[str, Any], root, variables
+) -> Dict[str, Any]:
+    result = {}
+    for field, value in spec.items():
+        head, _, rest = field.partition(".")
+        if rest:
+            value = {rest: value}
+        if _is_flag(value):
+            if value and head in document:
+                result[head] = document[head]
+            continue
+        if isinstance(value, dict) and not _is_operator(value):
+            projected = _project_included(
+                document.get(head, MISSING), value, root, variables
+            )
+            if projected is not MISSING:
+                existing = result.get(head)
+                if isinstance(existing, dict) and isinstance(projected, dict):
+                    existing.update(projected)
+                else:
+                    result[head] = projected
+            continue
+        computed = evaluate(value, root, variables)
+        if computed is not MISSING:
+            result[head] = computed
+    return result
+
+
+def project_document(
+    document: Dict[str, Any], spec: Dict[str, Any], variables: Variables = None
+) -> Dict[str, Any]:
+    id_value = spec.get("_id", True)
+    others = {field: value for field, value in spec.items() if field != "_id"}
+    exclusion = bool(others) and all(
+        _is_flag(value) and not value for value in others.values()
+    )
+    if not others:
+        exclusion = _is_flag(id_value) and not id_value
+    if exclusion:
+        result = dict(document)
+        for field, value in spec.items():
+            if _is_flag(value) and not value:
+                unset_field(result, field)
+        return result
+
+    result = {}
+    if _is_flag(id_value):
+        if id_value and "_id" in document:
+            result["_id"] = document["_id"]
+    else:
+        computed = evaluate(id_value, document, variables)
+        if computed is not MISSING:
+            result["_id"] = computed
+    for field, value in others.items():
+        if _is_flag(value) and not value:
+            raise OperationFailure(
+                f"Invalid $project :: caused by :: Cannot do exclusion on field {field} in inclusion projection",
+                code=31254,
+            )
+    result.update(_include(document, others, document, variables))
+    return result
+
+
+def _project(stream: Iterator, argument, resolver, variables) -> Iterator:
+    return (project_document(document, argument, variables) for document in stream)
+
+
+def add_fields(
+    document: Dict[str, Any], spec: Dict[str, Any], variables: Variables = None
+) -> Dict[str, Any]:
+    values = [
+        (field, evaluate(value, document, variables)) for field, value in spec.items()
+    ]
+    for field, value in values:
+        if value is MISSING:
+            unset_field(document, field)
+        else:
+            set_field(document, field, value)
+    return document
+
+
+def _add_fields(stream: Iterator, argument, resolver, variables) -> Iterator:
+    return (add_fields(document, argument, variables) for document in stream)
+
+
+def _unset(stream: Iterator, argument, resolver, variables) -> Iterator:
+    fields = argument if isinstance(argument, list) else [argument]
+    for document in stream:
+        for field in fields:
+            unset_field(document, field)
+        yield document
+
+
+def _replace_root(stream: Iterator, argument, resolver, variables) -> Iterator:
+    expression = argument["newRoot"] if "newRoot" in argument else argument
+    for document in stream:
+        root = evaluate(expression, document, variables)
+        if not isinstance(root, dict):
+            raise OperationFailure(
+                "'replacement document' must evaluate to an object", code=40228
+            )
+        yield root
+
+
+def _unwind(stream: Iterator, argument, resolver, variables) -> Iterator:
+    if isinstance(argument, str):
+        argument = {"path": argument}
+    path = argument["path"][1:]
+    preserve = argument.get("preserveNullAndEmptyArrays", False)
+    index_field = argument.get("includeArrayIndex")
+    for document in stream:
+        value = get_field(document, path)
+        if isinstance(value, list) and value:
+            for index, item in enumerate(value):
+                unwound = dict(document) if "." not in path else copy_value(document)
+                set_field(unwound, path, item)
+                if index_field:
+                    set_field(unwound, index_field, index)
+                yield unwound
+        elif isinstance(value, list) or value is None or value is MISSING:
+            if preserve:
+                if isinstance(value, list):
+                    unset_field(document, path)
+                if index_field:
+                    set_field(document, index_field, None)
+                yield document
+        else:
+            if index_field:
+                set_field(document, index_field, None)
+            yield document
+
+
+def _lookup_values(document: Dict[str, Any], field: str) -> List[Any]:
+    values = []
+    for value in resolve_query_path(document, split_path(field)):
+        if isinstance(value, list):
+            values.extend(value)
+        else:
+            values.append(value)
+    # a missing local field matches foreign documents where the field is null
+    return [None if value is MISSING else value for value in values] or [None]
+
+
+def _lookup(stream: Iterator, argument, resolver, variables) -> Iterator:
+    if resolver is None:
+        raise OperationFailure("$lookup needs a database", code=40321)
+    source = resolver.lookup_source(argument["from"])
+    local_field = argument.get("localField")
+    foreign_field = argument.get("foreignField")
+    sub_pipeline = argument.get("pipeline")
+    let = argument.get("let", {})
+    target = argument["as"]
+
+    foreign_map = None
+    if local_field is not None and not source.has_index(foreign_field):
+        # no index on the foreign field, hash the foreign documents once
+        foreign_map = {}
+        for foreign in source.snapshot():
+            keys = set()
+            for value in _lookup_values(foreign, foreign_field):
+                keys.add(sort_key(value))
+            for key in keys:
+                foreign_map.setdefault(key, []).append(foreign)
+
+    for document in stream:
+        if local_field is not None:
+            values = _lookup_values(document, local_field)
+            if foreign_map is not None:
+                seen, matches = set(), []
+                for value in values:
+                    for foreign in foreign_map.get(sort_key(value), ()):
+                        if id(foreign) not in seen:
+                            seen.add(id(foreign))
+                            matches.append(foreign)
+            else:
+                matches = source.find_equal(foreign_field, values)
+        else:
+            matches = source.snapshot()
+        if sub_pipeline is not None:
+            scoped = dict(variables or {})
+            for name, expression in let.items():
+                scoped[name] = evaluate(expression, document, variables)
+            joined = list(run_pipeline(matches, sub_pipeline, resolver, scoped))
+        else:
+            joined = [copy_value(foreign) for foreign in matches]
+        set_field(document, target, joined)
+        yield document
+
+
+def _facet(stream: Iterator, argument, resolver, variables) -> Iterator:
+    documents = list(stream)
+    yield {
+        name: list(run_pipeline(documents, pipeline, resolver, variables))
+        for name, pipeline in argument.items()
+    }
+
+
+def _count(stream: Iterator, argument, resolver, variables) -> Iterator:
+    count = sum(1 for _ in stream)
+    if count:
+        yield {argument: count}
+
+
+def _bucket_auto(stream: Iterator, argument, resolver, variables) -> Iterator:
+    group_by = argument["groupBy"]
+    buckets = argument["buckets"]
+    output = argument.get("output", {"count": {"$sum": 1}})
+    keyed = [(evaluate(group_by, doc, variables), doc) for doc in stream]
+    keyed = [(None if key is MISSING else key, doc) for key, doc in keyed]
+    keyed.sort(key=lambda pair: sort_key(pair[0]))
+    if not keyed:
+        return
+    per_bucket = max(1, -(-len(keyed) // buckets))
+    groups: List[List] = []
+    for key, doc in keyed:
+        # equal values never span two buckets
+        if (
+            groups
+            and len(groups[-1]) >= per_bucket
+            and sort_key(groups[-1][-1][0]) != sort_key(key)
+            and len(groups) < buckets
+        ):
+            groups.append([])
+        elif not groups:
+            groups.append([])
+        groups[-1].append((key, doc))
+    for index, group in enumerate(groups):
+        upper = groups[index + 1][0][0] if index + 1 < len(groups) else group[-1][0]
+        result = {"_id": {"min": group[0][0], "max": upper}}
+        result.update(_accumulate([doc for _, doc in group], output, variables))
+        yield result
+
+
+def _accumulate(
+    documents: List[Dict[str, Any]], spec: Dict[str, Any], variables: Variables
+) -> Dict[str, Any]:
+    result = {}
+    for field, accumulator in spec.items():
+        ((operator, expression),) = accumulator.items()
+        function = _ACCUMULATORS.get(operator)
+        if function is None:
+            raise OperationFailure(f"unknown group operator '{operator}'", code=15952)
+        values = [evaluate(expression, doc, variables) for doc in documents]
+        result[field] = function(values)
+    return result
+
+
+def _numbers(values: List[Any]) -> List[Any]:
+    return [
+        value
+        for value in values
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
+
+
+def _add_to_set(values: List[Any]) -> List[Any]:
+    seen, result = set(), []
+    for value in values:
+        if value is MISSING:
+            continue
+        key = sort_key(value)
+        if key not in seen:
+            seen.add(key)
+            result.append(value)
+    return result
+
+
+def _present(values: List[Any]) -> List[Any]:
+    return [value for value in values if value is not MISSING and value is not None]
+
+
+_ACCUMULATORS: Dict[str, Callable[[List[Any]], Any]] = {
+    "$sum": lambda values: sum(_numbers(values)),
+    "$avg": lambda values: (
+        sum(_numbers(values)) / len(_numbers(values)) if _numbers(values) else None
+    ),
+    "$min": lambda values: min(_present(values), key=sort_key, default=None),
+    "$max": lambda values: max(_present(values), key=sort_key, default=None),
+    "$first": lambda values: None if not values or values[0] is MISSING else values[0],
+    "$last": lambda values: None if not values or values[-1] is MISSING else values[-1],
+    "$push": lambda values: [value for value in values if value is not MISSING],
+    "$addToSet": _add_to_set,
+    "$count": lambda values: len(values),
+}
+
+
+def _group(stream: Iterator, argument, resolver, variables) -> Iterator:
+    id_expression = argument["_id"]
+    accumulators = {field: value for field, value in argument.items() if field != "_id"}
+    groups: Dict[Any, List] = {}
+    keys: Dict[Any, Any] = {}
+    for document in stream:
+        key = evaluate(id_expression, document, variables)
+        key = None if key is MISSING else key
+        hashable = sort_key(key)
+        if hashable not in groups:
+            groups[hashable] = []
+            keys[hashable] = key
+        groups[hashable].append(document)
+    for hashable, documents in groups.items():
+        result = {"_id": keys[hashable]}
+        result.update(_accumulate(documents, accumulators, variables))
+        yield result
+
+
+_STAGES: Dict[str, Callable[..., Iterator]] = {
+    "$match": _match,
+    "$skip": _skip,
+    "$limit": _limit,
+    "$sample": _sample,
+    "$project": _project,
+    "$addFields": _add_fields,
+    "$set": _add_fields,
+    "$unset": _unset,
+    "$replaceRoot": _replace_root,
+    "$replaceWith": _replace_root,
+    "$unwind": _unwind,
+    "$lookup": _lookup,
+    "$facet": _facet,
+    "$count": _count,
+    "$bucketAuto": _bucket_auto,
+    "$group": _group,
+}
+
+
+def first_match_filter(pipeline: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The leading $match of a pipeline, which can use the collection's indexes."""
+    if pipeline and "$match" in pipeline[0] and len(pipeline[0]) == 1:
+        return pipeline[0]["$match"]
+    return None
@@ -0,0 +1,150 @@
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+from pymongo.errors import OperationFailure
+
+from .collection import AsyncMemoryCollection, MemoryCollection
+from .session import AsyncMemorySession, MemorySession
+
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def lookup_source(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def _forget(self, name: str) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+
+    def list_collection_names(self, **kwargs) -> List[str]:
+        return list(self._collections)
+
+    def drop_collection(self, name: Union[str, MemoryCollection], **kwargs) -> None:
+        if isinstance(name, MemoryCollection):
+            name = name.name
+        collection = self._collections.get(name)
+        if collection is not None:
+            collection.drop()
+
+    def command(
+        self, command: Union[str, Dict[str, Any]], value: Any = 1, **kwargs
+    ) -> Dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}'", code=59)
+
+
+class MemoryClient:
+    """
+    In-process stand-in for MongoClient, e.g. `SyncMongoClient(client=MemoryClient())`.
+    Databases and collections are created on first access.
+    """
+
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            with self._lock:
+                database = self._databases.get(name)
+                if database is None:
+                    database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    @property
+    def admin(self) -> MemoryDatabase:
+        return self.get_database("admin")
+
+    def list_database_names(self, **kwargs) -> List[str]:
+        return list(self._databases)
+
+    def drop_database(self, name: Union[str, MemoryDatabase], **kwargs) -> None:
+        if isinstance(name, MemoryDatabase):
+            name = name.name
+        with self._lock:
+            self._databases.pop(name, None)
+
+    def start_session(self, **kwargs) -> MemorySession:
+        return MemorySession(self)
+
+    def close(self) -> None:
+        pass
+
+
+class AsyncMemoryDatabase:
+    def __init__(self, database: MemoryDatabase):
+        self.delegate = database
+        self.name = database.name
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str, **kwargs) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self.delegate.get_collection(name))
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return self.delegate.list_collection_names()
+
+    async def drop_collection(self, name: str, **kwargs) -> None:
+        self.delegate.drop_collection(name)
+
+    async def command(
+        self, command: Union[str, Dict[str, Any]], value: Any = 1, **kwargs
+    ) -> Dict:
+        return self.delegate.command(command, value, **kwargs)
+
+
+class AsyncMemoryClient:
+    """
+    Motor-like counterpart of MemoryClient, e.g.
+    `AsyncMongoClient(client=AsyncMemoryClient())`. Pass a MemoryClient to
+    share its data with sync code.
+    """
+
+    def __init__(self, client: Optional[MemoryClient] = None):
+        self.delegate = client or MemoryClient()
+
+    def __getitem__(self, name: str) -> AsyncMemoryDatabase:
+        return self.get_database(name)
+
+    def get_database(self, name: str, **kwargs) -> AsyncMemoryDatabase:
+        return AsyncMemoryDatabase(self.delegate.get_database(name))
+
+    @property
+    def admin(self) -> AsyncMemoryDatabase:
+        return self.get_database("admin")
+
+    async def list_database_names(self, **kwargs) -> List[str]:
+        return self.delegate.list_database_names()
+
+    async def drop_database(self, name: str, **kwargs) -> None:
+        self.delegate.drop_database(name)
+
+    async def start_session(self, **kwargs) -> AsyncMemorySession:
+        return AsyncMemorySession(self.delegate.start_session())
+
+    def close(self) -> None:
+        pass
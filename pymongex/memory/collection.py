@@ -0,0 +1,834 @@
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import bson
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+from ..utils import MISSING, sort_key
+from .aggregation import first_match_filter, run_pipeline
+from .query import compile_query, equality_values, upsert_seed
+from .updates import (
+    apply_update,
+    replace_document,
+    validate_replacement,
+    validate_update,
+)
+from .values import copy_value, get_field, resolve_query_path, split_path, to_storage
+
+if TYPE_CHECKING:
+    from .client import MemoryDatabase
+
+IndexKeys = Union[str, List[Tuple[str, int]]]
+
+RAW_BATCH_SIZE = 1000
+
+
+def _normalize_keys(keys: IndexKeys) -> List[Tuple[str, int]]:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    if isinstance(keys, dict):
+        return list(keys.items())
+    return [(key, direction) for key, direction in keys]
+
+
+def _index_name(keys: List[Tuple[str, int]]) -> str:
+    return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+
+def _field_keys(document: Dict[str, Any], field: str) -> Set[Tuple]:
+    # multikey: an array is indexed as a whole and by each of its elements
+    keys = set()
+    for value in resolve_query_path(document, split_path(field)):
+        keys.add(sort_key(None if value is MISSING else value))
+        if isinstance(value, list):
+            keys.update(sort_key(item) for item in value)
+    return keys
+
+
+def _unique_key(document: Dict[str, Any], fields: List[str]) -> Tuple:
+    key = []
+    for field in fields:
+        value = resolve_query_path(document, split_path(field))[0]
+        key.append(sort_key(None if value is MISSING else value))
+    return tuple(key)
+
+
+def distinct_values(documents: Iterable[Dict[str, Any]], key: str) -> List[Any]:
+    seen, values = set(), []
+    for document in documents:
+        for value in resolve_query_path(document, split_path(key)):
+            for item in value if isinstance(value, list) else [value]:
+                if item is MISSING:
+                    continue
+                item_key = sort_key(item)
+                if item_key not in seen:
+                    seen.add(item_key)
+                    values.append(copy_value(item))
+    return values
+
+
+class _Index:
+    """Hash index on the first key of an index specification."""
+
+    def __init__(
+        self, name: str, keys: List[Tuple[str, int]], unique: bool, sparse: bool
+    ):
+        self.name = name
+        self.keys = keys
+        self.fields = [key for key, _ in keys]
+        self.unique = unique
+        self.sparse = sparse
+        self.entries: Dict[Tuple, Set[Tuple]] = {}
+        self.unique_entries: Dict[Tuple, Tuple] = {}
+
+    @property
+    def field(self) -> str:
+        return self.fields[0]
+
+    def _skipped(self, document: Dict[str, Any]) -> bool:
+        return self.sparse and all(
+            resolve_query_path(document, split_path(field)) == [MISSING]
+            for field in self.fields
+        )
+
+    def check(self, document: Dict[str, Any], id_key: Tuple) -> None:
+        if not self.unique or self._skipped(document):
+            return
+        owner = self.unique_entries.get(_unique_key(document, self.fields))
+        if owner is not None and owner != id_key:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error index: {self.name}",
+                code=11000,
+                details={"keyPattern": dict(self.keys), "index": self.name},
+            )
+
+    def add(self, document: Dict[str, Any], id_key: Tuple) -> None:
+        if self._skipped(document):
+            return
+        for key in _field_keys(document, self.field):
+            self.entries.setdefault(key, set()).add(id_key)
+        if self.unique:
+            self.unique_entries[_unique_key(document, self.fields)] = id_key
+
+    def remove(self, document: Dict[str, Any], id_key: Tuple) -> None:
+        if self._skipped(document):
+            return
+        for key in _field_keys(document, self.field):
+            ids = self.entries.get(key)
+            if ids is not None:
+                ids.discard(id_key)
+                if not ids:
+                    del self.entries[key]
+        if self.unique:
+            self.unique_entries.pop(_unique_key(document, self.fields), None)
+
+    def copy(self) -> "_Index":
+        index = _Index(self.name, self.keys, self.unique, self.sparse)
+        index.entries = {key: set(ids) for key, ids in self.entries.items()}
+        index.unique_entries = dict(self.unique_entries)
+        return index
+
+    def info(self) -> Dict[str, Any]:
+        info = {"key": list(self.keys), "v": 2}
+        if self.unique:
+            info["unique"] = True
+        if self.sparse:
+            info["sparse"] = True
+        return info
+
+
+class MemoryCursor:
+    """List backed cursor, results are computed on first iteration."""
+
+    def __init__(self, fetch: Callable[[], List[Any]]):
+        self._fetch = fetch
+        self._iterator: Optional[Iterator[Any]] = None
+
+    def _results(self) -> Iterator[Any]:
+        if self._iterator is None:
+            self._iterator = iter(self._fetch())
+        return self._iterator
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        return next(self._results())
+
+    def next(self) -> Any:
+        return self.__next__()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._iterator = iter(())
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+
+class MemoryFindCursor(MemoryCursor):
+    def __init__(self, collection: "MemoryCollection", filter, projection, kwargs):
+        super().__init__(self._run)
+        self._collection = collection
+        self._filter = filter
+        self._projection = projection
+        self._sort = kwargs.get("sort")
+        self._skip = kwargs.get("skip", 0)
+        self._limit = kwargs.get("limit", 0)
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self._sort = key_or_list
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def _run(self) -> List[Dict[str, Any]]:
+        pipeline = [{"$match": self._filter or {}}]
+        if self._sort:
+            pipeline.append({"$sort": dict(_normalize_keys(self._sort))})
+        if self._skip:
+            pipeline.append({"$skip": self._skip})
+        if self._limit:
+            pipeline.append({"$limit": abs(self._limit)})
+        projection = self._projection
+        if isinstance(projection, (list, tuple)):
+            projection = {field: 1 for field in projection}
+        if projection:
+            pipeline.append({"$project": projection})
+        return self._collection._aggregate(pipeline)
+
+
+class MemoryCollection:
+    """
+    Pymongo-like collection kept in process memory. Stored documents are
+    replaced on write, never changed in place, so reads work on a snapshot
+    without holding the lock. Query semantics, errors and result types follow
+    pymongo; hints, collations and write concerns are accepted and ignored.
+    Sessions only matter for transactions, see MemorySession.
+    """
+
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._documents: Dict[Tuple, Dict[str, Any]] = {}
+        self._positions: Dict[Tuple, int] = {}
+        self._next_position = 0
+        self._indexes: Dict[str, _Index] = {}
+        self._lock = threading.RLock()
+
+    def with_options(self, **kwargs) -> "MemoryCollection":
+        return self
+
+    # reads
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._documents.values())
+
+    def has_index(self, field: str) -> bool:
+        return field == "_id" or any(
+            index.field == field for index in self._indexes.values()
+        )
+
+    def find_equal(self, field: str, values: List[Any]) -> List[Dict[str, Any]]:
+        """Stored documents whose indexed `field` equals one of `values`."""
+        with self._lock:
+            if field == "_id":
+                id_keys = {sort_key(value) for value in values}
+            else:
+                index = next(i for i in self._indexes.values() if i.field == field)
+                id_keys = set()
+                for value in values:
+                    id_keys.update(index.entries.get(sort_key(value), ()))
+            found = [
+                (self._positions[key], self._documents[key])
+                for key in id_keys
+                if key in self._documents
+            ]
+        found.sort(key=lambda pair: pair[0])
+        return [document for _, document in found]
+
+    def _candidates(self, filter: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # narrows a scan with the _id or a secondary index, the filter is
+        # still applied to every candidate
+        if filter:
+            values = equality_values(filter, "_id")
+            if values is not None:
+                return self.find_equal("_id", values)
+            for index in list(self._indexes.values()):
+                values = equality_values(filter, index.field)
+                if values is not None:
+                    return self.find_equal(index.field, values)
+        return self.snapshot()
+
+    def _match(self, filter: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        predicate = compile_query(filter)
+        return [doc for doc in self._candidates(filter) if predicate(doc)]
+
+    def _aggregate(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        write_stage = None
+        if pipeline and ("$out" in pipeline[-1] or "$merge" in pipeline[-1]):
+            write_stage, pipeline = pipeline[-1], pipeline[:-1]
+        for stage in pipeline:
+            if "$out" in stage or "$merge" in stage:
+                raise OperationFailure(
+                    f"{next(iter(stage))} can only be the final stage in the pipeline",
+                    code=40601,
+                )
+        documents = self._candidates(first_match_filter(pipeline))
+        results = list(run_pipeline(documents, pipeline, self.database))
+        if write_stage is None:
+            return results
+        # like the server, a pipeline writing its results returns none
+        if "$out" in write_stage:
+            self._write_target(write_stage["$out"]).replace_contents(results)
+        else:
+            spec = write_stage["$merge"]
+            if not isinstance(spec, dict):
+                spec = {"into": spec}
+            self._write_target(spec["into"]).merge_documents(
+                results,
+                on=spec.get("on", "_id"),
+                when_matched=spec.get("whenMatched", "merge"),
+                when_not_matched=spec.get("whenNotMatched", "insert"),
+            )
+        return []
+
+    def _write_target(self, target: Union[str, Dict[str, str]]) -> "MemoryCollection":
+        if isinstance(target, dict):
+            database = self.database.client.get_database(
+                target.get("db", self.database.name)
+            )
+            return database.get_collection(target["coll"])
+        return self.database.get_collection(target)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> MemoryCursor:
+        return MemoryCursor(lambda: self._aggregate(pipeline))
+
+    def aggregate_raw_batches(
+        self, pipeline: List[Dict[str, Any]], **kwargs
+    ) -> MemoryCursor:
+        batch_size = kwargs.get("batchSize") or kwargs.get("batch_size")
+        batch_size = batch_size or RAW_BATCH_SIZE
+
+        def fetch() -> List[bytes]:
+            documents = self._aggregate(pipeline)
+            return [
+                b"".join(bson.encode(doc) for doc in documents[i : i + batch_size])
+                for i in range(0, len(documents), batch_size)
+            ]
+
+        return MemoryCursor(fetch)
+
+    def find(self, filter: Any = None, projection: Any = None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return MemoryFindCursor(self, filter, projection, kwargs)
+
+    def find_one(self, filter: Any = None, *args, **kwargs) -> Optional[Dict]:
+        kwargs["limit"] = 1
+        for document in self.find(filter, *args, **kwargs):
+            return document
+        return None
+
+    def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        count = len(self._match(filter)) - kwargs.get("skip", 0)
+        if kwargs.get("limit"):
+            count = min(count, kwargs["limit"])
+        return max(0, count)
+
+    def estimated_document_count(self, **kwargs) -> int:
+        return len(self._documents)
+
+    def distinct(self, key: str, filter: Optional[Dict] = None, **kwargs) -> List:
+        return distinct_values(self._match(filter), key)
+
+    # writes, callers hold the lock
+
+    def _join(self, session: Any) -> None:
+        # a transaction saves the collection before its first write to it
+        if session is not None:
+            getattr(session, "delegate", session)._track(self)
+
+    def _save_state(self) -> Tuple:
+        indexes = {name: index.copy() for name, index in self._indexes.items()}
+        return dict(self._documents), dict(self._positions), indexes
+
+    def _restore_state(self, state: Tuple) -> None:
+        with self._lock:
+            self._documents, self._positions, self._indexes = state
+
+    def _check_unique(self, document: Dict[str, Any], id_key: Tuple) -> None:
+        for index in self._indexes.values():
+            index.check(document, id_key)
+
+    def _store(self, document: Dict[str, Any]) -> Any:
+        if "_id" not in document:
+            document = {"_id": ObjectId(), **document}
+        id_key = sort_key(document["_id"])
+        if id_key in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} "
+                f"index: _id_ dup key: {{ _id: {document['_id']!r} }}",
+                code=11000,
+                details={"keyPattern": {"_id": 1}, "index": "_id_"},
+            )
+        self._check_unique(document, id_key)
+        self._documents[id_key] = document
+        self._positions[id_key] = self._next_position
+        self._next_position += 1
+        for index in self._indexes.values():
+            index.add(document, id_key)
+        return document["_id"]
+
+    def _replace(self, old: Dict[str, Any], new: Dict[str, Any]) -> None:
+        id_key = sort_key(old["_id"])
+        self._check_unique(new, id_key)
+        for index in self._indexes.values():
+            index.remove(old, id_key)
+            index.add(new, id_key)
+        self._documents[id_key] = new
+
+    def _remove(self, document: Dict[str, Any]) -> None:
+        id_key = sort_key(document["_id"])
+        for index in self._indexes.values():
+            index.remove(document, id_key)
+        del self._documents[id_key]
+        del self._positions[id_key]
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        # like pymongo, the caller's document gets the generated _id
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        stored = to_storage(document)
+        # the server keeps _id as the first field
+        return self._store({"_id": stored.pop("_id"), **stored})
+
+    def _update(
+        self,
+        filter: Dict[str, Any],
+        update: Any,
+        upsert: bool,
+        multi: bool,
+        replacement: bool = False,
+    ) -> Dict[str, Any]:
+        matched = self._match(filter)
+        if not multi:
+            matched = matched[:1]
+        modified = 0
+        for document in matched:
+            if replacement:
+                updated = replace_document(document, update)
+            else:
+                updated = apply_update(document, update)
+            if updated != document:
+                self._replace(document, updated)
+                modified += 1
+        result = {"n": len(matched), "nModified": modified}
+        if not matched and upsert:
+            seed = upsert_seed(filter)
+            if replacement:
+                document = {**to_storage(update)}
+                if "_id" in seed and "_id" not in document:
+                    document = {"_id": seed["_id"], **document}
+            else:
+                document = apply_update(seed, update, insert=True)
+            result["upserted"] = self._store(document)
+            result["n"] = 1
+        return result
+
+    def _delete(self, filter: Dict[str, Any], multi: bool) -> int:
+        matched = self._match(filter)
+        if not multi:
+            matched = matched[:1]
+        for document in matched:
+            self._remove(document)
+        return len(matched)
+
+    def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        with self._lock:
+            self._join(kwargs.get("session"))
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(
+        self, documents: List[Dict[str, Any]], ordered: bool = True, **kwargs
+    ) -> InsertManyResult:
+        result = self.bulk_write(
+            [InsertOne(document) for document in documents],
+            ordered=ordered,
+            session=kwargs.get("session"),
+        )
+        return InsertManyResult([doc["_id"] for doc in documents], result.acknowledged)
+
+    def update_one(
+        self, filter: Dict, update: Any, upsert: bool = False, **kwargs
+    ) -> UpdateResult:
+        validate_update(update)
+        with self._lock:
+            self._join(kwargs.get("session"))
+            return UpdateResult(self._update(filter, update, upsert, False), True)
+
+    def update_many(
+        self, filter: Dict, update: Any, upsert: bool = False, **kwargs
+    ) -> UpdateResult:
+        validate_update(update)
+        with self._lock:
+            self._join(kwargs.get("session"))
+            return UpdateResult(self._update(filter, update, upsert, True), True)
+
+    def replace_one(
+        self, filter: Dict, replacement: Dict, upsert: bool = False, **kwargs
+    ) -> UpdateResult:
+        validate_replacement(replacement)
+        with self._lock:
+            self._join(kwargs.get("session"))
+            result = self._update(filter, replacement, upsert, False, replacement=True)
+        return UpdateResult(result, True)
+
+    def delete_one(self, filter: Dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            self._join(kwargs.get("session"))
+            return DeleteResult({"n": self._delete(filter, False)}, True)
+
+    def delete_many(self, filter: Dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            self._join(kwargs.get("session"))
+            return DeleteResult({"n": self._delete(filter, True)}, True)
+
+    def _bulk_operation(self, request: Any, result: Dict[str, Any], index: int):
+        if isinstance(request, InsertOne):
+            self._insert(request._doc)
+            result["nInserted"] += 1
+            return
+        if isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+            replacement = isinstance(request, ReplaceOne)
+            if replacement:
+                validate_replacement(request._doc)
+            else:
+                validate_update(request._doc)
+            outcome = self._update(
+                request._filter,
+                request._doc,
+                request._upsert,
+                isinstance(request, UpdateMany),
+                replacement=replacement,
+            )
+            if "upserted" in outcome:
+                result["nUpserted"] += 1
+                result["upserted"].append({"index": index, "_id": outcome["upserted"]})
+            else:
+                result["nMatched"] += outcome["n"]
+                result["nModified"] += outcome["nModified"]
+            return
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            multi = isinstance(request, DeleteMany)
+            result["nRemoved"] += self._delete(request._filter, multi)
+            return
+        raise TypeError(f"{request!r} is not a valid request")
+
+    def bulk_write(
+        self, requests: List[Any], ordered: bool = True, **kwargs
+    ) -> BulkWriteResult:
+        result = {
+            "writeErrors": [],
+            "writeConcernErrors": [],
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+        }
+        with self._lock:
+            self._join(kwargs.get("session"))
+            for index, request in enumerate(requests):
+                try:
+                    self._bulk_operation(request, result, index)
+                except (DuplicateKeyError, OperationFailure) as e:
+                    result["writeErrors"].append(
+                        {
+                            "index": index,
+                            "code": e.code,
+                            "errmsg": str(e),
+                            "op": getattr(request, "_doc", None)
+                            or getattr(request, "_filter", None),
+                        }
+                    )
+                    if ordered:
+                        break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def replace_contents(self, documents: List[Dict[str, Any]]) -> None:
+        """The $out write: `documents` replace the collection, indexes are kept."""
+        documents = [to_storage(document) for document in documents]
+        with self._lock:
+            state = self._save_state()
+            try:
+                for document in list(self._documents.values()):
+                    self._remove(document)
+                for document in documents:
+                    self._store(document)
+            except Exception:
+                # the server writes to a temporary collection, $out is atomic
+                self._restore_state(state)
+                raise
+
+    def merge_documents(
+        self,
+        documents: List[Dict[str, Any]],
+        on: Union[str, List[str]] = "_id",
+        when_matched: Any = "merge",
+        when_not_matched: str = "insert",
+    ) -> None:
+        """The $merge write, pipelines as whenMatched are not supported."""
+        fields = [on] if isinstance(on, str) else list(on)
+        if not isinstance(when_matched, str):
+            raise OperationFailure(
+                "$merge with a whenMatched pipeline is not supported by the "
+                "memory engine",
+                code=2,
+            )
+        with self._lock:
+            for document in documents:
+                document = to_storage(document)
+                if "_id" not in document:
+                    document = {"_id": ObjectId(), **document}
+                filter = {}
+                for field in fields:
+                    value = get_field(document, field)
+                    if value is MISSING or value is None:
+                        raise OperationFailure(
+                            f"$merge write error: 'on' field '{field}' cannot be "
+                            "missing, null, undefined or an array",
+                            code=51132,
+                        )
+                    filter[field] = value
+                matched = self._match(filter)[:1]
+                if not matched:
+                    if when_not_matched == "insert":
+                        self._store(document)
+                    elif when_not_matched == "fail":
+                        raise OperationFailure(
+                            "$merge could not find a matching document in the "
+                            "target collection for at least one document in the "
+                            "source collection",
+                            code=13113,
+                        )
+                    continue
+                old = matched[0]
+                if when_matched == "replace":
+                    self._replace(old, {**document, "_id": old["_id"]})
+                elif when_matched == "merge":
+                    self._replace(old, {**old, **document, "_id": old["_id"]})
+                elif when_matched == "fail":
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name}",
+                        code=11000,
+                    )
+
+    # indexes
+
+    def create_index(
+        self,
+        keys: IndexKeys,
+        unique: bool = False,
+        sparse: bool = False,
+        name: Optional[str] = None,
+        **kwargs,
+    ) -> str:
+        keys = _normalize_keys(keys)
+        name = name or _index_name(keys)
+        if keys == [("_id", 1)]:
+            return "_id_"
+        with self._lock:
+            if name in self._indexes:
+                return name
+            index = _Index(name, keys, unique, sparse)
+            for id_key, document in self._documents.items():
+                index.check(document, id_key)
+                index.add(document, id_key)
+            self._indexes[name] = index
+        return name
+
+    def drop_index(self, index_or_name: Union[str, IndexKeys]) -> None:
+        name = index_or_name
+        if not isinstance(name, str) or name not in self._indexes:
+            name = _index_name(_normalize_keys(index_or_name))
+        with self._lock:
+            if name not in self._indexes:
+                raise OperationFailure(f"index not found with name [{name}]", code=27)
+            del self._indexes[name]
+
+    def drop_indexes(self) -> None:
+        with self._lock:
+            self._indexes = {}
+
+    def index_information(self) -> Dict[str, Dict[str, Any]]:
+        info = {"_id_": {"key": [("_id", 1)], "v": 2}}
+        with self._lock:
+            info.update({name: index.info() for name, index in self._indexes.items()})
+        return info
+
+    def drop(self) -> None:
+        with self._lock:
+            self._documents = {}
+            self._positions = {}
+            self._indexes = {}
+        self.database._forget(self.name)
+
+
+class AsyncMemoryCursor:
+    """Motor-like cursor over a MemoryCursor."""
+
+    def __init__(self, cursor: MemoryCursor):
+        self._cursor = cursor
+
+    async def to_list(self, length: Optional[int] = None) -> List[Any]:
+        if length is None:
+            return list(self._cursor)
+        items = []
+        for item in self._cursor:
+            items.append(item)
+            if len(items) >= length:
+                break
+        return items
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def next(self) -> Any:
+        return await self.__anext__()
+
+    async def close(self) -> None:
+        self._cursor.close()
+
+    def sort(self, *args, **kwargs) -> "AsyncMemoryCursor":
+        self._cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, skip: int) -> "AsyncMemoryCursor":
+        self._cursor.skip(skip)
+        return self
+
+    def limit(self, limit: int) -> "AsyncMemoryCursor":
+        self._cursor.limit(limit)
+        return self
+
+
+class AsyncMemoryCollection:
+    """
+    Motor-like view of a MemoryCollection. Operations are in-memory and run
+    inline on the event loop.
+    """
+
+    def __init__(self, collection: MemoryCollection):
+        self.delegate = collection
+        self.name = collection.name
+        self.full_name = collection.full_name
+
+    def with_options(self, **kwargs) -> "AsyncMemoryCollection":
+        return self
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs):
+        return AsyncMemoryCursor(self.delegate.aggregate(pipeline, **kwargs))
+
+    def aggregate_raw_batches(self, pipeline: List[Dict[str, Any]], **kwargs):
+        cursor = self.delegate.aggregate_raw_batches(pipeline, **kwargs)
+        return AsyncMemoryCursor(cursor)
+
+    def find(self, *args, **kwargs) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self.delegate.find(*args, **kwargs))
+
+    async def find_one(self, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        return self.delegate.find_one(*args, **kwargs)
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return self.delegate.count_documents(filter, **kwargs)
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return self.delegate.estimated_document_count(**kwargs)
+
+    async def distinct(self, *args, **kwargs) -> List[Any]:
+        return self.delegate.distinct(*args, **kwargs)
+
+    async def insert_one(self, *args, **kwargs) -> InsertOneResult:
+        return self.delegate.insert_one(*args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs) -> InsertManyResult:
+        return self.delegate.insert_many(*args, **kwargs)
+
+    async def update_one(self, *args, **kwargs) -> UpdateResult:
+        return self.delegate.update_one(*args, **kwargs)
+
+    async def update_many(self, *args, **kwargs) -> UpdateResult:
+        return self.delegate.update_many(*args, **kwargs)
+
+    async def replace_one(self, *args, **kwargs) -> UpdateResult:
+        return self.delegate.replace_one(*args, **kwargs)
+
+    async def delete_one(self, *args, **kwargs) -> DeleteResult:
+        return self.delegate.delete_one(*args, **kwargs)
+
+    async def delete_many(self, *args, **kwargs) -> DeleteResult:
+        return self.delegate.delete_many(*args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs) -> BulkWriteResult:
+        return self.delegate.bulk_write(*args, **kwargs)
+
+    async def create_index(self, *args, **kwargs) -> str:
+        return self.delegate.create_index(*args, **kwargs)
+
+    async def drop_index(self, *args, **kwargs) -> None:
+        self.delegate.drop_index(*args, **kwargs)
+
+    async def drop_indexes(self) -> None:
+        self.delegate.drop_indexes()
+
+    async def index_information(self) -> Dict[str, Dict[str, Any]]:
+        return self.delegate.index_information()
+
+    async def drop(self) -> None:
+        self.delegate.drop()
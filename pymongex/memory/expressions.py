@@ -0,0 +1,388 @@
+import re
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from ..utils import MISSING, sort_key, type_rank, utc_now
+from .values import get_field
+
+Variables = Optional[Dict[str, Any]]
+
+
+def truthy(value: Any) -> bool:
+    if value is MISSING or value is None or value is False:
+        return False
+    if type_rank(value) == 3 and value == 0:
+        return False
+    return True
+
+
+def _compare_key(value: Any):
+    # unlike queries, expressions tell a missing field apart from null
+    if value is MISSING:
+        return (0, 0)
+    return sort_key(value)
+
+
+def compare(a: Any, b: Any) -> int:
+    ka, kb = _compare_key(a), _compare_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def _variable(name: str, document: Dict[str, Any], variables: Variables) -> Any:
+    head, _, rest = name.partition(".")
+    if head in ("ROOT", "CURRENT"):
+        value = (variables or {}).get(head, document)
+    elif head == "REMOVE":
+        return MISSING
+    elif head == "NOW":
+        value = utc_now()
+    elif variables is not None and head in variables:
+        value = variables[head]
+    else:
+        raise OperationFailure(f"Use of undefined variable: {head}", code=17276)
+    return get_field(value, rest) if rest else value
+
+
+def evaluate(expression: Any, document: Dict[str, Any], variables: Variables = None):
+    """Evaluates an aggregation expression against `document`."""
+    if isinstance(expression, str):
+        if expression.startswith("$$"):
+            return _variable(expression[2:], document, variables)
+        if expression.startswith("$"):
+            return get_field(document, expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [
+            None if value is MISSING else value
+            for value in (evaluate(item, document, variables) for item in expression)
+        ]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator = next(iter(expression))
+            if operator.startswith("$"):
+                function = _OPERATORS.get(operator)
+                if function is None:
+                    raise OperationFailure(
+                        f"Unrecognized expression '{operator}'", code=168
+                    )
+                return function(expression[operator], document, variables)
+        result = {}
+        for key, item in expression.items():
+            value = evaluate(item, document, variables)
+            if value is not MISSING:
+                result[key] = value
+        return result
+    return expression
+
+
+def _args(argument: Any) -> List[Any]:
+    return argument if isinstance(argument, list) else [argument]
+
+
+def _evaluated(argument, document, variables) -> List[Any]:
+    return [evaluate(item, document, variables) for item in _args(argument)]
+
+
+def _null(value: Any) -> bool:
+    return value is None or value is MISSING
+
+
+def _comparison(test: Callable[[int], bool]):
+    def function(argument, document, variables):
+        a, b = _evaluated(argument, document, variables)
+        return test(compare(a, b))
+
+    return function
+
+
+def _cond(argument, document, variables):
+    if isinstance(argument, list):
+        condition, then, otherwise = argument
+    else:
+        condition, then, otherwise = (
+            argument["if"],
+            argument["then"],
+            argument["else"],
+        )
+    if truthy(evaluate(condition, document, variables)):
+        return evaluate(then, document, variables)
+    return evaluate(otherwise, document, variables)
+
+
+def _switch(argument, document, variables):
+    for branch in argument["branches"]:
+        if truthy(evaluate(branch["case"], document, variables)):
+            return evaluate(branch["then"], document, variables)
+    if "default" not in argument:
+        raise OperationFailure("$switch could not find a matching branch", code=40066)
+    return evaluate(argument["default"], document, variables)
+
+
+def _if_null(argument, document, variables):
+    for item in argument[:-1]:
+        value = evaluate(item, document, variables)
+        if not _null(value):
+            return value
+    return evaluate(argument[-1], document, variables)
+
+
+def _arithmetic(function: Callable[[List[Any]], Any]):
+    def wrapper(argument, document, variables):
+        values = _evaluated(argument, document, variables)
+        if any(_null(value) for value in values):
+            return None
+        return function(values)
+
+    return wrapper
+
+
+def _add(values: List[Any]) -> Any:
+    dates = [value for value in values if isinstance(value, datetime)]
+    numbers = sum(value for value in values if not isinstance(value, datetime))
+    if dates:
+        return dates[0] + timedelta(milliseconds=numbers)
+    return numbers
+
+
+def _subtract(values: List[Any]) -> Any:
+    a, b = values
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return int((a - b).total_seconds() * 1000)
+    if isinstance(a, datetime):
+        return a - timedelta(milliseconds=b)
+    return a - b
+
+
+def _multiply(values: List[Any]) -> Any:
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+
+def _divide(values: List[Any]) -> Any:
+    a, b = values
+    if b == 0:
+        raise OperationFailure("can't $divide by zero", code=2)
+    return a / b
+
+
+def _array_values(argument, document, variables) -> List[Any]:
+    # $sum, $avg, $min and $max take one array or several values
+    values = _evaluated(argument, document, variables)
+    if not isinstance(argument, list) and values and isinstance(values[0], list):
+        return values[0]
+    return values
+
+
+def _sum(argument, document, variables):
+    values = _array_values(argument, document, variables)
+    return sum(v for v in values if type_rank(v) == 3 and not isinstance(v, bool))
+
+
+def _avg(argument, document, variables):
+    values = _array_values(argument, document, variables)
+    numbers = [v for v in values if type_rank(v) == 3 and not isinstance(v, bool)]
+    return sum(numbers) / len(numbers) if numbers else None
+
+
+def _extreme(pick: Callable):
+    def function(argument, document, variables):
+        values = [
+            v for v in _array_values(argument, document, variables) if not _null(v)
+        ]
+        if not values:
+            return None
+        return pick(values, key=sort_key)
+
+    return function
+
+
+def _size(argument, document, variables):
+    (value,) = _evaluated(argument, document, variables)
+    if not isinstance(value, list):
+        raise OperationFailure("The argument to $size must be an array", code=17124)
+    return len(value)
+
+
+def _array_elem_at(argument, document, variables):
+    array, index = _evaluated(argument, document, variables)
+    if _null(array):
+        return None
+    if -len(array) <= index < len(array):
+        return array[index]
+    return MISSING
+
+
+def _first(argument, document, variables):
+    (array,) = _evaluated(argument, document, variables)
+    if _null(array):
+        return None
+    return array[0] if array else MISSING
+
+
+def _last(argument, document, variables):
+    (array,) = _evaluated(argument, document, variables)
+    if _null(array):
+        return None
+    return array[-1] if array else MISSING
+
+
+def _in(argument, document, variables):
+    value, array = _evaluated(argument, document, variables)
+    if not isinstance(array, list):
+        raise OperationFailure("$in requires an array as a second argument", code=40081)
+    return any(compare(value, item) == 0 for item in array)
+
+
+def _concat(argument, document, variables):
+    values = _evaluated(argument, document, variables)
+    if any(_null(value) for value in values):
+        return None
+    return "".join(values)
+
+
+def _concat_arrays(argument, document, variables):
+    values = _evaluated(argument, document, variables)
+    if any(_null(value) for value in values):
+        return None
+    return [item for value in values for item in value]
+
+
+def _string(function: Callable[[str], Any]):
+    def wrapper(argument, document, variables):
+        (value,) = _evaluated(argument, document, variables)
+        return function("" if _null(value) else str(value))
+
+    return wrapper
+
+
+def _to_string(argument, document, variables):
+    (value,) = _evaluated(argument, document, variables)
+    if _null(value):
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return (
+            value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+        )
+    return str(value)
+
+
+def _to_object_id(argument, document, variables):
+    (value,) = _evaluated(argument, document, variables)
+    if _null(value):
+        return None
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+
+def _merge_objects(argument, document, variables):
+    result = {}
+    for value in _array_values(argument, document, variables):
+        if isinstance(value, dict):
+            result.update(value)
+    return result
+
+
+def _scoped(variables: Variables, name: str, value: Any) -> Dict[str, Any]:
+    scoped = dict(variables or {})
+    scoped[name] = value
+    return scoped
+
+
+def _map(argument, document, variables):
+    array = evaluate(argument["input"], document, variables)
+    if _null(array):
+        return None
+    name = argument.get("as", "this")
+    return [
+        evaluate(argument["in"], document, _scoped(variables, name, item))
+        for item in array
+    ]
+
+
+def _filter(argument, document, variables):
+    array = evaluate(argument["input"], document, variables)
+    if _null(array):
+        return None
+    name = argument.get("as", "this")
+    result = [
+        item
+        for item in array
+        if truthy(
+            evaluate(
+                argument["cond"],
+                document,
+                _scoped(variables, name, item),
+            )
+        )
+    ]
+    if "limit" in argument:
+        result = result[: evaluate(argument["limit"], document, variables)]
+    return result
+
+
+def _regex_match(argument, document, variables):
+    value = evaluate(argument["input"], document, variables)
+    if not isinstance(value, str):
+        return False
+    flags = 0
+    for option in argument.get("options", ""):
+        flags |= {"i": re.I, "m": re.M, "s": re.S, "x": re.X}.get(option, 0)
+    return bool(re.search(argument["regex"], value, flags))
+
+
+_OPERATORS: Dict[str, Callable[[Any, Dict[str, Any], Variables], Any]] = {
+    "$literal": lambda argument, document, variables: argument,
+    "$eq": _comparison(lambda c: c == 0),
+    "$ne": _comparison(lambda c: c != 0),
+    "$gt": _comparison(lambda c: c > 0),
+    "$gte": _comparison(lambda c: c >= 0),
+    "$lt": _comparison(lambda c: c < 0),
+    "$lte": _comparison(lambda c: c <= 0),
+    "$cmp": _comparison(lambda c: c),
+    "$and": lambda argument, document, variables: all(
+        truthy(evaluate(item, document, variables)) for item in _args(argument)
+    ),
+    "$or": lambda argument, document, variables: any(
+        truthy(evaluate(item, document, variables)) for item in _args(argument)
+    ),
+    "$not": lambda argument, document, variables: not truthy(
+        _evaluated(argument, document, variables)[0]
+    ),
+    "$cond": _cond,
+    "$switch": _switch,
+    "$ifNull": _if_null,
+    "$add": _arithmetic(_add),
+    "$subtract": _arithmetic(_subtract),
+    "$multiply": _arithmetic(_multiply),
+    "$divide": _arithmetic(_divide),
+    "$mod": _arithmetic(lambda values: values[0] % values[1]),
+    "$abs": _arithmetic(lambda values: abs(values[0])),
+    "$sum": _sum,
+    "$avg": _avg,
+    "$min": _extreme(min),
+    "$max": _extreme(max),
+    "$size": _size,
+    "$arrayElemAt": _array_elem_at,
+    "$first": _first,
+    "$last": _last,
+    "$in": _in,
+    "$isArray": lambda argument, document, variables: isinstance(
+        _evaluated(argument, document, variables)[0], list
+    ),
+    "$concat": _concat,
+    "$concatArrays": _concat_arrays,
+    "$toLower": _string(str.lower),
+    "$toUpper": _string(str.upper),
+    "$toString": _to_string,
+    "$toObjectId": _to_object_id,
+    "$mergeObjects": _merge_objects,
+    "$map": _map,
+    "$filter": _filter,
+    "$regexMatch": _regex_match,
+}
@@ -0,0 +1,262 @@
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.regex import Regex
+from pymongo.errors import OperationFailure
+
+from ..utils import MISSING, sort_key, type_rank
+from .values import resolve_query_path, split_path, values_equal
+
+Predicate = Callable[[Dict[str, Any], Optional[Dict[str, Any]]], bool]
+
+_TYPE_NAMES = {
+    "double": lambda v: isinstance(v, float),
+    "string": lambda v: isinstance(v, str),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "objectId": lambda v: isinstance(v, ObjectId),
+    "bool": lambda v: isinstance(v, bool),
+    "date": lambda v: isinstance(v, datetime),
+    "null": lambda v: v is None,
+    "int": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "long": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: type_rank(v) == 3,
+}
+
+
+def _is_operator_dict(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value) and next(iter(value)).startswith("$")
+
+
+def _is_regex(value: Any) -> bool:
+    return isinstance(value, (re.Pattern, Regex))
+
+
+def _compile_regex(pattern: Any, options: str = "") -> re.Pattern:
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option in options or "":
+        flags |= {"i": re.I, "m": re.M, "s": re.S, "x": re.X}.get(option, 0)
+    return re.compile(pattern, flags)
+
+
+def _candidates(values: List[Any]) -> List[Any]:
+    # a condition on an array field is tried on the array and on each element
+    candidates = []
+    for value in values:
+        candidates.append(value)
+        if isinstance(value, list):
+            candidates.extend(value)
+    return candidates
+
+
+def _equals(candidate: Any, expected: Any) -> bool:
+    if _is_regex(expected):
+        return isinstance(candidate, str) and bool(
+            _compile_regex(expected).search(candidate)
+        )
+    return values_equal(candidate, expected)
+
+
+def _compare(candidate: Any, expected: Any, test: Callable[[Tuple, Tuple], bool]):
+    # comparisons only match values of the same type bracket
+    if type_rank(candidate) != type_rank(expected):
+        return False
+    return test(sort_key(candidate), sort_key(expected))
+
+
+def _operator_matches(
+    operator: str,
+    argument: Any,
+    values: List[Any],
+    condition: Dict[str, Any],
+    variables: Optional[Dict[str, Any]],
+) -> bool:
+    if operator == "$eq":
+        return any(_equals(c, argument) for c in _candidates(values))
+    if operator == "$ne":
+        return not any(_equals(c, argument) for c in _candidates(values))
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        test = {
+            "$gt": lambda a, b: a > b,
+            "$gte": lambda a, b: a >= b,
+            "$lt": lambda a, b: a < b,
+            "$lte": lambda a, b: a <= b,
+        }[operator]
+        return any(_compare(c, argument, test) for c in _candidates(values))
+    if operator == "$in":
+        candidates = _candidates(values)
+        return any(_equals(c, expected) for expected in argument for c in candidates)
+    if operator == "$nin":
+        candidates = _candidates(values)
+        return not any(
+            _equals(c, expected) for expected in argument for c in candidates
+        )
+    if operator == "$exists":
+        exists = any(value is not MISSING for value in values)
+        return exists == bool(argument)
+    if operator == "$regex":
+        pattern = _compile_regex(argument, condition.get("$options", ""))
+        return any(
+            isinstance(c, str) and pattern.search(c) for c in _candidates(values)
+        )
+    if operator == "$options":
+        return True
+    if operator == "$not":
+        if _is_regex(argument) or isinstance(argument, str):
+            return not _operator_matches("$regex", argument, values, {}, variables)
+        return not _condition_matches(argument, values, variables)
+    if operator == "$size":
+        return any(isinstance(v, list) and len(v) == argument for v in values)
+    if operator == "$all":
+        if not argument:
+            return False
+        return all(
+            (
+                _condition_matches(expected, values, variables)
+                if _is_operator_dict(expected)
+                else any(_equals(c, expected) for c in _candidates(values))
+            )
+            for expected in argument
+        )
+    if operator == "$elemMatch":
+        if _is_operator_dict(argument):
+            return any(
+                isinstance(v, list)
+                and any(_condition_matches(argument, [item], variables) for item in v)
+                for v in values
+            )
+        predicate = compile_query(argument)
+        return any(
+            isinstance(v, list)
+            and any(isinstance(i, dict) and predicate(i, variables) for i in v)
+            for v in values
+        )
+    if operator == "$type":
+        names = argument if isinstance(argument, list) else [argument]
+        return any(
+            c is not MISSING and _TYPE_NAMES[name](c)
+            for name in names
+            for c in _candidates(values)
+        )
+    if operator == "$mod":
+        divisor, remainder = argument
+        return any(
+            type_rank(c) == 3 and not isinstance(c, bool) and c % divisor == remainder
+            for c in _candidates(values)
+        )
+    raise OperationFailure(f"unknown operator: {operator}", code=2)
+
+
+def _condition_matches(
+    condition: Any, values: List[Any], variables: Optional[Dict[str, Any]]
+) -> bool:
+    if _is_operator_dict(condition):
+        return all(
+            _operator_matches(operator, argument, values, condition, variables)
+            for operator, argument in condition.items()
+        )
+    return any(_equals(c, condition) for c in _candidates(values))
+
+
+def compile_query(query: Optional[Dict[str, Any]]) -> Predicate:
+    """Compiles a find filter into `predicate(document, variables) -> bool`."""
+    if not query:
+        return lambda document, variables=None: True
+
+    predicates: List[Predicate] = []
+    for key, condition in query.items():
+        if key == "$and":
+            parts = [compile_query(part) for part in condition]
+            predicates.append(
+                lambda d, v=None, parts=parts: all(p(d, v) for p in parts)
+            )
+        elif key == "$or":
+            parts = [compile_query(part) for part in condition]
+            predicates.append(
+                lambda d, v=None, parts=parts: any(p(d, v) for p in parts)
+            )
+        elif key == "$nor":
+            parts = [compile_query(part) for part in condition]
+            predicates.append(
+                lambda d, v=None, parts=parts: not any(p(d, v) for p in parts)
+            )
+        elif key == "$expr":
+            from .expressions import evaluate, truthy
+
+            predicates.append(
+                lambda d, v=None, expr=condition: truthy(evaluate(expr, d, v))
+            )
+        elif key == "$comment":
+            continue
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        else:
+            parts = split_path(key)
+            predicates.append(
+                lambda d, v=None, parts=parts, condition=condition: _condition_matches(
+                    condition, resolve_query_path(d, parts), v
+                )
+            )
+
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda document, variables=None: all(
+        predicate(document, variables) for predicate in predicates
+    )
+
+
+def equality_values(query: Optional[Dict[str, Any]], field: str) -> Optional[List]:
+    """
+    Values `field` has to equal for `query` to match, when the query pins it
+    with a plain value, $eq or $in. Used to narrow candidates with an index.
+    """
+    if not query:
+        return None
+    condition = query.get(field, MISSING)
+    if condition is not MISSING:
+        if _is_operator_dict(condition):
+            if "$eq" in condition:
+                values = [condition["$eq"]]
+            elif "$in" in condition:
+                values = list(condition["$in"])
+            else:
+                values = None
+        elif isinstance(condition, dict) and condition:
+            values = [condition]
+        elif isinstance(condition, (list, dict)):
+            values = None
+        else:
+            values = [condition]
+        if values is not None and not any(_is_regex(value) for value in values):
+            return values
+    for part in query.get("$and", []):
+        values = equality_values(part, field)
+        if values is not None:
+            return values
+    return None
+
+
+def upsert_seed(query: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The equality fields of a filter, the starting point of an upserted document."""
+    from .values import set_field, to_storage
+
+    document: Dict[str, Any] = {}
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            for part in condition:
+                for field, value in upsert_seed(part).items():
+                    set_field(document, field, value)
+        elif key.startswith("$"):
+            continue
+        elif _is_operator_dict(condition):
+            if "$eq" in condition:
+                set_field(document, key, to_storage(condition["$eq"]))
+        elif not _is_regex(condition):
+            set_field(document, key, to_storage(condition))
+    return document
@@ -0,0 +1,125 @@
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import InvalidOperation
+
+if TYPE_CHECKING:
+    from .client import MemoryClient
+    from .collection import MemoryCollection
+
+
+class _Transaction:
+    def __init__(self, session: "MemorySession"):
+        self._session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if not self._session.in_transaction:
+            return
+        if exc_type is None:
+            self._session.commit_transaction()
+        else:
+            self._session.abort_transaction()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.__exit__(exc_type, exc, tb)
+
+
+class MemorySession:
+    """
+    Pymongo-like session of a MemoryClient. Writes made in a transaction are
+    visible right away, there is no isolation, but aborting restores every
+    collection written in the transaction to its state before the first write.
+    """
+
+    def __init__(self, client: "MemoryClient"):
+        self.client = client
+        self.has_ended = False
+        self._saved: Optional[Dict["MemoryCollection", Tuple]] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.end_session()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._saved is not None
+
+    def _track(self, collection: "MemoryCollection") -> None:
+        with self._lock:
+            if self._saved is not None and collection not in self._saved:
+                self._saved[collection] = collection._save_state()
+
+    def start_transaction(self, **kwargs) -> _Transaction:
+        if self.has_ended:
+            raise InvalidOperation("Cannot use ended session")
+        if self.in_transaction:
+            raise InvalidOperation("Transaction already in progress")
+        self._saved = {}
+        return _Transaction(self)
+
+    def commit_transaction(self) -> None:
+        if not self.in_transaction:
+            raise InvalidOperation("No transaction started")
+        self._saved = None
+
+    def abort_transaction(self) -> None:
+        if not self.in_transaction:
+            raise InvalidOperation("No transaction started")
+        saved, self._saved = self._saved, None
+        for collection, state in saved.items():
+            collection._restore_state(state)
+
+    def with_transaction(self, callback: Callable[["MemorySession"], Any], **kwargs):
+        with self.start_transaction():
+            return callback(self)
+
+    def end_session(self) -> None:
+        if self.in_transaction:
+            self.abort_transaction()
+        self.has_ended = True
+
+
+class AsyncMemorySession:
+    """Motor-like view of a MemorySession."""
+
+    def __init__(self, session: MemorySession):
+        self.delegate = session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.end_session()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.delegate.in_transaction
+
+    @property
+    def has_ended(self) -> bool:
+        return self.delegate.has_ended
+
+    def start_transaction(self, **kwargs) -> _Transaction:
+        return self.delegate.start_transaction(**kwargs)
+
+    async def commit_transaction(self) -> None:
+        self.delegate.commit_transaction()
+
+    async def abort_transaction(self) -> None:
+        self.delegate.abort_transaction()
+
+    async def with_transaction(self, coro_function: Callable, **kwargs) -> Any:
+        async with self.start_transaction():
+            return await coro_function(self)
+
+    async def end_session(self) -> None:
+        self.delegate.end_session()
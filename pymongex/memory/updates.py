@@ -0,0 +1,248 @@
+from typing import Any, Dict, List, Union
+
+from pymongo.errors import OperationFailure, WriteError
+
+from ..utils import MISSING, sort_key, type_rank, utc_now
+from .aggregation import run_pipeline
+from .query import compile_query
+from .values import (
+    copy_value,
+    get_field,
+    set_field,
+    split_path,
+    to_storage,
+    unset_field,
+    values_equal,
+)
+
+Update = Union[Dict[str, Any], List[Dict[str, Any]]]
+
+# stages allowed in an update pipeline
+_UPDATE_STAGES = {
+    "$addFields",
+    "$set",
+    "$project",
+    "$unset",
+    "$replaceRoot",
+    "$replaceWith",
+}
+
+
+def validate_update(update: Update) -> None:
+    # raised by pymongo before anything is sent
+    if isinstance(update, list):
+        return
+    if not update:
+        raise ValueError("update cannot be empty")
+    if not next(iter(update)).startswith("$"):
+        raise ValueError("update only works with $ operators")
+
+
+def validate_replacement(replacement: Dict[str, Any]) -> None:
+    if replacement and next(iter(replacement)).startswith("$"):
+        raise ValueError("replacement can not include $ operators")
+
+
+def _number(value: Any, operator: str, path: str) -> Any:
+    if type_rank(value) != 3 or isinstance(value, bool):
+        raise WriteError(
+            f"Cannot apply {operator} to a value of non-numeric type. "
+            f"{{_id: ...}} has the field '{path}' of non-numeric type",
+            code=14,
+        )
+    return value
+
+
+def _array_at(document: Dict[str, Any], path: str) -> List[Any]:
+    value = get_field(document, path)
+    if value is MISSING:
+        value = []
+        set_field(document, path, value)
+    if not isinstance(value, list):
+        raise WriteError(
+            f"The field '{path}' must be an array but is of type "
+            f"{type(value).__name__} in document {{_id: ...}}",
+            code=2,
+        )
+    return value
+
+
+def _each(argument: Any) -> List[Any]:
+    if isinstance(argument, dict) and "$each" in argument:
+        return [to_storage(value) for value in argument["$each"]]
+    return [to_storage(argument)]
+
+
+def _push(document: Dict[str, Any], path: str, argument: Any) -> None:
+    array = _array_at(document, path)
+    values = _each(argument)
+    position = argument.get("$position") if isinstance(argument, dict) else None
+    if position is None:
+        array.extend(values)
+    else:
+        array[position:position] = values
+    if isinstance(argument, dict) and "$sort" in argument:
+        spec = argument["$sort"]
+        if isinstance(spec, dict):
+            for field, direction in reversed(list(spec.items())):
+                array.sort(
+                    key=lambda item: sort_key(get_field(item, field)),
+                    reverse=direction < 0,
+                )
+        else:
+            array.sort(key=sort_key, reverse=spec < 0)
+    if isinstance(argument, dict) and "$slice" in argument:
+        limit = argument["$slice"]
+        array[:] = array[:limit] if limit >= 0 else array[limit:]
+
+
+def _add_to_set(document: Dict[str, Any], path: str, argument: Any) -> None:
+    array = _array_at(document, path)
+    existing = {sort_key(item) for item in array}
+    for value in _each(argument):
+        key = sort_key(value)
+        if key not in existing:
+            existing.add(key)
+            array.append(value)
+
+
+def _pull(document: Dict[str, Any], path: str, argument: Any) -> None:
+    array = get_field(document, path)
+    if not isinstance(array, list):
+        return
+    if isinstance(argument, dict):
+        if next(iter(argument), "").startswith("$"):
+            predicate = compile_query({"value": argument})
+            keep = [item for item in array if not predicate({"value": item})]
+        else:
+            predicate = compile_query(argument)
+            keep = [
+                item
+                for item in array
+                if not (isinstance(item, dict) and predicate(item))
+            ]
+    else:
+        keep = [item for item in array if not values_equal(item, argument)]
+    array[:] = keep
+
+
+def _apply_operator(
+    document: Dict[str, Any], operator: str, path: str, argument: Any, insert: bool
+) -> None:
+    if path == "_id" or path.startswith("_id."):
+        if not (insert and operator in ("$set", "$setOnInsert")):
+            raise WriteError(
+                "Performing an update on the path '_id' would modify the "
+                "immutable field '_id'",
+                code=66,
+            )
+    if "$" in split_path(path) or any(
+        part.startswith("$[") for part in split_path(path)
+    ):
+        raise WriteError(
+            "positional update operators are not supported by the memory engine",
+            code=2,
+        )
+    if operator == "$set":
+        set_field(document, path, to_storage(argument))
+    elif operator == "$setOnInsert":
+        if insert:
+            set_field(document, path, to_storage(argument))
+    elif operator == "$unset":
+        unset_field(document, path)
+    elif operator == "$inc":
+        current = get_field(document, path)
+        current = 0 if current is MISSING else _number(current, "$inc", path)
+        set_field(document, path, current + _number(argument, "$inc", path))
+    elif operator == "$mul":
+        current = get_field(document, path)
+        current = 0 if current is MISSING else _number(current, "$mul", path)
+        set_field(document, path, current * _number(argument, "$mul", path))
+    elif operator in ("$min", "$max"):
+        current = get_field(document, path)
+        value = to_storage(argument)
+        if current is MISSING:
+            set_field(document, path, value)
+        elif operator == "$min" and sort_key(value) < sort_key(current):
+            set_field(document, path, value)
+        elif operator == "$max" and sort_key(value) > sort_key(current):
+            set_field(document, path, value)
+    elif operator == "$rename":
+        value = get_field(document, path)
+        if value is not MISSING:
+            unset_field(document, path)
+            set_field(document, argument, value)
+    elif operator == "$currentDate":
+        set_field(document, path, to_storage(utc_now()))
+    elif operator == "$push":
+        _push(document, path, argument)
+    elif operator == "$addToSet":
+        _add_to_set(document, path, argument)
+    elif operator == "$pull":
+        _pull(document, path, argument)
+    elif operator == "$pullAll":
+        array = get_field(document, path)
+        if isinstance(array, list):
+            array[:] = [
+                item
+                for item in array
+                if not any(values_equal(item, value) for value in argument)
+            ]
+    elif operator == "$pop":
+        array = get_field(document, path)
+        if isinstance(array, list) and array:
+            array.pop(0 if argument < 0 else -1)
+    else:
+        raise WriteError(f"Unknown modifier: {operator}", code=9)
+
+
+def apply_update(
+    document: Dict[str, Any], update: Update, insert: bool = False
+) -> Dict[str, Any]:
+    """
+    Returns the updated copy of `document`. `insert` is set when the update
+    creates an upserted document, which applies $setOnInsert.
+    """
+    if isinstance(update, list):
+        for stage in update:
+            name = next(iter(stage))
+            if name not in _UPDATE_STAGES:
+                raise OperationFailure(
+                    f"Invalid update pipeline: {name} is not allowed to be used "
+                    "within an update",
+                    code=72,
+                )
+        id_value = document.get("_id", MISSING)
+        (updated,) = run_pipeline([document], update)
+        updated = to_storage(updated)
+        if id_value is not MISSING:
+            if "_id" in updated and not values_equal(updated["_id"], id_value):
+                raise WriteError(
+                    "Performing an update on the path '_id' would modify the "
+                    "immutable field '_id'",
+                    code=66,
+                )
+            updated = {"_id": id_value, **updated}
+        return updated
+
+    updated = copy_value(document)
+    for operator, fields in update.items():
+        if not operator.startswith("$"):
+            raise ValueError("update only works with $ operators")
+        for path, argument in fields.items():
+            _apply_operator(updated, operator, path, argument, insert)
+    return updated
+
+
+def replace_document(
+    document: Dict[str, Any], replacement: Dict[str, Any]
+) -> Dict[str, Any]:
+    replaced = to_storage(replacement)
+    if "_id" in replaced and not values_equal(replaced["_id"], document["_id"]):
+        raise WriteError(
+            "After applying the update, the (immutable) field '_id' was found "
+            "to have been altered",
+            code=66,
+        )
+    replaced.pop("_id", None)
+    return {"_id": document["_id"], **replaced}
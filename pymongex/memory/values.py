@@ -0,0 +1,118 @@
+from datetime import datetime
+from typing import Any, Dict, List
+
+from ..utils import MISSING, sort_key, to_utc_naive
+
+
+def values_equal(a: Any, b: Any) -> bool:
+    return sort_key(a) == sort_key(b)
+
+
+def split_path(path: str) -> List[str]:
+    return path.split(".")
+
+
+def resolve_query_path(value: Any, parts: List[str]) -> List[Any]:
+    """
+    All values a query sees at a dotted path. Arrays are traversed, so
+    `a.b` on `{"a": [{"b": 1}, {"b": 2}]}` yields 1 and 2.
+    """
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        if head in value:
+            return resolve_query_path(value[head], rest)
+        return [MISSING]
+    if isinstance(value, list):
+        results = []
+        if head.isdigit() and int(head) < len(value):
+            results.extend(resolve_query_path(value[int(head)], rest))
+        for item in value:
+            if isinstance(item, dict) and head in item:
+                results.extend(resolve_query_path(item[head], rest))
+        return results or [MISSING]
+    return [MISSING]
+
+
+def get_field(value: Any, path: str) -> Any:
+    """Aggregation field path semantics, `a.b` over an array gives an array."""
+    for part in split_path(path):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            value = [
+                item[part] for item in value if isinstance(item, dict) and part in item
+            ]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def set_field(document: Dict[str, Any], path: str, value: Any) -> None:
+    parts = split_path(path)
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list) and part.isdigit():
+            index = int(part)
+            while len(target) <= index:
+                target.append(None)
+            if not isinstance(target[index], (dict, list)):
+                target[index] = {}
+            target = target[index]
+            continue
+        child = target.get(part)
+        if not isinstance(child, (dict, list)):
+            child = target[part] = {}
+        target = child
+    last = parts[-1]
+    if isinstance(target, list) and last.isdigit():
+        index = int(last)
+        while len(target) <= index:
+            target.append(None)
+        target[index] = value
+    else:
+        target[last] = value
+
+
+def unset_field(document: Dict[str, Any], path: str) -> bool:
+    parts = split_path(path)
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, dict):
+            target = target.get(part)
+        elif isinstance(target, list) and part.isdigit() and int(part) < len(target):
+            target = target[int(part)]
+        else:
+            return False
+    last = parts[-1]
+    if isinstance(target, dict) and last in target:
+        del target[last]
+        return True
+    if isinstance(target, list) and last.isdigit() and int(last) < len(target):
+        # like the server, unsetting an array element leaves a null behind
+        target[int(last)] = None
+        return True
+    return False
+
+
+def copy_value(value: Any) -> Any:
+    """Deep copy of BSON-like values, much cheaper than copy.deepcopy."""
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def to_storage(value: Any) -> Any:
+    """Copies a value the way a BSON round trip would store it."""
+    if isinstance(value, dict):
+        return {key: to_storage(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_storage(item) for item in value]
+    if isinstance(value, datetime):
+        return to_utc_naive(value)
+    return value
@@ -0,0 +1,4 @@
+from .histogram import BYTE_BUCKETS, COUNT_BUCKETS, LATENCY_BUCKETS, Histogram
+from .listeners import CommandMetricsListener, PoolMetricsListener, metrics_listeners
+from .recording import get_metrics_sink, instrumented, set_metrics_sink
+from .sinks import InMemorySink, MetricsSink, render_prometheus
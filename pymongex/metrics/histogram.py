@@ -0,0 +1,94 @@
+import bisect
+import math
+import threading
+from typing import Dict, List, Sequence
+
+# upper bounds in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# documents per call
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+# bytes per call
+BYTE_BUCKETS = tuple(4**exponent * 256 for exponent in range(12))
+
+
+class Histogram:
+    """
+    Thread-safe fixed bucket histogram. `counts[i]` holds the observations
+    up to `buckets[i]`, the last count the ones above every bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets: List[float] = sorted(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def cumulative(self) -> List[int]:
+        # observations up to each bucket, then the total (the +Inf bucket)
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        cumulative = []
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def quantile(self, quantile: float) -> float:
+        """Estimate interpolated within the bucket, like histogram_quantile."""
+        if not 0 <= quantile <= 1:
+            raise ValueError("quantile must be between 0 and 1")
+        cumulative = self.cumulative()
+        if not cumulative[-1]:
+            return 0.0
+        rank = quantile * cumulative[-1]
+        index = bisect.bisect_left(cumulative, rank)
+        if index >= len(self.buckets):
+            return self.max
+        upper = self.buckets[index]
+        lower = self.buckets[index - 1] if index else min(0.0, upper)
+        below = cumulative[index - 1] if index else 0
+        in_bucket = cumulative[index] - below
+        if not in_bucket:
+            return upper
+        return lower + (upper - lower) * (rank - below) / in_bucket
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
@@ -0,0 +1,112 @@
+from typing import Any, Dict, List
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from pymongo import monitoring
+
+from . import recording
+
+
+def _reply_size(reply) -> int:
+    if isinstance(reply, RawBSONDocument):
+        return len(reply.raw)
+    return len(bson.encode(reply))
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Records the duration and failures of every command per command name and
+    database, and adds the server time and reply size to the service call
+    that sent it.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        sink = recording.get_metrics_sink()
+        if sink is None:
+            return
+        duration = event.duration_micros / 1e6
+        labels = {"command": event.command_name, "database": event.database_name}
+        sink.observe("command_seconds", duration, labels)
+        call = recording.current_call()
+        if call is not None:
+            call.server_time += duration
+            call.commands += 1
+            if recording.measures_bytes():
+                call.bytes_received += _reply_size(event.reply)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        sink = recording.get_metrics_sink()
+        if sink is None:
+            return
+        duration = event.duration_micros / 1e6
+        labels = {"command": event.command_name, "database": event.database_name}
+        sink.observe("command_seconds", duration, labels)
+        sink.increment("command_failures_total", labels)
+        call = recording.current_call()
+        if call is not None:
+            call.server_time += duration
+            call.commands += 1
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Records connection checkout waits, checkouts and failed checkouts."""
+
+    @staticmethod
+    def _labels(event) -> Dict[str, str]:
+        host, port = event.address
+        return {"address": f"{host}:{port}"}
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent):
+        sink = recording.get_metrics_sink()
+        if sink is None:
+            return
+        labels = self._labels(event)
+        sink.observe("pool_wait_seconds", event.duration, labels)
+        sink.increment("pool_checkouts_total", labels)
+
+    def connection_check_out_failed(
+        self, event: monitoring.ConnectionCheckOutFailedEvent
+    ) -> None:
+        sink = recording.get_metrics_sink()
+        if sink is None:
+            return
+        labels = {**self._labels(event), "reason": str(event.reason)}
+        sink.observe("pool_wait_seconds", event.duration, labels)
+        sink.increment("pool_checkout_failures_total", labels)
+
+    # the other pool events are not recorded
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        pass
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_checked_in(self, event) -> None:
+        pass
+
+
+def metrics_listeners() -> List[Any]:
+    # passed as event_listeners to the MongoClients the singletons create
+    return [CommandMetricsListener(), PoolMetricsListener()]
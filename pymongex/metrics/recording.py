@@ -0,0 +1,147 @@
+import functools
+import inspect
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from .sinks import MetricsSink
+
+_sink: Optional[MetricsSink] = None
+_measure_bytes = True
+
+
+def set_metrics_sink(sink: Optional[MetricsSink], measure_bytes: bool = True) -> None:
+    """
+    Sends the metrics to `sink`, None turns the instrumentation off. Bytes
+    received are measured by re-encoding the decoded command replies, about
+    the cost of the BSON decoding itself, `measure_bytes=False` skips it.
+    """
+    global _sink, _measure_bytes
+    _sink = sink
+    _measure_bytes = measure_bytes
+
+
+def get_metrics_sink() -> Optional[MetricsSink]:
+    return _sink
+
+
+def measures_bytes() -> bool:
+    return _measure_bytes
+
+
+class CallMetrics:
+    """What the commands and decoding of one service call added up to."""
+
+    __slots__ = ("server_time", "validation_time", "bytes_received", "commands")
+
+    def __init__(self):
+        self.server_time = 0.0
+        self.validation_time = 0.0
+        self.bytes_received = 0
+        self.commands = 0
+
+
+_current_call: ContextVar[Optional[CallMetrics]] = ContextVar(
+    "pymongex_call_metrics", default=None
+)
+
+
+def current_call() -> Optional[CallMetrics]:
+    return _current_call.get()
+
+
+def record_validation(started: float) -> None:
+    # called by the clients with the perf_counter taken before validating
+    call = _current_call.get()
+    if call is not None:
+        call.validation_time += time.perf_counter() - started
+
+
+def _document_count(result: Any) -> int:
+    if result is None or isinstance(result, (int, float)):
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+
+def _record_call(
+    sink: MetricsSink,
+    model: str,
+    method: str,
+    call: CallMetrics,
+    elapsed: float,
+    result: Any = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    labels = {"model": model, "method": method}
+    sink.observe("service_call_seconds", elapsed, labels)
+    sink.observe("service_server_seconds", call.server_time, labels)
+    sink.observe("service_validation_seconds", call.validation_time, labels)
+    if error is not None:
+        error_labels = {**labels, "error": type(error).__name__}
+        sink.increment("service_errors_total", error_labels)
+        return
+    sink.observe("service_documents", _document_count(result), labels)
+    if _measure_bytes:
+        sink.observe("service_received_bytes", call.bytes_received, labels)
+
+
+def _model_name(service: type) -> str:
+    model = getattr(service, "_out_model", None)
+    return model.__name__ if model is not None else service.__name__
+
+
+def instrumented(method: Callable) -> Callable:
+    """
+    Records the latency, server and validation time, documents and bytes of a
+    service classmethod, placed under @classmethod. Calls made by an
+    instrumented method, like the get_by_id of create_one, count towards it.
+    """
+    name = method.__name__
+
+    if inspect.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(cls, *args, **kwargs):
+            sink = _sink
+            if sink is None or _current_call.get() is not None:
+                return await method(cls, *args, **kwargs)
+            call = CallMetrics()
+            token = _current_call.set(call)
+            start = time.perf_counter()
+            try:
+                result = await method(cls, *args, **kwargs)
+            except BaseException as error:
+                elapsed = time.perf_counter() - start
+                _record_call(sink, _model_name(cls), name, call, elapsed, error=error)
+                raise
+            finally:
+                _current_call.reset(token)
+            elapsed = time.perf_counter() - start
+            _record_call(sink, _model_name(cls), name, call, elapsed, result)
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(cls, *args, **kwargs):
+        sink = _sink
+        if sink is None or _current_call.get() is not None:
+            return method(cls, *args, **kwargs)
+        call = CallMetrics()
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        try:
+            result = method(cls, *args, **kwargs)
+        except BaseException as error:
+            elapsed = time.perf_counter() - start
+            _record_call(sink, _model_name(cls), name, call, elapsed, error=error)
+            raise
+        finally:
+            _current_call.reset(token)
+        elapsed = time.perf_counter() - start
+        _record_call(sink, _model_name(cls), name, call, elapsed, result)
+        return result
+
+    return wrapper
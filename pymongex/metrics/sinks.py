@@ -0,0 +1,142 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .histogram import BYTE_BUCKETS, COUNT_BUCKETS, LATENCY_BUCKETS, Histogram
+
+Labels = Dict[str, str]
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Labels) -> _Key:
+    return name, tuple(sorted(labels.items()))
+
+
+def default_buckets(name: str) -> Sequence[float]:
+    if name.endswith("_bytes"):
+        return BYTE_BUCKETS
+    if name.endswith("_documents"):
+        return COUNT_BUCKETS
+    return LATENCY_BUCKETS
+
+
+class MetricsSink:
+    """
+    Receives the metrics recorded by pymongex. Histogram observations go to
+    `observe` and counter increments to `increment`. Both are called on the
+    hot path of every instrumented call, so they should not block.
+    """
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        raise NotImplementedError
+
+    def increment(self, name: str, labels: Labels, value: float = 1) -> None:
+        raise NotImplementedError
+
+
+class InMemorySink(MetricsSink):
+    """Keeps histograms and counters in process, per metric name and labels."""
+
+    def __init__(self, buckets: Optional[Dict[str, Sequence[float]]] = None):
+        # bucket bounds per metric name, the default ones go by name suffix
+        self.buckets = buckets or {}
+        self._histograms: Dict[_Key, Histogram] = {}
+        self._counters: Dict[_Key, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        key = _key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    buckets = self.buckets.get(name) or default_buckets(name)
+                    histogram = self._histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def increment(self, name: str, labels: Labels, value: float = 1) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self._histograms.get(_key(name, labels))
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self._counters.get(_key(name, labels), 0)
+
+    def histograms(self) -> List[Tuple[str, Labels, Histogram]]:
+        with self._lock:
+            items = sorted(self._histograms.items())
+        return [(name, dict(labels), histogram) for (name, labels), histogram in items]
+
+    def counters(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            items = sorted(self._counters.items())
+        return [(name, dict(labels), value) for (name, labels), value in items]
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        # JSON friendly view, one entry per metric name and labels
+        return {
+            "histograms": [
+                {"name": name, "labels": labels, **histogram.snapshot()}
+                for name, labels, histogram in self.histograms()
+            ],
+            "counters": [
+                {"name": name, "labels": labels, "value": value}
+                for name, labels, value in self.counters()
+            ],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, **extra: str) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus(sink: InMemorySink, namespace: str = "pymongex") -> str:
+    """The metrics of `sink` in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+    for name, labels, histogram in sink.histograms():
+        metric = f"{namespace}_{name}" if namespace else name
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = histogram.cumulative()
+        bounds = list(histogram.buckets) + [float("inf")]
+        for bound, count in zip(bounds, cumulative):
+            bucket_labels = _format_labels(labels, le=_format_number(bound))
+            lines.append(f"{metric}_bucket{bucket_labels} {count}")
+        formatted = _format_labels(labels)
+        lines.append(f"{metric}_sum{formatted} {_format_number(histogram.sum)}")
+        lines.append(f"{metric}_count{formatted} {cumulative[-1]}")
+    for name, labels, value in sink.counters():
+        metric = f"{namespace}_{name}" if namespace else name
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(labels)} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
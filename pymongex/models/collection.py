@@ -1,12 +1,20 @@
 from datetime import datetime as dt
 from datetime import timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Type
 
-from pydantic import Field, model_validator
+from pydantic import Field, PrivateAttr, model_serializer, model_validator
 
 from ..constants import PyObjectId
+from ..options import QueryOptions
 from ..storage.collection import Collection
 from ..utils import utc_now
+from .compression import (
+    compress_document,
+    declares_compressed,
+    decompress_value,
+    defer_compressed,
+    field_adapter,
+)
 from .datamodel import DataModel
 
 
@@ -20,6 +28,81 @@ def ensure_utc_timezone(value: Any) -> Any:
     return value
 
 
+def _serialized(name: str, include: Any, exclude: Any) -> bool:
+    # whether a dump with `include` and `exclude` writes the field `name`
+    if include is not None and name not in include:
+        return False
+    if exclude is None or name not in exclude:
+        return True
+    # a dict excludes the whole field for True, some of its items otherwise
+    return isinstance(exclude, dict) and exclude[name] not in (True, ...)
+
+
+# unannotated, the serialization schema stays the one of the model
+def _materialize_compressed(self, handler, info):
+    # every serialization path comes here, nested models and TypeAdapter
+    # dumps included, which read the fields from __dict__ directly
+    pending = (self.__pydantic_private__ or {}).get("_compressed")
+    if pending:
+        for name in list(pending):
+            if _serialized(name, info.include, info.exclude):
+                self._decompress(name)
+    return handler(self)
+
+
+# projections only depend on the model class, built once per class
+_projection_cache: Dict[Type["OutCollectionModel"], Dict[str, Any]] = {}
+_untracked_cache: Dict[Type["OutCollectionModel"], Set[str]] = {}
+
+_MISSING = object()
+
+
+def _is_path_key(key: Any) -> bool:
+    return isinstance(key, str) and bool(key) and "." not in key and key[0] != "$"
+
+
+def diff_documents(
+    old: Dict[str, Any],
+    new: Dict[str, Any],
+    prefix: str = "",
+    update: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    The update turning `old` into `new`: changed values are $set, removed keys
+    $unset and items appended to a list $push'ed. Nested documents are
+    compared key by key, so only the changed paths are written.
+    """
+    update = {} if update is None else update
+    for key, value in new.items():
+        path = f"{prefix}{key}"
+        previous = old.get(key, _MISSING)
+        if previous is _MISSING:
+            update.setdefault("$set", {})[path] = value
+        elif previous == value:
+            continue
+        elif (
+            isinstance(value, dict)
+            and isinstance(previous, dict)
+            and value
+            and all(_is_path_key(k) for k in value)
+            and all(_is_path_key(k) for k in previous)
+        ):
+            diff_documents(previous, value, f"{path}.", update)
+        elif (
+            isinstance(value, list)
+            and isinstance(previous, list)
+            and len(value) > len(previous)
+            and value[: len(previous)] == previous
+        ):
+            update.setdefault("$push", {})[path] = {"$each": value[len(previous) :]}
+        else:
+            update.setdefault("$set", {})[path] = value
+    for key in old:
+        if key not in new:
+            update.setdefault("$unset", {})[f"{prefix}{key}"] = ""
+    return update
+
+
 class CollectionModel(DataModel):
 
     class Collection:
@@ -44,6 +127,10 @@ class CollectionModel(DataModel):
             raise NotImplementedError("Collection name not specified in model config")
         return collection.name
 
+    @classmethod
+    def get_query_options(cls) -> Optional[QueryOptions]:
+        return getattr(cls.Collection, "query_options", None)
+
 
 class InCollectionModel(CollectionModel):
     created_at: dt = Field(
@@ -55,7 +142,7 @@ class InCollectionModel(CollectionModel):
     )
 
     def db_dict(self):
-        return self.dict(exclude={"id"})
+        return compress_document(type(self), self.dict(exclude={"id"}))
 
 
 class OutCollectionModel(CollectionModel):
@@ -63,6 +150,73 @@ class OutCollectionModel(CollectionModel):
     created_at: Optional[dt] = Field(default=None)
     updated_at: Optional[dt] = Field(default=None)
 
+    # the stored fields as loaded, None when the model was not loaded by a client
+    _loaded_state: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+    # compressed values not accessed yet, see models.compression
+    _compressed: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def defer_decompression(cls, values: Any, handler: Any) -> Any:
+        values, pending = defer_compressed(cls, values)
+        model = handler(values)
+        if pending:
+            for name in pending:
+                model.__dict__.pop(name, None)
+            model._compressed = pending
+        return model
+
+    def __getattr__(self, name: str) -> Any:
+        # only reached for names missing from __dict__
+        if name.startswith("_"):
+            return super().__getattr__(name)
+        private = self.__pydantic_private__ or {}
+        if name in (private.get("_compressed") or ()):
+            self._decompress(name)
+            return self.__dict__[name]
+        return super().__getattr__(name)
+
+    def _decompress(self, name: str) -> None:
+        pending = self._compressed
+        raw = pending.pop(name)
+        if not pending:
+            self._compressed = None
+        value = field_adapter(type(self), name).validate_python(decompress_value(raw))
+        self.__dict__[name] = value
+        # the loaded state holds the raw value while the field is not accessed
+        if self._loaded_state is not None and self._loaded_state.get(name) is raw:
+            self._loaded_state[name] = super().model_dump(include={name})[name]
+
+    def _decompress_all(self) -> None:
+        private = self.__pydantic_private__ or {}
+        for name in list(private.get("_compressed") or ()):
+            self._decompress(name)
+
+    def __copy__(self) -> "OutCollectionModel":
+        copied = super().__copy__()
+        pending = (self.__pydantic_private__ or {}).get("_compressed")
+        if pending:
+            copied._compressed = dict(pending)
+        return copied
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # only the models with compressed fields pay for the wrap serializer
+        if not hasattr(cls, "materialize_compressed") and declares_compressed(cls):
+            cls.materialize_compressed = model_serializer(mode="wrap")(
+                _materialize_compressed
+            )
+
+    def __repr_args__(self) -> Any:
+        self._decompress_all()
+        return super().__repr_args__()
+
+    def __eq__(self, other: Any) -> bool:
+        self._decompress_all()
+        if isinstance(other, OutCollectionModel):
+            other._decompress_all()
+        return super().__eq__(other)
+
     @model_validator(mode="before")
     def replace_empty_dict_with_none(cls, values: Dict[str, Any]) -> Dict[str, Any]:
         # set fiels that are {} to None
@@ -73,10 +227,67 @@ class OutCollectionModel(CollectionModel):
 
     @classmethod
     def get_projection(cls):
-        projection = {field: 1 for field in cls.get_keys()}
-        projection["id"] = "$_id"
-        projection["_id"] = 0
-        return projection
+        projection = _projection_cache.get(cls)
+        if projection is None:
+            projection = {field: 1 for field in cls.get_keys()}
+            projection["id"] = "$_id"
+            projection["_id"] = 0
+            _projection_cache[cls] = projection
+        # callers extend the projection with expanded fields
+        return dict(projection)
+
+    @classmethod
+    def tracks_changes(cls) -> bool:
+        # opt-in, the snapshot costs a model_dump and its memory per loaded model
+        return getattr(cls.Collection, "track_changes", False)
+
+    @classmethod
+    def get_version_field(cls) -> Optional[str]:
+        return getattr(cls.Collection, "version_field", None)
+
+    @classmethod
+    def get_untracked_fields(cls) -> Set[str]:
+        # not written back: the id, the timestamp set by the client and
+        # the fields filled by $lookup
+        untracked = _untracked_cache.get(cls)
+        if untracked is None:
+            untracked = {"id", "updated_at"}
+            untracked.update(cls.get_expandable_fields())
+            untracked.update(cls.get_custom_pipelines())
+            _untracked_cache[cls] = untracked
+        return untracked
+
+    @classmethod
+    def mark_loaded(cls, models: List["OutCollectionModel"]) -> List[Any]:
+        if cls.tracks_changes():
+            for model in models:
+                model.mark_clean()
+        return models
+
+    def _tracked_state(self) -> Dict[str, Any]:
+        # compressed values not accessed yet are unchanged, kept raw
+        pending = (self.__pydantic_private__ or {}).get("_compressed") or {}
+        state = super().model_dump(exclude=self.get_untracked_fields() | set(pending))
+        state.update(pending)
+        return state
+
+    def mark_clean(self) -> None:
+        """Takes the current state as the stored one to diff changes against."""
+        self._loaded_state = self._tracked_state()
+
+    def get_loaded_value(self, field: str) -> Any:
+        if self._loaded_state is None:
+            return getattr(self, field, None)
+        return self._loaded_state.get(field)
+
+    def get_changes(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        The minimal update writing what changed since the model was loaded,
+        {} if nothing did. None when changes are not tracked for this model.
+        """
+        if self._loaded_state is None:
+            return None
+        return diff_documents(self._loaded_state, self._tracked_state())
 
     @classmethod
     def get_nested_projection(cls, nested_field):
@@ -148,3 +359,5 @@ class OutCollectionModel(CollectionModel):
             for prop in schema.get("properties", {}).values():
                 prop.pop("local_field", None)
                 prop.pop("foreign_field", None)
+                prop.pop("compress", None)
+                prop.pop("compress_min_bytes", None)
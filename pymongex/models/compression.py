@@ -0,0 +1,270 @@
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Type
+
+import bson
+from bson import Binary
+from pydantic import BaseModel, TypeAdapter
+from pydantic.fields import FieldInfo
+from pymongo import UpdateOne
+
+# user defined BSON binary subtype of the compressed values
+BINARY_SUBTYPE = 0x80
+
+DEFAULT_MIN_BYTES = 512
+
+_CODECS = {"zlib": 1, "zstd": 2}
+_CODEC_NAMES = {number: name for name, number in _CODECS.items()}
+
+# how the value was serialized before compression
+_STR, _BYTES, _BSON = 0, 1, 2
+
+_zstd: Any = None
+
+
+def _zstandard() -> Any:
+    # optional dependency, imported on first use
+    global _zstd
+    if _zstd is None:
+        try:
+            import zstandard
+        except ImportError:
+            _zstd = False
+        else:
+            _zstd = zstandard
+    return _zstd or None
+
+
+def available_codecs() -> Tuple[str, ...]:
+    return ("zlib", "zstd") if _zstandard() is not None else ("zlib",)
+
+
+def resolve_codec(codec: Any) -> str:
+    """
+    The codec of a compress marker: True picks zstd when the zstandard
+    package is installed and zlib otherwise, an unavailable zstd falls back
+    to zlib, which every reader can decompress.
+    """
+    if codec is True or codec is None:
+        codec = "zstd"
+    if codec not in _CODECS:
+        raise ValueError(f"Unknown compression codec {codec!r}, use zlib or zstd")
+    if codec == "zstd" and _zstandard() is None:
+        return "zlib"
+    return codec
+
+
+def _serialize(value: Any) -> Tuple[int, bytes]:
+    if isinstance(value, str):
+        return _STR, value.encode("utf-8")
+    if isinstance(value, (bytes, bytearray)) and not isinstance(value, Binary):
+        return _BYTES, bytes(value)
+    return _BSON, bson.encode({"v": value})
+
+
+def _deserialize(kind: int, data: bytes) -> Any:
+    if kind == _STR:
+        return data.decode("utf-8")
+    if kind == _BYTES:
+        return data
+    return bson.decode(data)["v"]
+
+
+def compress_bytes(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return _zstandard().ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+
+def decompress_bytes(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise RuntimeError(
+                "The value is compressed with zstd, install the zstandard package"
+            )
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def is_compressed(value: Any) -> bool:
+    return isinstance(value, Binary) and value.subtype == BINARY_SUBTYPE
+
+
+def compress_value(
+    value: Any, codec: Any = True, min_bytes: int = DEFAULT_MIN_BYTES
+) -> Any:
+    """
+    `value` as a compressed BSON Binary, the value itself when it is None,
+    already compressed, shorter than `min_bytes` serialized or does not get
+    smaller.
+    """
+    if value is None or is_compressed(value):
+        return value
+    kind, data = _serialize(value)
+    if len(data) < min_bytes:
+        return value
+    codec = resolve_codec(codec)
+    compressed = compress_bytes(data, codec)
+    if len(compressed) + 2 >= len(data):
+        return value
+    header = bytes((_CODECS[codec], kind))
+    return Binary(header + compressed, BINARY_SUBTYPE)
+
+
+def decompress_value(value: Any) -> Any:
+    # values written uncompressed are returned as they are
+    if not is_compressed(value):
+        return value
+    data = bytes(value)
+    codec = _CODEC_NAMES.get(data[0])
+    if codec is None:
+        raise ValueError(f"Unknown compression codec id {data[0]}")
+    return _deserialize(data[1], decompress_bytes(data[2:], codec))
+
+
+@lru_cache(maxsize=None)
+def compressed_fields(model: Type[BaseModel]) -> Dict[str, Tuple[Any, int]]:
+    """
+    The fields of a model marked with json_schema_extra={"compress": True},
+    or a codec name, and their codec and compress_min_bytes.
+    """
+    fields = {}
+    for name in model.get_keys():
+        codec = model.get_field_extra(name, "compress")
+        if codec:
+            min_bytes = model.get_field_extra(name, "compress_min_bytes")
+            fields[name] = (
+                codec,
+                DEFAULT_MIN_BYTES if min_bytes is None else min_bytes,
+            )
+    return fields
+
+
+def _is_marked(info: FieldInfo) -> bool:
+    extra = info.json_schema_extra
+    return isinstance(extra, dict) and bool(extra.get("compress"))
+
+
+def declares_compressed(model: type) -> bool:
+    """
+    Whether a model class declares or inherits compressed fields, readable
+    from __init_subclass__, before pydantic collects its model_fields.
+    """
+    for base in model.__mro__[1:]:
+        if any(map(_is_marked, getattr(base, "model_fields", {}).values())):
+            return True
+    own = [value for value in vars(model).values() if isinstance(value, FieldInfo)]
+    for annotation in vars(model).get("__annotations__", {}).values():
+        metadata = getattr(annotation, "__metadata__", ())
+        own += [value for value in metadata if isinstance(value, FieldInfo)]
+    return any(map(_is_marked, own))
+
+
+@lru_cache(maxsize=None)
+def field_adapter(model: Type[BaseModel], name: str) -> TypeAdapter:
+    return TypeAdapter(model.model_fields[name].annotation)
+
+
+def compress_document(
+    model: Type[BaseModel], document: Dict[str, Any]
+) -> Dict[str, Any]:
+    for name, (codec, min_bytes) in compressed_fields(model).items():
+        if name in document:
+            document[name] = compress_value(document[name], codec, min_bytes)
+    return document
+
+
+def decompress_document(
+    model: Type[BaseModel], document: Dict[str, Any]
+) -> Dict[str, Any]:
+    # documents prepared by db_dict are validated again by some insert paths
+    fields = compressed_fields(model)
+    if fields and any(is_compressed(document.get(name)) for name in fields):
+        document = dict(document)
+        for name in fields:
+            document[name] = decompress_value(document.get(name))
+    return document
+
+
+def compress_update(model: Type[BaseModel], update: Any) -> Any:
+    """Compresses the compressed fields an update $set's as a whole."""
+    fields = compressed_fields(model)
+    if not fields or not isinstance(update, dict):
+        return update
+    values = update.get("$set")
+    if isinstance(values, dict):
+        for name in fields.keys() & values.keys():
+            codec, min_bytes = fields[name]
+            values[name] = compress_value(values[name], codec, min_bytes)
+    return update
+
+
+def compress_model_update(model: BaseModel, update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The update of a model with its compressed fields $set as a whole, a
+    compressed value has no paths to write.
+    """
+    fields = compressed_fields(type(model))
+    for name in fields:
+        prefix = f"{name}."
+        touched = False
+        for operator in list(update):
+            spec = update[operator]
+            for path in [path for path in spec if path.startswith(prefix)]:
+                del spec[path]
+                touched = True
+            if not spec:
+                del update[operator]
+        if touched:
+            value = getattr(model, name)
+            update.setdefault("$set", {})[name] = field_adapter(
+                type(model), name
+            ).dump_python(value)
+    return compress_update(type(model), update)
+
+
+def defer_compressed(
+    model: Type[BaseModel], values: Any
+) -> Tuple[Any, Optional[Dict[str, Binary]]]:
+    """
+    Takes the compressed values of fields with a default out of `values`,
+    they are decompressed on first access. Required fields are decompressed
+    right away.
+    """
+    fields = compressed_fields(model)
+    if not fields or not isinstance(values, dict):
+        return values, None
+    pending = None
+    for name in fields:
+        value = values.get(name)
+        if not is_compressed(value):
+            continue
+        if pending is None:
+            values = dict(values)
+            pending = {}
+        if model.model_fields[name].is_required():
+            values[name] = decompress_value(value)
+        else:
+            pending[name] = values.pop(name)
+    return values, pending or None
+
+
+def compression_request(
+    model: Type[BaseModel], document: Dict[str, Any]
+) -> Optional[UpdateOne]:
+    """
+    The update compressing the marked fields of a stored document, None when
+    there is nothing to compress. It only applies while the fields still
+    hold the values read, a concurrent write wins.
+    """
+    values = {}
+    for name, (codec, min_bytes) in compressed_fields(model).items():
+        value = document.get(name)
+        compressed = compress_value(value, codec, min_bytes)
+        if compressed is not value:
+            values[name] = compressed
+    if not values:
+        return None
+    query = {"_id": document["_id"], **{name: document[name] for name in values}}
+    return UpdateOne(query, {"$set": values})
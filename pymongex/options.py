@@ -0,0 +1,113 @@
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pymongo
+from pydantic import BaseModel, ConfigDict, Field
+
+from .exceptions import DeadlineExceeded
+
+_deadline: ContextVar[Optional[float]] = ContextVar("pymongex_deadline", default=None)
+
+
+class QueryOptions(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    max_time_ms: Optional[int] = Field(default=None, gt=0)
+    hint: Optional[Union[str, List[Tuple[str, int]], Dict[str, int]]] = None
+    allow_disk_use: Optional[bool] = None
+    batch_size: Optional[int] = Field(default=None, ge=0)
+    collation: Optional[Dict[str, Any]] = None
+    comment: Optional[Any] = None
+
+    def merge(self, other: Optional["QueryOptions"]) -> "QueryOptions":
+        """Return a copy where every field set on `other` overrides this one."""
+        if other is None:
+            return self
+        return self.model_copy(update=other.model_dump(exclude_none=True))
+
+    def aggregate_kwargs(self) -> Dict[str, Any]:
+        kwargs = {
+            "maxTimeMS": self.max_time_ms,
+            "hint": self.hint,
+            "allowDiskUse": self.allow_disk_use,
+            "batchSize": self.batch_size,
+            "collation": self.collation,
+            "comment": self.comment,
+        }
+        return {k: v for k, v in kwargs.items() if v is not None}
+
+    def count_kwargs(self) -> Dict[str, Any]:
+        kwargs = {
+            "maxTimeMS": self.max_time_ms,
+            "hint": self.hint,
+            "collation": self.collation,
+            "comment": self.comment,
+        }
+        return {k: v for k, v in kwargs.items() if v is not None}
+
+    def write_kwargs(self, hint: bool = True, collation: bool = True) -> Dict[str, Any]:
+        # insert commands accept neither hint nor collation
+        kwargs = {"comment": self.comment}
+        if hint:
+            kwargs["hint"] = self.hint
+        if collation:
+            kwargs["collation"] = self.collation
+        return {k: v for k, v in kwargs.items() if v is not None}
+
+    def timeout(self):
+        """
+        Write commands have no maxTimeMS option, so max_time_ms is enforced
+        client side through pymongo's timeout context instead.
+        """
+        if self.max_time_ms is None:
+            return nullcontext()
+        return pymongo.timeout(self.max_time_ms / 1000)
+
+
+def get_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining_ms() -> Optional[int]:
+    """Milliseconds left until the ambient deadline or None if no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    remaining = int((deadline - time.monotonic()) * 1000)
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded before the operation was sent")
+    return remaining
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Sets an ambient deadline for every pymongex call made inside the block.
+    Nested deadlines can only shorten the outer one.
+    """
+    if seconds <= 0:
+        raise ValueError("deadline has to be a strict positive number of seconds")
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        new_deadline = min(current, new_deadline)
+    token = _deadline.set(new_deadline)
+    try:
+        yield new_deadline
+    finally:
+        _deadline.reset(token)
+
+
+def resolve_options(
+    defaults: Optional[QueryOptions], options: Optional[QueryOptions]
+) -> QueryOptions:
+    """Combine model defaults, per-call options and the ambient deadline."""
+    resolved = (defaults or QueryOptions()).merge(options)
+    remaining = remaining_ms()
+    if remaining is not None and (
+        resolved.max_time_ms is None or remaining < resolved.max_time_ms
+    ):
+        resolved = resolved.model_copy(update={"max_time_ms": remaining})
+    return resolved
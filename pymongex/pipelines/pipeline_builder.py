@@ -1,7 +1,10 @@
-from typing import Any, Dict, List, Optional, Type
+from typing import Any, Dict, List, Optional, Tuple, Type
 
 from ..models.collection import OutCollectionModel
 
+# stages after $limit per (model, expand, project_model), see _model_stages
+_model_stages_cache: Dict[Tuple[type, Tuple[str, ...], bool], List[Dict[str, Any]]] = {}
+
 
 class PipelineBuilder:
     def __init__(
@@ -31,11 +34,23 @@ class PipelineBuilder:
         self._add_sort_stage()
         self._add_skip_stage()
         self._add_limit_stage()
-        self._add_expand_stages()
-        self._add_custom_pipelines()
-        self._add_final_projection()
+        self.pipeline.extend(self._model_stages())
         return self.pipeline
 
+    def _model_stages(self) -> List[Dict[str, Any]]:
+        # the lookups, custom pipelines and projection do not depend on the
+        # query, they are built once and the stages shared read-only
+        key = (self.model, tuple(self.expand or ()), self.project_model)
+        stages = _model_stages_cache.get(key)
+        if stages is None:
+            query_stages, self.pipeline = self.pipeline, []
+            self._add_expand_stages()
+            self._add_custom_pipelines()
+            self._add_final_projection()
+            stages, self.pipeline = self.pipeline, query_stages
+            _model_stages_cache[key] = stages
+        return stages
+
     def _validate_parameters(self):
         if self.limit is not None and self.limit <= 0:
             raise ValueError("limit has to be a strict positive value or None")
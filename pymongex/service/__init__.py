@@ -1,2 +1,30 @@
-from .async_service import AsyncBaseService
-from .sync_service import SyncBaseService
+from importlib import import_module
+
+# AsyncBaseService pulls in motor, so the services are only imported on access
+_LAZY_ATTRIBUTES = {
+    "AdmissionController": ".admission",
+    "Priority": ".admission",
+    "priority": ".admission",
+    "AsyncBaseService": ".async_service",
+    "AsyncPartitionedService": ".async_service",
+    "AsyncViewService": ".async_service",
+    "CounterBuffer": ".counters",
+    "PartitionPeriod": ".partitions",
+    "Partitioning": ".partitions",
+    "Snapshot": ".snapshots",
+    "SnapshotDrift": ".snapshots",
+    "SyncBaseService": ".sync_service",
+    "SyncPartitionedService": ".sync_service",
+    "SyncViewService": ".sync_service",
+    "AsyncUnitOfWork": ".unit_of_work",
+    "UnitOfWork": ".unit_of_work",
+}
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional
+
+from ..constants import BaseEnum
+from ..exceptions import AdmissionRejected
+from ..options import get_deadline
+
+
+class Priority(BaseEnum):
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+
+# waiters are admitted in this order
+PRIORITY_ORDER = (Priority.INTERACTIVE, Priority.BATCH)
+
+_priority: ContextVar[Optional[Priority]] = ContextVar(
+    "pymongex_priority", default=None
+)
+
+
+@contextmanager
+def priority(value: Priority):
+    """Sets the admission priority class of every service call inside the block."""
+    token = _priority.set(Priority(value))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class AdmissionController:
+    """
+    Bounds the number of concurrent calls of an AsyncBaseService. Calls above
+    max_concurrency wait in a bounded queue, interactive before batch, and are
+    rejected right away when the queue is full or once they waited longer than
+    queue_timeout_ms or the ambient deadline.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int = 0,
+        queue_timeout_ms: Optional[float] = None,
+        default_priority: Priority = Priority.INTERACTIVE,
+    ):
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency has to be a strict positive integer")
+        if max_queue < 0:
+            raise ValueError("max_queue has to be a positive integer")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout_ms = queue_timeout_ms
+        self.default_priority = default_priority
+        self._in_flight = 0
+        self._waiters: Dict[Priority, Deque[asyncio.Future]] = {
+            p: deque() for p in PRIORITY_ORDER
+        }
+        self._counters = {"admitted": 0, "rejected_full": 0, "rejected_timeout": 0}
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": self.in_flight, "queued": self.queued, **self._counters}
+
+    def _queue_timeout(self) -> Optional[float]:
+        timeout = None
+        if self.queue_timeout_ms is not None:
+            timeout = self.queue_timeout_ms / 1000
+        deadline = get_deadline()
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.monotonic())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    async def acquire(self, priority: Optional[Priority] = None) -> None:
+        if self._in_flight < self.max_concurrency and not self.queued:
+            self._in_flight += 1
+            self._counters["admitted"] += 1
+            return
+
+        if self.queued >= self.max_queue:
+            self._counters["rejected_full"] += 1
+            raise AdmissionRejected("Admission queue is full", reason="queue_full")
+
+        priority = Priority(priority or _priority.get() or self.default_priority)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self._queue_timeout())
+        except BaseException:
+            self._abandon(priority, waiter)
+            raise
+        if not waiter.done():
+            self._abandon(priority, waiter)
+            self._counters["rejected_timeout"] += 1
+            raise AdmissionRejected(
+                "Timed out waiting for admission", reason="queue_timeout"
+            )
+        self._counters["admitted"] += 1
+
+    def _abandon(self, priority: Priority, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # the slot was handed over concurrently, pass it on
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self._waiters[priority].remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self) -> None:
+        # hand the slot directly to the next waiter so it can not be overtaken
+        for p in PRIORITY_ORDER:
+            waiters = self._waiters[p]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self._in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[Priority] = None):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
@@ -1,71 +1,247 @@
-from typing import Any, List, Optional, Type, Union
+import asyncio
+import copy
+import inspect
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime as dt
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 from bson import ObjectId
 from pydantic import BaseModel
 
 from ..clients.async_client import AsyncMongoClient
+from ..clients.changes import (
+    CHANGE_SORT,
+    ChangePage,
+    ChangeWatermark,
+    change_query,
+    check_incremental,
+    merge_changes,
+    tombstone_location,
+)
+from ..clients.read_policy import is_read_only_pipeline
+from ..clients.result_cache import invalidate_collection
+from ..metrics.recording import instrumented
 from ..models.collection import (
     InCollectionModel,
     OutCollectionModel,
 )
+from ..models.compression import compressed_fields, compression_request
+from ..options import QueryOptions
 from ..pipelines import PipelineBuilder
-from .base_service import BaseService
+from ..utils import utc_now
+from .admission import AdmissionController
+from .base_service import BaseService, LazyClient
+from .counters import (
+    CounterBuffer,
+    flush_periodically,
+    flush_requests,
+    service_buffer,
+    shard_location,
+    sum_counters,
+    unwritten,
+)
+from .ids import order_by_ids, sort_models
+from .parallel import (
+    ScanCheckpoint,
+    apply_to_batch,
+    build_partition_queries,
+    build_split_pipeline,
+    model_key_value,
+    split_points_from_result,
+)
+from .partitions import (
+    catalog,
+    expired_partitions,
+    get_partitioning,
+    group_by_partition,
+    id_hint_first,
+    overlapping,
+    partition_of,
+    partition_service,
+)
+from .snapshots import (
+    FAN_OUT_BATCH,
+    UNSET,
+    Snapshot,
+    SnapshotDrift,
+    check_batch,
+    fan_out_requests,
+    fill_documents,
+    get_snapshots,
+    index_sources,
+    local_values,
+    needs_fan_out,
+    schedule_fan_out,
+    set_value,
+    snapshot_dependents,
+    wait_async_fan_outs,
+)
+from .unit_of_work import current_unit_of_work
+from .upsert import UpsertMode, UpsertResult, build_upsert_requests
+from .views import (
+    ViewRefresh,
+    deleted_since,
+    finish_refresh,
+    overlap_since,
+    refresh_failed,
+    refresh_periodically,
+    refresh_pipeline,
+    refreshes_incrementally,
+    state_location,
+    state_update,
+    state_watermark,
+    view_source,
+    view_source_field,
+)
 
 
 class AsyncBaseService(BaseService):
-    _mongo_client: AsyncMongoClient = AsyncMongoClient()
+    _mongo_client: AsyncMongoClient = LazyClient(AsyncMongoClient)
     _in_model: Type[InCollectionModel]
     _out_model: Type[OutCollectionModel]
+    _admission: Optional[AdmissionController] = None
+
+    @classmethod
+    async def _admit(cls, method: Callable[..., Awaitable[Any]], *args, **kwargs):
+        if cls._admission is None:
+            return await method(*args, **kwargs)
+        async with cls._admission.slot():
+            return await method(*args, **kwargs)
 
     @classmethod
+    def admission_stats(cls) -> Optional[Dict[str, int]]:
+        if cls._admission is None:
+            return None
+        return cls._admission.stats()
+
+    @classmethod
+    @instrumented
     async def create_one(
         cls,
         document: Union[dict, InCollectionModel, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
-        inserted_id = await cls._mongo_client.insert_one(cls._in_model, document)
+        document = (await cls._fill_snapshots([document]))[0]
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            return unit.create(cls, [document])[0]
+        inserted_id = await cls._admit(
+            cls._mongo_client.insert_one, cls._in_model, document, options=options
+        )
         return await cls.get_by_id(
             inserted_id,
             expand=expand,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     async def create_many(
         cls,
         documents: List[Union[dict, InCollectionModel, BaseModel]],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> List[OutCollectionModel]:
-        inserted_ids = await cls._mongo_client.insert_many(cls._in_model, documents)
+        documents = await cls._fill_snapshots(documents)
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            return unit.create(cls, documents)
+        inserted_ids = await cls._admit(
+            cls._mongo_client.insert_many, cls._in_model, documents, options=options
+        )
         return await cls.get_by_ids(
             inserted_ids,
             expand=expand,
+            options=options,
+        )
+
+    @classmethod
+    @instrumented
+    async def upsert_many(
+        cls,
+        records: List[Union[dict, InCollectionModel, BaseModel]],
+        key_fields: List[str],
+        mode: Union[str, UpsertMode] = UpsertMode.MERGE,
+        chunk_size: int = 1000,
+        options: QueryOptions = None,
+    ) -> UpsertResult:
+        """
+        Inserts or updates `records` matched on `key_fields`, see
+        SyncBaseService.upsert_many.
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size has to be a strict positive integer")
+        requests, indexes = build_upsert_requests(
+            cls._in_model, records, key_fields, mode
         )
+        result = UpsertResult()
+        for start in range(0, len(requests), chunk_size):
+            end = start + chunk_size
+            bulk_result = await cls._admit(
+                cls._mongo_client.bulk_write,
+                cls._in_model,
+                requests[start:end],
+                ordered=False,
+                options=options,
+            )
+            result.add(bulk_result, indexes[start:end])
+        return result
 
     @classmethod
+    @instrumented
     async def get_one(
         cls,
         query: dict = {},
         sort: dict = None,
         expand: list[str] = None,
         skip: int = 0,
+        options: QueryOptions = None,
     ) -> Optional[OutCollectionModel]:
-        return await cls._mongo_client.find_one(
+        return await cls._admit(
+            cls._mongo_client.find_one,
             cls._out_model,
             query,
             sort=sort,
             expand=expand,
             skip=skip,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     async def get_by_id(
         cls,
         id: Union[str, ObjectId],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> Optional[OutCollectionModel]:
-        return await cls.get_one({"_id": ObjectId(id)}, expand=expand)
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            model = unit.get_identity(cls._out_model, id, expand)
+            if model is not None:
+                return model
+        model = await cls.get_one({"_id": ObjectId(id)}, expand=expand, options=options)
+        if unit is not None and model is not None:
+            model = unit.add_identity(model, expand)
+        return model
 
     @classmethod
+    @instrumented
     async def get_many(
         cls,
         query: dict = {},
@@ -73,17 +249,76 @@ class AsyncBaseService(BaseService):
         skip: int = 0,
         limit: int = None,
         expand: List[str] = None,
+        options: QueryOptions = None,
     ) -> List[OutCollectionModel]:
-        return await cls._mongo_client.find_many(
-            cls._out_model,
-            query,
-            sort=sort,
-            skip=skip,
-            limit=limit,
-            expand=expand,
+        def load() -> Awaitable[List[OutCollectionModel]]:
+            return cls._admit(
+                cls._mongo_client.find_many,
+                cls._out_model,
+                query,
+                sort=sort,
+                skip=skip,
+                limit=limit,
+                expand=expand,
+                options=options,
+            )
+
+        if cls._cache is None:
+            return await load()
+        pipeline = cls._mongo_client._prepare_find_pipeline(
+            cls._out_model, query, sort=sort, skip=skip, limit=limit, expand=expand
         )
+        key, collections = cls._cache_entry("get_many", pipeline, options)
+        return await cls._cache.get_or_load_async(key, collections, load)
+
+    @classmethod
+    async def _map_chunks(
+        cls,
+        fn: Callable[[List[ObjectId]], Awaitable[Any]],
+        chunks: List[List[ObjectId]],
+        max_concurrency: Optional[int] = None,
+    ) -> AsyncIterator[Any]:
+        # fn(chunk) in chunk order, at most max_concurrency chunks in flight
+        limit = max_concurrency or cls._id_chunk_concurrency
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(asyncio.ensure_future(fn(chunk)))
+                if len(pending) >= limit:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @classmethod
+    async def stream_by_ids(
+        cls,
+        ids: List[Union[str, ObjectId]],
+        expand: List[str] = None,
+        options: QueryOptions = None,
+        preserve_order: bool = False,
+        chunk_size: int = None,
+        max_concurrency: int = None,
+    ) -> AsyncIterator[List[OutCollectionModel]]:
+        """
+        Yields the models of the deduplicated `ids` one chunk of `chunk_size`
+        ids at a time, see SyncBaseService.stream_by_ids.
+        """
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+
+        async def read(chunk: List[ObjectId]) -> List[OutCollectionModel]:
+            models = await cls.get_many(
+                {"_id": {"$in": chunk}}, expand=expand, options=options
+            )
+            return order_by_ids(models, chunk) if preserve_order else models
+
+        async for models in cls._map_chunks(read, chunks, max_concurrency):
+            yield models
 
     @classmethod
+    @instrumented
     async def get_by_ids(
         cls,
         ids: List[Union[str, ObjectId]],
@@ -91,115 +326,421 @@ class AsyncBaseService(BaseService):
         skip: int = 0,
         limit: int = None,
         expand: List[str] = None,
+        options: QueryOptions = None,
+        preserve_order: bool = False,
+        chunk_size: int = None,
+        max_concurrency: int = None,
     ) -> List[OutCollectionModel]:
-        return await cls.get_many(
-            {"_id": {"$in": [ObjectId(id) for id in ids]}},
-            sort=sort,
-            skip=skip,
-            limit=limit,
-            expand=expand,
-        )
+        """
+        Models of `ids`, read in concurrent queries of `chunk_size` ids past
+        that size, see SyncBaseService.get_by_ids.
+        """
+        if preserve_order and sort:
+            raise ValueError("preserve_order and sort cannot be combined")
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+        if len(chunks) <= 1:
+            models = await cls.get_many(
+                {"_id": {"$in": ids}},
+                sort=sort,
+                skip=skip,
+                limit=limit,
+                expand=expand,
+                options=options,
+            )
+            return order_by_ids(models, ids) if preserve_order else models
+        # every chunk may hold the first skip + limit models
+        chunk_limit = skip + limit if limit is not None else None
+
+        async def read(chunk: List[ObjectId]) -> List[OutCollectionModel]:
+            return await cls.get_many(
+                {"_id": {"$in": chunk}},
+                sort=sort,
+                limit=chunk_limit,
+                expand=expand,
+                options=options,
+            )
+
+        models = [
+            model
+            async for chunk_models in cls._map_chunks(read, chunks, max_concurrency)
+            for model in chunk_models
+        ]
+        if preserve_order:
+            models = order_by_ids(models, ids)
+        elif sort:
+            sort_models(models, sort)
+        return models[skip : skip + limit if limit is not None else None]
 
     @classmethod
+    @instrumented
     async def update_one(
         cls,
         query: dict,
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
-        update = cls._prepare_update(update)
-        await cls._mongo_client.update_one(cls._in_model, query, update)
-        return await cls.get_one(query, expand=expand)
+        update = await cls._snapshot_update(cls._prepare_update(update))
+        targets = cls._fan_out_targets(update)
+        ids = await cls._source_ids(query, many=False) if targets else []
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            return unit.update(cls, query, update, fan_out=(targets, ids))
+        await cls._admit(
+            cls._mongo_client.update_one, cls._in_model, query, update, options=options
+        )
+        cls._fan_out(targets, ids)
+        return await cls.get_one(query, expand=expand, options=options)
 
     @classmethod
+    @instrumented
     async def update(
         cls,
         model: OutCollectionModel,
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
-        return await cls.update_one(
-            {"_id": model.id},
-            model.model_dump(),
-            expand=expand,
+        """
+        Writes the fields changed since `model` was loaded and returns the
+        stored document. Returns `model` itself without a round trip when
+        nothing changed.
+        """
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            return unit.update_model(cls, model)
+        query, update = cls._prepare_model_update(model)
+        if update is None:
+            return model
+        update = await cls._snapshot_update(update)
+        targets = cls._fan_out_targets(update)
+        modified = await cls._admit(
+            cls._mongo_client.update_one, cls._in_model, query, update, options=options
         )
+        cls._finish_model_update(model, query, modified)
+        cls._fan_out(targets, [model.id])
+        return await cls.get_by_id(model.id, expand=expand, options=options)
 
     @classmethod
+    @instrumented
     async def update_by_id(
         cls,
         id: Union[str, ObjectId],
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
         return await cls.update_one(
             {"_id": ObjectId(id)},
             update,
             expand=expand,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     async def update_many(
         cls,
         query: dict,
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> List[OutCollectionModel]:
-        update = cls._prepare_update(update)
-        await cls._mongo_client.update_many(cls._in_model, query, update)
+        update = await cls._snapshot_update(cls._prepare_update(update))
+        targets = cls._fan_out_targets(update)
+        ids = await cls._source_ids(query, many=True) if targets else []
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            return unit.update(cls, query, update, many=True, fan_out=(targets, ids))
+        await cls._admit(
+            cls._mongo_client.update_many, cls._in_model, query, update, options=options
+        )
+        cls._fan_out(targets, ids)
         return await cls.get_many(
             query,
             expand=expand,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     async def update_by_ids(
         cls,
         ids: List[Union[str, ObjectId]],
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
+        preserve_order: bool = False,
+        chunk_size: int = None,
+        max_concurrency: int = None,
     ) -> List[OutCollectionModel]:
-        return await cls.update_many(
-            {"_id": {"$in": [ObjectId(id) for id in ids]}},
-            update,
-            expand=expand,
-        )
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+        # a unit of work batches the update anyway, it is recorded once
+        unit = current_unit_of_work(asynchronous=True)
+        if len(chunks) <= 1 or unit is not None:
+            models = await cls.update_many(
+                {"_id": {"$in": ids}}, update, expand=expand, options=options
+            )
+            if preserve_order and isinstance(models, list):
+                return order_by_ids(models, ids)
+            return models
+        update = cls._prepare_update(update)
+
+        async def write(chunk: List[ObjectId]) -> List[OutCollectionModel]:
+            # the client adds updated_at to the update, each chunk gets a copy
+            return await cls.update_many(
+                {"_id": {"$in": chunk}},
+                copy.deepcopy(update),
+                expand=expand,
+                options=options,
+            )
+
+        models = [
+            model
+            async for chunk_models in cls._map_chunks(write, chunks, max_concurrency)
+            for model in chunk_models
+        ]
+        return order_by_ids(models, ids) if preserve_order else models
 
     @classmethod
-    async def delete(cls, model: OutCollectionModel) -> int:
-        return await cls.delete_by_id(model.id)
+    @instrumented
+    async def delete(
+        cls, model: OutCollectionModel, options: QueryOptions = None
+    ) -> int:
+        return await cls.delete_by_id(model.id, options=options)
 
     @classmethod
-    async def delete_one(cls, query: dict) -> int:
-        return await cls._mongo_client.delete_one(cls._in_model, query)
+    @instrumented
+    async def delete_one(cls, query: dict, options: QueryOptions = None) -> int:
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            return unit.delete(cls, query)
+        return await cls._admit(
+            cls._mongo_client.delete_one, cls._in_model, query, options=options
+        )
 
     @classmethod
-    async def delete_by_id(cls, id: Union[str, ObjectId]) -> int:
-        return await cls.delete_one({"_id": ObjectId(id)})
+    @instrumented
+    async def delete_by_id(
+        cls, id: Union[str, ObjectId], options: QueryOptions = None
+    ) -> int:
+        return await cls.delete_one({"_id": ObjectId(id)}, options=options)
 
     @classmethod
-    async def delete_many(cls, query: dict) -> int:
-        return await cls._mongo_client.delete_many(cls._in_model, query)
+    @instrumented
+    async def delete_many(cls, query: dict, options: QueryOptions = None) -> int:
+        unit = current_unit_of_work(asynchronous=True)
+        if unit is not None:
+            return unit.delete(cls, query, many=True)
+        return await cls._admit(
+            cls._mongo_client.delete_many, cls._in_model, query, options=options
+        )
 
     @classmethod
-    async def delete_by_ids(cls, ids: List[Union[str, ObjectId]]) -> int:
-        return await cls.delete_many({"_id": {"$in": [ObjectId(id) for id in ids]}})
+    @instrumented
+    async def delete_by_ids(
+        cls,
+        ids: List[Union[str, ObjectId]],
+        options: QueryOptions = None,
+        chunk_size: int = None,
+        max_concurrency: int = None,
+    ) -> int:
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+        unit = current_unit_of_work(asynchronous=True)
+        if len(chunks) <= 1 or unit is not None:
+            return await cls.delete_many({"_id": {"$in": ids}}, options=options)
+
+        async def delete(chunk: List[ObjectId]) -> int:
+            return await cls.delete_many({"_id": {"$in": chunk}}, options=options)
+
+        return sum(
+            [
+                deleted
+                async for deleted in cls._map_chunks(delete, chunks, max_concurrency)
+            ]
+        )
 
     @classmethod
-    async def count(cls, query: dict) -> int:
-        return await cls._mongo_client.count(cls._in_model, query)
+    @instrumented
+    async def count(cls, query: dict, options: QueryOptions = None) -> int:
+        return await cls._admit(
+            cls._mongo_client.count, cls._in_model, query, options=options
+        )
 
     @classmethod
+    @instrumented
     async def aggregate(
-        cls, pipeline: List[dict], parse: bool = False
+        cls,
+        pipeline: List[dict],
+        parse: bool = False,
+        options: QueryOptions = None,
     ) -> Union[List[OutCollectionModel], List[Union[dict, Any]]]:
-        return await cls._mongo_client.aggregate(cls._out_model, pipeline, parse=parse)
+        def load() -> Awaitable[Union[List[OutCollectionModel], List[Any]]]:
+            return cls._admit(
+                cls._mongo_client.aggregate,
+                cls._out_model,
+                pipeline,
+                parse=parse,
+                options=options,
+            )
+
+        if cls._cache is None or not is_read_only_pipeline(pipeline):
+            return await load()
+        key, collections = cls._cache_entry("aggregate", pipeline, options, parse)
+        return await cls._cache.get_or_load_async(key, collections, load)
+
+    @classmethod
+    async def changes_since(
+        cls,
+        watermark: Optional[ChangeWatermark] = None,
+        batch_size: int = 1000,
+        settle_seconds: float = 2.0,
+        options: QueryOptions = None,
+    ) -> AsyncIterator[ChangePage]:
+        """
+        Pages of the documents inserted, updated or deleted after `watermark`,
+        in (updated_at, _id) order. Persist the watermark of a page once it is
+        processed and pass it back to resume, None starts from the beginning.
+        Needs Collection.incremental_sync on the model, see
+        ensure_change_indexes for the indexes keeping this proportional to
+        the number of changes.
+        """
+        check_incremental(cls._in_model)
+        tombstones = cls._mongo_client._get_collection_client(
+            tombstone_location(cls._in_model)
+        )
+        while True:
+            query = change_query(watermark, settle_seconds, utc_now())
+            documents = await cls.get_many(
+                query, sort=CHANGE_SORT, limit=batch_size, options=options
+            )
+            cursor = tombstones.find(query).sort(list(CHANGE_SORT.items()))
+            deleted = await cursor.limit(batch_size).to_list(None)
+            page = merge_changes(documents, deleted, batch_size, watermark)
+            if len(page):
+                yield page
+            if len(page) < batch_size:
+                return
+            watermark = page.watermark
+
+    @classmethod
+    async def ensure_change_indexes(
+        cls, tombstone_ttl_seconds: Optional[int] = None
+    ) -> None:
+        keys = list(CHANGE_SORT.items())
+        client = cls._mongo_client
+        await client._get_collection_client(cls._in_model).create_index(keys)
+        tombstones = client._get_collection_client(tombstone_location(cls._in_model))
+        await tombstones.create_index(keys)
+        if tombstone_ttl_seconds is not None:
+            await tombstones.create_index(
+                "deleted_at", expireAfterSeconds=tombstone_ttl_seconds
+            )
+
+    @classmethod
+    def _counter_buffer(cls) -> CounterBuffer:
+        buffer, _ = service_buffer(cls)
+        # one flush task per buffer, restarted when its event loop is gone
+        if buffer.schedule is None or buffer.schedule.done():
+            buffer.schedule = asyncio.get_running_loop().create_task(
+                flush_periodically(
+                    cls.flush_counters, buffer.flush_seconds, cls._in_model.__name__
+                )
+            )
+        return buffer
+
+    @classmethod
+    async def increment_counters(
+        cls, id: Union[str, ObjectId], increments: Dict[str, Union[int, float]]
+    ) -> None:
+        buffer = cls._counter_buffer()
+        if buffer.add(ObjectId(id), increments):
+            await cls.flush_counters()
+
+    @classmethod
+    async def flush_counters(cls) -> int:
+        """Writes the pending increments, await it on shutdown."""
+        buffer = cls._counter_buffer()
+        pending, since = buffer.take()
+        if not pending:
+            return 0
+        start = time.perf_counter()
+        try:
+            requests = flush_requests(buffer, pending)
+            if buffer.shards > 1:
+                shards = cls._mongo_client._get_collection_client(
+                    shard_location(cls._in_model)
+                )
+                await shards.bulk_write(requests, ordered=False)
+            else:
+                await cls._mongo_client.bulk_write(
+                    cls._in_model, requests, ordered=False
+                )
+        except Exception as error:
+            buffer.restore(unwritten(pending, error), since, error)
+            raise
+        buffer.flushed(len(pending), since, time.perf_counter() - start)
+        return len(pending)
 
     @classmethod
+    async def get_counters(
+        cls, id: Union[str, ObjectId], fields: List[str]
+    ) -> Dict[str, Union[int, float]]:
+        id = ObjectId(id)
+        buffer = cls._counter_buffer()
+        projection = {field: 1 for field in fields}
+        client = cls._mongo_client
+        documents = [
+            await client._get_collection_client(cls._in_model).find_one(
+                {"_id": id}, projection
+            )
+        ]
+        if buffer.shards > 1:
+            shards = client._get_collection_client(shard_location(cls._in_model))
+            cursor = shards.find({"counter_of": id}, projection)
+            documents += await cursor.to_list(None)
+        return sum_counters(fields, documents, buffer.pending(id))
+
+    @classmethod
+    async def ensure_counter_indexes(cls) -> None:
+        location = shard_location(cls._in_model)
+        shards = cls._mongo_client._get_collection_client(location)
+        await shards.create_index("counter_of")
+
+    @classmethod
+    async def compress_fields(cls, query: dict = {}, batch_size: int = 1000) -> int:
+        fields = compressed_fields(cls._in_model)
+        if not fields:
+            return 0
+        collection = cls._mongo_client._get_collection_client(cls._in_model)
+        cursor = collection.find(query, {name: 1 for name in fields}).sort("_id", 1)
+        rewritten = 0
+        requests = []
+        async for document in cursor:
+            request = compression_request(cls._in_model, document)
+            if request is not None:
+                requests.append(request)
+            if len(requests) >= batch_size:
+                result = await cls._mongo_client.bulk_write(
+                    cls._in_model, requests, ordered=False
+                )
+                rewritten += result.modified_count
+                requests = []
+        if requests:
+            result = await cls._mongo_client.bulk_write(
+                cls._in_model, requests, ordered=False
+            )
+            rewritten += result.modified_count
+        return rewritten
+
+    @classmethod
+    @instrumented
     async def get_only_ids(
         cls,
         query: dict = {},
         sort: dict = None,
         skip: int = 0,
         limit: int = None,
+        options: QueryOptions = None,
     ) -> List[ObjectId]:
 
         pipeline = PipelineBuilder.build_simple_pipeline(
@@ -210,5 +751,679 @@ class AsyncBaseService(BaseService):
             project={"_id": 1},
         )
 
-        documents = await cls.aggregate(pipeline)
+        documents = await cls.aggregate(pipeline, options=options)
         return [doc["_id"] for doc in documents]
+
+    @classmethod
+    async def iter_many(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        skip: int = 0,
+        limit: int = None,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> AsyncIterator[OutCollectionModel]:
+        """
+        get_many as an async iterator, read past the cache. With the STREAM
+        result limit action a result exceeding the limits is streamed from the
+        cursor.
+        """
+        async for model in cls._mongo_client.iter_many(
+            cls._out_model,
+            query,
+            sort=sort,
+            skip=skip,
+            limit=limit,
+            expand=expand,
+            options=options,
+        ):
+            yield model
+
+    @classmethod
+    async def stream_batches(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> AsyncIterator[List[OutCollectionModel]]:
+        async for batch in cls._mongo_client.find_batches(
+            cls._out_model,
+            query,
+            sort=sort,
+            batch_size=batch_size,
+            expand=expand,
+            options=options,
+        ):
+            yield batch
+
+    @classmethod
+    async def stream(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> AsyncIterator[OutCollectionModel]:
+        async for batch in cls.stream_batches(
+            query, sort=sort, batch_size=batch_size, expand=expand, options=options
+        ):
+            for model in batch:
+                yield model
+
+    @classmethod
+    async def split_points(
+        cls,
+        query: dict = {},
+        partitions: int = 4,
+        key: str = "_id",
+        method: str = "bucket_auto",
+        sample_size: int = None,
+        options: QueryOptions = None,
+    ) -> List[Any]:
+        pipeline = build_split_pipeline(query, key, partitions, method, sample_size)
+        documents = await cls.aggregate(pipeline, options=options)
+        return split_points_from_result(documents, partitions, method)
+
+    @classmethod
+    async def _scan_partition(
+        cls,
+        index: int,
+        query: dict,
+        key: str,
+        batch_size: int,
+        expand: List[str],
+        on_batch: Optional[Callable[[int, List[OutCollectionModel]], Any]],
+        options: QueryOptions,
+    ) -> List[Any]:
+        results = []
+        # sorted on the key so the last key of a batch is a valid resume point
+        async for batch in cls.stream_batches(
+            query,
+            sort={key: 1},
+            batch_size=batch_size,
+            expand=expand,
+            options=options,
+        ):
+            if on_batch is None:
+                results.extend(batch)
+                continue
+            result = on_batch(index, batch)
+            if inspect.isawaitable(result):
+                result = await result
+            results.append(result)
+        return results
+
+    @classmethod
+    async def parallel_scan(
+        cls,
+        query: dict = {},
+        partitions: int = 4,
+        key: str = "_id",
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        on_batch: Optional[Callable[[int, List[OutCollectionModel]], Any]] = None,
+        method: str = "bucket_auto",
+        split_points: Optional[List[Any]] = None,
+        options: QueryOptions = None,
+    ) -> List[Any]:
+        """
+        Splits the `key` range of the matching documents into partitions and reads
+        them concurrently as asyncio tasks. Returns the models ordered by key, or
+        the results of `on_batch(partition_index, batch)` (sync or async) if given.
+        """
+        if split_points is None:
+            split_points = await cls.split_points(
+                query, partitions, key=key, method=method, options=options
+            )
+        queries = build_partition_queries(query, key, split_points)
+        results = await asyncio.gather(
+            *[
+                cls._scan_partition(
+                    index, partition_query, key, batch_size, expand, on_batch, options
+                )
+                for index, partition_query in enumerate(queries)
+            ]
+        )
+        return [result for partition in results for result in partition]
+
+    @classmethod
+    async def map_collection(
+        cls,
+        fn: Callable[[List[OutCollectionModel]], Any],
+        query: dict = {},
+        processes: int = None,
+        partitions: int = None,
+        key: str = "_id",
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        checkpoint_path: str = None,
+        method: str = "bucket_auto",
+        options: QueryOptions = None,
+    ) -> List[Any]:
+        """
+        Runs `fn` on every batch of models in a process pool and returns the
+        results. `fn` has to be picklable (a module level function). With a
+        checkpoint_path, finished batches are recorded per partition and a
+        rerun only processes what is left.
+        """
+        processes = processes or os.cpu_count()
+        partitions = partitions or processes
+        checkpoint = ScanCheckpoint(checkpoint_path) if checkpoint_path else None
+
+        split_points = checkpoint.split_points if checkpoint else None
+        if split_points is None:
+            split_points = await cls.split_points(
+                query, partitions, key=key, method=method, options=options
+            )
+            if checkpoint:
+                checkpoint.set_split_points(split_points)
+        resume_after = checkpoint.resume_after() if checkpoint else None
+        queries = build_partition_queries(query, key, split_points, resume_after)
+        loop = asyncio.get_running_loop()
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+
+            async def on_batch(index: int, batch: List[OutCollectionModel]) -> Any:
+                result = await loop.run_in_executor(pool, apply_to_batch, fn, batch)
+                if checkpoint:
+                    checkpoint.advance(index, model_key_value(batch[-1], key))
+                return result
+
+            async def run_partition(index: int, partition_query: dict) -> List[Any]:
+                if checkpoint and checkpoint.is_done(index):
+                    return []
+                results = await cls._scan_partition(
+                    index, partition_query, key, batch_size, expand, on_batch, options
+                )
+                if checkpoint:
+                    checkpoint.finish(index)
+                return results
+
+            results = await asyncio.gather(
+                *[
+                    run_partition(index, partition_query)
+                    for index, partition_query in enumerate(queries)
+                ]
+            )
+        return [result for partition in results for result in partition]
+
+    @classmethod
+    async def _load_sources(cls, snapshot: Snapshot, query: dict) -> List[dict]:
+        collection = cls._mongo_client._get_collection_client(snapshot.source)
+        cursor = collection.find(query, snapshot.projection())
+        return await cursor.to_list(None)
+
+    @classmethod
+    async def _fill_snapshots(cls, documents: List[Any]) -> List[Any]:
+        snapshots = get_snapshots(cls._in_model)
+        if not snapshots:
+            return documents
+        documents = cls._mongo_client._prepare_insert_documents(
+            cls._in_model, documents
+        )
+        for field, snapshot in snapshots.items():
+            values = local_values(documents, snapshot)
+            sources = []
+            if values:
+                query = {snapshot.foreign_field: {"$in": values}}
+                sources = await cls._load_sources(snapshot, query)
+            fill_documents(documents, field, snapshot, index_sources(sources, snapshot))
+        return documents
+
+    @classmethod
+    async def _snapshot_update(cls, update: dict) -> dict:
+        # an update changing a reference also writes the new snapshot
+        for field, snapshot in get_snapshots(cls._in_model).items():
+            value = set_value(update, snapshot.local_field)
+            if value is UNSET:
+                continue
+            sources = []
+            if value is not None:
+                query = {snapshot.foreign_field: value}
+                sources = await cls._load_sources(snapshot, query)
+            update["$set"][field] = snapshot.value(sources[0] if sources else None)
+        return update
+
+    @classmethod
+    def _fan_out_targets(cls, update: Any) -> List[Tuple[type, str, Snapshot]]:
+        services = AsyncBaseService.get_registered_services()
+        return [
+            (service, field, snapshot)
+            for service, field, snapshot in snapshot_dependents(services, cls._in_model)
+            if needs_fan_out(snapshot, update)
+        ]
+
+    @classmethod
+    async def _source_ids(cls, query: dict, many: bool) -> List[Any]:
+        # read before the update, which may make the query stop matching
+        collection = cls._mongo_client._get_collection_client(cls._in_model)
+        cursor = collection.find(query, {"_id": 1})
+        if not many:
+            cursor = cursor.limit(1)
+        return [document["_id"] for document in await cursor.to_list(None)]
+
+    @classmethod
+    def _fan_out(
+        cls, targets: List[Tuple[type, str, Snapshot]], ids: List[Any]
+    ) -> None:
+        # in the background, the caller's write does not wait for dependents
+        if targets and ids:
+            schedule_fan_out(cls._write_fan_out(targets, ids))
+
+    @classmethod
+    async def _write_fan_out(
+        cls, targets: List[Tuple[type, str, Snapshot]], ids: List[Any]
+    ) -> None:
+        """Refreshes the snapshots of the documents `ids` in their dependents."""
+        now = utc_now()
+        for service, field, snapshot in targets:
+            sources = await cls._load_sources(snapshot, {"_id": {"$in": ids}})
+            requests = fan_out_requests(field, snapshot, sources, now)
+            for start in range(0, len(requests), FAN_OUT_BATCH):
+                await service._mongo_client.bulk_write(
+                    service._in_model,
+                    requests[start : start + FAN_OUT_BATCH],
+                    ordered=False,
+                )
+
+    @classmethod
+    async def wait_fan_outs(cls) -> None:
+        """Waits for the snapshot fan-outs of the updates made so far."""
+        await wait_async_fan_outs()
+
+    @classmethod
+    async def check_snapshots(
+        cls, fix: bool = False, batch_size: int = 1000
+    ) -> List[SnapshotDrift]:
+        """
+        Compares the snapshots of every document with their sources, per
+        snapshot field. `fix` rewrites the drifted ones, e.g. after sources
+        were changed without going through their service.
+        """
+        collection = cls._mongo_client._get_collection_client(cls._in_model)
+        reports = []
+        for field, snapshot in get_snapshots(cls._in_model).items():
+            drift = SnapshotDrift(field=field)
+            projection = {snapshot.local_field: 1, field: 1}
+            cursor = collection.find({}, projection).sort("_id", 1)
+            documents = []
+            async for document in cursor:
+                documents.append(document)
+                if len(documents) >= batch_size:
+                    await cls._check_snapshot_batch(
+                        documents, field, snapshot, drift, fix
+                    )
+                    documents = []
+            if documents:
+                await cls._check_snapshot_batch(documents, field, snapshot, drift, fix)
+            reports.append(drift)
+        return reports
+
+    @classmethod
+    async def _check_snapshot_batch(
+        cls,
+        documents: List[dict],
+        field: str,
+        snapshot: Snapshot,
+        drift: SnapshotDrift,
+        fix: bool,
+    ) -> None:
+        values = local_values(documents, snapshot)
+        sources = []
+        if values:
+            query = {snapshot.foreign_field: {"$in": values}}
+            sources = await cls._load_sources(snapshot, query)
+        sources = index_sources(sources, snapshot)
+        fixes = check_batch(documents, field, snapshot, sources, drift, utc_now())
+        if fix and fixes:
+            result = await cls._mongo_client.bulk_write(
+                cls._in_model, fixes, ordered=False
+            )
+            drift.fixed += result.modified_count
+
+
+class AsyncViewService(AsyncBaseService):
+    """Counterpart of SyncViewService for async services."""
+
+    @classmethod
+    def _state_collection(cls):
+        return cls._mongo_client._get_collection_client(state_location(cls._out_model))
+
+    @classmethod
+    async def get_watermark(cls) -> Optional[dt]:
+        state = await cls._state_collection().find_one(
+            {"_id": cls._out_model.get_collection()}
+        )
+        return state_watermark(state)
+
+    @classmethod
+    async def refresh(
+        cls, full: bool = False, options: QueryOptions = None
+    ) -> ViewRefresh:
+        model = cls._out_model
+        previous = await cls.get_watermark()
+        full = full or previous is None or not refreshes_incrementally(model)
+        started_at = utc_now()
+        start = time.perf_counter()
+        removed = 0
+        try:
+            pipeline = refresh_pipeline(model, None if full else previous)
+            await cls._mongo_client.aggregate(
+                view_source(model), pipeline, options=options
+            )
+            if not full:
+                removed = await cls._remove_deleted(previous)
+        except Exception as error:
+            refresh_failed(model, error)
+            raise
+        duration = time.perf_counter() - start
+        refresh = finish_refresh(model, full, started_at, duration, previous, removed)
+        await cls._state_collection().update_one(
+            {"_id": model.get_collection()}, state_update(refresh), upsert=True
+        )
+        return refresh
+
+    @classmethod
+    async def _remove_deleted(cls, watermark: dt) -> int:
+        model = cls._out_model
+        source = view_source(model)
+        client = cls._mongo_client
+        tombstones = client._get_collection_client(tombstone_location(source))
+        query = deleted_since(overlap_since(model, watermark))
+        cursor = tombstones.find(query, {"_id": 1})
+        ids = [document["_id"] for document in await cursor.to_list(None)]
+        if not ids:
+            return 0
+        # a tombstone outlives its document when the delete failed after it
+        cursor = client._get_collection_client(source).find(
+            {"_id": {"$in": ids}}, {"_id": 1}
+        )
+        live = {document["_id"] for document in await cursor.to_list(None)}
+        ids = [id for id in ids if id not in live]
+        if not ids:
+            return 0
+        view = client._get_collection_client(model)
+        result = await view.delete_many({view_source_field(model): {"$in": ids}})
+        invalidate_collection(model.get_database(), model.get_collection())
+        return result.deleted_count
+
+    @classmethod
+    async def view_lag(cls) -> Optional[float]:
+        watermark = await cls.get_watermark()
+        if watermark is None:
+            return None
+        return (utc_now() - watermark).total_seconds()
+
+    @classmethod
+    def schedule_refresh(cls, interval_seconds: float) -> "asyncio.Task[None]":
+        """Refreshes the view every `interval_seconds`, cancel the task to stop."""
+        return asyncio.create_task(
+            refresh_periodically(cls.refresh, interval_seconds, cls._out_model.__name__)
+        )
+
+
+class AsyncPartitionedService(AsyncBaseService):
+    """The async counterpart of SyncPartitionedService."""
+
+    _partition: Optional[str] = None
+
+    @classmethod
+    async def list_partitions(cls, refresh: bool = False) -> List[str]:
+        partitions = catalog(cls)
+        names = None if refresh else partitions.cached()
+        if names is None:
+            database = cls._mongo_client._get_database_client(
+                cls._in_model.get_database()
+            )
+            names = partitions.load(await database.list_collection_names())
+        return names
+
+    @classmethod
+    def partition_service(cls, name: str) -> Type["AsyncPartitionedService"]:
+        return partition_service(cls, name)
+
+    @classmethod
+    async def _services(cls, query: dict) -> List[Type["AsyncPartitionedService"]]:
+        names = overlapping(cls._in_model, await cls.list_partitions(), query)
+        return [cls.partition_service(name) for name in names]
+
+    @classmethod
+    async def _find_service(
+        cls, query: dict
+    ) -> Optional[Type["AsyncPartitionedService"]]:
+        for service in await cls._services(query):
+            if await service.get_one(query) is not None:
+                return service
+        return None
+
+    @classmethod
+    def _model_service(
+        cls, model: OutCollectionModel
+    ) -> Type["AsyncPartitionedService"]:
+        name = type(model).get_collection()
+        collection = cls._in_model.get_collection()
+        partitioning = get_partitioning(cls._in_model)
+        if partitioning.parse(collection, name) is None:
+            value = getattr(model, partitioning.field, None)
+            name = partition_of(cls._in_model, {partitioning.field: value})
+        return cls.partition_service(name)
+
+    @classmethod
+    @instrumented
+    async def create_one(
+        cls,
+        document: Union[dict, InCollectionModel, BaseModel],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> OutCollectionModel:
+        if cls._partition is not None:
+            return await super().create_one(document, expand=expand, options=options)
+        models = await cls.create_many([document], expand=expand, options=options)
+        return models[0]
+
+    @classmethod
+    @instrumented
+    async def create_many(
+        cls,
+        documents: List[Union[dict, InCollectionModel, BaseModel]],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> List[OutCollectionModel]:
+        if cls._partition is not None:
+            return await super().create_many(documents, expand=expand, options=options)
+        documents = cls._mongo_client._prepare_insert_documents(
+            cls._in_model, documents
+        )
+        for document in documents:
+            if document.get("_id") is None:
+                document["_id"] = ObjectId()
+        models = []
+        for name, group in group_by_partition(cls._in_model, documents).items():
+            service = cls.partition_service(name)
+            models += await service.create_many(group, expand=expand, options=options)
+            catalog(cls).add(name)
+        return order_by_ids(models, [document["_id"] for document in documents])
+
+    @classmethod
+    @instrumented
+    async def get_one(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        expand: list[str] = None,
+        skip: int = 0,
+        options: QueryOptions = None,
+    ) -> Optional[OutCollectionModel]:
+        if cls._partition is not None:
+            return await super().get_one(
+                query, sort=sort, expand=expand, skip=skip, options=options
+            )
+        models = await cls.get_many(
+            query, sort=sort, skip=skip, limit=1, expand=expand, options=options
+        )
+        return models[0] if models else None
+
+    @classmethod
+    @instrumented
+    async def get_by_id(
+        cls,
+        id: Union[str, ObjectId],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> Optional[OutCollectionModel]:
+        if cls._partition is not None:
+            return await super().get_by_id(id, expand=expand, options=options)
+        id = ObjectId(id)
+        for name in id_hint_first(cls._in_model, await cls.list_partitions(), id):
+            service = cls.partition_service(name)
+            model = await service.get_by_id(id, expand=expand, options=options)
+            if model is not None:
+                return model
+        return None
+
+    @classmethod
+    @instrumented
+    async def get_many(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        skip: int = 0,
+        limit: int = None,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> List[OutCollectionModel]:
+        if cls._partition is not None:
+            return await super().get_many(
+                query, sort=sort, skip=skip, limit=limit, expand=expand, options=options
+            )
+        services = await cls._services(query)
+        window = None if limit is None else skip + limit
+        field = get_partitioning(cls._in_model).field
+        if sort and next(iter(sort)) == field:
+            if next(iter(sort.values())) < 0:
+                services = services[::-1]
+            models = []
+            for service in services:
+                models += await service.get_many(
+                    query,
+                    sort=sort,
+                    limit=None if window is None else window - len(models),
+                    expand=expand,
+                    options=options,
+                )
+                if window is not None and len(models) >= window:
+                    break
+            return models[skip:window]
+
+        results = await asyncio.gather(
+            *(
+                service.get_many(
+                    query, sort=sort, limit=window, expand=expand, options=options
+                )
+                for service in services
+            )
+        )
+        models = [model for partition_models in results for model in partition_models]
+        if sort:
+            sort_models(models, sort)
+        return models[skip:window]
+
+    @classmethod
+    @instrumented
+    async def count(cls, query: dict, options: QueryOptions = None) -> int:
+        if cls._partition is not None:
+            return await super().count(query, options=options)
+        counts = await asyncio.gather(
+            *(
+                service.count(query, options=options)
+                for service in await cls._services(query)
+            )
+        )
+        return sum(counts)
+
+    @classmethod
+    @instrumented
+    async def update_one(
+        cls,
+        query: dict,
+        update: Union[dict, BaseModel],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> OutCollectionModel:
+        if cls._partition is not None:
+            return await super().update_one(
+                query, update, expand=expand, options=options
+            )
+        service = await cls._find_service(query)
+        if service is None:
+            return None
+        return await service.update_one(query, update, expand=expand, options=options)
+
+    @classmethod
+    @instrumented
+    async def update(
+        cls,
+        model: OutCollectionModel,
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> OutCollectionModel:
+        if cls._partition is not None:
+            return await super().update(model, expand=expand, options=options)
+        service = cls._model_service(model)
+        return await service.update(model, expand=expand, options=options)
+
+    @classmethod
+    @instrumented
+    async def update_many(
+        cls,
+        query: dict,
+        update: Union[dict, BaseModel],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> List[OutCollectionModel]:
+        if cls._partition is not None:
+            return await super().update_many(
+                query, update, expand=expand, options=options
+            )
+        models = []
+        for service in await cls._services(query):
+            models += await service.update_many(
+                query, update, expand=expand, options=options
+            )
+        return models
+
+    @classmethod
+    @instrumented
+    async def delete_one(cls, query: dict, options: QueryOptions = None) -> int:
+        if cls._partition is not None:
+            return await super().delete_one(query, options=options)
+        service = await cls._find_service(query)
+        if service is None:
+            return 0
+        return await service.delete_one(query, options=options)
+
+    @classmethod
+    @instrumented
+    async def delete_many(cls, query: dict, options: QueryOptions = None) -> int:
+        if cls._partition is not None:
+            return await super().delete_many(query, options=options)
+        deleted = 0
+        for service in await cls._services(query):
+            deleted += await service.delete_many(query, options=options)
+        return deleted
+
+    @classmethod
+    async def drop_partitions(cls, before: dt) -> List[str]:
+        database = cls._mongo_client._get_database_client(cls._in_model.get_database())
+        dropped = expired_partitions(
+            cls._in_model, await cls.list_partitions(refresh=True), before
+        )
+        for name in dropped:
+            await database.drop_collection(name)
+            invalidate_collection(cls._in_model.get_database(), name)
+            catalog(cls).discard(name)
+        return dropped
@@ -1,16 +1,117 @@
-from typing import Type
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 from bson import ObjectId
 from pydantic import BaseModel
 
+from ..clients.result_cache import (
+    CollectionKey,
+    ResultCache,
+    cache_key,
+    pipeline_collections,
+)
+from ..clients.result_limits import result_size_stats
 from ..constants import BaseEnum, PyObjectId
+from ..exceptions import VersionConflict
 from ..models.collection import (
     OutCollectionModel,
 )
+from ..models.compression import compress_model_update, compress_update
+from ..options import QueryOptions
+from .ids import chunk_ids, unique_ids
+
+ClientT = TypeVar("ClientT")
+
+
+class LazyClient(Generic[ClientT]):
+    """
+    Creates the service client on first access instead of at class definition.
+    Like a plain class attribute, the client is shared by all subclasses that
+    do not assign their own _mongo_client.
+    """
+
+    def __init__(self, factory: Callable[[], ClientT]):
+        self._factory = factory
+        self._client: Optional[ClientT] = None
+        self._lock = threading.Lock()
+
+    def __get__(self, instance, owner) -> ClientT:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
 
 
 class BaseService:
     _out_model: Type[OutCollectionModel]
+    # get_many keyword arguments run by warmup(), e.g. [{"query": {}, "limit": 1}]
+    _warmup_queries: List[Dict[str, Any]] = []
+    # ids per query of the *_by_ids methods, and how many queries run at once
+    _id_chunk_size: int = 10000
+    _id_chunk_concurrency: int = 4
+    # opt-in cache of the get_many and aggregate results
+    _cache: Optional[ResultCache] = None
+    _registry: List[Type["BaseService"]] = []
+
+    def __init_subclass__(cls, register: bool = True, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # the per partition services are not registered
+        if register:
+            BaseService._registry.append(cls)
+
+    @classmethod
+    def get_registered_services(cls) -> List[Type["BaseService"]]:
+        # only services bound to a model, in definition order
+        return [
+            service
+            for service in BaseService._registry
+            if issubclass(service, cls) and "_out_model" in service.__dict__
+        ]
+
+    @classmethod
+    def memory_stats(cls) -> Dict[str, int]:
+        """
+        Calls, documents and bytes of the measured find_many results of the
+        model, totals and peaks. Results are measured once ResultLimits apply.
+        """
+        return result_size_stats(cls._out_model).snapshot()
+
+    @classmethod
+    def _cache_entry(
+        cls,
+        operation: str,
+        pipeline: List[Dict[str, Any]],
+        options: Optional[QueryOptions],
+        *parts: Any,
+    ) -> Tuple[str, Set[CollectionKey]]:
+        """Cache key of a read and the collections whose writes invalidate it."""
+        model = cls._out_model
+        database = model.get_database()
+        collection = model.get_collection()
+        # the collation is the only option changing the result
+        collation = options.collation if options is not None else None
+        key = cache_key(
+            f"{model.__module__}.{model.__qualname__}",
+            database,
+            collection,
+            operation,
+            pipeline,
+            collation,
+            *parts,
+        )
+        return key, pipeline_collections(database, collection, pipeline)
 
     @classmethod
     def _apply_types_to_query(cls, query: dict[str, dict]) -> dict:
@@ -69,6 +170,14 @@ class BaseService:
 
         return converted_query
 
+    @classmethod
+    def _chunk_ids(
+        cls, ids: List[Any], chunk_size: Optional[int] = None
+    ) -> Tuple[List[ObjectId], List[List[ObjectId]]]:
+        # the deduplicated ids and their chunks
+        ids = unique_ids(ids)
+        return ids, chunk_ids(ids, chunk_size or cls._id_chunk_size)
+
     @classmethod
     def _prepare_update(cls, update: dict) -> dict:
         if isinstance(update, BaseModel):
@@ -78,4 +187,48 @@ class BaseService:
         is_set = not any([key.startswith("$") for key in update.keys()])
         if is_set:
             update = {"$set": update}
-        return update
+        return compress_update(cls._in_model, update)
+
+    @classmethod
+    def _prepare_model_update(
+        cls, model: OutCollectionModel
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Query and update writing `model`, the update is None when nothing
+        changed since it was loaded. Models without tracked changes are
+        written in full. With a version field, the query matches the loaded
+        version and the update increments it.
+        """
+        query = {"_id": model.id}
+        update = model.get_changes()
+        if update is None:
+            update = cls._prepare_update(model.model_dump())
+        elif not update:
+            return query, None
+        version_field = model.get_version_field()
+        if version_field is not None:
+            fields = update.get("$set", {})
+            fields.pop(version_field, None)
+            if not fields:
+                update.pop("$set", None)
+            query[version_field] = model.get_loaded_value(version_field)
+            update.setdefault("$inc", {})[version_field] = 1
+        return query, compress_model_update(model, update)
+
+    @classmethod
+    def _finish_model_update(
+        cls, model: OutCollectionModel, query: Dict[str, Any], modified: int
+    ) -> None:
+        version_field = model.get_version_field()
+        if version_field is not None:
+            version = query[version_field]
+            if not modified:
+                raise VersionConflict(
+                    f"{type(model).__name__} {model.id} is not at "
+                    f"{version_field}={version!r} anymore",
+                    id=model.id,
+                    version=version,
+                )
+            setattr(model, version_field, (version or 0) + 1)
+        if model.tracks_changes():
+            model.mark_clean()
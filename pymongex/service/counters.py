@@ -0,0 +1,244 @@
+import asyncio
+import atexit
+import logging
+import random
+import threading
+import time
+from numbers import Number
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..clients.changes import CollectionLocation
+from ..metrics.recording import get_metrics_sink
+from ..models.collection import CollectionModel
+
+logger = logging.getLogger("pymongex.counters")
+
+SHARDS_SUFFIX = "_counter_shards"
+
+Increments = Dict[str, Number]
+
+_buffers_lock = threading.Lock()
+
+
+class CounterBuffer:
+    """
+    Increments of the counter fields of a model, accumulated in memory per
+    document and written by a flush as one $inc per document. Configured in
+    the model's Collection:
+
+    - counter_shards: with more than one, the increments of a document are
+      spread over that many shard documents of `<collection>_counter_shards`
+      instead of the document itself, get_counters sums them.
+    - counter_flush_seconds: flush interval, default 1. Bounds the increments
+      lost when the process dies; a failed flush keeps the increments it did
+      not write for the next one, see unwritten.
+    - counter_max_pending: documents with pending increments that trigger a
+      flush before the interval, default 10000.
+
+    Flushes write neither updated_at nor the result cache of the counters.
+    """
+
+    FIELDS = ("flushes", "flushed_documents", "errors")
+
+    def __init__(self, model: Type[CollectionModel]):
+        self.model = model
+        self.shards = getattr(model.Collection, "counter_shards", 1)
+        self.flush_seconds = getattr(model.Collection, "counter_flush_seconds", 1.0)
+        self.max_pending = getattr(model.Collection, "counter_max_pending", 10000)
+        if self.shards < 1:
+            raise ValueError("counter_shards has to be a strict positive integer")
+        if self.flush_seconds <= 0:
+            raise ValueError("counter_flush_seconds has to be a strict positive number")
+        self.schedule: Any = None
+        self._pending: Dict[Any, Increments] = {}
+        # monotonic time of the oldest pending increment
+        self._since: Optional[float] = None
+        self._lock = threading.Lock()
+        self._counters = {field: 0 for field in self.FIELDS}
+
+    def add(self, id: Any, increments: Increments) -> bool:
+        """Buffers `increments`, returns True when a flush is due."""
+        for field, amount in increments.items():
+            if not isinstance(amount, Number) or isinstance(amount, bool):
+                raise ValueError(f"Increment of {field} is not a number: {amount!r}")
+        with self._lock:
+            pending = self._pending.setdefault(id, {})
+            for field, amount in increments.items():
+                pending[field] = pending.get(field, 0) + amount
+            if self._since is None:
+                self._since = time.monotonic()
+            return len(self._pending) >= self.max_pending
+
+    def pending(self, id: Any) -> Increments:
+        with self._lock:
+            return dict(self._pending.get(id, {}))
+
+    def take(self) -> Tuple[Dict[Any, Increments], Optional[float]]:
+        with self._lock:
+            pending, since = self._pending, self._since
+            self._pending, self._since = {}, None
+        return pending, since
+
+    def restore(
+        self, pending: Dict[Any, Increments], since: float, error: BaseException
+    ) -> None:
+        # merged back under the increments added during the failed flush
+        with self._lock:
+            for id, increments in pending.items():
+                current = self._pending.setdefault(id, {})
+                for field, amount in increments.items():
+                    current[field] = current.get(field, 0) + amount
+            if pending:
+                self._since = since if self._since is None else min(since, self._since)
+            self._counters["errors"] += 1
+        sink = get_metrics_sink()
+        if sink is not None:
+            labels = {"model": self.model.__name__, "error": type(error).__name__}
+            sink.increment("counter_flush_errors_total", labels)
+
+    def flushed(self, documents: int, since: float, duration: float) -> None:
+        with self._lock:
+            self._counters["flushes"] += 1
+            self._counters["flushed_documents"] += documents
+        sink = get_metrics_sink()
+        if sink is not None:
+            labels = {"model": self.model.__name__}
+            sink.observe("counter_flush_seconds", duration, labels)
+            # age of the oldest increment written, the loss window in practice
+            sink.observe("counter_flush_lag_seconds", time.monotonic() - since, labels)
+            sink.increment("counter_flushed_documents_total", labels, documents)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            since = self._since
+            return {
+                **self._counters,
+                "pending_documents": len(self._pending),
+                "oldest_pending_seconds": (
+                    time.monotonic() - since if since is not None else 0.0
+                ),
+            }
+
+
+def service_buffer(service: type) -> Tuple[CounterBuffer, bool]:
+    """The buffer of a service and whether it was just created."""
+    buffer = service.__dict__.get("_counters")
+    if buffer is not None:
+        return buffer, False
+    with _buffers_lock:
+        buffer = service.__dict__.get("_counters")
+        if buffer is not None:
+            return buffer, False
+        buffer = CounterBuffer(service._in_model)
+        service._counters = buffer
+        return buffer, True
+
+
+def shard_location(model: Type[CollectionModel]) -> CollectionLocation:
+    return CollectionLocation(
+        model.get_database(), f"{model.get_collection()}{SHARDS_SUFFIX}"
+    )
+
+
+def flush_requests(
+    buffer: CounterBuffer, pending: Dict[Any, Increments]
+) -> List[UpdateOne]:
+    if buffer.shards == 1:
+        return [UpdateOne({"_id": id}, {"$inc": inc}) for id, inc in pending.items()]
+    requests = []
+    for id, increments in pending.items():
+        # a random shard per flush spreads the processes writing one document
+        shard = random.randrange(buffer.shards)
+        requests.append(
+            UpdateOne(
+                {"_id": f"{id}:{shard}"},
+                {"$inc": increments, "$setOnInsert": {"counter_of": id}},
+                upsert=True,
+            )
+        )
+    return requests
+
+
+def unwritten(
+    pending: Dict[Any, Increments], error: BaseException
+) -> Dict[Any, Increments]:
+    """
+    The increments of a failed flush to keep. The writeErrors of a
+    BulkWriteError list the requests that failed, the others were applied.
+    Any other error, e.g. a timeout, can not tell and keeps them all: a flush
+    is at-least-once, increments may be applied twice.
+    """
+    if not isinstance(error, BulkWriteError):
+        return pending
+    # one request per document, in the order of pending
+    ids = list(pending)
+    failed = [ids[write["index"]] for write in error.details.get("writeErrors", [])]
+    return {id: pending[id] for id in failed}
+
+
+def sum_counters(
+    fields: List[str],
+    documents: List[Optional[Dict[str, Any]]],
+    pending: Increments,
+) -> Dict[str, Number]:
+    totals = {field: 0 for field in fields}
+    for document in documents:
+        for field in fields:
+            totals[field] += (document or {}).get(field) or 0
+    for field in fields:
+        totals[field] += pending.get(field, 0)
+    return totals
+
+
+class FlushSchedule:
+    """
+    Flushes a buffer every `interval_seconds` on a daemon thread, and once
+    more when stopped or at interpreter exit. Failed flushes are logged.
+    """
+
+    def __init__(self, flush: Callable[[], Any], interval_seconds: float, name: str):
+        self.interval_seconds = interval_seconds
+        self._flush = flush
+        self._name = name
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"pymongex-counters-{name}", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run_flush(self) -> None:
+        try:
+            self._flush()
+        except Exception:
+            logger.exception("Flush of the %s counters failed", self._name)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            self._run_flush()
+
+    def stop(self) -> None:
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._run_flush()
+
+
+async def flush_periodically(
+    flush: Callable[[], Awaitable[Any]], interval_seconds: float, name: str
+) -> None:
+    """
+    The async counterpart of FlushSchedule, runs until cancelled. There is no
+    flush at exit, await flush_counters on shutdown.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await flush()
+        except Exception:
+            logger.exception("Flush of the %s counters failed", name)
@@ -0,0 +1,69 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+from ..utils import sort_key
+
+
+def _from_raw(raw: bytes) -> List[ObjectId]:
+    # ObjectId(bytes) validates the id again, its slot is set directly instead
+    object_ids = []
+    for start in range(0, len(raw), 12):
+        object_id = ObjectId.__new__(ObjectId)
+        object_id._ObjectId__id = raw[start : start + 12]
+        object_ids.append(object_id)
+    return object_ids
+
+
+def to_object_ids(ids: Iterable[Any]) -> List[ObjectId]:
+    """
+    ObjectIds of `ids`. A list of hex strings is decoded in one bytes.fromhex
+    call and sliced, which skips the per-id validation of ObjectId(str).
+    """
+    ids = list(ids)
+    if ids and all(type(id) is str and len(id) == 24 for id in ids):
+        try:
+            raw = bytes.fromhex("".join(ids))
+        except ValueError:
+            raw = b""
+        # fromhex skips whitespace, a short result means some id was invalid
+        if len(raw) == 12 * len(ids):
+            return _from_raw(raw)
+    return [id if isinstance(id, ObjectId) else ObjectId(id) for id in ids]
+
+
+def unique_ids(ids: Iterable[Any]) -> List[ObjectId]:
+    # deduplicated ObjectIds, in order of first appearance
+    return list(dict.fromkeys(to_object_ids(ids)))
+
+
+def chunk_ids(ids: List[ObjectId], chunk_size: int) -> List[List[ObjectId]]:
+    if chunk_size <= 0:
+        raise ValueError("chunk_size has to be a strict positive integer")
+    return [ids[start : start + chunk_size] for start in range(0, len(ids), chunk_size)]
+
+
+def order_by_ids(models: List[Any], ids: List[ObjectId]) -> List[Any]:
+    # models in the order of ids, ids without a model are skipped
+    by_id: Dict[ObjectId, Any] = {model.id: model for model in models}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+def _attribute(model: Any, key: str) -> Any:
+    value = model
+    for part in key.split("."):
+        if value is None:
+            return None
+        # models expose _id as id
+        value = getattr(value, "id" if part == "_id" else part, None)
+    return value
+
+
+def sort_models(models: List[Any], sort: Optional[Dict[str, int]]) -> List[Any]:
+    """Sorts models read in several queries like the server sorts on `sort`."""
+    # stable sorts from the last key to the first one
+    for key, direction in reversed(list((sort or {}).items())):
+        models.sort(
+            key=lambda model: sort_key(_attribute(model, key)), reverse=direction < 0
+        )
+    return models
@@ -0,0 +1,148 @@
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import json_util
+
+SPLIT_METHODS = ("bucket_auto", "sample")
+
+
+def build_split_pipeline(
+    query: dict,
+    key: str,
+    partitions: int,
+    method: str = "bucket_auto",
+    sample_size: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Pipeline returning the documents needed to derive split points of `key`.
+    $bucketAuto is exact but reads every matching key, $sample only reads
+    `sample_size` documents (default 32 per partition).
+    """
+    if partitions <= 0:
+        raise ValueError("partitions has to be a strict positive integer")
+    if method not in SPLIT_METHODS:
+        raise ValueError(f"method must be one of {SPLIT_METHODS}")
+    if method == "bucket_auto":
+        return [
+            {"$match": query},
+            {"$bucketAuto": {"groupBy": f"${key}", "buckets": partitions}},
+        ]
+    sample_size = sample_size or partitions * 32
+    return [
+        {"$match": query},
+        {"$sample": {"size": sample_size}},
+        {"$project": {"_id": 0, "value": f"${key}"}},
+    ]
+
+
+def split_points_from_result(
+    documents: List[Dict[str, Any]], partitions: int, method: str = "bucket_auto"
+) -> List[Any]:
+    """Return up to partitions - 1 ascending, distinct boundaries."""
+    if method == "bucket_auto":
+        # the first bucket starts at the minimum, every other minimum is a boundary
+        points = [doc["_id"]["min"] for doc in documents[1:]]
+    else:
+        values = sorted(doc["value"] for doc in documents if "value" in doc)
+        points = [values[len(values) * i // partitions] for i in range(1, partitions)]
+    distinct = []
+    for point in points:
+        if not distinct or point != distinct[-1]:
+            distinct.append(point)
+    return distinct
+
+
+def build_partition_queries(
+    query: dict,
+    key: str,
+    split_points: List[Any],
+    resume_after: Optional[Dict[int, Any]] = None,
+) -> List[dict]:
+    """
+    One query per partition: [-inf, p1), [p1, p2), ..., [pn, inf).
+    `resume_after` maps a partition index to the last key already processed.
+    """
+    bounds = [None, *split_points, None]
+    queries = []
+    for index in range(len(bounds) - 1):
+        condition = {}
+        if bounds[index] is not None:
+            condition["$gte"] = bounds[index]
+        if bounds[index + 1] is not None:
+            condition["$lt"] = bounds[index + 1]
+        if resume_after and resume_after.get(index) is not None:
+            condition["$gt"] = resume_after[index]
+        parts = [query] if query else []
+        if condition:
+            parts.append({key: condition})
+        if not parts:
+            queries.append({})
+        elif len(parts) == 1:
+            queries.append(parts[0])
+        else:
+            queries.append({"$and": parts})
+    return queries
+
+
+def model_key_value(model: Any, key: str) -> Any:
+    # models expose _id as id
+    return getattr(model, "id" if key == "_id" else key)
+
+
+def apply_to_batch(fn: Callable[[List[Any]], Any], batch: List[Any]) -> Any:
+    # module level so it can be pickled for process pools
+    return fn(batch)
+
+
+class ScanCheckpoint:
+    """
+    Per-partition progress of a map_collection job stored as JSON so a job can
+    resume. The split points are stored too since they have to stay stable
+    between runs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {"split_points": None, "partitions": {}}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self._state = json_util.loads(f.read())
+
+    @property
+    def split_points(self) -> Optional[List[Any]]:
+        return self._state["split_points"]
+
+    def set_split_points(self, split_points: List[Any]) -> None:
+        with self._lock:
+            self._state["split_points"] = split_points
+            self._write()
+
+    def resume_after(self) -> Dict[int, Any]:
+        return {
+            int(index): partition["last"]
+            for index, partition in self._state["partitions"].items()
+        }
+
+    def is_done(self, index: int) -> bool:
+        partition = self._state["partitions"].get(str(index), {})
+        return partition.get("done", False)
+
+    def advance(self, index: int, last: Any) -> None:
+        with self._lock:
+            partition = self._state["partitions"].setdefault(str(index), {})
+            partition["last"] = last
+            self._write()
+
+    def finish(self, index: int) -> None:
+        with self._lock:
+            partition = self._state["partitions"].setdefault(str(index), {"last": None})
+            partition["done"] = True
+            self._write()
+
+    def _write(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json_util.dumps(self._state))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,286 @@
+import threading
+import time
+from datetime import datetime as dt
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from bson import ObjectId
+from pydantic import BaseModel
+
+from ..constants import BaseEnum
+from ..models.collection import CollectionModel, ensure_utc_timezone
+from ..storage import Collection
+
+_lock = threading.Lock()
+_partition_models: Dict[Tuple[type, str], type] = {}
+
+
+class PartitionPeriod(BaseEnum):
+    DAY = "day"
+    MONTH = "month"
+    YEAR = "year"
+
+
+_FORMATS = {
+    PartitionPeriod.DAY: "%Y_%m_%d",
+    PartitionPeriod.MONTH: "%Y_%m",
+    PartitionPeriod.YEAR: "%Y",
+}
+
+
+class Partitioning(BaseModel):
+    """
+    Splits the documents of a model over one collection per period of a
+    datetime field, named `<collection>_<period>`, e.g. events_2026_10 with
+    `partitioning = Partitioning(field="created_at", period="month")` in the
+    model's Collection. See SyncPartitionedService.
+    """
+
+    field: str = "created_at"
+    period: PartitionPeriod = PartitionPeriod.MONTH
+    # how long the list of partitions read from the database is reused
+    cache_seconds: float = 30.0
+
+    def start(self, value: dt) -> dt:
+        """Start of the period containing `value`."""
+        value = ensure_utc_timezone(value).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        if self.period == PartitionPeriod.DAY:
+            return value
+        if self.period == PartitionPeriod.MONTH:
+            return value.replace(day=1)
+        return value.replace(month=1, day=1)
+
+    def end(self, start: dt) -> dt:
+        """Start of the period after the one starting at `start`."""
+        if self.period == PartitionPeriod.DAY:
+            return start + timedelta(days=1)
+        if self.period == PartitionPeriod.MONTH:
+            if start.month == 12:
+                return start.replace(year=start.year + 1, month=1)
+            return start.replace(month=start.month + 1)
+        return start.replace(year=start.year + 1)
+
+    def name(self, collection: str, value: dt) -> str:
+        return f"{collection}_{self.start(value).strftime(_FORMATS[self.period])}"
+
+    def parse(self, collection: str, name: str) -> Optional[dt]:
+        """Start of the partition `name`, None when it is not a partition."""
+        prefix = f"{collection}_"
+        if not name.startswith(prefix):
+            return None
+        try:
+            start = dt.strptime(name[len(prefix) :], _FORMATS[self.period])
+        except ValueError:
+            return None
+        start = ensure_utc_timezone(start)
+        # strptime accepts unpadded numbers
+        return start if self.name(collection, start) == name else None
+
+
+def get_partitioning(model: Type[CollectionModel]) -> Partitioning:
+    partitioning = getattr(model.Collection, "partitioning", None)
+    if partitioning is None:
+        raise ValueError(
+            f"{model.__name__} is not partitioned, its Collection declares no "
+            "partitioning"
+        )
+    return partitioning
+
+
+def partition_of(model: Type[CollectionModel], document: Dict[str, Any]) -> str:
+    partitioning = get_partitioning(model)
+    value = document.get(partitioning.field)
+    if not isinstance(value, dt):
+        raise ValueError(
+            f"{model.__name__} documents are partitioned on {partitioning.field}, "
+            f"which has to be a datetime, got {value!r}"
+        )
+    return partitioning.name(model.get_collection(), value)
+
+
+def _condition_bounds(condition: Any) -> Tuple[Optional[dt], Optional[dt]]:
+    if isinstance(condition, dt):
+        return condition, condition
+    low = high = None
+    if not isinstance(condition, dict):
+        return low, high
+    for operator, value in condition.items():
+        if operator == "$eq" and isinstance(value, dt):
+            low = high = value
+        elif operator in ("$gt", "$gte") and isinstance(value, dt):
+            low = value
+        elif operator in ("$lt", "$lte") and isinstance(value, dt):
+            high = value
+        elif operator == "$in" and value and all(isinstance(v, dt) for v in value):
+            low, high = min(value), max(value)
+    return low, high
+
+
+def query_bounds(
+    query: Dict[str, Any], field: str
+) -> Tuple[Optional[dt], Optional[dt]]:
+    """
+    Inclusive range of `field` a query can match, None for an unbounded
+    side. Only top level and $and conditions narrow it, $or never does.
+    """
+    bounds = [_condition_bounds(query.get(field))]
+    bounds += [query_bounds(part, field) for part in query.get("$and", [])]
+    lows = [ensure_utc_timezone(low) for low, _ in bounds if low is not None]
+    highs = [ensure_utc_timezone(high) for _, high in bounds if high is not None]
+    return (max(lows) if lows else None), (min(highs) if highs else None)
+
+
+def overlapping(
+    model: Type[CollectionModel], names: List[str], query: Dict[str, Any]
+) -> List[str]:
+    """The partitions among `names` a query can match documents of."""
+    partitioning = get_partitioning(model)
+    low, high = query_bounds(query, partitioning.field)
+    selected = []
+    for name in names:
+        start = partitioning.parse(model.get_collection(), name)
+        if high is not None and start > high:
+            continue
+        if low is not None and partitioning.end(start) <= low:
+            continue
+        selected.append(name)
+    return selected
+
+
+def id_hint_first(
+    model: Type[CollectionModel], names: List[str], id: ObjectId
+) -> List[str]:
+    # the partition of the id's creation time first, right when partitioning
+    # on created_at with generated ids
+    hint = get_partitioning(model).name(model.get_collection(), id.generation_time)
+    return sorted(names, key=lambda name: name != hint)
+
+
+class PartitionCatalog:
+    """The partitions of a model, listed again after cache_seconds."""
+
+    def __init__(self, model: Type[CollectionModel]):
+        self.model = model
+        self.partitioning = get_partitioning(model)
+        self._names: Optional[set] = None
+        self._loaded_at = 0.0
+
+    def cached(self) -> Optional[List[str]]:
+        expired = time.monotonic() - self._loaded_at > self.partitioning.cache_seconds
+        if self._names is None or expired:
+            return None
+        return sorted(self._names)
+
+    def load(self, collection_names: List[str]) -> List[str]:
+        collection = self.model.get_collection()
+        self._names = {
+            name
+            for name in collection_names
+            if self.partitioning.parse(collection, name) is not None
+        }
+        self._loaded_at = time.monotonic()
+        # zero padded names sort chronologically
+        return sorted(self._names)
+
+    def add(self, name: str) -> None:
+        if self._names is not None:
+            self._names.add(name)
+
+    def discard(self, name: str) -> None:
+        if self._names is not None:
+            self._names.discard(name)
+
+
+def catalog(service: type) -> PartitionCatalog:
+    current = service.__dict__.get("_partition_catalog")
+    if current is None:
+        with _lock:
+            current = service.__dict__.get("_partition_catalog")
+            if current is None:
+                current = service._partition_catalog = PartitionCatalog(
+                    service._in_model
+                )
+    return current
+
+
+def partition_model(model: type, name: str) -> type:
+    """Subclass of `model` stored in the partition collection `name`."""
+    key = (model, name)
+    partition = _partition_models.get(key)
+    if partition is not None:
+        return partition
+    with _lock:
+        partition = _partition_models.get(key)
+        if partition is None:
+            # qualified under the model so pydantic ignores the nested class
+            config = type(
+                "Collection",
+                (model.Collection,),
+                {
+                    "collection": Collection(db=model.get_database(), name=name),
+                    "partitioning": None,
+                    "__module__": model.__module__,
+                    "__qualname__": f"{model.__qualname__}.Collection",
+                },
+            )
+            partition = _partition_models[key] = type(
+                model.__name__,
+                (model,),
+                {
+                    "Collection": config,
+                    "__module__": model.__module__,
+                    "__qualname__": model.__qualname__,
+                },
+            )
+    return partition
+
+
+def partition_service(service: type, name: str) -> type:
+    """Unregistered subclass of `service` bound to the partition `name`."""
+    services = service.__dict__.get("_partition_services")
+    partition = services.get(name) if services is not None else None
+    if partition is not None:
+        return partition
+    in_model = partition_model(service._in_model, name)
+    out_model = partition_model(service._out_model, name)
+    with _lock:
+        if "_partition_services" not in service.__dict__:
+            service._partition_services = {}
+        partition = service._partition_services.get(name)
+        if partition is None:
+            partition = service._partition_services[name] = type(
+                f"{service.__name__}_{name}",
+                (service,),
+                {
+                    "_in_model": in_model,
+                    "_out_model": out_model,
+                    "_partition": name,
+                    "__module__": service.__module__,
+                },
+                register=False,
+            )
+    return partition
+
+
+def group_by_partition(
+    model: Type[CollectionModel], documents: List[Dict[str, Any]]
+) -> Dict[str, List[Dict[str, Any]]]:
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for document in documents:
+        groups.setdefault(partition_of(model, document), []).append(document)
+    return groups
+
+
+def expired_partitions(
+    model: Type[CollectionModel], names: List[str], before: dt
+) -> List[str]:
+    # partitions whose whole period is before `before`
+    partitioning = get_partitioning(model)
+    before = ensure_utc_timezone(before)
+    return [
+        name
+        for name in names
+        if partitioning.end(partitioning.parse(model.get_collection(), name)) <= before
+    ]
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Set, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field
+from pymongo import UpdateMany, UpdateOne
+
+from ..constants import PyObjectId
+from ..models.collection import CollectionModel
+from ..utils import sort_key
+
+# set_value of a path the update does not $set
+UNSET = object()
+
+# updates per bulk_write of a fan-out
+FAN_OUT_BATCH = 1000
+
+logger = logging.getLogger("pymongex.snapshots")
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+# the last fan-out task of each event loop, the next one waits for it
+_last_tasks: "weakref.WeakKeyDictionary[Any, asyncio.Task]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class Snapshot(BaseModel):
+    """
+    Copy of some fields of a referenced document embedded in a model, so reads
+    need no $lookup. Declared per field in Collection.snapshots, e.g.
+    `snapshots = {"customer": Snapshot(source=Customer, local_field="customer_id",
+    fields=["name", "tier"])}`. The services fill it on create and update and
+    refresh it in the background when the source document is updated through
+    its service, see submit_fan_out.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    source: Type[CollectionModel]
+    local_field: str
+    fields: List[str]
+    foreign_field: str = "_id"
+
+    def projection(self) -> Dict[str, int]:
+        projection = {field: 1 for field in self.fields}
+        projection[self.foreign_field] = 1
+        return projection
+
+    def value(self, source: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # None when the referenced document does not exist
+        if source is None:
+            return None
+        return {field: source.get(field) for field in self.fields}
+
+    def is_source(self, model: Type[CollectionModel]) -> bool:
+        return (self.source.get_database(), self.source.get_collection()) == (
+            model.get_database(),
+            model.get_collection(),
+        )
+
+
+class SnapshotDrift(BaseModel):
+    field: str
+    checked: int = 0
+    # documents whose snapshot differs from their source
+    drifted: int = 0
+    # documents referencing a source that does not exist anymore
+    missing: int = 0
+    fixed: int = 0
+    # the first drifted or missing ids
+    sample_ids: List[PyObjectId] = Field(default_factory=list)
+
+
+SAMPLE_SIZE = 100
+
+
+def get_snapshots(model: Type[CollectionModel]) -> Dict[str, Snapshot]:
+    return getattr(model.Collection, "snapshots", None) or {}
+
+
+def snapshot_dependents(
+    services: List[type], source: Type[CollectionModel]
+) -> List[Tuple[type, str, Snapshot]]:
+    """The services, fields and snapshots copying documents of `source`."""
+    dependents = {}
+    for service in services:
+        model = getattr(service, "_in_model", None)
+        if model is None:
+            continue
+        for field, snapshot in get_snapshots(model).items():
+            if snapshot.is_source(source):
+                key = (model.get_database(), model.get_collection(), field)
+                dependents.setdefault(key, (service, field, snapshot))
+    return list(dependents.values())
+
+
+def local_values(documents: List[Dict[str, Any]], snapshot: Snapshot) -> List[Any]:
+    values = {}
+    for document in documents:
+        value = document.get(snapshot.local_field)
+        if value is not None:
+            values.setdefault(sort_key(value), value)
+    return list(values.values())
+
+
+def index_sources(
+    sources: List[Dict[str, Any]], snapshot: Snapshot
+) -> Dict[Tuple, Dict[str, Any]]:
+    return {sort_key(source.get(snapshot.foreign_field)): source for source in sources}
+
+
+def fill_documents(
+    documents: List[Dict[str, Any]],
+    field: str,
+    snapshot: Snapshot,
+    sources: Dict[Tuple, Dict[str, Any]],
+) -> None:
+    for document in documents:
+        value = document.get(snapshot.local_field)
+        source = sources.get(sort_key(value)) if value is not None else None
+        document[field] = snapshot.value(source)
+
+
+def set_value(update: Any, path: str) -> Any:
+    # the value an operator update sets `path` to
+    if not isinstance(update, dict):
+        return UNSET
+    return update.get("$set", {}).get(path, UNSET)
+
+
+def touched_fields(update: Any) -> Optional[Set[str]]:
+    """Top level fields an update writes, None when it can not be told."""
+    if not isinstance(update, dict):
+        return None
+    fields = set()
+    for operator, spec in update.items():
+        if not operator.startswith("$") or not isinstance(spec, dict):
+            return None
+        fields.update(path.split(".", 1)[0] for path in spec)
+    return fields
+
+
+def needs_fan_out(snapshot: Snapshot, update: Any) -> bool:
+    fields = touched_fields(update)
+    if fields is None:
+        return True
+    return bool(fields.intersection(snapshot.fields + [snapshot.foreign_field]))
+
+
+def fan_out_requests(
+    field: str, snapshot: Snapshot, sources: List[Dict[str, Any]], now: Any
+) -> List[UpdateMany]:
+    # one update_many per changed source, refreshing all its dependents
+    return [
+        UpdateMany(
+            {snapshot.local_field: source.get(snapshot.foreign_field)},
+            {"$set": {field: snapshot.value(source), "updated_at": now}},
+        )
+        for source in sources
+    ]
+
+
+def check_batch(
+    documents: List[Dict[str, Any]],
+    field: str,
+    snapshot: Snapshot,
+    sources: Dict[Tuple, Dict[str, Any]],
+    drift: SnapshotDrift,
+    now: Any,
+) -> List[UpdateOne]:
+    """Counts the drifted snapshots of a batch, returns the updates fixing them."""
+    fixes = []
+    for document in documents:
+        drift.checked += 1
+        value = document.get(snapshot.local_field)
+        source = sources.get(sort_key(value)) if value is not None else None
+        expected = snapshot.value(source)
+        if document.get(field) == expected:
+            continue
+        if value is not None and source is None:
+            drift.missing += 1
+        else:
+            drift.drifted += 1
+        if len(drift.sample_ids) < SAMPLE_SIZE:
+            drift.sample_ids.append(document["_id"])
+        fixes.append(
+            UpdateOne(
+                {"_id": document["_id"]},
+                {"$set": {field: expected, "updated_at": now}},
+            )
+        )
+    return fixes
+
+
+def _log_failure(future: Any) -> None:
+    if future.cancelled() or future.exception() is None:
+        return
+    logger.error(
+        "Snapshot fan-out failed, check_snapshots(fix=True) repairs the "
+        "dependents left behind",
+        exc_info=future.exception(),
+    )
+
+
+def submit_fan_out(fan_out: Callable[[], Any]) -> Future:
+    """
+    Runs a fan-out of the sync services after the source write returned, on
+    one thread so fan-outs of the same source apply in update order. A
+    failure is logged and left for check_snapshots. Pending fan-outs finish
+    at interpreter exit.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="pymongex-snapshots"
+            )
+    future = _executor.submit(fan_out)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def wait_fan_outs() -> None:
+    """Blocks until the fan-outs submitted so far are written."""
+    if _executor is not None:
+        _executor.submit(lambda: None).result()
+
+
+async def _after(previous: Optional[asyncio.Task], fan_out: Coroutine) -> None:
+    if previous is not None:
+        await asyncio.wait([previous])
+    await fan_out
+
+
+def schedule_fan_out(fan_out: Coroutine) -> asyncio.Task:
+    """The async counterpart of submit_fan_out, tasks run one after the other."""
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(_after(_last_tasks.get(loop), fan_out))
+    task.add_done_callback(_log_failure)
+    _last_tasks[loop] = task
+    return task
+
+
+async def wait_async_fan_outs() -> None:
+    """Waits for the fan-outs scheduled so far on the running loop."""
+    task = _last_tasks.get(asyncio.get_running_loop())
+    if task is not None:
+        await asyncio.wait([task])
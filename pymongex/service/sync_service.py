@@ -1,53 +1,187 @@
-from typing import Any, List, Optional, Type, Union
+import copy
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime as dt
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, Union
 
 from bson import ObjectId
 from pydantic import BaseModel
 
+from ..clients.changes import (
+    CHANGE_SORT,
+    ChangePage,
+    ChangeWatermark,
+    change_query,
+    check_incremental,
+    merge_changes,
+    tombstone_location,
+)
+from ..clients.read_policy import is_read_only_pipeline
+from ..clients.result_cache import invalidate_collection
 from ..clients.sync_client import SyncMongoClient
+from ..metrics.recording import instrumented
 from ..models.collection import (
     InCollectionModel,
     OutCollectionModel,
 )
+from ..models.compression import compressed_fields, compression_request
+from ..options import QueryOptions
 from ..pipelines import PipelineBuilder
-from .base_service import BaseService
+from ..utils import utc_now
+from .base_service import BaseService, LazyClient
+from .counters import (
+    CounterBuffer,
+    FlushSchedule,
+    flush_requests,
+    service_buffer,
+    shard_location,
+    sum_counters,
+    unwritten,
+)
+from .ids import order_by_ids, sort_models
+from .parallel import (
+    ScanCheckpoint,
+    apply_to_batch,
+    build_partition_queries,
+    build_split_pipeline,
+    model_key_value,
+    split_points_from_result,
+)
+from .partitions import (
+    catalog,
+    expired_partitions,
+    get_partitioning,
+    group_by_partition,
+    id_hint_first,
+    overlapping,
+    partition_of,
+    partition_service,
+)
+from .snapshots import (
+    FAN_OUT_BATCH,
+    UNSET,
+    Snapshot,
+    SnapshotDrift,
+    check_batch,
+    fan_out_requests,
+    fill_documents,
+    get_snapshots,
+    index_sources,
+    local_values,
+    needs_fan_out,
+    set_value,
+    snapshot_dependents,
+    submit_fan_out,
+    wait_fan_outs,
+)
+from .unit_of_work import current_unit_of_work
+from .upsert import UpsertMode, UpsertResult, build_upsert_requests
+from .views import (
+    RefreshSchedule,
+    ViewRefresh,
+    deleted_since,
+    finish_refresh,
+    overlap_since,
+    refresh_failed,
+    refresh_pipeline,
+    refreshes_incrementally,
+    state_location,
+    state_update,
+    state_watermark,
+    view_source,
+    view_source_field,
+)
 
 
 class SyncBaseService(BaseService):
-    _mongo_client: SyncMongoClient = SyncMongoClient()
+    _mongo_client: SyncMongoClient = LazyClient(SyncMongoClient)
     _in_model: Type[InCollectionModel]
     _out_model: Type[OutCollectionModel]
 
     @classmethod
+    @instrumented
     def create_one(
         cls,
         document: Union[dict, InCollectionModel, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
-        inserted_id = cls._mongo_client.insert_one(cls._in_model, document)
+        document = (cls._fill_snapshots([document]))[0]
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.create(cls, [document])[0]
+        inserted_id = cls._mongo_client.insert_one(
+            cls._in_model, document, options=options
+        )
         return cls.get_by_id(
             inserted_id,
             expand=expand,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     def create_many(
         cls,
         documents: List[Union[dict, InCollectionModel, BaseModel]],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> List[OutCollectionModel]:
-        inserted_ids = cls._mongo_client.insert_many(cls._in_model, documents)
+        documents = cls._fill_snapshots(documents)
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.create(cls, documents)
+        inserted_ids = cls._mongo_client.insert_many(
+            cls._in_model, documents, options=options
+        )
         return cls.get_by_ids(
             inserted_ids,
             expand=expand,
+            options=options,
         )
 
     @classmethod
+    @instrumented
+    def upsert_many(
+        cls,
+        records: List[Union[dict, InCollectionModel, BaseModel]],
+        key_fields: List[str],
+        mode: Union[str, UpsertMode] = UpsertMode.MERGE,
+        chunk_size: int = 1000,
+        options: QueryOptions = None,
+    ) -> UpsertResult:
+        """
+        Inserts or updates `records` matched on `key_fields`, as unordered
+        bulk writes of `chunk_size` upserts. "merge" writes the fields set on
+        each record, "replace" replaces the stored document. created_at is
+        only written on insert, updated_at on every write.
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size has to be a strict positive integer")
+        requests, indexes = build_upsert_requests(
+            cls._in_model, records, key_fields, mode
+        )
+        result = UpsertResult()
+        for start in range(0, len(requests), chunk_size):
+            end = start + chunk_size
+            bulk_result = cls._mongo_client.bulk_write(
+                cls._in_model, requests[start:end], ordered=False, options=options
+            )
+            result.add(bulk_result, indexes[start:end])
+        return result
+
+    @classmethod
+    @instrumented
     def get_one(
         cls,
         query: dict = {},
         sort: dict = None,
         expand: list[str] = None,
         skip: int = 0,
+        options: QueryOptions = None,
     ) -> Optional[OutCollectionModel]:
         return cls._mongo_client.find_one(
             cls._out_model,
@@ -55,17 +189,29 @@ class SyncBaseService(BaseService):
             sort=sort,
             expand=expand,
             skip=skip,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     def get_by_id(
         cls,
         id: Union[str, ObjectId],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> Optional[OutCollectionModel]:
-        return cls.get_one({"_id": ObjectId(id)}, expand=expand)
+        unit = current_unit_of_work()
+        if unit is not None:
+            model = unit.get_identity(cls._out_model, id, expand)
+            if model is not None:
+                return model
+        model = cls.get_one({"_id": ObjectId(id)}, expand=expand, options=options)
+        if unit is not None and model is not None:
+            model = unit.add_identity(model, expand)
+        return model
 
     @classmethod
+    @instrumented
     def get_many(
         cls,
         query: dict = {},
@@ -73,17 +219,79 @@ class SyncBaseService(BaseService):
         skip: int = 0,
         limit: int = None,
         expand: List[str] = None,
+        options: QueryOptions = None,
     ) -> List[OutCollectionModel]:
-        return cls._mongo_client.find_many(
-            cls._out_model,
-            query,
-            sort=sort,
-            skip=skip,
-            limit=limit,
-            expand=expand,
+        def load() -> List[OutCollectionModel]:
+            return cls._mongo_client.find_many(
+                cls._out_model,
+                query,
+                sort=sort,
+                skip=skip,
+                limit=limit,
+                expand=expand,
+                options=options,
+            )
+
+        if cls._cache is None:
+            return load()
+        pipeline = cls._mongo_client._prepare_find_pipeline(
+            cls._out_model, query, sort=sort, skip=skip, limit=limit, expand=expand
         )
+        key, collections = cls._cache_entry("get_many", pipeline, options)
+        return cls._cache.get_or_load(key, collections, load)
+
+    @classmethod
+    def _map_chunks(
+        cls,
+        fn: Callable[[List[ObjectId]], Any],
+        chunks: List[List[ObjectId]],
+        max_concurrency: Optional[int] = None,
+    ) -> Iterator[Any]:
+        # fn(chunk) in chunk order, at most max_concurrency chunks in flight
+        if len(chunks) <= 1:
+            yield from map(fn, chunks)
+            return
+        workers = min(max_concurrency or cls._id_chunk_concurrency, len(chunks))
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for chunk in chunks:
+                    pending.append(executor.submit(copy_context().run, fn, chunk))
+                    if len(pending) >= workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @classmethod
+    def stream_by_ids(
+        cls,
+        ids: List[Union[str, ObjectId]],
+        expand: List[str] = None,
+        options: QueryOptions = None,
+        preserve_order: bool = False,
+        chunk_size: int = None,
+        max_concurrency: int = None,
+    ) -> Iterator[List[OutCollectionModel]]:
+        """
+        Yields the models of the deduplicated `ids` one chunk of `chunk_size`
+        ids at a time, in chunk order, reading up to `max_concurrency` chunks
+        concurrently. With `preserve_order` the models follow the order of ids.
+        """
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+
+        def read(chunk: List[ObjectId]) -> List[OutCollectionModel]:
+            models = cls.get_many(
+                {"_id": {"$in": chunk}}, expand=expand, options=options
+            )
+            return order_by_ids(models, chunk) if preserve_order else models
+
+        yield from cls._map_chunks(read, chunks, max_concurrency)
 
     @classmethod
+    @instrumented
     def get_by_ids(
         cls,
         ids: List[Union[str, ObjectId]],
@@ -91,115 +299,410 @@ class SyncBaseService(BaseService):
         skip: int = 0,
         limit: int = None,
         expand: List[str] = None,
+        options: QueryOptions = None,
+        preserve_order: bool = False,
+        chunk_size: int = None,
+        max_concurrency: int = None,
     ) -> List[OutCollectionModel]:
-        return cls.get_many(
-            {"_id": {"$in": [ObjectId(id) for id in ids]}},
-            sort=sort,
-            skip=skip,
-            limit=limit,
-            expand=expand,
-        )
+        """
+        Models of `ids`, read in concurrent queries of `chunk_size` ids past
+        that size. `sort`, `skip` and `limit` apply to the merged result.
+        `preserve_order` returns the models in the order of ids instead.
+        """
+        if preserve_order and sort:
+            raise ValueError("preserve_order and sort cannot be combined")
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+        if len(chunks) <= 1:
+            models = cls.get_many(
+                {"_id": {"$in": ids}},
+                sort=sort,
+                skip=skip,
+                limit=limit,
+                expand=expand,
+                options=options,
+            )
+            return order_by_ids(models, ids) if preserve_order else models
+        # every chunk may hold the first skip + limit models
+        chunk_limit = skip + limit if limit is not None else None
+
+        def read(chunk: List[ObjectId]) -> List[OutCollectionModel]:
+            return cls.get_many(
+                {"_id": {"$in": chunk}},
+                sort=sort,
+                limit=chunk_limit,
+                expand=expand,
+                options=options,
+            )
+
+        models = [
+            model
+            for chunk_models in cls._map_chunks(read, chunks, max_concurrency)
+            for model in chunk_models
+        ]
+        if preserve_order:
+            models = order_by_ids(models, ids)
+        elif sort:
+            sort_models(models, sort)
+        return models[skip : skip + limit if limit is not None else None]
 
     @classmethod
+    @instrumented
     def update_one(
         cls,
         query: dict,
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
-        update = cls._prepare_update(update)
-        cls._mongo_client.update_one(cls._in_model, query, update)
-        return cls.get_one(query, expand=expand)
+        update = cls._snapshot_update(cls._prepare_update(update))
+        targets = cls._fan_out_targets(update)
+        ids = cls._source_ids(query, many=False) if targets else []
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.update(cls, query, update, fan_out=(targets, ids))
+        cls._mongo_client.update_one(cls._in_model, query, update, options=options)
+        cls._fan_out(targets, ids)
+        return cls.get_one(query, expand=expand, options=options)
 
     @classmethod
+    @instrumented
     def update(
         cls,
         model: OutCollectionModel,
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
-        return cls.update_one(
-            {"_id": model.id},
-            model.model_dump(),
-            expand=expand,
+        """
+        Writes the fields changed since `model` was loaded and returns the
+        stored document. Returns `model` itself without a round trip when
+        nothing changed.
+        """
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.update_model(cls, model)
+        query, update = cls._prepare_model_update(model)
+        if update is None:
+            return model
+        update = cls._snapshot_update(update)
+        targets = cls._fan_out_targets(update)
+        modified = cls._mongo_client.update_one(
+            cls._in_model, query, update, options=options
         )
+        cls._finish_model_update(model, query, modified)
+        cls._fan_out(targets, [model.id])
+        return cls.get_by_id(model.id, expand=expand, options=options)
 
     @classmethod
+    @instrumented
     def update_by_id(
         cls,
         id: Union[str, ObjectId],
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> OutCollectionModel:
         return cls.update_one(
             {"_id": ObjectId(id)},
             update,
             expand=expand,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     def update_many(
         cls,
         query: dict,
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
     ) -> List[OutCollectionModel]:
-        update = cls._prepare_update(update)
-        cls._mongo_client.update_many(cls._in_model, query, update)
+        update = cls._snapshot_update(cls._prepare_update(update))
+        targets = cls._fan_out_targets(update)
+        ids = cls._source_ids(query, many=True) if targets else []
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.update(cls, query, update, many=True, fan_out=(targets, ids))
+        cls._mongo_client.update_many(cls._in_model, query, update, options=options)
+        cls._fan_out(targets, ids)
         return cls.get_many(
             query,
             expand=expand,
+            options=options,
         )
 
     @classmethod
+    @instrumented
     def update_by_ids(
         cls,
         ids: List[Union[str, ObjectId]],
         update: Union[dict, BaseModel],
         expand: list[str] = None,
+        options: QueryOptions = None,
+        preserve_order: bool = False,
+        chunk_size: int = None,
+        max_concurrency: int = None,
     ) -> List[OutCollectionModel]:
-        return cls.update_many(
-            {"_id": {"$in": [ObjectId(id) for id in ids]}},
-            update,
-            expand=expand,
-        )
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+        # a unit of work batches the update anyway, it is recorded once
+        if len(chunks) <= 1 or current_unit_of_work() is not None:
+            models = cls.update_many(
+                {"_id": {"$in": ids}}, update, expand=expand, options=options
+            )
+            if preserve_order and isinstance(models, list):
+                return order_by_ids(models, ids)
+            return models
+        update = cls._prepare_update(update)
+
+        def write(chunk: List[ObjectId]) -> List[OutCollectionModel]:
+            # the client adds updated_at to the update, each chunk gets a copy
+            return cls.update_many(
+                {"_id": {"$in": chunk}},
+                copy.deepcopy(update),
+                expand=expand,
+                options=options,
+            )
+
+        models = [
+            model
+            for chunk_models in cls._map_chunks(write, chunks, max_concurrency)
+            for model in chunk_models
+        ]
+        return order_by_ids(models, ids) if preserve_order else models
 
     @classmethod
-    def delete(cls, model: OutCollectionModel) -> int:
-        return cls.delete_by_id(model.id)
+    @instrumented
+    def delete(cls, model: OutCollectionModel, options: QueryOptions = None) -> int:
+        return cls.delete_by_id(model.id, options=options)
 
     @classmethod
-    def delete_one(cls, query: dict) -> int:
-        return cls._mongo_client.delete_one(cls._in_model, query)
+    @instrumented
+    def delete_one(cls, query: dict, options: QueryOptions = None) -> int:
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.delete(cls, query)
+        return cls._mongo_client.delete_one(cls._in_model, query, options=options)
 
     @classmethod
-    def delete_by_id(cls, id: Union[str, ObjectId]) -> int:
-        return cls.delete_one({"_id": ObjectId(id)})
+    @instrumented
+    def delete_by_id(
+        cls, id: Union[str, ObjectId], options: QueryOptions = None
+    ) -> int:
+        return cls.delete_one({"_id": ObjectId(id)}, options=options)
 
     @classmethod
-    def delete_many(cls, query: dict) -> int:
-        return cls._mongo_client.delete_many(cls._in_model, query)
+    @instrumented
+    def delete_many(cls, query: dict, options: QueryOptions = None) -> int:
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.delete(cls, query, many=True)
+        return cls._mongo_client.delete_many(cls._in_model, query, options=options)
 
     @classmethod
-    def delete_by_ids(cls, ids: List[Union[str, ObjectId]]) -> int:
-        return cls.delete_many({"_id": {"$in": [ObjectId(id) for id in ids]}})
+    @instrumented
+    def delete_by_ids(
+        cls,
+        ids: List[Union[str, ObjectId]],
+        options: QueryOptions = None,
+        chunk_size: int = None,
+        max_concurrency: int = None,
+    ) -> int:
+        ids, chunks = cls._chunk_ids(ids, chunk_size)
+        if len(chunks) <= 1 or current_unit_of_work() is not None:
+            return cls.delete_many({"_id": {"$in": ids}}, options=options)
+
+        def delete(chunk: List[ObjectId]) -> int:
+            return cls.delete_many({"_id": {"$in": chunk}}, options=options)
+
+        return sum(cls._map_chunks(delete, chunks, max_concurrency))
 
     @classmethod
-    def count(cls, query: dict) -> int:
-        return cls._mongo_client.count(cls._in_model, query)
+    @instrumented
+    def count(cls, query: dict, options: QueryOptions = None) -> int:
+        return cls._mongo_client.count(cls._in_model, query, options=options)
 
     @classmethod
+    @instrumented
     def aggregate(
-        cls, pipeline: List[dict], parse: bool = False
+        cls,
+        pipeline: List[dict],
+        parse: bool = False,
+        options: QueryOptions = None,
     ) -> Union[List[OutCollectionModel], List[Union[dict, Any]]]:
-        return cls._mongo_client.aggregate(cls._out_model, pipeline, parse=parse)
+        def load() -> Union[List[OutCollectionModel], List[Union[dict, Any]]]:
+            return cls._mongo_client.aggregate(
+                cls._out_model, pipeline, parse=parse, options=options
+            )
+
+        if cls._cache is None or not is_read_only_pipeline(pipeline):
+            return load()
+        key, collections = cls._cache_entry("aggregate", pipeline, options, parse)
+        return cls._cache.get_or_load(key, collections, load)
+
+    @classmethod
+    def changes_since(
+        cls,
+        watermark: Optional[ChangeWatermark] = None,
+        batch_size: int = 1000,
+        settle_seconds: float = 2.0,
+        options: QueryOptions = None,
+    ) -> Iterator[ChangePage]:
+        """
+        Pages of the documents inserted, updated or deleted after `watermark`,
+        in (updated_at, _id) order. Persist the watermark of a page once it is
+        processed and pass it back to resume, None starts from the beginning.
+        Needs Collection.incremental_sync on the model, see
+        ensure_change_indexes for the indexes keeping this proportional to
+        the number of changes.
+        """
+        check_incremental(cls._in_model)
+        tombstones = cls._mongo_client._get_collection_client(
+            tombstone_location(cls._in_model)
+        )
+        while True:
+            query = change_query(watermark, settle_seconds, utc_now())
+            documents = cls.get_many(
+                query, sort=CHANGE_SORT, limit=batch_size, options=options
+            )
+            cursor = tombstones.find(query).sort(list(CHANGE_SORT.items()))
+            deleted = list(cursor.limit(batch_size))
+            page = merge_changes(documents, deleted, batch_size, watermark)
+            if len(page):
+                yield page
+            if len(page) < batch_size:
+                return
+            watermark = page.watermark
+
+    @classmethod
+    def ensure_change_indexes(cls, tombstone_ttl_seconds: Optional[int] = None):
+        """
+        Indexes changes_since pages on. Tombstones older than
+        `tombstone_ttl_seconds` expire, a consumer further behind has to
+        resync from scratch.
+        """
+        keys = list(CHANGE_SORT.items())
+        client = cls._mongo_client
+        client._get_collection_client(cls._in_model).create_index(keys)
+        tombstones = client._get_collection_client(tombstone_location(cls._in_model))
+        tombstones.create_index(keys)
+        if tombstone_ttl_seconds is not None:
+            tombstones.create_index(
+                "deleted_at", expireAfterSeconds=tombstone_ttl_seconds
+            )
+
+    @classmethod
+    def _counter_buffer(cls) -> CounterBuffer:
+        buffer, created = service_buffer(cls)
+        if created:
+            buffer.schedule = FlushSchedule(
+                cls.flush_counters, buffer.flush_seconds, cls._in_model.__name__
+            )
+        return buffer
+
+    @classmethod
+    def increment_counters(
+        cls, id: Union[str, ObjectId], increments: Dict[str, Union[int, float]]
+    ) -> None:
+        """
+        Buffers $inc `increments` of a document, written with the other
+        pending increments of the model by the next flush, see CounterBuffer.
+        """
+        buffer = cls._counter_buffer()
+        if buffer.add(ObjectId(id), increments):
+            cls.flush_counters()
+
+    @classmethod
+    def flush_counters(cls) -> int:
+        """Writes the pending increments, returns the number of documents."""
+        buffer = cls._counter_buffer()
+        pending, since = buffer.take()
+        if not pending:
+            return 0
+        start = time.perf_counter()
+        try:
+            requests = flush_requests(buffer, pending)
+            if buffer.shards > 1:
+                shards = cls._mongo_client._get_collection_client(
+                    shard_location(cls._in_model)
+                )
+                shards.bulk_write(requests, ordered=False)
+            else:
+                cls._mongo_client.bulk_write(cls._in_model, requests, ordered=False)
+        except Exception as error:
+            buffer.restore(unwritten(pending, error), since, error)
+            raise
+        buffer.flushed(len(pending), since, time.perf_counter() - start)
+        return len(pending)
 
     @classmethod
+    def get_counters(
+        cls, id: Union[str, ObjectId], fields: List[str]
+    ) -> Dict[str, Union[int, float]]:
+        """
+        Totals of counter fields of a document: its stored values, its shard
+        documents and the increments this process has not flushed yet.
+        """
+        id = ObjectId(id)
+        buffer = cls._counter_buffer()
+        projection = {field: 1 for field in fields}
+        client = cls._mongo_client
+        documents = [
+            client._get_collection_client(cls._in_model).find_one(
+                {"_id": id}, projection
+            )
+        ]
+        if buffer.shards > 1:
+            shards = client._get_collection_client(shard_location(cls._in_model))
+            documents += list(shards.find({"counter_of": id}, projection))
+        return sum_counters(fields, documents, buffer.pending(id))
+
+    @classmethod
+    def ensure_counter_indexes(cls) -> None:
+        """Indexes get_counters reads the shard documents with."""
+        location = shard_location(cls._in_model)
+        cls._mongo_client._get_collection_client(location).create_index("counter_of")
+
+    @classmethod
+    def compress_fields(cls, query: dict = {}, batch_size: int = 1000) -> int:
+        """
+        Compresses the marked fields of the stored documents matching
+        `query`, e.g. ones written before the fields were marked, with
+        unordered bulk writes of `batch_size` updates. Returns the number of
+        documents rewritten.
+        """
+        fields = compressed_fields(cls._in_model)
+        if not fields:
+            return 0
+        collection = cls._mongo_client._get_collection_client(cls._in_model)
+        cursor = collection.find(query, {name: 1 for name in fields}).sort("_id", 1)
+        rewritten = 0
+        requests = []
+        for document in cursor:
+            request = compression_request(cls._in_model, document)
+            if request is not None:
+                requests.append(request)
+            if len(requests) >= batch_size:
+                result = cls._mongo_client.bulk_write(
+                    cls._in_model, requests, ordered=False
+                )
+                rewritten += result.modified_count
+                requests = []
+        if requests:
+            result = cls._mongo_client.bulk_write(
+                cls._in_model, requests, ordered=False
+            )
+            rewritten += result.modified_count
+        return rewritten
+
+    @classmethod
+    @instrumented
     def get_only_ids(
         cls,
         query: dict = {},
         sort: dict = None,
         skip: int = 0,
         limit: int = None,
+        options: QueryOptions = None,
     ) -> List[ObjectId]:
 
         pipeline = PipelineBuilder.build_simple_pipeline(
@@ -210,5 +713,685 @@ class SyncBaseService(BaseService):
             project={"_id": 1},
         )
 
-        documents = cls.aggregate(pipeline)
+        documents = cls.aggregate(pipeline, options=options)
         return [doc["_id"] for doc in documents]
+
+    @classmethod
+    def iter_many(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        skip: int = 0,
+        limit: int = None,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> Iterator[OutCollectionModel]:
+        """
+        get_many as an iterator, read past the cache. With the STREAM result
+        limit action a result exceeding the limits is streamed from the cursor.
+        """
+        return cls._mongo_client.iter_many(
+            cls._out_model,
+            query,
+            sort=sort,
+            skip=skip,
+            limit=limit,
+            expand=expand,
+            options=options,
+        )
+
+    @classmethod
+    def stream_batches(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> Iterator[List[OutCollectionModel]]:
+        return cls._mongo_client.find_batches(
+            cls._out_model,
+            query,
+            sort=sort,
+            batch_size=batch_size,
+            expand=expand,
+            options=options,
+        )
+
+    @classmethod
+    def stream(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> Iterator[OutCollectionModel]:
+        for batch in cls.stream_batches(
+            query, sort=sort, batch_size=batch_size, expand=expand, options=options
+        ):
+            yield from batch
+
+    @classmethod
+    def split_points(
+        cls,
+        query: dict = {},
+        partitions: int = 4,
+        key: str = "_id",
+        method: str = "bucket_auto",
+        sample_size: int = None,
+        options: QueryOptions = None,
+    ) -> List[Any]:
+        pipeline = build_split_pipeline(query, key, partitions, method, sample_size)
+        documents = cls.aggregate(pipeline, options=options)
+        return split_points_from_result(documents, partitions, method)
+
+    @classmethod
+    def _scan_partition(
+        cls,
+        index: int,
+        query: dict,
+        key: str,
+        batch_size: int,
+        expand: List[str],
+        on_batch: Optional[Callable[[int, List[OutCollectionModel]], Any]],
+        options: QueryOptions,
+    ) -> List[Any]:
+        results = []
+        # sorted on the key so the last key of a batch is a valid resume point
+        for batch in cls.stream_batches(
+            query,
+            sort={key: 1},
+            batch_size=batch_size,
+            expand=expand,
+            options=options,
+        ):
+            if on_batch is None:
+                results.extend(batch)
+            else:
+                results.append(on_batch(index, batch))
+        return results
+
+    @classmethod
+    def parallel_scan(
+        cls,
+        query: dict = {},
+        partitions: int = 4,
+        key: str = "_id",
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        on_batch: Optional[Callable[[int, List[OutCollectionModel]], Any]] = None,
+        method: str = "bucket_auto",
+        split_points: Optional[List[Any]] = None,
+        options: QueryOptions = None,
+    ) -> List[Any]:
+        """
+        Splits the `key` range of the matching documents into partitions and reads
+        them concurrently on a thread pool. Returns the models ordered by key, or
+        the results of `on_batch(partition_index, batch)` if it is given.
+        """
+        if split_points is None:
+            split_points = cls.split_points(
+                query, partitions, key=key, method=method, options=options
+            )
+        queries = build_partition_queries(query, key, split_points)
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            futures = [
+                executor.submit(
+                    cls._scan_partition,
+                    index,
+                    partition_query,
+                    key,
+                    batch_size,
+                    expand,
+                    on_batch,
+                    options,
+                )
+                for index, partition_query in enumerate(queries)
+            ]
+            return [result for future in futures for result in future.result()]
+
+    @classmethod
+    def map_collection(
+        cls,
+        fn: Callable[[List[OutCollectionModel]], Any],
+        query: dict = {},
+        processes: int = None,
+        partitions: int = None,
+        key: str = "_id",
+        batch_size: int = 1000,
+        expand: List[str] = None,
+        checkpoint_path: str = None,
+        method: str = "bucket_auto",
+        options: QueryOptions = None,
+    ) -> List[Any]:
+        """
+        Runs `fn` on every batch of models in a process pool and returns the
+        results. `fn` has to be picklable (a module level function). With a
+        checkpoint_path, finished batches are recorded per partition and a
+        rerun only processes what is left.
+        """
+        processes = processes or os.cpu_count()
+        partitions = partitions or processes
+        checkpoint = ScanCheckpoint(checkpoint_path) if checkpoint_path else None
+
+        split_points = checkpoint.split_points if checkpoint else None
+        if split_points is None:
+            split_points = cls.split_points(
+                query, partitions, key=key, method=method, options=options
+            )
+            if checkpoint:
+                checkpoint.set_split_points(split_points)
+        resume_after = checkpoint.resume_after() if checkpoint else None
+        queries = build_partition_queries(query, key, split_points, resume_after)
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+
+            def on_batch(index: int, batch: List[OutCollectionModel]) -> Any:
+                result = pool.submit(apply_to_batch, fn, batch).result()
+                if checkpoint:
+                    checkpoint.advance(index, model_key_value(batch[-1], key))
+                return result
+
+            def run_partition(index: int, partition_query: dict) -> List[Any]:
+                if checkpoint and checkpoint.is_done(index):
+                    return []
+                results = cls._scan_partition(
+                    index, partition_query, key, batch_size, expand, on_batch, options
+                )
+                if checkpoint:
+                    checkpoint.finish(index)
+                return results
+
+            with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                futures = [
+                    executor.submit(run_partition, index, partition_query)
+                    for index, partition_query in enumerate(queries)
+                ]
+                return [result for future in futures for result in future.result()]
+
+    @classmethod
+    def _load_sources(cls, snapshot: Snapshot, query: dict) -> List[dict]:
+        collection = cls._mongo_client._get_collection_client(snapshot.source)
+        return list(collection.find(query, snapshot.projection()))
+
+    @classmethod
+    def _fill_snapshots(cls, documents: List[Any]) -> List[Any]:
+        snapshots = get_snapshots(cls._in_model)
+        if not snapshots:
+            return documents
+        documents = cls._mongo_client._prepare_insert_documents(
+            cls._in_model, documents
+        )
+        for field, snapshot in snapshots.items():
+            values = local_values(documents, snapshot)
+            sources = []
+            if values:
+                query = {snapshot.foreign_field: {"$in": values}}
+                sources = cls._load_sources(snapshot, query)
+            fill_documents(documents, field, snapshot, index_sources(sources, snapshot))
+        return documents
+
+    @classmethod
+    def _snapshot_update(cls, update: dict) -> dict:
+        # an update changing a reference also writes the new snapshot
+        for field, snapshot in get_snapshots(cls._in_model).items():
+            value = set_value(update, snapshot.local_field)
+            if value is UNSET:
+                continue
+            sources = []
+            if value is not None:
+                query = {snapshot.foreign_field: value}
+                sources = cls._load_sources(snapshot, query)
+            update["$set"][field] = snapshot.value(sources[0] if sources else None)
+        return update
+
+    @classmethod
+    def _fan_out_targets(cls, update: Any) -> List[Tuple[type, str, Snapshot]]:
+        services = SyncBaseService.get_registered_services()
+        return [
+            (service, field, snapshot)
+            for service, field, snapshot in snapshot_dependents(services, cls._in_model)
+            if needs_fan_out(snapshot, update)
+        ]
+
+    @classmethod
+    def _source_ids(cls, query: dict, many: bool) -> List[Any]:
+        # read before the update, which may make the query stop matching
+        collection = cls._mongo_client._get_collection_client(cls._in_model)
+        cursor = collection.find(query, {"_id": 1})
+        if not many:
+            cursor = cursor.limit(1)
+        return [document["_id"] for document in cursor]
+
+    @classmethod
+    def _fan_out(
+        cls, targets: List[Tuple[type, str, Snapshot]], ids: List[Any]
+    ) -> None:
+        # in the background, the caller's write does not wait for dependents
+        if targets and ids:
+            submit_fan_out(lambda: cls._write_fan_out(targets, ids))
+
+    @classmethod
+    def _write_fan_out(
+        cls, targets: List[Tuple[type, str, Snapshot]], ids: List[Any]
+    ) -> None:
+        """Refreshes the snapshots of the documents `ids` in their dependents."""
+        now = utc_now()
+        for service, field, snapshot in targets:
+            sources = cls._load_sources(snapshot, {"_id": {"$in": ids}})
+            requests = fan_out_requests(field, snapshot, sources, now)
+            for start in range(0, len(requests), FAN_OUT_BATCH):
+                service._mongo_client.bulk_write(
+                    service._in_model,
+                    requests[start : start + FAN_OUT_BATCH],
+                    ordered=False,
+                )
+
+    @classmethod
+    def wait_fan_outs(cls) -> None:
+        """Waits for the snapshot fan-outs of the updates made so far."""
+        wait_fan_outs()
+
+    @classmethod
+    def check_snapshots(
+        cls, fix: bool = False, batch_size: int = 1000
+    ) -> List[SnapshotDrift]:
+        """
+        Compares the snapshots of every document with their sources, per
+        snapshot field. `fix` rewrites the drifted ones, e.g. after sources
+        were changed without going through their service.
+        """
+        collection = cls._mongo_client._get_collection_client(cls._in_model)
+        reports = []
+        for field, snapshot in get_snapshots(cls._in_model).items():
+            drift = SnapshotDrift(field=field)
+            projection = {snapshot.local_field: 1, field: 1}
+            cursor = collection.find({}, projection).sort("_id", 1)
+            documents = []
+            for document in cursor:
+                documents.append(document)
+                if len(documents) >= batch_size:
+                    cls._check_snapshot_batch(documents, field, snapshot, drift, fix)
+                    documents = []
+            if documents:
+                cls._check_snapshot_batch(documents, field, snapshot, drift, fix)
+            reports.append(drift)
+        return reports
+
+    @classmethod
+    def _check_snapshot_batch(
+        cls,
+        documents: List[dict],
+        field: str,
+        snapshot: Snapshot,
+        drift: SnapshotDrift,
+        fix: bool,
+    ) -> None:
+        values = local_values(documents, snapshot)
+        sources = []
+        if values:
+            query = {snapshot.foreign_field: {"$in": values}}
+            sources = cls._load_sources(snapshot, query)
+        sources = index_sources(sources, snapshot)
+        fixes = check_batch(documents, field, snapshot, sources, drift, utc_now())
+        if fix and fixes:
+            result = cls._mongo_client.bulk_write(cls._in_model, fixes, ordered=False)
+            drift.fixed += result.modified_count
+
+
+class SyncViewService(SyncBaseService):
+    """
+    Service of a materialized view. The Collection of its model declares the
+    view_source model and the view_pipeline run on it, reads go to the view
+    collection like for any other model and refresh() brings it up to date.
+    """
+
+    @classmethod
+    def _state_collection(cls):
+        return cls._mongo_client._get_collection_client(state_location(cls._out_model))
+
+    @classmethod
+    def get_watermark(cls) -> Optional[dt]:
+        """Source changes up to the watermark are in the view, None before a build."""
+        state = cls._state_collection().find_one(
+            {"_id": cls._out_model.get_collection()}
+        )
+        return state_watermark(state)
+
+    @classmethod
+    def refresh(cls, full: bool = False, options: QueryOptions = None) -> ViewRefresh:
+        """
+        Builds the view on the first call or with `full`, afterwards only the
+        source documents changed since the watermark are reprocessed and the
+        view documents of the deleted ones removed, when the view allows it,
+        see refreshes_incrementally. Refresh more often than the tombstones
+        of the source expire, deletes older than them are missed.
+        """
+        model = cls._out_model
+        previous = cls.get_watermark()
+        full = full or previous is None or not refreshes_incrementally(model)
+        started_at = utc_now()
+        start = time.perf_counter()
+        removed = 0
+        try:
+            pipeline = refresh_pipeline(model, None if full else previous)
+            cls._mongo_client.aggregate(view_source(model), pipeline, options=options)
+            if not full:
+                removed = cls._remove_deleted(previous)
+        except Exception as error:
+            refresh_failed(model, error)
+            raise
+        duration = time.perf_counter() - start
+        refresh = finish_refresh(model, full, started_at, duration, previous, removed)
+        cls._state_collection().update_one(
+            {"_id": model.get_collection()}, state_update(refresh), upsert=True
+        )
+        return refresh
+
+    @classmethod
+    def _remove_deleted(cls, watermark: dt) -> int:
+        model = cls._out_model
+        source = view_source(model)
+        client = cls._mongo_client
+        tombstones = client._get_collection_client(tombstone_location(source))
+        query = deleted_since(overlap_since(model, watermark))
+        cursor = tombstones.find(query, {"_id": 1})
+        ids = [document["_id"] for document in cursor]
+        if not ids:
+            return 0
+        # a tombstone outlives its document when the delete failed after it
+        cursor = client._get_collection_client(source).find(
+            {"_id": {"$in": ids}}, {"_id": 1}
+        )
+        live = {document["_id"] for document in cursor}
+        ids = [id for id in ids if id not in live]
+        if not ids:
+            return 0
+        view = client._get_collection_client(model)
+        result = view.delete_many({view_source_field(model): {"$in": ids}})
+        invalidate_collection(model.get_database(), model.get_collection())
+        return result.deleted_count
+
+    @classmethod
+    def view_lag(cls) -> Optional[float]:
+        """Seconds of source changes the view may be missing, None before a build."""
+        watermark = cls.get_watermark()
+        if watermark is None:
+            return None
+        return (utc_now() - watermark).total_seconds()
+
+    @classmethod
+    def schedule_refresh(cls, interval_seconds: float) -> RefreshSchedule:
+        """Refreshes the view every `interval_seconds` until the schedule is stopped."""
+        return RefreshSchedule(cls.refresh, interval_seconds, cls._out_model.__name__)
+
+
+class SyncPartitionedService(SyncBaseService):
+    """
+    Service of a model whose Collection declares a `partitioning`, see
+    Partitioning. Inserts go to the partition of their document. Reads,
+    counts, updates and deletes only visit the partitions overlapping the
+    range the query sets on the partitioning field, sorted and limited
+    results are merged here. Other methods, e.g. aggregate, upsert_many or
+    stream, act on the unpartitioned base collection.
+    """
+
+    # set on the per partition subclasses, which behave as plain services
+    _partition: Optional[str] = None
+
+    @classmethod
+    def list_partitions(cls, refresh: bool = False) -> List[str]:
+        """The existing partitions, oldest first."""
+        partitions = catalog(cls)
+        names = None if refresh else partitions.cached()
+        if names is None:
+            database = cls._mongo_client._get_database_client(
+                cls._in_model.get_database()
+            )
+            names = partitions.load(database.list_collection_names())
+        return names
+
+    @classmethod
+    def partition_service(cls, name: str) -> Type["SyncPartitionedService"]:
+        return partition_service(cls, name)
+
+    @classmethod
+    def _services(cls, query: dict) -> List[Type["SyncPartitionedService"]]:
+        names = overlapping(cls._in_model, cls.list_partitions(), query)
+        return [cls.partition_service(name) for name in names]
+
+    @classmethod
+    def _find_service(cls, query: dict) -> Optional[Type["SyncPartitionedService"]]:
+        # the partition of the first document matching `query`
+        for service in cls._services(query):
+            if service.get_one(query) is not None:
+                return service
+        return None
+
+    @classmethod
+    def _model_service(
+        cls, model: OutCollectionModel
+    ) -> Type["SyncPartitionedService"]:
+        # models read through this service are instances of a partition model
+        name = type(model).get_collection()
+        collection = cls._in_model.get_collection()
+        partitioning = get_partitioning(cls._in_model)
+        if partitioning.parse(collection, name) is None:
+            value = getattr(model, partitioning.field, None)
+            name = partition_of(cls._in_model, {partitioning.field: value})
+        return cls.partition_service(name)
+
+    @classmethod
+    @instrumented
+    def create_one(
+        cls,
+        document: Union[dict, InCollectionModel, BaseModel],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> OutCollectionModel:
+        if cls._partition is not None:
+            return super().create_one(document, expand=expand, options=options)
+        return cls.create_many([document], expand=expand, options=options)[0]
+
+    @classmethod
+    @instrumented
+    def create_many(
+        cls,
+        documents: List[Union[dict, InCollectionModel, BaseModel]],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> List[OutCollectionModel]:
+        if cls._partition is not None:
+            return super().create_many(documents, expand=expand, options=options)
+        documents = cls._mongo_client._prepare_insert_documents(
+            cls._in_model, documents
+        )
+        # ids are set here to return the models in the order of `documents`
+        for document in documents:
+            if document.get("_id") is None:
+                document["_id"] = ObjectId()
+        models = []
+        for name, group in group_by_partition(cls._in_model, documents).items():
+            service = cls.partition_service(name)
+            models += service.create_many(group, expand=expand, options=options)
+            catalog(cls).add(name)
+        return order_by_ids(models, [document["_id"] for document in documents])
+
+    @classmethod
+    @instrumented
+    def get_one(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        expand: list[str] = None,
+        skip: int = 0,
+        options: QueryOptions = None,
+    ) -> Optional[OutCollectionModel]:
+        if cls._partition is not None:
+            return super().get_one(
+                query, sort=sort, expand=expand, skip=skip, options=options
+            )
+        models = cls.get_many(
+            query, sort=sort, skip=skip, limit=1, expand=expand, options=options
+        )
+        return models[0] if models else None
+
+    @classmethod
+    @instrumented
+    def get_by_id(
+        cls,
+        id: Union[str, ObjectId],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> Optional[OutCollectionModel]:
+        if cls._partition is not None:
+            return super().get_by_id(id, expand=expand, options=options)
+        id = ObjectId(id)
+        for name in id_hint_first(cls._in_model, cls.list_partitions(), id):
+            service = cls.partition_service(name)
+            model = service.get_by_id(id, expand=expand, options=options)
+            if model is not None:
+                return model
+        return None
+
+    @classmethod
+    @instrumented
+    def get_many(
+        cls,
+        query: dict = {},
+        sort: dict = None,
+        skip: int = 0,
+        limit: int = None,
+        expand: List[str] = None,
+        options: QueryOptions = None,
+    ) -> List[OutCollectionModel]:
+        if cls._partition is not None:
+            return super().get_many(
+                query, sort=sort, skip=skip, limit=limit, expand=expand, options=options
+            )
+        services = cls._services(query)
+        # each partition returns its first skip + limit documents
+        window = None if limit is None else skip + limit
+        field = get_partitioning(cls._in_model).field
+        if sort and next(iter(sort)) == field:
+            # partitions are in sort order, read until the window is full
+            if next(iter(sort.values())) < 0:
+                services = services[::-1]
+            models = []
+            for service in services:
+                models += service.get_many(
+                    query,
+                    sort=sort,
+                    limit=None if window is None else window - len(models),
+                    expand=expand,
+                    options=options,
+                )
+                if window is not None and len(models) >= window:
+                    break
+            return models[skip:window]
+
+        def read(service: Type[SyncPartitionedService]) -> List[OutCollectionModel]:
+            return service.get_many(
+                query, sort=sort, limit=window, expand=expand, options=options
+            )
+
+        models = [
+            model
+            for partition_models in cls._map_chunks(read, services)
+            for model in partition_models
+        ]
+        if sort:
+            sort_models(models, sort)
+        return models[skip:window]
+
+    @classmethod
+    @instrumented
+    def count(cls, query: dict, options: QueryOptions = None) -> int:
+        if cls._partition is not None:
+            return super().count(query, options=options)
+        return sum(
+            service.count(query, options=options) for service in cls._services(query)
+        )
+
+    @classmethod
+    @instrumented
+    def update_one(
+        cls,
+        query: dict,
+        update: Union[dict, BaseModel],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> OutCollectionModel:
+        if cls._partition is not None:
+            return super().update_one(query, update, expand=expand, options=options)
+        service = cls._find_service(query)
+        if service is None:
+            return None
+        return service.update_one(query, update, expand=expand, options=options)
+
+    @classmethod
+    @instrumented
+    def update(
+        cls,
+        model: OutCollectionModel,
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> OutCollectionModel:
+        if cls._partition is not None:
+            return super().update(model, expand=expand, options=options)
+        service = cls._model_service(model)
+        return service.update(model, expand=expand, options=options)
+
+    @classmethod
+    @instrumented
+    def update_many(
+        cls,
+        query: dict,
+        update: Union[dict, BaseModel],
+        expand: list[str] = None,
+        options: QueryOptions = None,
+    ) -> List[OutCollectionModel]:
+        if cls._partition is not None:
+            return super().update_many(query, update, expand=expand, options=options)
+        return [
+            model
+            for service in cls._services(query)
+            for model in service.update_many(
+                query, update, expand=expand, options=options
+            )
+        ]
+
+    @classmethod
+    @instrumented
+    def delete_one(cls, query: dict, options: QueryOptions = None) -> int:
+        if cls._partition is not None:
+            return super().delete_one(query, options=options)
+        service = cls._find_service(query)
+        return 0 if service is None else service.delete_one(query, options=options)
+
+    @classmethod
+    @instrumented
+    def delete_many(cls, query: dict, options: QueryOptions = None) -> int:
+        if cls._partition is not None:
+            return super().delete_many(query, options=options)
+        return sum(
+            service.delete_many(query, options=options)
+            for service in cls._services(query)
+        )
+
+    @classmethod
+    def drop_partitions(cls, before: dt) -> List[str]:
+        """
+        Drops the partitions whose whole period is before `before`, much
+        cheaper than deleting their documents. Returns the dropped names.
+        """
+        database = cls._mongo_client._get_database_client(cls._in_model.get_database())
+        dropped = expired_partitions(
+            cls._in_model, cls.list_partitions(refresh=True), before
+        )
+        for name in dropped:
+            database.drop_collection(name)
+            invalidate_collection(cls._in_model.get_database(), name)
+            catalog(cls).discard(name)
+        return dropped
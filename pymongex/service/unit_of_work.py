@@ -0,0 +1,442 @@
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult
+
+from ..clients.result_cache import invalidate_collection
+from ..constants import BaseEnum
+from ..exceptions import VersionConflict
+from ..models.collection import OutCollectionModel
+from ..options import QueryOptions
+
+_current_unit: ContextVar[Optional["BaseUnitOfWork"]] = ContextVar(
+    "pymongex_unit_of_work", default=None
+)
+
+
+def current_unit_of_work(asynchronous: bool = False) -> Optional["BaseUnitOfWork"]:
+    """The unit of work of the current context, checked against the service kind."""
+    unit = _current_unit.get()
+    if unit is not None and unit.asynchronous != asynchronous:
+        expected = "AsyncUnitOfWork" if asynchronous else "UnitOfWork"
+        raise ValueError(
+            f"Service called inside a {type(unit).__name__}, use {expected}"
+        )
+    return unit
+
+
+class WriteKind(BaseEnum):
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+
+
+class PendingWrite:
+    """
+    A write recorded by a unit of work. `id` is known for creates and model
+    updates, `result` is set by the flush: the stored model for creates and
+    updates by id or model, the stored models for update_many and None for
+    deletes. `fan_out` holds the snapshot dependents of an update and the ids
+    of the sources it changes, refreshed once the flush succeeded.
+    """
+
+    def __init__(
+        self,
+        service: type,
+        kind: WriteKind,
+        request: Any = None,
+        model: Optional[OutCollectionModel] = None,
+        query: Optional[Dict[str, Any]] = None,
+        many: bool = False,
+        id: Any = None,
+        fan_out: Optional[Tuple[List[Any], List[Any]]] = None,
+    ):
+        self.service = service
+        self.kind = kind
+        self.request = request
+        self.model = model
+        self.query = query
+        self.many = many
+        self.id = id
+        self.fan_out = fan_out
+        self.result: Any = None
+
+
+class _Batch:
+    """Consecutive requests to one collection, sent as one ordered bulk_write."""
+
+    def __init__(self, service: type):
+        self.service = service
+        self.requests: List[Any] = []
+        # model updates matched on their loaded version
+        self.versioned: List[Tuple[PendingWrite, Dict[str, Any]]] = []
+        self.plain_updates = 0
+
+
+class BaseUnitOfWork:
+    asynchronous = False
+
+    def __init__(
+        self, transaction: bool = False, options: Optional[QueryOptions] = None
+    ):
+        self.transaction = transaction
+        self.options = options
+        self.writes: List[PendingWrite] = []
+        self.bulk_results: List[BulkWriteResult] = []
+        self._identity_map: Dict[Tuple, OutCollectionModel] = {}
+        self._token: Optional[Token] = None
+
+    # identity map
+
+    @staticmethod
+    def _identity_key(model_class: type, id: Any, expand: Optional[List[str]]):
+        return model_class, ObjectId(id), tuple(sorted(expand or ()))
+
+    def get_identity(
+        self, model_class: type, id: Any, expand: Optional[List[str]] = None
+    ) -> Optional[OutCollectionModel]:
+        return self._identity_map.get(self._identity_key(model_class, id, expand))
+
+    def add_identity(
+        self, model: OutCollectionModel, expand: Optional[List[str]] = None
+    ) -> OutCollectionModel:
+        key = self._identity_key(type(model), model.id, expand)
+        return self._identity_map.setdefault(key, model)
+
+    # recording, called by the services
+
+    def create(self, service: type, documents: List[Any]) -> List[PendingWrite]:
+        client = service._mongo_client
+        prepared = client._prepare_insert_documents(service._in_model, documents)
+        writes = []
+        for document in prepared:
+            document.setdefault("_id", ObjectId())
+            write = PendingWrite(
+                service, WriteKind.CREATE, InsertOne(document), id=document["_id"]
+            )
+            writes.append(write)
+        self.writes.extend(writes)
+        return writes
+
+    def update(
+        self,
+        service: type,
+        query: Dict[str, Any],
+        update: Any,
+        many: bool = False,
+        fan_out: Optional[Tuple[List[Any], List[Any]]] = None,
+    ) -> PendingWrite:
+        service._mongo_client._add_updated_at(update)
+        request = UpdateMany(query, update) if many else UpdateOne(query, update)
+        id = query.get("_id") if isinstance(query.get("_id"), ObjectId) else None
+        write = PendingWrite(
+            service,
+            WriteKind.UPDATE,
+            request,
+            query=query,
+            many=many,
+            id=id,
+            fan_out=fan_out,
+        )
+        self.writes.append(write)
+        return write
+
+    def update_model(self, service: type, model: OutCollectionModel) -> PendingWrite:
+        # the changes are diffed at flush, a model is written once per flush
+        for write in self.writes:
+            if write.model is model and write.kind == WriteKind.UPDATE:
+                return write
+        write = PendingWrite(service, WriteKind.UPDATE, model=model, id=model.id)
+        self.writes.append(write)
+        return write
+
+    def delete(
+        self, service: type, query: Dict[str, Any], many: bool = False
+    ) -> PendingWrite:
+        request = DeleteMany(query) if many else DeleteOne(query)
+        write = PendingWrite(service, WriteKind.DELETE, request, query=query, many=many)
+        self.writes.append(write)
+        return write
+
+    # flushing
+
+    def _model_updates(self) -> List[PendingWrite]:
+        return [write for write in self.writes if write.model is not None]
+
+    @staticmethod
+    def _set_model_update(
+        write: PendingWrite, query: Dict[str, Any], update: Optional[Dict[str, Any]]
+    ) -> None:
+        # the diff of a model, with its snapshots, taken when the flush starts
+        if update is None:
+            write.result = write.model
+            return
+        service = write.service
+        service._mongo_client._add_updated_at(update)
+        write.request = UpdateOne(query, update)
+        write.query = query
+        write.fan_out = (service._fan_out_targets(update), [write.model.id])
+
+    def _plan(self) -> List[_Batch]:
+        """
+        Groups the writes per collection, keeping their order. A collection's
+        requests are split where version checked model updates meet other
+        updates, so the matched count of a batch tells whether a version
+        check failed.
+        """
+        batches: Dict[Tuple[str, str], List[_Batch]] = {}
+        for write in self.writes:
+            service = write.service
+            model = service._in_model
+            key = (model.get_database(), model.get_collection())
+            request, versioned_query = write.request, None
+            if write.model is not None:
+                if write.request is None:
+                    continue
+                if write.model.get_version_field() is not None:
+                    versioned_query = write.query
+            collection_batches = batches.setdefault(key, [_Batch(service)])
+            batch = collection_batches[-1]
+            is_update = isinstance(request, (UpdateOne, UpdateMany))
+            if is_update and (
+                (versioned_query is not None and batch.plain_updates)
+                or (versioned_query is None and batch.versioned)
+            ):
+                batch = _Batch(service)
+                collection_batches.append(batch)
+            batch.requests.append(request)
+            if versioned_query is not None:
+                batch.versioned.append((write, versioned_query))
+            elif is_update:
+                batch.plain_updates += 1
+        return [batch for group in batches.values() for batch in group]
+
+    def _check_versions(self, batch: _Batch, result: BulkWriteResult) -> None:
+        if not batch.versioned or result.matched_count >= len(batch.versioned):
+            return
+        version_field = batch.versioned[0][0].model.get_version_field()
+        ids = [write.id for write, _ in batch.versioned]
+        versions = [query[version_field] for _, query in batch.versioned]
+        missing = len(batch.versioned) - result.matched_count
+        raise VersionConflict(
+            f"{missing} of {len(ids)} {batch.service._out_model.__name__} updates "
+            f"did not match the loaded {version_field}",
+            id=ids if len(ids) > 1 else ids[0],
+            version=versions if len(versions) > 1 else versions[0],
+        )
+
+    @staticmethod
+    def _invalidate(batches: List[_Batch]) -> None:
+        # transactional writes become visible on commit, after their bulk_write
+        # already invalidated the cached results
+        for batch in batches:
+            model = batch.service._in_model
+            invalidate_collection(model.get_database(), model.get_collection())
+
+    def _finish_model_updates(self) -> None:
+        for write in self.writes:
+            if write.model is not None and write.query is not None:
+                write.service._finish_model_update(write.model, write.query, 1)
+
+    def _fan_out(self) -> None:
+        for write in self.writes:
+            if write.fan_out is not None:
+                write.service._fan_out(*write.fan_out)
+
+    def _reads(self) -> Tuple[Dict[type, List[Any]], List[PendingWrite]]:
+        # writes whose result is read back by id, per service, and the others
+        by_id: Dict[type, List[Any]] = {}
+        by_query = []
+        for write in self.writes:
+            if write.kind == WriteKind.DELETE or write.result is not None:
+                continue
+            if write.id is not None and not write.many:
+                by_id.setdefault(write.service, []).append(write.id)
+            else:
+                by_query.append(write)
+        return by_id, by_query
+
+    def _set_results(
+        self, models: List[OutCollectionModel]
+    ) -> Dict[Any, OutCollectionModel]:
+        found = {}
+        for model in models:
+            key = self._identity_key(type(model), model.id, None)
+            self._identity_map[key] = model
+            found[model.id] = model
+        return found
+
+    def _collect(self, found: Dict[Tuple[type, Any], Any]) -> List[Any]:
+        for write in self.writes:
+            if write.result is None and (write.service, write.id) in found:
+                write.result = found[(write.service, write.id)]
+        results = [write.result for write in self.writes]
+        self.writes = []
+        return results
+
+    def _enter(self) -> None:
+        self._token = _current_unit.set(self)
+
+    def _exit(self) -> None:
+        _current_unit.reset(self._token)
+        self._token = None
+
+
+class UnitOfWork(BaseUnitOfWork):
+    """
+    Collects the creates, updates and deletes made through sync services
+    inside the block and writes them on exit, one ordered bulk_write per
+    collection, inside a transaction if `transaction` is set. Service write
+    methods return a PendingWrite in the block, its `result` is set on exit.
+    get_by_id returns the same instance for the same id within the unit.
+    Nothing is written when the block raises.
+
+        with UnitOfWork(transaction=True) as unit:
+            order = OrderService.create_one({...})
+            customer = CustomerService.get_by_id(order_customer_id)
+            customer.order_count += 1
+            CustomerService.update(customer)
+        order.result, unit.results
+    """
+
+    def __init__(
+        self, transaction: bool = False, options: Optional[QueryOptions] = None
+    ):
+        super().__init__(transaction, options)
+        self.results: List[Any] = []
+
+    def __enter__(self) -> "UnitOfWork":
+        self._enter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._exit()
+
+    def _write(self, batches: List[_Batch], session: Any = None) -> None:
+        for batch in batches:
+            result = batch.service._mongo_client.bulk_write(
+                batch.service._in_model,
+                batch.requests,
+                ordered=True,
+                options=self.options,
+                session=session,
+            )
+            self.bulk_results.append(result)
+            self._check_versions(batch, result)
+
+    def flush(self) -> List[Any]:
+        """Writes the pending writes and returns their results in order."""
+        for write in self._model_updates():
+            query, update = write.service._prepare_model_update(write.model)
+            if update is not None:
+                update = write.service._snapshot_update(update)
+            self._set_model_update(write, query, update)
+        batches = self._plan()
+        if batches and self.transaction:
+            client = batches[0].service._mongo_client
+            try:
+                with client.start_session() as session:
+                    with session.start_transaction():
+                        self._write(batches, session)
+            finally:
+                self._invalidate(batches)
+        elif batches:
+            self._write(batches)
+        self._finish_model_updates()
+        self._fan_out()
+
+        by_id, by_query = self._reads()
+        found = {}
+        for service, ids in by_id.items():
+            models = service.get_by_ids(ids, options=self.options)
+            for id, model in self._set_results(models).items():
+                found[(service, id)] = model
+        for write in by_query:
+            if write.many:
+                write.result = write.service.get_many(write.query, options=self.options)
+            else:
+                write.result = write.service.get_one(write.query, options=self.options)
+        results = self._collect(found)
+        self.results.extend(results)
+        return results
+
+
+class AsyncUnitOfWork(BaseUnitOfWork):
+    """Counterpart of UnitOfWork for async services, used with `async with`."""
+
+    asynchronous = True
+
+    def __init__(
+        self, transaction: bool = False, options: Optional[QueryOptions] = None
+    ):
+        super().__init__(transaction, options)
+        self.results: List[Any] = []
+
+    async def __aenter__(self) -> "AsyncUnitOfWork":
+        self._enter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                await self.flush()
+        finally:
+            self._exit()
+
+    async def _write(self, batches: List[_Batch], session: Any = None) -> None:
+        for batch in batches:
+            result = await batch.service._mongo_client.bulk_write(
+                batch.service._in_model,
+                batch.requests,
+                ordered=True,
+                options=self.options,
+                session=session,
+            )
+            self.bulk_results.append(result)
+            self._check_versions(batch, result)
+
+    async def flush(self) -> List[Any]:
+        """Writes the pending writes and returns their results in order."""
+        for write in self._model_updates():
+            query, update = write.service._prepare_model_update(write.model)
+            if update is not None:
+                update = await write.service._snapshot_update(update)
+            self._set_model_update(write, query, update)
+        batches = self._plan()
+        if batches and self.transaction:
+            client = batches[0].service._mongo_client
+            try:
+                async with await client.start_session() as session:
+                    async with session.start_transaction():
+                        await self._write(batches, session)
+            finally:
+                self._invalidate(batches)
+        elif batches:
+            await self._write(batches)
+        self._finish_model_updates()
+        self._fan_out()
+
+        by_id, by_query = self._reads()
+        found = {}
+        for service, ids in by_id.items():
+            models = await service.get_by_ids(ids, options=self.options)
+            for id, model in self._set_results(models).items():
+                found[(service, id)] = model
+        for write in by_query:
+            if write.many:
+                write.result = await write.service.get_many(
+                    write.query, options=self.options
+                )
+            else:
+                write.result = await write.service.get_one(
+                    write.query, options=self.options
+                )
+        results = self._collect(found)
+        self.results.extend(results)
+        return results
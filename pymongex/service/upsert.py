@@ -0,0 +1,124 @@
+from typing import Any, Dict, List, Tuple, Type, Union
+
+from pydantic import BaseModel, Field
+from pymongo import UpdateOne
+from pymongo.results import BulkWriteResult
+
+from ..constants import BaseEnum
+from ..models.collection import InCollectionModel
+from ..models.compression import compress_document
+from ..utils import sort_key, utc_now
+
+
+class UpsertMode(BaseEnum):
+    # the stored document becomes the record, created_at and _id are kept
+    REPLACE = "replace"
+    # only the fields set on the record are written, the defaults of the
+    # others only when the document is inserted
+    MERGE = "merge"
+
+
+class UpsertResult(BaseModel):
+    matched_count: int = 0
+    modified_count: int = 0
+    upserted_count: int = 0
+    # index of the record in the input -> _id of the inserted document
+    upserted_ids: Dict[int, Any] = Field(default_factory=dict)
+
+    def add(self, result: BulkWriteResult, indexes: List[int]) -> None:
+        self.matched_count += result.matched_count
+        self.modified_count += result.modified_count
+        self.upserted_count += result.upserted_count
+        for position, id in result.upserted_ids.items():
+            self.upserted_ids[indexes[position]] = id
+
+
+def _validate_record(
+    model: Type[InCollectionModel],
+    record: Union[Dict[str, Any], InCollectionModel, BaseModel],
+) -> InCollectionModel:
+    if isinstance(record, InCollectionModel):
+        return record
+    if isinstance(record, BaseModel):
+        return model(**record.model_dump(exclude_unset=True))
+    if isinstance(record, dict):
+        return model(**record)
+    raise ValueError("Records must be of the same type as the model or a dict")
+
+
+def _upsert_request(
+    document: Dict[str, Any],
+    defaults: Dict[str, Any],
+    key_fields: List[str],
+    mode: UpsertMode,
+    now: Any,
+) -> UpdateOne:
+    query = {}
+    for field in key_fields:
+        if field not in document:
+            raise ValueError(f"Upsert record is missing the key field {field!r}")
+        query[field] = document[field]
+    created_at = document.pop("created_at")
+    document["updated_at"] = now
+    if mode == UpsertMode.MERGE:
+        # a path can not be in both $set and $setOnInsert
+        on_insert = {
+            field: value for field, value in defaults.items() if field not in document
+        }
+        on_insert["created_at"] = created_at
+        update = {"$set": document, "$setOnInsert": on_insert}
+        return UpdateOne(query, update, upsert=True)
+    # a ReplaceOne would overwrite created_at, the replacement is a pipeline
+    # keeping the stored _id and created_at instead
+    kept = {
+        "_id": "$_id",
+        "created_at": {"$ifNull": ["$created_at", {"$literal": created_at}]},
+    }
+    replacement = {"$mergeObjects": [kept, {"$literal": document}]}
+    return UpdateOne(query, [{"$replaceWith": replacement}], upsert=True)
+
+
+def build_upsert_requests(
+    model: Type[InCollectionModel],
+    records: List[Union[Dict[str, Any], InCollectionModel, BaseModel]],
+    key_fields: List[str],
+    mode: Union[str, UpsertMode] = UpsertMode.MERGE,
+) -> Tuple[List[UpdateOne], List[int]]:
+    """
+    Upserts of `records` matched on `key_fields`, and the index of the record
+    each one was built from. Records sharing a key are folded into one
+    request, merged in input order or the last one winning on replace, as
+    unordered upserts of one key could insert it twice.
+    """
+    if not key_fields:
+        raise ValueError("key_fields must name at least one field")
+    mode = UpsertMode(mode)
+    merge = mode == UpsertMode.MERGE
+    documents: Dict[Tuple, Dict[str, Any]] = {}
+    defaults: Dict[Tuple, Dict[str, Any]] = {}
+    indexes: Dict[Tuple, int] = {}
+    for index, record in enumerate(records):
+        instance = _validate_record(model, record)
+        document = compress_document(model, instance.model_dump(exclude={"id"}))
+        unset = {}
+        if merge:
+            unset = {
+                field: document.pop(field)
+                for field in list(document)
+                if field not in instance.model_fields_set and field != "created_at"
+            }
+        document["created_at"] = instance.created_at
+        key = tuple(sort_key(document.get(field)) for field in key_fields)
+        if merge and key in documents:
+            created_at = documents[key]["created_at"]
+            document = {**documents[key], **document, "created_at": created_at}
+            unset = {**defaults[key], **unset}
+        documents[key] = document
+        defaults[key] = unset
+        indexes[key] = index
+    now = utc_now()
+    requests = [
+        _upsert_request(document, defaults[key], key_fields, mode, now)
+        for key, document in documents.items()
+    ]
+    return requests, list(indexes.values())
@@ -0,0 +1,253 @@
+import asyncio
+import copy
+import logging
+import threading
+from datetime import datetime as dt
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type, Union
+
+from pydantic import BaseModel
+
+from ..clients.changes import is_incremental
+from ..metrics.recording import get_metrics_sink
+from ..models.collection import (
+    CollectionModel,
+    OutCollectionModel,
+    ensure_utc_timezone,
+)
+from ..utils import utc_now
+
+logger = logging.getLogger("pymongex.views")
+
+# collection of the refresh state of the views, one per database
+STATE_COLLECTION = "pymongex_views"
+
+# stages whose output is not one document per source document, a $merge of
+# their results over the changed documents only would replace whole groups
+_AGGREGATING_STAGES = {
+    "$group",
+    "$bucket",
+    "$bucketAuto",
+    "$sortByCount",
+    "$count",
+    "$facet",
+    "$unwind",
+    "$setWindowFields",
+}
+
+
+class ViewRefresh(BaseModel):
+    view: str
+    full: bool
+    started_at: dt
+    # source changes up to the watermark are in the view
+    watermark: dt
+    duration_ms: float
+    # how far behind the view was when the refresh started, None on a first build
+    lag_seconds: Optional[float] = None
+    # view documents of deleted source documents removed by an incremental refresh
+    removed: int = 0
+
+
+class _StateLocation:
+    # where the refresh state of a view database is kept, passed to the
+    # clients in place of a model
+    def __init__(self, database: str):
+        self.database = database
+
+    def get_database(self) -> str:
+        return self.database
+
+    def get_collection(self) -> str:
+        return STATE_COLLECTION
+
+
+def state_location(model: Type[OutCollectionModel]) -> _StateLocation:
+    return _StateLocation(model.get_database())
+
+
+def state_watermark(state: Optional[Dict[str, Any]]) -> Optional[dt]:
+    # clients without tz_aware return naive UTC datetimes
+    if state is None:
+        return None
+    return ensure_utc_timezone(state.get("watermark"))
+
+
+def view_source(model: Type[OutCollectionModel]) -> Type[CollectionModel]:
+    source = getattr(model.Collection, "view_source", None)
+    if source is None:
+        raise ValueError(
+            f"{model.__name__} is not a materialized view, its Collection "
+            "declares no view_source"
+        )
+    return source
+
+
+def refreshes_incrementally(model: Type[OutCollectionModel]) -> bool:
+    """
+    Whether refresh() can reprocess only the source documents changed since
+    the watermark. It takes a source with Collection.incremental_sync, whose
+    tombstones tell the deleted documents, and a one to one view_pipeline,
+    mapping each source document to one view document. Other views are
+    rebuilt on every refresh.
+    """
+    if not is_incremental(view_source(model)):
+        return False
+    pipeline = getattr(model.Collection, "view_pipeline", [])
+    return not any(name in _AGGREGATING_STAGES for stage in pipeline for name in stage)
+
+
+def view_source_field(model: Type[OutCollectionModel]) -> str:
+    # the view field holding the _id of its source document
+    return getattr(model.Collection, "view_source_field", "_id")
+
+
+def overlap_since(model: Type[OutCollectionModel], watermark: dt) -> dt:
+    overlap = getattr(model.Collection, "view_overlap_seconds", 5.0)
+    return watermark - timedelta(seconds=overlap)
+
+
+def changed_since(watermark: dt) -> Dict[str, Any]:
+    # inserts only stamp created_at, updates and upserts stamp updated_at
+    return {
+        "$or": [
+            {"updated_at": {"$gt": watermark}},
+            {"updated_at": None, "created_at": {"$gt": watermark}},
+        ]
+    }
+
+
+def _target(model: Type[OutCollectionModel]) -> Union[str, Dict[str, str]]:
+    source = view_source(model)
+    if source.get_database() == model.get_database():
+        return model.get_collection()
+    return {"db": model.get_database(), "coll": model.get_collection()}
+
+
+def refresh_pipeline(
+    model: Type[OutCollectionModel], watermark: Optional[dt]
+) -> List[Dict[str, Any]]:
+    """
+    The pipeline refreshing a view, run on its source collection. Without a
+    watermark the view is rebuilt with $out, otherwise the source documents
+    changed since the watermark are reprocessed and $merge'd, see
+    refreshes_incrementally. The watermark is moved back by the
+    view_overlap_seconds of the model, reprocessing is idempotent and this
+    covers writes stamped before but committed after the previous refresh.
+    A source document that stops matching a $match of the pipeline keeps
+    its view document until the next full refresh.
+    """
+    pipeline = copy.deepcopy(getattr(model.Collection, "view_pipeline", []))
+    if watermark is None:
+        return pipeline + [{"$out": _target(model)}]
+    merge = {
+        "into": _target(model),
+        "on": getattr(model.Collection, "view_merge_on", "_id"),
+        "whenMatched": "replace",
+        "whenNotMatched": "insert",
+    }
+    since = overlap_since(model, watermark)
+    return [{"$match": changed_since(since)}] + pipeline + [{"$merge": merge}]
+
+
+def deleted_since(watermark: dt) -> Dict[str, Any]:
+    # the tombstones of the source deletes, see changes_since
+    return {"updated_at": {"$gt": watermark}}
+
+
+def state_update(refresh: ViewRefresh) -> Dict[str, Any]:
+    # $max keeps the watermark from moving back when refreshes overlap
+    return {
+        "$max": {"watermark": refresh.watermark},
+        "$set": {
+            "refreshed_at": utc_now(),
+            "duration_ms": refresh.duration_ms,
+            "full": refresh.full,
+        },
+    }
+
+
+def finish_refresh(
+    model: Type[OutCollectionModel],
+    full: bool,
+    started_at: dt,
+    duration: float,
+    previous: Optional[dt],
+    removed: int = 0,
+) -> ViewRefresh:
+    lag = (started_at - previous).total_seconds() if previous is not None else None
+    refresh = ViewRefresh(
+        view=model.__name__,
+        full=full,
+        started_at=started_at,
+        watermark=started_at,
+        duration_ms=duration * 1000,
+        lag_seconds=lag,
+        removed=removed,
+    )
+    sink = get_metrics_sink()
+    if sink is not None:
+        mode = "full" if full else "incremental"
+        sink.observe(
+            "view_refresh_seconds", duration, {"view": model.__name__, "mode": mode}
+        )
+        if lag is not None:
+            sink.observe("view_lag_seconds", lag, {"view": model.__name__})
+    return refresh
+
+
+def refresh_failed(model: Type[OutCollectionModel], error: BaseException) -> None:
+    sink = get_metrics_sink()
+    if sink is not None:
+        labels = {"view": model.__name__, "error": type(error).__name__}
+        sink.increment("view_refresh_errors_total", labels)
+
+
+class RefreshSchedule:
+    """
+    Refreshes a view every `interval_seconds` on a daemon thread until
+    stopped. Failed refreshes are logged and retried at the next interval.
+    """
+
+    def __init__(self, refresh: Callable[[], Any], interval_seconds: float, name: str):
+        if interval_seconds <= 0:
+            raise ValueError("interval_seconds has to be a strict positive number")
+        self.interval_seconds = interval_seconds
+        self.last_refresh: Optional[ViewRefresh] = None
+        self.last_error: Optional[BaseException] = None
+        self._refresh = refresh
+        self._name = name
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"pymongex-view-{name}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.last_refresh = self._refresh()
+                self.last_error = None
+            except Exception as error:
+                self.last_error = error
+                logger.exception("Refresh of view %s failed", self._name)
+            self._stopped.wait(self.interval_seconds)
+
+    def stop(self, wait: bool = True) -> None:
+        self._stopped.set()
+        if wait and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+async def refresh_periodically(
+    refresh: Callable[[], Awaitable[Any]], interval_seconds: float, name: str
+) -> None:
+    """The async counterpart of RefreshSchedule, runs until cancelled."""
+    if interval_seconds <= 0:
+        raise ValueError("interval_seconds has to be a strict positive number")
+    while True:
+        try:
+            await refresh()
+        except Exception:
+            logger.exception("Refresh of view %s failed", name)
+        await asyncio.sleep(interval_seconds)
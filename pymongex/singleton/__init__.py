@@ -1,2 +1,16 @@
-from .async_mongo_singleton import MongoAsyncClientSingleton
-from .sync_mongo_singleton import MongoSyncClientSingleton
+from importlib import import_module
+
+# the async singleton pulls in motor, so both are only imported on access
+_LAZY_ATTRIBUTES = {
+    "MongoAsyncClientSingleton": ".async_mongo_singleton",
+    "MongoSyncClientSingleton": ".sync_mongo_singleton",
+}
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
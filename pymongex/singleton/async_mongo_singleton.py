@@ -1,6 +1,7 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from ..config import get_connection_string
+from ..metrics.listeners import metrics_listeners
 
 
 class MongoAsyncClientSingleton:
@@ -18,7 +19,9 @@ class MongoAsyncClientSingleton:
             connection_string = get_connection_string()
             if connection_string is None:
                 raise ValueError("Connection string is not set.")
-            cls._client = AsyncIOMotorClient(connection_string)
+            cls._client = AsyncIOMotorClient(
+                connection_string, event_listeners=metrics_listeners()
+            )
         return cls._client
 
     @classmethod
@@ -2,6 +2,7 @@ from pymongo import MongoClient
 from pymongo.server_api import ServerApi
 
 from ..config import get_connection_string
+from ..metrics.listeners import metrics_listeners
 
 
 class MongoSyncClientSingleton:
@@ -19,7 +20,11 @@ class MongoSyncClientSingleton:
             connection_string = get_connection_string()
             if connection_string is None:
                 raise ValueError("Connection string is not set.")
-            cls._client = MongoClient(connection_string, server_api=ServerApi("1"))
+            cls._client = MongoClient(
+                connection_string,
+                server_api=ServerApi("1"),
+                event_listeners=metrics_listeners(),
+            )
         return cls._client
 
     @classmethod
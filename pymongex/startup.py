@@ -0,0 +1,139 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Type
+
+from pydantic import BaseModel, Field
+
+from .clients.decoding import list_adapter, model_adapter
+from .models.collection import OutCollectionModel
+from .pipelines.pipeline_builder import PipelineBuilder
+
+
+class WarmupReport(BaseModel):
+    # seconds spent per phase: connections, models, queries
+    phases: Dict[str, float] = Field(default_factory=dict)
+    connections: int = 0
+    models: int = 0
+    queries: int = 0
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+
+def precompile_model(model: Type[OutCollectionModel]) -> None:
+    """
+    Builds the validators, projection and cached find pipeline stages of a
+    model up front, with and without its expandable fields.
+    """
+    model_adapter(model)
+    list_adapter(model)
+    model.get_projection()
+    PipelineBuilder(model=model, query={}).build_pipeline()
+    expandable = model.get_expandable_fields()
+    if expandable:
+        PipelineBuilder(model=model, query={}, expand=expandable).build_pipeline()
+        for field in expandable:
+            nested_model = model.get_field_type(field)
+            model_adapter(nested_model)
+
+
+def _collect_models(services: List[type]) -> List[Type[OutCollectionModel]]:
+    models = []
+    for service in services:
+        if service._out_model not in models:
+            models.append(service._out_model)
+    return models
+
+
+def _registered_services(services: Optional[List[type]], base: type) -> List[type]:
+    if services is not None:
+        return services
+    return base.get_registered_services()
+
+
+def warmup(
+    min_connections: int = 10,
+    services: Optional[List[type]] = None,
+    run_queries: bool = True,
+) -> WarmupReport:
+    """
+    Opens `min_connections` pooled connections concurrently, precompiles every
+    registered SyncBaseService model and runs their declared _warmup_queries.
+    """
+    from .service.sync_service import SyncBaseService
+    from .singleton.sync_mongo_singleton import MongoSyncClientSingleton
+
+    services = _registered_services(services, SyncBaseService)
+    report = WarmupReport()
+
+    start = time.perf_counter()
+    if min_connections > 0:
+        client = MongoSyncClientSingleton.get_client()
+        # concurrent commands can not share a connection, so each opens one
+        with ThreadPoolExecutor(max_workers=min_connections) as executor:
+            list(
+                executor.map(
+                    lambda _: client.admin.command("ping"), range(min_connections)
+                )
+            )
+        report.connections = min_connections
+    report.phases["connections"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    models = _collect_models(services)
+    for model in models:
+        precompile_model(model)
+    report.models = len(models)
+    report.phases["models"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if run_queries:
+        for service in services:
+            for kwargs in service._warmup_queries:
+                service.get_many(**{"limit": 1, **kwargs})
+                report.queries += 1
+    report.phases["queries"] = time.perf_counter() - start
+    return report
+
+
+async def async_warmup(
+    min_connections: int = 10,
+    services: Optional[List[type]] = None,
+    run_queries: bool = True,
+) -> WarmupReport:
+    """Async counterpart of warmup() for AsyncBaseService models."""
+    from .service.async_service import AsyncBaseService
+    from .singleton.async_mongo_singleton import MongoAsyncClientSingleton
+
+    services = _registered_services(services, AsyncBaseService)
+    report = WarmupReport()
+
+    start = time.perf_counter()
+    if min_connections > 0:
+        client = MongoAsyncClientSingleton.get_client()
+        await asyncio.gather(
+            *[client.admin.command("ping") for _ in range(min_connections)]
+        )
+        report.connections = min_connections
+    report.phases["connections"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    models = _collect_models(services)
+    # validator schemas are built on a thread to keep the loop responsive
+    await asyncio.to_thread(lambda: [precompile_model(model) for model in models])
+    report.models = len(models)
+    report.phases["models"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if run_queries:
+        queries = [
+            service.get_many(**{"limit": 1, **kwargs})
+            for service in services
+            for kwargs in service._warmup_queries
+        ]
+        await asyncio.gather(*queries)
+        report.queries = len(queries)
+    report.phases["queries"] = time.perf_counter() - start
+    return report
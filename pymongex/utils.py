@@ -1,6 +1,98 @@
-from datetime import UTC
-from datetime import datetime as dt
+import re
+from datetime import UTC, datetime, timezone
+from typing import Any, Tuple
+
+from bson import ObjectId
+from bson.binary import Binary
+from bson.decimal128 import Decimal128
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.regex import Regex
+from bson.timestamp import Timestamp
 
 
 def utc_now():
-    return dt.now(UTC)
+    return datetime.now(UTC)
+
+
+class _Missing:
+    """A path that does not exist, unlike a field holding None."""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+    def __bool__(self) -> bool:
+        return False
+
+
+MISSING = _Missing()
+
+
+def type_rank(value: Any) -> int:
+    """Position of the value's type in the BSON comparison order."""
+    if value is None or value is MISSING:
+        return 2
+    if isinstance(value, bool):
+        return 9
+    if isinstance(value, (int, float, Decimal128)):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, dict):
+        return 5
+    if isinstance(value, (list, tuple)):
+        return 6
+    if isinstance(value, (bytes, Binary)):
+        return 7
+    if isinstance(value, ObjectId):
+        return 8
+    if isinstance(value, datetime):
+        return 10
+    if isinstance(value, Timestamp):
+        return 11
+    if isinstance(value, (re.Pattern, Regex)):
+        return 12
+    if isinstance(value, MinKey):
+        return 1
+    if isinstance(value, MaxKey):
+        return 13
+    raise TypeError(f"Unsupported value type {type(value).__name__}")
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    # pymongo returns naive UTC datetimes with millisecond precision
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def sort_key(value: Any) -> Tuple:
+    """
+    Key ordering values like MongoDB does across types. It is hashable, so it
+    doubles as the key of hash indexes; a missing value sorts like null.
+    """
+    rank = type_rank(value)
+    if rank == 2:
+        return (2, 0)
+    if rank == 3:
+        if isinstance(value, Decimal128):
+            value = float(value.to_decimal())
+        return (3, value)
+    if rank == 5:
+        return (5, tuple((key, sort_key(item)) for key, item in value.items()))
+    if rank == 6:
+        return (6, tuple(sort_key(item) for item in value))
+    if rank == 10:
+        return (10, to_utc_naive(value))
+    if rank == 12:
+        return (12, value.pattern)
+    if rank in (1, 13):
+        return (rank, 0)
+    return (rank, value)
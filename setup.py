@@ -11,4 +11,9 @@ setup(
         "pymongo[srv]==4.8.0",
         "pydantic==2.8.2",
     ],
+    entry_points={
+        "console_scripts": [
+            "pymongex-loadtest=pymongex.loadtest.cli:main",
+        ],
+    },
 )